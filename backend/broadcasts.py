@@ -0,0 +1,268 @@
+"""Admin broadcasts to user segments.
+
+A segment picks customers by the servers they have (plan, data center,
+status) and by whether they have unpaid invoices. Preparing a broadcast
+streams the segment's users through a cursor in user id order, renders each
+user's message and writes a batch at a time to the email queue, recording how
+far it got; a broadcast interrupted by a restart resumes from there. Sent,
+failed and suppressed counts are added as the queue reports each message.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from email_queue import EmailQueue, queued_message
+
+logger = logging.getLogger(__name__)
+
+PREPARING = "preparing"
+SENDING = "sending"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+ACTIVE_STATUSES = (PREPARING, SENDING)
+SEGMENT_FIELDS = ("plan_id", "data_center_id", "server_status", "unpaid_invoices")
+
+
+def server_query(segment: dict) -> Optional[dict]:
+    """Servers a segment selects by, or None when it does not filter on servers"""
+    query = {field: segment[key] for key, field in
+             (("plan_id", "plan_id"), ("data_center_id", "data_center_id"), ("server_status", "status"))
+             if segment.get(key)}
+    return query or None
+
+
+def describe_segment(segment: dict) -> str:
+    parts = [f"{key.replace('_', ' ')} {segment[key]}" for key in ("plan_id", "data_center_id", "server_status")
+             if segment.get(key)]
+    if segment.get("unpaid_invoices"):
+        parts.append("with unpaid invoices")
+    return ", ".join(parts) or "all customers"
+
+
+class Segments:
+    """Resolves segments to customer user ids and documents; ``exclude(email)`` drops users who must not be mailed"""
+
+    def __init__(self, db, batch_size: int = 500, exclude: Optional[Callable[[str], bool]] = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.exclude = exclude
+
+    async def _user_ids_from(self, collection, query: dict, after: Optional[str]) -> AsyncIterator[List[str]]:
+        """Distinct user ids of matching documents in ascending order, a batch at a time"""
+        pipeline = [{"$match": query}, {"$group": {"_id": "$user_id"}}]
+        if after is not None:
+            pipeline.append({"$match": {"_id": {"$gt": after}}})
+        pipeline.append({"$sort": {"_id": 1}})
+        batch = []
+        async for row in collection.aggregate(pipeline, allowDiskUse=True):
+            if row["_id"] is None:
+                continue
+            batch.append(row["_id"])
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def user_batches(self, segment: dict, after: Optional[str] = None) -> AsyncIterator[List[dict]]:
+        """Customers in the segment ordered by user id, starting after ``after``"""
+        projection = {"_id": 0, "id": 1, "email": 1, "full_name": 1, "company": 1}
+        servers = server_query(segment)
+        unpaid = {"status": "unpaid"} if segment.get("unpaid_invoices") else None
+        if servers is None and unpaid is None:
+            query = {"role": "user"}
+            if after is not None:
+                query["id"] = {"$gt": after}
+            cursor = self.db.users.find(query, projection).sort("id", 1).batch_size(self.batch_size)
+            batch = []
+            async for user in cursor:
+                if self.exclude and self.exclude(user["email"]):
+                    continue
+                batch.append(user)
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+            return
+
+        source, query = (self.db.servers, servers) if servers is not None else (self.db.invoices, unpaid)
+        async for user_ids in self._user_ids_from(source, query, after):
+            if servers is not None and unpaid is not None:
+                # Both filters: keep the users in this batch who also owe an invoice
+                owing = set(await self.db.invoices.distinct("user_id", {**unpaid, "user_id": {"$in": user_ids}}))
+                user_ids = [user_id for user_id in user_ids if user_id in owing]
+            users = {user["id"]: user for user in await self.db.users.find(
+                {"id": {"$in": user_ids}, "role": "user"}, projection
+            ).to_list(len(user_ids))}
+            batch = [users[user_id] for user_id in user_ids
+                     if user_id in users and not (self.exclude and self.exclude(users[user_id]["email"]))]
+            if batch:
+                yield batch
+
+    async def count(self, segment: dict) -> int:
+        return sum([len(batch) async for batch in self.user_batches(segment)])
+
+
+class Broadcaster:
+    """Creates broadcasts and prepares them into ``queue``.
+
+    ``render(broadcast, users)`` returns (subject, html) per user. Progress is
+    passed to ``on_progress`` on every status change and otherwise at most
+    once per ``progress_interval`` seconds per broadcast.
+    """
+
+    def __init__(self, broadcasts, queue: EmailQueue, segments: Segments,
+                 render: Callable[[dict, List[dict]], Awaitable[List[tuple]]],
+                 on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+                 progress_interval: float = 1.0):
+        self.broadcasts = broadcasts
+        self.queue = queue
+        self.segments = segments
+        self.render = render
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._published: Dict[str, tuple] = {}
+
+    async def ensure_indexes(self):
+        await self.broadcasts.create_index("id", unique=True)
+        await self.broadcasts.create_index([("status", 1), ("created_at", -1)])
+
+    async def _publish(self, broadcast: Optional[dict]):
+        if broadcast is None or self.on_progress is None:
+            return
+        now = time.monotonic()
+        status, published_at = self._published.get(broadcast["id"], (None, 0.0))
+        if status == broadcast["status"] and now - published_at < self.progress_interval:
+            return
+        if broadcast["status"] in ACTIVE_STATUSES:
+            self._published[broadcast["id"]] = (broadcast["status"], now)
+        else:
+            self._published.pop(broadcast["id"], None)
+        await self.on_progress(broadcast)
+
+    async def create(self, subject: str, message: str, segment: dict, created_by: str,
+                     description: Optional[str] = None) -> dict:
+        now = datetime.now(timezone.utc)
+        broadcast = {
+            "id": str(uuid.uuid4()),
+            "subject": subject,
+            "message": message,
+            "segment": {key: segment.get(key) for key in SEGMENT_FIELDS if segment.get(key)},
+            "segment_description": description or describe_segment(segment),
+            "status": PREPARING,
+            "queued": 0,
+            "sent": 0,
+            "failed": 0,
+            "suppressed": 0,
+            "cursor": None,
+            "created_by": created_by,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.broadcasts.insert_one(broadcast)
+        broadcast.pop("_id", None)
+        self.start_preparing(broadcast)
+        return broadcast
+
+    def start_preparing(self, broadcast: dict):
+        if broadcast["id"] not in self._tasks:
+            task = asyncio.create_task(self.prepare(broadcast))
+            self._tasks[broadcast["id"]] = task
+            task.add_done_callback(lambda _, broadcast_id=broadcast["id"]: self._tasks.pop(broadcast_id, None))
+
+    async def prepare(self, broadcast: dict):
+        """Queue the broadcast for every user in its segment, resuming after ``cursor``"""
+        try:
+            async for users in self.segments.user_batches(broadcast["segment"], after=broadcast.get("cursor")):
+                rendered = await self.render(broadcast, users)
+                added = await self.queue.enqueue_many([
+                    queued_message(user["email"], subject, html, broadcast_id=broadcast["id"], user_id=user["id"])
+                    for user, (subject, html) in zip(users, rendered)
+                ])
+                updated = await self.broadcasts.find_one_and_update(
+                    {"id": broadcast["id"], "status": PREPARING},
+                    {"$inc": {"queued": added}, "$set": {"cursor": users[-1]["id"], "updated_at": datetime.now(timezone.utc)}},
+                    projection={"_id": 0, "message": 0},
+                    return_document=ReturnDocument.AFTER
+                )
+                if updated is None:
+                    # Cancelled while preparing
+                    await self.queue.cancel({"broadcast_id": broadcast["id"]})
+                    return
+                await self._publish(updated)
+        except asyncio.CancelledError:
+            # Shutting down; another start resumes from the cursor
+            raise
+        except Exception as e:
+            logger.exception(f"Preparing broadcast {broadcast['id']} failed")
+            await self._finish(broadcast["id"], {"status": PREPARING}, FAILED, error=f"{type(e).__name__}: {e}")
+            await self.queue.cancel({"broadcast_id": broadcast["id"]})
+            return
+        updated = await self.broadcasts.find_one_and_update(
+            {"id": broadcast["id"], "status": PREPARING},
+            {"$set": {"status": SENDING, "prepared_at": datetime.now(timezone.utc), "updated_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0, "message": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        await self._publish(updated)
+        await self._complete_if_done(updated)
+
+    async def _finish(self, broadcast_id: str, query: dict, status: str, **fields) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        broadcast = await self.broadcasts.find_one_and_update(
+            {"id": broadcast_id, **query},
+            {"$set": {"status": status, "finished_at": now, "updated_at": now, **fields}},
+            projection={"_id": 0, "message": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        await self._publish(broadcast)
+        return broadcast
+
+    async def _complete_if_done(self, broadcast: Optional[dict]):
+        if broadcast is None or broadcast["status"] != SENDING:
+            return
+        # Broadcasts created before suppressions were counted have no suppressed field
+        if broadcast["sent"] + broadcast["failed"] + broadcast.get("suppressed", 0) >= broadcast["queued"]:
+            await self._finish(broadcast["id"], {"status": SENDING}, COMPLETED)
+
+    async def record_result(self, message: dict, status: str):
+        """EmailQueue ``on_result`` hook: count a broadcast message as sent, failed or suppressed"""
+        if not message.get("broadcast_id"):
+            return
+        broadcast = await self.broadcasts.find_one_and_update(
+            {"id": message["broadcast_id"]},
+            {"$inc": {status: 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0, "message": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        await self._publish(broadcast)
+        await self._complete_if_done(broadcast)
+
+    async def cancel(self, broadcast_id: str) -> Optional[dict]:
+        broadcast = await self._finish(broadcast_id, {"status": {"$in": list(ACTIVE_STATUSES)}}, CANCELLED)
+        if broadcast is not None:
+            await self.queue.cancel({"broadcast_id": broadcast_id})
+        return broadcast
+
+    async def resume(self) -> int:
+        """Restart preparing broadcasts left unfinished by a restart"""
+        resumed = 0
+        async for broadcast in self.broadcasts.find({"status": PREPARING}, {"_id": 0}):
+            self.start_preparing(broadcast)
+            resumed += 1
+        return resumed
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
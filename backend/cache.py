@@ -0,0 +1,45 @@
+"""Small in-process caches shared by the API."""
+import time
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """Dict-backed cache whose entries expire ``ttl`` seconds after they are set.
+
+    Not shared between workers: use it only for data where a short window of
+    staleness is acceptable, and invalidate explicitly on local writes.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return value
+            self._data.pop(key, None)
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        if key not in self._data and len(self._data) >= self.maxsize:
+            # Dicts keep insertion order, so the first key is the oldest entry
+            self._data.pop(next(iter(self._data)), None)
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else default
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,210 @@
+"""Email delivery log and suppression list.
+
+Every send attempt is recorded in ``email_events`` with its template,
+recipient, outcome and provider latency. Records are buffered in memory and
+written with one insert_many every ``flush_interval`` seconds (or sooner once
+``batch_size`` are waiting), so logging adds no database round trip to a send.
+Events expire after ``retention_days``.
+
+Suppressed addresses (hard bounces, spam reports, ones an admin blocked) get
+no email at all. Addresses that unsubscribed only stop getting marketing
+email (broadcasts); password resets, invoices and server credentials still
+reach them. Both are held in sets of lowercased addresses, so checking before
+a send is a single set lookup. Each worker reloads the sets from
+``email_suppressions`` every ``refresh_interval`` seconds to pick up changes
+made by other workers.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SENT = "sent"
+FAILED = "failed"
+SUPPRESSED = "suppressed"
+NOT_CONFIGURED = "not_configured"
+
+STATUSES = (SENT, FAILED, SUPPRESSED, NOT_CONFIGURED)
+
+# Provider events that mean an address should not be mailed again
+SUPPRESSING_EVENTS = {"bounce", "dropped", "spamreport", "unsubscribe", "group_unsubscribe"}
+# ...of which these only opt the address out of marketing email
+UNSUBSCRIBE_EVENTS = {"unsubscribe", "group_unsubscribe"}
+
+# Suppression scopes
+ALL = "all"
+MARKETING = "marketing"
+
+# Templates an unsubscribe applies to; every other template is transactional
+MARKETING_TEMPLATES = {"broadcast"}
+
+
+def suppression_scope(doc: dict) -> str:
+    """Scope of a stored suppression; unsubscribes recorded before scopes were kept only cover marketing"""
+    scope = doc.get("scope")
+    if scope is None and doc.get("source") == "sendgrid" and doc.get("reason") in UNSUBSCRIBE_EVENTS:
+        return MARKETING
+    return scope or ALL
+
+
+class EmailLog:
+    """Buffered delivery log plus the in-memory suppression set"""
+
+    def __init__(self, events, suppressions, retention_days: int = 90, flush_interval: float = 2.0,
+                 batch_size: int = 500, refresh_interval: float = 60.0):
+        self.events = events
+        self.suppressions = suppressions
+        self.retention = timedelta(days=retention_days)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.refresh_interval = refresh_interval
+        self.suppressed: Set[str] = set()
+        self.unsubscribed: Set[str] = set()
+        self._buffer: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._loaded_at = 0.0
+
+    async def ensure_indexes(self):
+        await self.events.create_index("expires_at", expireAfterSeconds=0)
+        await self.events.create_index([("created_at", -1)])
+        await self.events.create_index([("to", 1), ("created_at", -1)])
+        await self.events.create_index([("status", 1), ("created_at", -1)])
+        await self.suppressions.create_index("email", unique=True)
+
+    async def load(self) -> int:
+        """Replace the suppression sets with the stored list"""
+        suppressed, unsubscribed = set(), set()
+        async for doc in self.suppressions.find({}, {"_id": 0, "email": 1, "scope": 1, "source": 1, "reason": 1}):
+            (unsubscribed if suppression_scope(doc) == MARKETING else suppressed).add(doc["email"])
+        self.suppressed, self.unsubscribed = suppressed, unsubscribed
+        self._loaded_at = asyncio.get_running_loop().time()
+        return len(suppressed) + len(unsubscribed)
+
+    def is_suppressed(self, email: str, template: Optional[str] = None) -> bool:
+        """Whether ``template`` must not be sent to ``email``"""
+        email = email.lower()
+        return email in self.suppressed or (template in MARKETING_TEMPLATES and email in self.unsubscribed)
+
+    def record(self, to_email: str, status: str, template: Optional[str] = None,
+               latency_ms: Optional[float] = None, error: Optional[str] = None):
+        """Queue an event for the next flush; never blocks the send"""
+        now = datetime.now(timezone.utc)
+        self._buffer.append({
+            "to": to_email.lower(),
+            "template": template,
+            "status": status,
+            "latency_ms": round(latency_ms, 1) if latency_ms is not None else None,
+            "error": error,
+            "created_at": now,
+            "expires_at": now + self.retention
+        })
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        if not self._buffer:
+            return 0
+        batch, self._buffer = self._buffer, []
+        try:
+            await self.events.insert_many(batch, ordered=False)
+        except Exception:
+            # Delivery history is best effort; losing a batch must not stop sending
+            logger.exception(f"Failed to write {len(batch)} email events")
+            return 0
+        return len(batch)
+
+    async def suppress(self, email: str, reason: str, source: str = "admin", scope: str = ALL) -> bool:
+        """Add an address to the list, or widen an unsubscribe to all email; False if already covered"""
+        email = email.lower()
+        if scope == ALL:
+            self.suppressed.add(email)
+            self.unsubscribed.discard(email)
+        elif email not in self.suppressed:
+            self.unsubscribed.add(email)
+        now = datetime.now(timezone.utc)
+        try:
+            await self.suppressions.insert_one({
+                "email": email, "reason": reason, "source": source, "scope": scope, "created_at": now
+            })
+        except DuplicateKeyError:
+            if scope != ALL:
+                return False
+            # A bounce or block after an unsubscribe stops transactional email too
+            result = await self.suppressions.update_one(
+                {"email": email, "$or": [
+                    {"scope": MARKETING},
+                    {"scope": {"$exists": False}, "source": "sendgrid", "reason": {"$in": list(UNSUBSCRIBE_EVENTS)}}
+                ]},
+                {"$set": {"scope": ALL, "reason": reason, "source": source, "updated_at": now}}
+            )
+            return result.modified_count > 0
+        return True
+
+    async def unsuppress(self, email: str) -> bool:
+        email = email.lower()
+        self.suppressed.discard(email)
+        self.unsubscribed.discard(email)
+        result = await self.suppressions.delete_one({"email": email})
+        return result.deleted_count > 0
+
+    async def stats(self, since: datetime) -> dict:
+        """Attempts by template and status since ``since``, with average and slowest provider latency"""
+        rows = [row async for row in self.events.aggregate([
+            {"$match": {"created_at": {"$gte": since}}},
+            {"$group": {
+                "_id": {"template": "$template", "status": "$status"},
+                "count": {"$sum": 1},
+                "avg_latency_ms": {"$avg": "$latency_ms"},
+                "max_latency_ms": {"$max": "$latency_ms"}
+            }}
+        ])]
+        totals = {status: 0 for status in STATUSES}
+        templates = {}
+        for row in rows:
+            template, status = row["_id"].get("template") or "other", row["_id"]["status"]
+            totals[status] = totals.get(status, 0) + row["count"]
+            entry = templates.setdefault(template, {"template": template, **{s: 0 for s in STATUSES}})
+            entry[status] = entry.get(status, 0) + row["count"]
+            if status == SENT:
+                entry["avg_latency_ms"] = round(row["avg_latency_ms"] or 0, 1)
+                entry["max_latency_ms"] = row["max_latency_ms"]
+        attempted = totals[SENT] + totals[FAILED]
+        return {
+            "since": since,
+            "totals": totals,
+            "failure_rate": round(totals[FAILED] / attempted, 4) if attempted else 0.0,
+            "templates": sorted(templates.values(), key=lambda t: -sum(t[s] for s in STATUSES)),
+            "suppressed_addresses": len(self.suppressed),
+            "unsubscribed_addresses": len(self.unsubscribed)
+        }
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if loop.time() - self._loaded_at >= self.refresh_interval:
+                try:
+                    await self.load()
+                except Exception:
+                    logger.exception("Failed to reload email suppressions")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
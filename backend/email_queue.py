@@ -0,0 +1,255 @@
+"""Outgoing email queue.
+
+Messages are rendered before they are queued and stored in Mongo, so a
+broadcast to tens of thousands of users is written in batches and sent by a
+worker loop rather than inside a request. The worker claims a batch at a time
+under a lease and sends at no more than ``rate`` messages a second, the
+provider's limit. A failed send is retried with exponential backoff; if the
+worker dies, its lease runs out and the batch is sent by another worker. A
+batch is never larger than the worker can send in half its lease, and each
+message's lease is renewed just before it is sent, so a slow but live worker
+never has its messages requeued and sent twice. A message to a suppressed
+address is final: it is neither retried nor counted as failed.
+
+The rate applies per worker process, so with several API workers set it to the
+provider limit divided by the number of workers.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional, Union
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+CANCELLED = "cancelled"
+SUPPRESSED = "suppressed"
+
+
+class Throttle:
+    """Spaces calls ``1 / rate`` seconds apart, allowing a burst of ``burst``"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1 / rate
+        self.burst = burst
+        self._next = time.monotonic()
+
+    async def wait(self):
+        now = time.monotonic()
+        # Idle time banks at most ``burst`` sends
+        self._next = max(self._next, now - self.interval * (self.burst - 1))
+        delay = self._next - now
+        self._next += self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def queued_message(to_email: str, subject: str, html: str, **fields) -> dict:
+    """A queue document; ``fields`` such as broadcast_id and user_id are stored with it"""
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "to": to_email,
+        "subject": subject,
+        "html": html,
+        "status": QUEUED,
+        "attempts": 0,
+        "run_after": now,
+        "created_at": now,
+        **fields
+    }
+
+
+class EmailQueue:
+    """Mongo-backed outbox sent through ``send(to, subject, html)``.
+
+    ``send`` returns True once sent, False to retry, or ``SUPPRESSED`` if the
+    address must not be mailed. ``on_result(message, status)`` is called once
+    per message with its final status: sent, failed or suppressed.
+    """
+
+    def __init__(self, messages, send: Callable[[str, str, str], Awaitable[Union[bool, str]]], rate: float = 10,
+                 batch_size: int = 100, concurrency: int = 8, lease_seconds: float = 300,
+                 max_attempts: int = 3, retry_delay: float = 60, poll_interval: float = 5,
+                 on_result: Optional[Callable[[dict, str], Awaitable[None]]] = None):
+        self.messages = messages
+        self.send = send
+        self.throttle = Throttle(rate, burst=concurrency)
+        # At ``rate`` messages a second a batch must be sent well within its lease
+        self.batch_size = max(1, min(batch_size, int(rate * lease_seconds / 2)))
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.on_result = on_result
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.counters = {SENT: 0, FAILED: 0, SUPPRESSED: 0, "retried": 0}
+        # Monotonic time the worker last polled or started a send; None until started
+        self.heartbeat: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.messages.create_index("id", unique=True)
+        await self.messages.create_index([("status", 1), ("run_after", 1)])
+        await self.messages.create_index([("status", 1), ("lease_expires_at", 1)])
+        # A broadcast queues each recipient once, even if its preparation is resumed
+        await self.messages.create_index([("broadcast_id", 1), ("user_id", 1)], unique=True,
+                                         partialFilterExpression={"broadcast_id": {"$exists": True}})
+
+    async def enqueue_many(self, messages: List[dict]) -> int:
+        """Insert queue documents, skipping ones already queued; returns how many were added"""
+        if not messages:
+            return 0
+        try:
+            result = await self.messages.insert_many(messages, ordered=False)
+            added = len(result.inserted_ids)
+        except BulkWriteError as e:
+            added = e.details.get("nInserted", 0)
+        self._wakeup.set()
+        return added
+
+    async def cancel(self, query: dict) -> int:
+        """Withdraw queued messages matching ``query``"""
+        result = await self.messages.update_many(
+            {**query, "status": QUEUED},
+            {"$set": {"status": CANCELLED, "finished_at": datetime.now(timezone.utc)}, "$unset": {"html": ""}}
+        )
+        return result.modified_count
+
+    async def requeue_expired(self) -> int:
+        """Put back messages whose worker stopped before sending them"""
+        result = await self.messages.update_many(
+            {"status": SENDING, "lease_expires_at": {"$lt": datetime.now(timezone.utc)}},
+            {"$set": {"status": QUEUED}, "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+        )
+        return result.modified_count
+
+    async def lease(self) -> List[dict]:
+        """Claim up to ``batch_size`` due messages for this worker"""
+        now = datetime.now(timezone.utc)
+        ids = [m["id"] for m in await self.messages.find(
+            {"status": QUEUED, "run_after": {"$lte": now}}, {"_id": 0, "id": 1}
+        ).sort("run_after", 1).limit(self.batch_size).to_list(self.batch_size)]
+        if not ids:
+            return []
+        lease = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        # Another worker may claim some of the same ids first; each keeps what it updated
+        await self.messages.update_many(
+            {"id": {"$in": ids}, "status": QUEUED},
+            {"$set": {"status": SENDING, "lease_owner": lease,
+                      "lease_expires_at": now + timedelta(seconds=self.lease_seconds)},
+             "$inc": {"attempts": 1}}
+        )
+        return await self.messages.find({"lease_owner": lease, "status": SENDING}, {"_id": 0}).to_list(len(ids))
+
+    async def renew(self, message: dict) -> bool:
+        """Extend the lease on a message about to be sent; False if this worker no longer holds it"""
+        result = await self.messages.update_one(
+            {"id": message["id"], "status": SENDING, "lease_owner": message["lease_owner"]},
+            {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)}}
+        )
+        # Matched, not modified: a renewal in the same millisecond as the lease changes nothing
+        return result.matched_count == 1
+
+    async def _deliver(self, message: dict):
+        if not await self.renew(message):
+            # The lease ran out and the message went back to the queue
+            logger.warning(f"Lease on queued email {message['id']} was lost before sending")
+            return
+        try:
+            sent = await self.send(message["to"], message["subject"], message["html"])
+        except Exception:
+            logger.exception(f"Sending queued email {message['id']} crashed")
+            sent = False
+        now = datetime.now(timezone.utc)
+        if sent == SUPPRESSED:
+            update = {"$set": {"status": SUPPRESSED, "finished_at": now}}
+        elif sent:
+            update = {"$set": {"status": SENT, "sent_at": now, "finished_at": now}}
+        elif message["attempts"] < self.max_attempts:
+            backoff = self.retry_delay * 2 ** (message["attempts"] - 1)
+            update = {"$set": {"status": QUEUED, "run_after": now + timedelta(seconds=backoff)}}
+        else:
+            update = {"$set": {"status": FAILED, "finished_at": now}}
+        update["$unset"] = {"lease_owner": "", "lease_expires_at": ""}
+        if update["$set"]["status"] != QUEUED:
+            # The body is only needed until the message is delivered
+            update["$unset"]["html"] = ""
+        result = await self.messages.update_one(
+            {"id": message["id"], "status": SENDING, "lease_owner": message["lease_owner"]}, update
+        )
+        if not result.modified_count:
+            return
+        status = update["$set"]["status"]
+        if status == QUEUED:
+            self.counters["retried"] += 1
+            return
+        self.counters[status] += 1
+        if self.on_result is not None:
+            await self.on_result(message, status)
+
+    async def run_pending(self) -> int:
+        """Send due messages until none are left; returns how many were attempted"""
+        await self.requeue_expired()
+        attempted = 0
+        slots = asyncio.Semaphore(self.concurrency)
+        pending = set()
+
+        async def deliver(message):
+            try:
+                await self._deliver(message)
+            finally:
+                slots.release()
+
+        while True:
+            self.heartbeat = time.monotonic()
+            batch = await self.lease()
+            if not batch:
+                break
+            for message in batch:
+                await slots.acquire()
+                await self.throttle.wait()
+                # A full batch takes batch_size / rate seconds; beat per send so a slow
+                # but moving queue never looks stuck to the liveness probe
+                self.heartbeat = time.monotonic()
+                task = asyncio.create_task(deliver(message))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            attempted += len(batch)
+        await asyncio.gather(*pending)
+        return attempted
+
+    async def _loop(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            try:
+                await self.run_pending()
+            except Exception:
+                logger.exception("Email queue poll failed")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"Email queue worker {self.worker_id} started at {1 / self.throttle.interval:g} messages/s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
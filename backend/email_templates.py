@@ -0,0 +1,126 @@
+"""Transactional email rendering.
+
+Every email is a Jinja2 template in ``templates/email`` that extends
+``_layout.html``, which carries the site branding (company name, site URL,
+support address) taken from site_settings. ``EmailRenderer.load()`` compiles
+all of them once at startup; rendering only runs the compiled code, so a
+notification run can render thousands of messages a second.
+
+Templates are HTML-autoescaped, so names, hostnames and other user data can be
+passed in as they are. The subject is the template's ``subject`` block, rendered
+with the body and unescaped back to plain text.
+
+Broadcast subjects and messages are written by admins and may use
+``{{ user.full_name }}`` or ``{{ brand.company_name }}``; they are compiled in a
+sandboxed environment, once per broadcast, and placed in ``broadcast.html``.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+from jinja2.sandbox import SandboxedEnvironment
+from markupsafe import Markup
+
+TEMPLATE_DIR = Path(__file__).parent / "templates" / "email"
+
+DEFAULT_BRANDING = {
+    "company_name": "KloudNests",
+    "site_url": "https://kloudnests.com",
+    "contact_email": "support@kloudnests.com",
+    "accent_color": "#3B82F6"
+}
+
+
+@dataclass(frozen=True)
+class RenderedEmail:
+    subject: str
+    html: str
+
+
+def branding_from_settings(settings: Optional[dict]) -> dict:
+    """Branding for the email layout; unset or empty site settings keep the defaults"""
+    settings = settings or {}
+    return {key: settings.get(key) or default for key, default in DEFAULT_BRANDING.items()}
+
+
+def money(value) -> str:
+    return f"${float(value or 0):,.2f}"
+
+
+def long_date(value) -> str:
+    """March 04, 2026 from a datetime, or the date part of a legacy ISO string"""
+    if isinstance(value, datetime):
+        return value.strftime("%B %d, %Y")
+    return str(value or "")[:10]
+
+
+def titled(value: str) -> str:
+    """bank_transfer -> Bank Transfer"""
+    return str(value or "").replace("_", " ").title()
+
+
+class EmailRenderer:
+    """Compiled email templates, looked up by file name without the extension"""
+
+    def __init__(self, template_dir: Path = TEMPLATE_DIR):
+        self.env = Environment(
+            loader=FileSystemLoader(str(template_dir)),
+            autoescape=select_autoescape(["html"]),
+            trim_blocks=True,
+            lstrip_blocks=True,
+            auto_reload=False
+        )
+        self.env.filters.update(money=money, long_date=long_date, titled=titled)
+        self.sandbox = SandboxedEnvironment(autoescape=True)
+        self.sandbox.filters.update(money=money, long_date=long_date, titled=titled)
+        self.templates: Dict[str, Template] = {}
+
+    def load(self) -> int:
+        """Compile every template up front, so a broken one fails at startup rather than mid-send"""
+        self.templates = {
+            name[:-len(".html")]: self.env.get_template(name)
+            for name in self.env.list_templates(extensions=["html"])
+            # Layout and macros are only used from other templates
+            if not name.startswith("_")
+        }
+        return len(self.templates)
+
+    def template(self, name: str) -> Template:
+        if name not in self.templates:
+            self.templates[name] = self.env.get_template(f"{name}.html")
+        return self.templates[name]
+
+    def render(self, name: str, brand: dict, /, **context) -> RenderedEmail:
+        return self._render(self.template(name), {"brand": brand, **context})
+
+    def render_many(self, name: str, brand: dict, contexts: Iterable[dict]) -> List[RenderedEmail]:
+        """One email per context, for notification runs that send the same template to many users"""
+        template = self.template(name)
+        return [self._render(template, {"brand": brand, **context}) for context in contexts]
+
+    def compile_message(self, subject: str, message: str) -> tuple:
+        """Sandboxed templates for an admin-written subject and message; raises TemplateError if invalid"""
+        return self.sandbox.from_string(subject), self.sandbox.from_string(message)
+
+    def render_broadcast(self, brand: dict, subject: str, message: str, users: Iterable[dict]) -> List[RenderedEmail]:
+        """The broadcast for each user, with their name and details filled in"""
+        subject_template, message_template = self.compile_message(subject, message)
+        layout = self.template("broadcast")
+        emails = []
+        for user in users:
+            variables = {"brand": brand, "user": user}
+            emails.append(self._render(layout, {
+                **variables,
+                "subject": Markup(subject_template.render(variables)).unescape(),
+                "message": Markup(message_template.render(variables))
+            }))
+        return emails
+
+    @staticmethod
+    def _render(template: Template, variables: dict) -> RenderedEmail:
+        context = template.new_context(variables)
+        html = "".join(template.root_render_func(context))
+        subject = Markup("".join(template.blocks["subject"](context))).unescape()
+        return RenderedEmail(subject=" ".join(subject.split()), html=html)
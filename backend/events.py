@@ -0,0 +1,134 @@
+"""Live events for the dashboards: server status, ticket replies, invoice
+payments and topup decisions.
+
+Handlers publish to the EventBus, which hands each event to the subscribers it
+is meant for: the user it concerns and admins holding the matching permission.
+Subscribers are server-sent event streams. With several API workers, events
+also go through a capped Mongo collection that every worker tails, so a
+subscriber gets events published by any worker.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Events queued for one stream; the oldest are dropped when a slow client falls behind"""
+
+    def __init__(self, user_id: str, permissions: Iterable[str], types: Optional[Set[str]], queue_size: int):
+        self.user_id = user_id
+        self.permissions = set(permissions)
+        self.types = types
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def wants(self, event: dict) -> bool:
+        if self.types and event["type"] not in self.types:
+            return False
+        return event.get("user_id") == self.user_id or event.get("permission") in self.permissions
+
+    def put(self, event: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+def format_sse(event: dict) -> str:
+    payload = {k: event[k] for k in ("id", "type", "data")}
+    payload["created_at"] = event["created_at"].isoformat()
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+class EventBus:
+    """Fans events out to subscriptions in this worker, and through ``collection`` to other workers.
+
+    ``collection`` is a capped collection; without one the bus only reaches
+    streams held by the worker that published the event.
+    """
+
+    def __init__(self, collection=None, queue_size: int = 100, capped_size: int = 16 * 1024 * 1024):
+        self.collection = collection
+        self.queue_size = queue_size
+        self.capped_size = capped_size
+        self.origin = uuid.uuid4().hex
+        self.subscriptions: Set[Subscription] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, user_id: str, permissions: Iterable[str] = (), types: Optional[Iterable[str]] = None) -> Subscription:
+        subscription = Subscription(user_id, permissions, set(types) if types else None, self.queue_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def _deliver(self, event: dict):
+        for subscription in self.subscriptions:
+            if subscription.wants(event):
+                subscription.put(event)
+
+    async def publish(self, event_type: str, data: dict, user_id: Optional[str] = None,
+                      permission: Optional[str] = None):
+        """Send an event to ``user_id`` and to admins with ``permission``; never raises"""
+        event = {
+            "id": uuid.uuid4().hex,
+            "type": event_type,
+            "user_id": user_id,
+            "permission": permission,
+            "data": data,
+            "created_at": datetime.now(timezone.utc),
+            "origin": self.origin
+        }
+        self._deliver(event)
+        if self.collection is not None:
+            try:
+                await self.collection.insert_one(dict(event))
+            except Exception as e:
+                logger.warning(f"Could not share {event_type} event with other workers: {e}")
+
+    async def start(self):
+        if self.collection is None or self._task is not None:
+            return
+        try:
+            await self.collection.database.create_collection(self.collection.name, capped=True, size=self.capped_size)
+        except CollectionInvalid:
+            pass
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _tail(self):
+        """Deliver events inserted by other workers, starting from the newest one at startup"""
+        newest = await self.collection.find({}, {"_id": 1}).sort("$natural", -1).limit(1).to_list(1)
+        last_id = newest[0]["_id"] if newest else None
+        while True:
+            try:
+                query = {"_id": {"$gt": last_id}} if last_id else {}
+                cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for event in cursor:
+                        last_id = event["_id"]
+                        if event.get("origin") != self.origin:
+                            event.pop("_id")
+                            self._deliver(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Event stream tail interrupted: {e}")
+            # A tailable cursor on an empty collection closes straight away
+            await asyncio.sleep(1)
@@ -0,0 +1,177 @@
+"""Liveness and readiness checks.
+
+Checks (Mongo ping, connection pool use, event loop lag, email backlog) run
+in a background loop every ``interval`` seconds and the latest report is
+kept in memory, so a probe only reads it: probes cost nothing however often
+the load balancer sends them, and a slow dependency never makes a probe hang.
+
+Each check returns a dict with ``status`` ok, degraded or failing. A failing
+critical check makes the worker not ready, so the load balancer stops sending
+it traffic. Degraded checks and failing non-critical ones are reported but
+leave the worker in rotation. Liveness only asks whether this process should
+be restarted: the check loop itself has stopped running, or a watched worker
+loop (the email or provisioning queue) has missed its heartbeat.
+"""
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+OK = "ok"
+DEGRADED = "degraded"
+FAILING = "failing"
+
+_SEVERITY = {OK: 0, DEGRADED: 1, FAILING: 2}
+
+
+def threshold_status(value: float, degraded_at: float, failing_at: float) -> str:
+    if value >= failing_at:
+        return FAILING
+    if value >= degraded_at:
+        return DEGRADED
+    return OK
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Counts connections checked out of the Mongo pools and requests waiting for one"""
+
+    def __init__(self):
+        self.in_use = 0
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def _add(self, in_use: int = 0, waiting: int = 0):
+        with self._lock:
+            self.in_use += in_use
+            self.waiting += waiting
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1)
+
+    def connection_checked_out(self, event):
+        self._add(in_use=1, waiting=-1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+Check = Callable[[], Awaitable[dict]]
+
+
+class HealthMonitor:
+    def __init__(self, interval: float = 5.0, timeout: float = 2.0):
+        self.interval = interval
+        self.timeout = timeout
+        self.checks: Dict[str, Tuple[Check, bool]] = {}
+        # name -> (heartbeat getter, seconds after which the worker counts as stuck)
+        self.workers: Dict[str, Tuple[Callable[[], Optional[float]], float]] = {}
+        self.report: dict = {"status": FAILING, "checks": {}, "checked_at": None, "message": "Not checked yet"}
+        self.refreshed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def check(self, name: str, critical: bool = True):
+        """Register an async check; usable as a decorator"""
+        def register(fn: Check) -> Check:
+            self.checks[name] = (fn, critical)
+            return fn
+        return register
+
+    def watch(self, name: str, heartbeat: Callable[[], Optional[float]], stale_after: float):
+        """Fail liveness if ``heartbeat()`` (a monotonic time) is older than ``stale_after`` seconds"""
+        self.workers[name] = (heartbeat, stale_after)
+
+    async def _run(self, name: str, fn: Check) -> dict:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(fn(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            result = {"status": FAILING, "error": f"Timed out after {self.timeout:g}s"}
+        except Exception as e:
+            result = {"status": FAILING, "error": f"{type(e).__name__}: {e}"}
+        result.setdefault("duration_ms", round((time.perf_counter() - started) * 1000, 1))
+        return result
+
+    async def refresh(self) -> dict:
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._run(name, self.checks[name][0]) for name in names))
+        checks = dict(zip(names, results))
+        status = OK
+        for name, result in checks.items():
+            critical = self.checks[name][1]
+            severity = result["status"] if critical or result["status"] == OK else DEGRADED
+            if _SEVERITY[severity] > _SEVERITY[status]:
+                status = severity
+        self.report = {"status": status, "checks": checks, "checked_at": datetime.now(timezone.utc)}
+        self.refreshed_at = time.monotonic()
+        return self.report
+
+    def _stale(self) -> bool:
+        # Allow one slow round of checks before calling the loop stalled
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at > 2 * self.interval + self.timeout
+
+    def liveness(self) -> Tuple[bool, dict]:
+        now = time.monotonic()
+        workers = {}
+        alive = not self._stale() or self.refreshed_at is None
+        for name, (heartbeat, stale_after) in self.workers.items():
+            beat = heartbeat()
+            age = None if beat is None else round(now - beat, 1)
+            stuck = age is not None and age > stale_after
+            workers[name] = {"status": FAILING if stuck else OK, "last_heartbeat_s": age}
+            alive = alive and not stuck
+        checks_age = None if self.refreshed_at is None else round(now - self.refreshed_at, 1)
+        return alive, {"status": OK if alive else FAILING, "checks_age_s": checks_age, "workers": workers}
+
+    def readiness(self) -> Tuple[bool, dict]:
+        if self._stale():
+            message = "Not checked yet" if self.refreshed_at is None else "Health checks have stopped running"
+            return False, {**self.report, "status": FAILING, "message": message}
+        return self.report["status"] != FAILING, self.report
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Health check round failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
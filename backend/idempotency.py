@@ -0,0 +1,135 @@
+"""Idempotency keys for side-effecting POST endpoints.
+
+A client sends an ``Idempotency-Key`` header with a request that charges a wallet
+or creates records. The first request with a key claims it and runs the handler;
+its response is stored and any retry with the same key gets that response back
+without the handler running again. Keys are scoped per user and endpoint, and
+records expire through a TTL index.
+
+Handlers raise HTTPException only to reject a request before writing anything
+(or after undoing what they wrote), so such a rejection releases the key and
+the client can correct the request and retry it. Any other failure may come
+after side effects, so the key is kept as failed and retries get an error
+instead of running the handler a second time; the same happens if the
+response cannot be stored after the handler succeeded.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+REPLAY_HEADER = "Idempotent-Replayed"
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+# The handler may have made changes but its response was not stored; never run again
+FAILED = "failed"
+
+FAILED_RESPONSE = {
+    "detail": "The original request with this Idempotency-Key failed after it may have made changes; "
+              "check its result before retrying with a new key"
+}
+
+
+def fingerprint(payload) -> str:
+    """Stable hash of the request parameters, to detect a key reused for a different request"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, collection, ttl: timedelta = timedelta(hours=24), lock_timeout: timedelta = timedelta(seconds=60)):
+        self.collection = collection
+        self.ttl = ttl
+        # A claim older than this is assumed abandoned by a crashed worker and can be taken over
+        self.lock_timeout = lock_timeout
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def run(self, key: Optional[str], user_id: str, scope: str, payload, handler: Callable[[], Awaitable]):
+        """Run ``handler`` once per key; without a key the request is not deduplicated"""
+        if not key:
+            return await handler()
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+        record_id = f"{user_id}:{scope}:{key}"
+        request_hash = fingerprint(payload)
+        stored = await self._claim(record_id, request_hash)
+        if stored is not None:
+            return JSONResponse(status_code=stored["status_code"], content=stored["body"], headers={REPLAY_HEADER: "true"})
+
+        try:
+            result = await handler()
+        except HTTPException:
+            # Rejected before any side effect; let the client retry the key
+            await self.collection.delete_one({"_id": record_id, "status": IN_PROGRESS})
+            raise
+        except BaseException:
+            await self._fail(record_id)
+            raise
+
+        try:
+            await self.collection.update_one(
+                {"_id": record_id},
+                {"$set": {"status": COMPLETED, "status_code": 200, "body": jsonable_encoder(result)}}
+            )
+        except Exception:
+            # The changes are made; a retry must not be able to take the key over and make them again
+            logger.exception(f"Failed to store the response for idempotency key {record_id}")
+            await self._fail(record_id)
+        return result
+
+    async def _fail(self, record_id: str):
+        try:
+            await self.collection.update_one(
+                {"_id": record_id},
+                {"$set": {"status": FAILED, "status_code": 500, "body": FAILED_RESPONSE}}
+            )
+        except Exception:
+            logger.exception(f"Failed to mark idempotency key {record_id} as failed")
+
+    async def _claim(self, record_id: str, request_hash: str) -> Optional[dict]:
+        """Claim the key for this request; returns the stored response when it already completed or failed"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                "_id": record_id,
+                "fingerprint": request_hash,
+                "status": IN_PROGRESS,
+                "locked_until": now + self.lock_timeout,
+                "created_at": now,
+                "expires_at": now + self.ttl
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        existing = await self.collection.find_one({"_id": record_id})
+        if existing is None:
+            # Expired or released between the insert and the read
+            return await self._claim(record_id, request_hash)
+        if existing["fingerprint"] != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with different request parameters")
+        if existing["status"] in (COMPLETED, FAILED):
+            return existing
+
+        taken_over = await self.collection.find_one_and_update(
+            {"_id": record_id, "status": IN_PROGRESS, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + self.lock_timeout}},
+            return_document=ReturnDocument.AFTER
+        )
+        if taken_over is None:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed")
+        return None
@@ -0,0 +1,70 @@
+"""Pool of unassigned machines that paid orders are allocated from.
+
+Each machine belongs to a data center and a plan. Availability lookups and
+claims use the (status, plan_id, data_center_id, created_at) index, and a claim
+is a single findOneAndUpdate on an available machine, so two orders racing for
+the last box cannot both get it.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+AVAILABLE = "available"
+ALLOCATED = "allocated"
+MAINTENANCE = "maintenance"
+MACHINE_STATUSES = (AVAILABLE, ALLOCATED, MAINTENANCE)
+
+# Fields copied from a machine onto the server record it becomes
+CREDENTIAL_FIELDS = (
+    "hostname", "ip_address", "username", "password", "ssh_port",
+    "panel_url", "panel_username", "panel_password", "additional_notes"
+)
+
+
+async def ensure_indexes(collection):
+    await collection.create_index([("status", 1), ("plan_id", 1), ("data_center_id", 1), ("created_at", 1)])
+    await collection.create_index("ip_address", unique=True)
+    await collection.create_index("id", unique=True)
+
+
+async def claim_machine(collection, plan_id: str, data_center_id: Optional[str], order_id: str,
+                        user_id: str, session=None) -> Optional[dict]:
+    """Atomically take the oldest available machine for the plan (and data center, if given)"""
+    query = {"status": AVAILABLE, "plan_id": plan_id}
+    if data_center_id:
+        query["data_center_id"] = data_center_id
+    return await collection.find_one_and_update(
+        query,
+        {"$set": {
+            "status": ALLOCATED,
+            "order_id": order_id,
+            "user_id": user_id,
+            "allocated_at": datetime.now(timezone.utc)
+        }},
+        projection={"_id": 0},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+
+async def release_machine(collection, machine_id: str, session=None) -> bool:
+    """Return an allocated machine to the pool, e.g. after its server is cancelled"""
+    result = await collection.update_one(
+        {"id": machine_id, "status": ALLOCATED},
+        {"$set": {"status": AVAILABLE}, "$unset": {"order_id": "", "user_id": "", "server_id": "", "allocated_at": ""}},
+        session=session
+    )
+    return result.modified_count == 1
+
+
+async def availability(collection) -> list:
+    """Available machine counts per plan and data center"""
+    pipeline = [
+        {"$match": {"status": AVAILABLE}},
+        {"$group": {"_id": {"plan_id": "$plan_id", "data_center_id": "$data_center_id"}, "available": {"$sum": 1}}},
+        {"$project": {"_id": 0, "plan_id": "$_id.plan_id", "data_center_id": "$_id.data_center_id", "available": 1}},
+        {"$sort": {"plan_id": 1, "data_center_id": 1}}
+    ]
+    return await collection.aggregate(pipeline).to_list(1000)
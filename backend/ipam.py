@@ -0,0 +1,359 @@
+"""IP address management.
+
+Subnets belong to a data center. Every address handed to a server or an
+inventory machine is recorded in ``ip_assignments``, whose unique index on
+ip_address is what actually prevents two hosts sharing an address, including
+across workers. Each subnet also gets an in-memory bitmap of used addresses so
+the next free one is found without scanning, even in a /16.
+"""
+import asyncio
+import ipaddress
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+WORD_BITS = 64
+FULL_WORD = (1 << WORD_BITS) - 1
+
+# A /12 at most; the bitmap for one costs 128 KB
+MAX_SUBNET_ADDRESSES = 1 << 20
+
+class IPAMError(Exception):
+    """Invalid address or subnet, or a subnet operation that is not allowed"""
+
+
+class AddressConflict(IPAMError):
+    """The address is already assigned to another server or machine"""
+
+    def __init__(self, ip_address: str, owner: Optional[dict]):
+        self.ip_address = ip_address
+        self.owner = owner
+        super().__init__(f"IP address {ip_address} is already in use")
+
+
+class SubnetExhausted(IPAMError):
+    """No free addresses are left in the subnet"""
+
+
+def normalize_address(value: str) -> str:
+    try:
+        return str(ipaddress.ip_address(value.strip()))
+    except ValueError:
+        raise IPAMError(f"Invalid IP address: {value}")
+
+
+def parse_network(cidr: str):
+    try:
+        network = ipaddress.ip_network(cidr.strip())
+    except ValueError:
+        raise IPAMError(f"Invalid subnet: {cidr}")
+    if network.num_addresses > MAX_SUBNET_ADDRESSES:
+        raise IPAMError(f"Subnets are limited to {MAX_SUBNET_ADDRESSES} addresses")
+    return network
+
+
+class SubnetAllocator:
+    """Used/free bitmap for one subnet.
+
+    Addresses are tracked by offset from the network address in 64-bit words.
+    ``_nonfull`` has bit i set while word i still has a free address, so the
+    lowest free address is two lowest-set-bit operations away.
+    """
+
+    def __init__(self, network, reserved: Tuple[str, ...] = ()):
+        self.network = network
+        self.size = network.num_addresses
+        words = (self.size + WORD_BITS - 1) // WORD_BITS
+        self._words = [0] * words
+        self._nonfull = (1 << words) - 1
+        self.free_count = self.size
+        # Bits past the end of the subnet in the last word are never free
+        tail = words * WORD_BITS - self.size
+        if tail:
+            self._words[-1] = FULL_WORD & ~((1 << (WORD_BITS - tail)) - 1)
+        if self._words[-1] == FULL_WORD:
+            self._nonfull &= ~(1 << (words - 1))
+        # Network and broadcast addresses can't be given to a host
+        if network.version == 4 and network.prefixlen < 31:
+            self.mark_used(0)
+            self.mark_used(self.size - 1)
+        for address in reserved:
+            self.mark_used(self.offset(address))
+
+    def offset(self, address: str) -> int:
+        offset = int(ipaddress.ip_address(address)) - int(self.network.network_address)
+        if not 0 <= offset < self.size:
+            raise IPAMError(f"{address} is not in {self.network}")
+        return offset
+
+    def address(self, offset: int) -> str:
+        return str(self.network.network_address + offset)
+
+    def is_free(self, offset: int) -> bool:
+        return not self._words[offset // WORD_BITS] >> (offset % WORD_BITS) & 1
+
+    def mark_used(self, offset: int):
+        index, bit = divmod(offset, WORD_BITS)
+        word = self._words[index]
+        if word >> bit & 1:
+            return
+        word |= 1 << bit
+        self._words[index] = word
+        self.free_count -= 1
+        if word == FULL_WORD:
+            self._nonfull &= ~(1 << index)
+
+    def mark_free(self, offset: int):
+        index, bit = divmod(offset, WORD_BITS)
+        word = self._words[index]
+        if not word >> bit & 1:
+            return
+        self._words[index] = word & ~(1 << bit)
+        self.free_count += 1
+        self._nonfull |= 1 << index
+
+    def next_free(self) -> Optional[int]:
+        if not self._nonfull:
+            return None
+        index = (self._nonfull & -self._nonfull).bit_length() - 1
+        word = self._words[index]
+        # Lowest clear bit of the word
+        return index * WORD_BITS + (~word & (word + 1)).bit_length() - 1
+
+    def free_ranges(self) -> Iterator[Tuple[int, int]]:
+        """Runs of free offsets as inclusive (first, last) pairs"""
+        start = None
+        for index, word in enumerate(self._words):
+            base = index * WORD_BITS
+            if word == 0:
+                if start is None:
+                    start = base
+                continue
+            if word == FULL_WORD:
+                if start is not None:
+                    yield start, base - 1
+                    start = None
+                continue
+            for bit in range(WORD_BITS):
+                used = word >> bit & 1
+                if not used and start is None:
+                    start = base + bit
+                elif used and start is not None:
+                    yield start, base + bit - 1
+                    start = None
+        if start is not None:
+            yield start, self.size - 1
+
+
+class IPAM:
+    """Subnets, address assignments and the cached allocator bitmaps.
+
+    Bitmaps are rebuilt from ``ip_assignments`` after ``ttl`` seconds, so
+    addresses released by another worker become available again. A bitmap that
+    is behind only ever makes a free address look used; allocation still goes
+    through the unique index and retries when another worker got there first.
+    """
+
+    def __init__(self, db, ttl: float = 300):
+        self.subnets = db.subnets
+        self.assignments = db.ip_assignments
+        self.ttl = ttl
+        self._networks: Optional[List[tuple]] = None
+        self._networks_loaded_at = 0.0
+        self._allocators: Dict[str, Tuple[SubnetAllocator, float]] = {}
+        self._lock = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        await self.assignments.create_index("ip_address", unique=True)
+        await self.assignments.create_index("subnet_id")
+        await self.assignments.create_index([("owner_type", 1), ("owner_id", 1)])
+        await self.subnets.create_index("id", unique=True)
+        await self.subnets.create_index("data_center_id")
+
+    def invalidate(self, subnet_id: Optional[str] = None):
+        self._networks = None
+        if subnet_id:
+            self._allocators.pop(subnet_id, None)
+
+    async def networks(self) -> List[tuple]:
+        """(network, subnet document) for every subnet"""
+        if self._networks is None or time.monotonic() - self._networks_loaded_at >= self.ttl:
+            subnets = await self.subnets.find({}, {"_id": 0}).to_list(10000)
+            self._networks = [(ipaddress.ip_network(subnet["cidr"]), subnet) for subnet in subnets]
+            self._networks_loaded_at = time.monotonic()
+        return self._networks
+
+    async def subnet_for(self, ip_address: str) -> Optional[dict]:
+        address = ipaddress.ip_address(ip_address)
+        for network, subnet in await self.networks():
+            if address in network:
+                return subnet
+        return None
+
+    async def get_subnet(self, subnet_id: str) -> dict:
+        for _, subnet in await self.networks():
+            if subnet["id"] == subnet_id:
+                return subnet
+        raise IPAMError("Subnet not found")
+
+    async def allocator(self, subnet: dict) -> SubnetAllocator:
+        cached = self._allocators.get(subnet["id"])
+        if cached and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        async with self._lock:
+            cached = self._allocators.get(subnet["id"])
+            if cached and time.monotonic() - cached[1] < self.ttl:
+                return cached[0]
+            allocator = SubnetAllocator(ipaddress.ip_network(subnet["cidr"]), tuple(filter(None, [subnet.get("gateway")])))
+            async for assignment in self.assignments.find({"subnet_id": subnet["id"]}, {"_id": 0, "ip_address": 1}):
+                allocator.mark_used(allocator.offset(assignment["ip_address"]))
+            self._allocators[subnet["id"]] = (allocator, time.monotonic())
+            return allocator
+
+    async def add_subnet(self, subnet_id: str, data_center_id: str, cidr: str, gateway: Optional[str] = None,
+                         description: Optional[str] = None, created_by: Optional[str] = None) -> dict:
+        network = parse_network(cidr)
+        if gateway:
+            gateway = normalize_address(gateway)
+            if ipaddress.ip_address(gateway) not in network:
+                raise IPAMError(f"Gateway {gateway} is not in {network}")
+        for existing, subnet in await self.networks():
+            if existing.version == network.version and existing.overlaps(network):
+                raise IPAMError(f"{network} overlaps subnet {existing}")
+        subnet = {
+            "id": subnet_id,
+            "data_center_id": data_center_id,
+            "cidr": str(network),
+            "gateway": gateway,
+            "description": description,
+            "created_at": datetime.now(timezone.utc),
+            "created_by": created_by
+        }
+        await self.subnets.insert_one(subnet)
+        subnet.pop("_id", None)
+        # Addresses assigned before the subnet existed now belong to it
+        unmanaged = await self.assignments.find({"subnet_id": None}, {"_id": 0, "ip_address": 1}).to_list(None)
+        inside = [a["ip_address"] for a in unmanaged if ipaddress.ip_address(a["ip_address"]) in network]
+        if inside:
+            await self.assignments.update_many({"ip_address": {"$in": inside}}, {"$set": {"subnet_id": subnet_id}})
+        self.invalidate()
+        return subnet
+
+    async def remove_subnet(self, subnet_id: str):
+        await self.get_subnet(subnet_id)
+        if await self.assignments.count_documents({"subnet_id": subnet_id}, limit=1):
+            raise IPAMError("Subnet still has assigned addresses")
+        await self.subnets.delete_one({"id": subnet_id})
+        self.invalidate(subnet_id)
+
+    async def owner(self, ip_address: str) -> Optional[dict]:
+        return await self.assignments.find_one({"ip_address": normalize_address(ip_address)}, {"_id": 0})
+
+    async def assign(self, ip_address: str, owner_type: str, owner_id: str) -> str:
+        """Record ``ip_address`` as used by the owner; raises AddressConflict if someone else has it"""
+        ip_address = normalize_address(ip_address)
+        subnet = await self.subnet_for(ip_address)
+        try:
+            await self.assignments.insert_one({
+                "ip_address": ip_address,
+                "subnet_id": subnet["id"] if subnet else None,
+                "owner_type": owner_type,
+                "owner_id": owner_id,
+                "assigned_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            owner = await self.assignments.find_one({"ip_address": ip_address}, {"_id": 0})
+            if owner and owner["owner_type"] == owner_type and owner["owner_id"] == owner_id:
+                return ip_address
+            raise AddressConflict(ip_address, owner)
+        if subnet and subnet["id"] in self._allocators:
+            allocator = self._allocators[subnet["id"]][0]
+            allocator.mark_used(allocator.offset(ip_address))
+        return ip_address
+
+    async def allocate(self, subnet_id: str, owner_type: str, owner_id: str) -> str:
+        """Assign the lowest free address in the subnet to the owner"""
+        subnet = await self.get_subnet(subnet_id)
+        allocator = await self.allocator(subnet)
+        while True:
+            offset = allocator.next_free()
+            if offset is None:
+                raise SubnetExhausted(f"No free addresses left in {subnet['cidr']}")
+            # Claimed in the bitmap first so concurrent requests in this worker skip it
+            allocator.mark_used(offset)
+            ip_address = allocator.address(offset)
+            try:
+                await self.assignments.insert_one({
+                    "ip_address": ip_address,
+                    "subnet_id": subnet_id,
+                    "owner_type": owner_type,
+                    "owner_id": owner_id,
+                    "assigned_at": datetime.now(timezone.utc)
+                })
+                return ip_address
+            except DuplicateKeyError:
+                # Taken by another worker since the bitmap was loaded
+                continue
+            except Exception:
+                allocator.mark_free(offset)
+                raise
+
+    async def release(self, ip_address: str, owner_id: Optional[str] = None) -> bool:
+        """Free an address, only if ``owner_id`` (when given) still holds it"""
+        try:
+            ip_address = normalize_address(ip_address)
+        except IPAMError:
+            return False
+        query = {"ip_address": ip_address}
+        if owner_id:
+            query["owner_id"] = owner_id
+        assignment = await self.assignments.find_one_and_delete(query, projection={"_id": 0})
+        if not assignment:
+            return False
+        cached = self._allocators.get(assignment.get("subnet_id"))
+        if cached:
+            cached[0].mark_free(cached[0].offset(ip_address))
+        return True
+
+    async def usage(self, subnet: dict, ranges: int = 20) -> dict:
+        allocator = await self.allocator(subnet)
+        next_free = allocator.next_free()
+        free_ranges = []
+        for first, last in allocator.free_ranges():
+            if len(free_ranges) == ranges:
+                break
+            free_ranges.append({"first": allocator.address(first), "last": allocator.address(last), "count": last - first + 1})
+        return {
+            **subnet,
+            "size": allocator.size,
+            "free": allocator.free_count,
+            "used": allocator.size - allocator.free_count,
+            "next_free": allocator.address(next_free) if next_free is not None else None,
+            "free_ranges": free_ranges
+        }
+
+    async def backfill(self, collection, owner_type: str) -> int:
+        """Register the addresses of existing records, skipping ones already assigned"""
+        assignments = []
+        async for doc in collection.find({"ip_address": {"$type": "string"}}, {"_id": 0, "id": 1, "ip_address": 1}):
+            try:
+                ip_address = normalize_address(doc["ip_address"])
+            except IPAMError:
+                continue
+            subnet = await self.subnet_for(ip_address)
+            assignments.append({
+                "ip_address": ip_address,
+                "subnet_id": subnet["id"] if subnet else None,
+                "owner_type": owner_type,
+                "owner_id": doc["id"],
+                "assigned_at": datetime.now(timezone.utc)
+            })
+        if not assignments:
+            return 0
+        try:
+            result = await self.assignments.insert_many(assignments, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            return e.details["nInserted"]
@@ -0,0 +1,306 @@
+"""Prometheus metrics for the API.
+
+A small registry of counters, gauges and histograms rendered in the
+Prometheus text exposition format, without a client library. Recording a
+sample is a dict lookup and a few integer additions; histograms keep
+per-bucket counts and are made cumulative only when scraped.
+
+``MetricsMiddleware`` is plain ASGI rather than BaseHTTPMiddleware, so it
+adds no task or stream per request. Requests are labelled with the route
+template (``/api/servers/{server_id}``), never the raw path, so label sets
+stay bounded; unmatched paths share one label.
+
+``MongoCommandTimer`` is a pymongo command listener timing every command per
+collection. pymongo calls it from motor's worker threads, so the metrics
+take a lock when recording.
+
+Gauges whose value is read at scrape time (queue depth, cache hit ratios)
+are registered with ``Registry.collector``; collectors may be coroutines.
+"""
+import asyncio
+import bisect
+import inspect
+import logging
+import math
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from a cached lookup to a slow report
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_total(self, value: float, *labels: str):
+        """For totals counted elsewhere, such as a cache's hit count, copied in by a collector"""
+        self._values[labels] = value
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (last is +Inf), sum, count]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            values = sorted((labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items())
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+Collector = Callable[[], Union[None, Awaitable[None]]]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Collector] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, fn: Collector) -> Collector:
+        """Register ``fn`` to refresh gauges just before each scrape; usable as a decorator"""
+        self.collectors.append(fn)
+        return fn
+
+    async def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                result = collect()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                # A failing collector leaves its gauges at their last value rather than failing the scrape
+                logger.exception(f"Metrics collector {getattr(collect, '__name__', collect)} failed")
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Counts requests and times them per method, route template and status"""
+
+    def __init__(self, app, requests: Counter, latency: Histogram, exclude: Iterable[str] = ()):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        # Route templates not recorded, such as long-lived streams and the scrape itself
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            if path not in self.exclude:
+                method = scope["method"]
+                self.requests.inc(method, path, str(status))
+                self.latency.observe(time.perf_counter() - started, method, path)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times Mongo commands per collection and counts failures"""
+
+    def __init__(self, duration: Histogram, failures: Counter):
+        self.duration = duration
+        self.failures = failures
+        self._pending: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        self._pending[(event.connection_id, event.request_id)] = (collection or "", event.command_name)
+
+    def _finish(self, event) -> Optional[tuple]:
+        key = self._pending.pop((event.connection_id, event.request_id), None)
+        if key is not None:
+            self.duration.observe(event.duration_micros / 1e6, *key)
+        return key
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        key = self._finish(event)
+        if key is not None:
+            self.failures.inc(*key)
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes a sleeping task, a direct measure of blocking work"""
+
+    def __init__(self, lag: Histogram, current: Gauge, interval: float = 0.5):
+        self.lag = lag
+        self.current = current
+        self.interval = interval
+        # Most recent sample in seconds, read by the health checks
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = lag = max(0.0, loop.time() - expected)
+            self.lag.observe(lag)
+            self.current.set(lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def timed_job(duration: Histogram, name: str):
+    """Decorator recording an async job's run time under ``name`` with status ok or error"""
+    def decorator(fn):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            status = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                duration.observe(time.perf_counter() - started, name, status)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorator
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Convert ISO string timestamps to native BSON dates.
+
+Older documents store created_at, due_date, renewal_date, ... as ISO strings, which
+sort and compare lexicographically. This tool rewrites them as dates in batches,
+walking each collection in _id order. Progress is checkpointed in the ``migrations``
+collection after every batch, so an interrupted run resumes where it stopped.
+
+Usage (from backend/, with MONGO_URL and DB_NAME set as for the server):
+    python migrate_datetimes.py [--batch-size 500] [--dry-run] [--collections invoices servers]
+    python migrate_datetimes.py --restart      # ignore checkpoints and scan everything again
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+MIGRATION_ID = "native_datetimes"
+
+# Timestamp fields per collection
+DATETIME_FIELDS = {
+    "users": ["created_at", "updated_at"],
+    "orders": ["created_at", "updated_at"],
+    "invoices": ["created_at", "due_date", "paid_date", "cancelled_at"],
+    "servers": ["created_at", "updated_at", "renewal_date", "suspended_at", "cancelled_at"],
+    "tickets": ["created_at", "updated_at"],
+    "ticket_messages": ["created_at"],
+    "transactions": ["created_at"],
+    "topup_requests": ["created_at", "processed_at"],
+    "plans": ["created_at", "updated_at"],
+    "addons": ["created_at"],
+    "datacenters": ["created_at"],
+    "contacts": ["created_at"],
+    "payment_proofs": ["created_at"],
+    "site_settings": ["updated_at"],
+}
+
+logger = logging.getLogger("migrate_datetimes")
+
+
+def parse_timestamp(value):
+    """ISO string -> aware UTC datetime; returns None for values that are not timestamps"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+async def is_migration_complete(db) -> bool:
+    state = await db.migrations.find_one({"_id": MIGRATION_ID}, {"completed_at": 1})
+    return bool(state and state.get("completed_at"))
+
+
+async def migrate_collection(db, name: str, fields, batch_size: int, dry_run: bool, resume_after=None) -> dict:
+    collection = db[name]
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    stats = {"scanned": 0, "converted": 0, "invalid": 0}
+    last_id = resume_after
+
+    while True:
+        batch_query = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+        projection = {field: 1 for field in fields}
+        docs = await collection.find(batch_query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+
+        operations = []
+        for doc in docs:
+            updates = {}
+            for field in fields:
+                value = doc.get(field)
+                if isinstance(value, str):
+                    parsed = parse_timestamp(value)
+                    if parsed is None:
+                        stats["invalid"] += 1
+                        logger.warning(f"{name} {doc['_id']}: cannot parse {field}={value!r}, left unchanged")
+                    else:
+                        updates[field] = parsed
+            if updates:
+                # Only rewrite values that are still the strings we read
+                guard = {field: doc[field] for field in updates}
+                operations.append(UpdateOne(dict(guard, _id=doc["_id"]), {"$set": updates}))
+                stats["converted"] += len(updates)
+        stats["scanned"] += len(docs)
+        last_id = docs[-1]["_id"]
+
+        if not dry_run:
+            if operations:
+                await collection.bulk_write(operations, ordered=False)
+            await db.migrations.update_one(
+                {"_id": MIGRATION_ID},
+                {"$set": {f"collections.{name}.last_id": last_id, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        logger.info(f"{name}: scanned {stats['scanned']}, converted {stats['converted']} fields")
+
+    if not dry_run:
+        await db.migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {f"collections.{name}.done": True, f"collections.{name}.stats": stats}},
+            upsert=True
+        )
+    return stats
+
+
+async def run(db, collections, batch_size: int, dry_run: bool, restart: bool) -> int:
+    if restart and not dry_run:
+        await db.migrations.delete_one({"_id": MIGRATION_ID})
+    state = await db.migrations.find_one({"_id": MIGRATION_ID}) or {}
+    progress = state.get("collections", {})
+
+    for name in collections:
+        checkpoint = progress.get(name, {})
+        if checkpoint.get("done") and not dry_run:
+            logger.info(f"{name}: already migrated, skipping")
+            continue
+        resume_after = None if dry_run else checkpoint.get("last_id")
+        if resume_after is not None:
+            logger.info(f"{name}: resuming after _id {resume_after}")
+        stats = await migrate_collection(db, name, DATETIME_FIELDS[name], batch_size, dry_run, resume_after)
+        print(f"{name}: {stats['scanned']} documents, {stats['converted']} fields converted, {stats['invalid']} unparseable")
+
+    if not dry_run:
+        state = await db.migrations.find_one({"_id": MIGRATION_ID}) or {}
+        if all(state.get("collections", {}).get(name, {}).get("done") for name in DATETIME_FIELDS):
+            await db.migrations.update_one(
+                {"_id": MIGRATION_ID},
+                {"$set": {"completed_at": datetime.now(timezone.utc)}}
+            )
+            print("Migration complete")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--restart", action="store_true", help="discard saved progress first")
+    parser.add_argument("--collections", nargs="+", choices=sorted(DATETIME_FIELDS), default=list(DATETIME_FIELDS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    load_dotenv(Path(__file__).parent / ".env")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    try:
+        return asyncio.run(run(client[os.environ["DB_NAME"]], args.collections, args.batch_size, args.dry_run, args.restart))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
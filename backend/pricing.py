@@ -0,0 +1,173 @@
+"""Order pricing.
+
+Plans, add-ons and data centers change rarely, so they are loaded into an
+in-memory snapshot that is refreshed after a short TTL and dropped whenever an
+admin edits the catalog. Quotes are then computed without touching the database.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+# Length of each billing cycle in months
+CYCLE_MONTHS = {"monthly": 1, "quarterly": 3, "yearly": 12}
+
+PLAN_PRICE_FIELDS = {"monthly": "price_monthly", "quarterly": "price_quarterly", "yearly": "price_yearly"}
+
+
+class PricingError(Exception):
+    """The requested plan cannot be priced (unknown, inactive or missing a price)"""
+
+
+@dataclass(frozen=True)
+class Discount:
+    """A price reduction applied to the subtotal, e.g. from a promotion or coupon"""
+    code: str
+    percent: float = 0.0
+    amount: float = 0.0
+
+    def apply(self, subtotal: float) -> float:
+        return min(subtotal, subtotal * self.percent / 100 + self.amount)
+
+
+@dataclass
+class Quote:
+    plan_id: str
+    plan_name: str
+    billing_cycle: str
+    base_price: float
+    data_center_name: Optional[str] = None
+    addon_details: List[dict] = field(default_factory=list)
+    discounts: List[dict] = field(default_factory=list)
+
+    @property
+    def addon_total(self) -> float:
+        return sum(addon["price"] for addon in self.addon_details)
+
+    @property
+    def subtotal(self) -> float:
+        return self.base_price + self.addon_total
+
+    @property
+    def discount_total(self) -> float:
+        return sum(discount["amount"] for discount in self.discounts)
+
+    @property
+    def total(self) -> float:
+        return round(self.subtotal - self.discount_total, 2)
+
+    def to_dict(self) -> dict:
+        return {
+            "plan_id": self.plan_id,
+            "plan_name": self.plan_name,
+            "billing_cycle": self.billing_cycle,
+            "data_center_name": self.data_center_name,
+            "base_price": self.base_price,
+            "addon_details": self.addon_details,
+            "addon_total": self.addon_total,
+            "subtotal": self.subtotal,
+            "discounts": self.discounts,
+            "total": self.total
+        }
+
+
+def addon_price_for_cycle(price: float, addon_cycle: str, order_cycle: str) -> float:
+    """Price of an add-on over one order billing cycle.
+
+    A recurring add-on billed more often than the order is charged for every
+    period in the cycle (a monthly add-on on a yearly order costs 12x). Add-ons
+    billed once or less often than the order cycle are charged their listed price.
+    """
+    addon_months = CYCLE_MONTHS.get(addon_cycle)
+    order_months = CYCLE_MONTHS[order_cycle]
+    if addon_months and addon_months < order_months:
+        return price * (order_months // addon_months)
+    return price
+
+
+@dataclass
+class CatalogSnapshot:
+    plans: Dict[str, dict]
+    addons: Dict[str, dict]
+    datacenters: Dict[str, dict]
+    loaded_at: float
+
+    def quote(self, plan_id: str, billing_cycle: str, data_center_id: Optional[str] = None,
+              addon_ids: Sequence[str] = (), discounts: Sequence[Discount] = ()) -> Quote:
+        plan = self.plans.get(plan_id)
+        if plan is None:
+            raise PricingError("Plan not found")
+        base_price = plan.get(PLAN_PRICE_FIELDS[billing_cycle])
+        if base_price is None:
+            raise PricingError(f"Plan has no {billing_cycle} price")
+
+        datacenter = self.datacenters.get(data_center_id) if data_center_id else None
+        result = Quote(
+            plan_id=plan["id"],
+            plan_name=plan["name"],
+            billing_cycle=billing_cycle,
+            base_price=base_price,
+            data_center_name=datacenter["name"] if datacenter else None
+        )
+        # Unknown or inactive add-ons are skipped, duplicates are charged once
+        for addon_id in dict.fromkeys(addon_ids or ()):
+            addon = self.addons.get(addon_id)
+            if addon is None:
+                continue
+            result.addon_details.append({
+                "id": addon["id"],
+                "name": addon["name"],
+                "price": addon_price_for_cycle(addon["price"], addon["billing_cycle"], billing_cycle)
+            })
+        remaining = result.subtotal
+        for discount in discounts:
+            amount = discount.apply(remaining)
+            remaining -= amount
+            result.discounts.append({"code": discount.code, "amount": amount})
+        return result
+
+
+class PricingCatalog:
+    """Active plans, add-ons and data centers, cached in memory for ``ttl`` seconds"""
+
+    def __init__(self, db, ttl: float = 60):
+        self.db = db
+        self.ttl = ttl
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._generation += 1
+        self._snapshot = None
+
+    async def snapshot(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot.loaded_at < self.ttl:
+            return snapshot
+        async with self._lock:
+            # Another request may have reloaded it while we waited
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - snapshot.loaded_at < self.ttl:
+                return snapshot
+            generation = self._generation
+            plans, addons, datacenters = await asyncio.gather(
+                self.db.plans.find({"is_active": True}, {"_id": 0}).to_list(1000),
+                self.db.addons.find({"is_active": True}, {"_id": 0}).to_list(1000),
+                self.db.datacenters.find({"is_active": True}, {"_id": 0}).to_list(1000)
+            )
+            snapshot = CatalogSnapshot(
+                plans={plan["id"]: plan for plan in plans},
+                addons={addon["id"]: addon for addon in addons},
+                datacenters={datacenter["id"]: datacenter for datacenter in datacenters},
+                loaded_at=time.monotonic()
+            )
+            # Don't keep data read before an admin edit landed
+            if generation == self._generation:
+                self._snapshot = snapshot
+            return snapshot
+
+    async def quote(self, plan_id: str, billing_cycle: str, data_center_id: Optional[str] = None,
+                    addon_ids: Sequence[str] = (), discounts: Sequence[Discount] = ()) -> Quote:
+        snapshot = await self.snapshot()
+        return snapshot.quote(plan_id, billing_cycle, data_center_id, addon_ids, discounts)
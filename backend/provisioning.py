@@ -0,0 +1,357 @@
+"""Provisioning job queue for server control actions.
+
+Reboots and reinstalls are stored as jobs in Mongo and run by a worker loop
+through a driver that talks to the actual infrastructure. A worker leases a job
+before running it and keeps extending the lease while the driver works; if the
+worker dies, the lease runs out and the job is queued again. Failed attempts
+are retried with exponential backoff, and each data center runs at most a
+configured number of jobs at once.
+
+Drivers implement ``execute(action, server, params)``. "fake" is built in for
+development and tests; any other driver is loaded from a "module:Class" path.
+"""
+import asyncio
+import importlib
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+ACTIONS = ("reboot", "reinstall")
+
+
+class DriverError(Exception):
+    """The driver could not carry out the action; ``retryable`` errors are attempted again"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ActionInProgress(Exception):
+    """The server already has a queued or running job"""
+
+
+class ProvisioningDriver:
+    """Carries out control actions against the hosting infrastructure"""
+
+    name = "base"
+
+    async def execute(self, action: str, server: dict, params: dict) -> dict:
+        handler = getattr(self, action, None)
+        if handler is None:
+            raise DriverError(f"{self.name} driver does not support {action}", retryable=False)
+        return await handler(server, params) or {}
+
+    # A driver lacking an action is misconfigured; retrying would only hide that
+    async def reboot(self, server: dict, params: dict) -> dict:
+        raise DriverError(f"{self.name} driver does not support reboot", retryable=False)
+
+    async def reinstall(self, server: dict, params: dict) -> dict:
+        raise DriverError(f"{self.name} driver does not support reinstall", retryable=False)
+
+
+class FakeDriver(ProvisioningDriver):
+    """Succeeds after ``delay`` seconds, failing the first ``failures`` attempts per server"""
+
+    name = "fake"
+
+    def __init__(self, delay: float = 0.0, failures: int = 0):
+        self.delay = delay
+        self.failures = failures
+        self.calls: List[tuple] = []
+        self._attempts: Dict[str, int] = {}
+
+    async def execute(self, action: str, server: dict, params: dict) -> dict:
+        self.calls.append((action, server["id"], params))
+        attempt = self._attempts[server["id"]] = self._attempts.get(server["id"], 0) + 1
+        await asyncio.sleep(self.delay)
+        if attempt <= self.failures:
+            raise DriverError(f"Simulated failure {attempt} of {self.failures}")
+        return await super().execute(action, server, params)
+
+    async def reboot(self, server: dict, params: dict) -> dict:
+        return {"rebooted_at": datetime.now(timezone.utc).isoformat()}
+
+    async def reinstall(self, server: dict, params: dict) -> dict:
+        return {"os": params.get("os") or server.get("os")}
+
+
+DRIVERS = {"fake": FakeDriver}
+
+
+def load_driver(spec: str) -> Optional[ProvisioningDriver]:
+    """Driver for a name in DRIVERS or a "module:Class" path; None when ``spec`` is empty"""
+    if not spec:
+        return None
+    if spec in DRIVERS:
+        return DRIVERS[spec]()
+    module_name, _, class_name = spec.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown provisioning driver {spec!r}; use one of {sorted(DRIVERS)} or module:Class")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def parse_limits(spec: Optional[str]) -> Dict[str, int]:
+    """Per data center overrides such as "dc-id-1=4,dc-id-2=1" """
+    limits = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        data_center_id, _, limit = item.partition("=")
+        limits[data_center_id.strip()] = int(limit)
+    return limits
+
+
+def job_summary(job: dict) -> dict:
+    """The fields of a job shown on its server"""
+    return {
+        "job_id": job["id"],
+        "action": job["action"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "error": job.get("last_error") if job["status"] != SUCCEEDED else None,
+        "updated_at": job["updated_at"]
+    }
+
+
+class ProvisioningQueue:
+    """Mongo-backed queue of control actions, run through ``driver``.
+
+    At most one job per server is queued or running at a time; the latest
+    job's summary is kept on the server as ``last_action`` so ``/servers/{id}``
+    shows its progress, and passed to ``on_update`` on every change.
+    """
+
+    def __init__(self, jobs, servers, driver: ProvisioningDriver, concurrency: int = 2,
+                 limits: Optional[Dict[str, int]] = None, lease_seconds: float = 120,
+                 max_attempts: int = 3, retry_delay: float = 30, poll_interval: float = 2,
+                 on_update: Optional[Callable[[dict, dict], Awaitable[None]]] = None):
+        self.jobs = jobs
+        self.servers = servers
+        self.driver = driver
+        self.concurrency = concurrency
+        self.limits = limits or {}
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.on_update = on_update
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        # Monotonic time the worker loop last polled; None until started
+        self.heartbeat: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.jobs.create_index("id", unique=True)
+        await self.jobs.create_index([("status", 1), ("run_after", 1)])
+        await self.jobs.create_index([("status", 1), ("data_center_id", 1)])
+        await self.jobs.create_index([("server_id", 1), ("created_at", -1)])
+        # One queued or running job per server
+        await self.jobs.create_index("server_id", unique=True, name="one_active_job_per_server",
+                                     partialFilterExpression={"active": True})
+
+    def limit_for(self, data_center_id: Optional[str]) -> int:
+        return self.limits.get(data_center_id or "", self.concurrency)
+
+    async def _publish(self, job: dict):
+        summary = job_summary(job)
+        await self.servers.update_one({"id": job["server_id"]}, {"$set": {"last_action": summary}})
+        if self.on_update is not None:
+            await self.on_update(job, summary)
+
+    async def enqueue(self, server: dict, action: str, params: Optional[dict] = None,
+                      requested_by: Optional[str] = None) -> dict:
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "server_id": server["id"],
+            "user_id": server.get("user_id"),
+            "data_center_id": server.get("data_center_id"),
+            "action": action,
+            "params": params or {},
+            "status": QUEUED,
+            "active": True,
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "run_after": now,
+            "requested_by": requested_by,
+            "created_at": now,
+            "updated_at": now
+        }
+        try:
+            await self.jobs.insert_one(job)
+        except DuplicateKeyError:
+            raise ActionInProgress(server["id"])
+        job.pop("_id", None)
+        await self._publish(job)
+        self._wakeup.set()
+        return job
+
+    async def retry(self, job_id: str) -> Optional[dict]:
+        """Queue a failed job again with a fresh set of attempts"""
+        now = datetime.now(timezone.utc)
+        try:
+            job = await self.jobs.find_one_and_update(
+                {"id": job_id, "status": FAILED},
+                {"$set": {"status": QUEUED, "active": True, "attempts": 0, "run_after": now, "updated_at": now},
+                 "$unset": {"last_error": "", "finished_at": ""}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            raise ActionInProgress(job_id)
+        if job:
+            await self._publish(job)
+            self._wakeup.set()
+        return job
+
+    async def requeue_expired(self) -> int:
+        """Put back jobs whose worker stopped renewing the lease"""
+        now = datetime.now(timezone.utc)
+        requeued = 0
+        async for job in self.jobs.find({"status": RUNNING, "lease_expires_at": {"$lt": now}}, {"_id": 0}):
+            if await self._finish_attempt(job, "Worker lease expired"):
+                requeued += 1
+        return requeued
+
+    async def lease(self) -> Optional[dict]:
+        """Claim the next due job whose data center has a free slot.
+
+        Slots are counted when leasing, so workers leasing at the same moment
+        can each start one job past a data center's limit.
+        """
+        now = datetime.now(timezone.utc)
+        busy = {
+            row["_id"]: row["running"] for row in await self.jobs.aggregate([
+                {"$match": {"status": RUNNING}},
+                {"$group": {"_id": "$data_center_id", "running": {"$sum": 1}}}
+            ]).to_list(None)
+        }
+        candidates = self.jobs.find({"status": QUEUED, "run_after": {"$lte": now}}, {"_id": 0, "id": 1, "data_center_id": 1}
+                                    ).sort("run_after", 1).limit(100)
+        async for candidate in candidates:
+            if busy.get(candidate.get("data_center_id"), 0) >= self.limit_for(candidate.get("data_center_id")):
+                continue
+            job = await self.jobs.find_one_and_update(
+                {"id": candidate["id"], "status": QUEUED},
+                {"$set": {
+                    "status": RUNNING,
+                    "lease_owner": self.worker_id,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                    "started_at": now,
+                    "updated_at": now
+                }, "$inc": {"attempts": 1}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if job:
+                await self._publish(job)
+                return job
+        return None
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self.jobs.update_one(
+                {"id": job_id, "status": RUNNING, "lease_owner": self.worker_id},
+                {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)}}
+            )
+
+    async def _finish_attempt(self, job: dict, error: Optional[str] = None, result: Optional[dict] = None,
+                              retryable: bool = True) -> Optional[dict]:
+        """Record the outcome of the current attempt; only the lease holder's update applies"""
+        now = datetime.now(timezone.utc)
+        if error is None:
+            updates = {"$set": {"status": SUCCEEDED, "result": result or {}, "finished_at": now, "updated_at": now},
+                       "$unset": {"active": "", "lease_owner": "", "lease_expires_at": ""}}
+        elif retryable and job["attempts"] < job["max_attempts"]:
+            backoff = self.retry_delay * 2 ** (job["attempts"] - 1)
+            updates = {"$set": {"status": QUEUED, "last_error": error, "run_after": now + timedelta(seconds=backoff), "updated_at": now},
+                       "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+        else:
+            updates = {"$set": {"status": FAILED, "last_error": error, "finished_at": now, "updated_at": now},
+                       "$unset": {"active": "", "lease_owner": "", "lease_expires_at": ""}}
+        job = await self.jobs.find_one_and_update(
+            {"id": job["id"], "status": RUNNING, "lease_owner": job.get("lease_owner")},
+            updates,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if job:
+            await self._publish(job)
+        return job
+
+    async def run_job(self, job: dict):
+        renewal = asyncio.create_task(self._renew_lease(job["id"]))
+        try:
+            server = await self.servers.find_one({"id": job["server_id"]}, {"_id": 0})
+            if server is None:
+                raise DriverError("Server no longer exists", retryable=False)
+            result = await self.driver.execute(job["action"], server, job["params"])
+        except asyncio.CancelledError:
+            # Shutting down; the lease expires and another worker picks the job up
+            raise
+        except DriverError as e:
+            logger.warning(f"Provisioning job {job['id']} ({job['action']}) failed: {e}")
+            await self._finish_attempt(job, str(e), retryable=e.retryable)
+        except Exception as e:
+            logger.exception(f"Provisioning job {job['id']} ({job['action']}) crashed")
+            await self._finish_attempt(job, f"{type(e).__name__}: {e}")
+        else:
+            await self._finish_attempt(job, result=result)
+        finally:
+            renewal.cancel()
+
+    async def run_pending(self) -> int:
+        """Start every due job there is capacity for; returns how many were started"""
+        await self.requeue_expired()
+        started = 0
+        while True:
+            job = await self.lease()
+            if job is None:
+                return started
+            task = asyncio.create_task(self.run_job(job))
+            self._running[job["id"]] = task
+            task.add_done_callback(lambda _, job_id=job["id"]: self._running.pop(job_id, None))
+            started += 1
+
+    async def _loop(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            try:
+                await self.run_pending()
+            except Exception:
+                logger.exception("Provisioning worker poll failed")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"Provisioning worker {self.worker_id} started with the {self.driver.name} driver")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        running = list(self._running.values())
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
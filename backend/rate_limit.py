@@ -0,0 +1,263 @@
+"""Token-bucket rate limiting for abuse-prone endpoints (login, registration, 2FA...).
+
+Buckets are keyed by route, scope ("ip" or "account") and identity. Two storage
+backends are available: an in-memory one for a single worker process and a
+Mongo-backed one, shared by all workers, whose documents expire via a TTL index.
+"""
+import ipaddress
+import json
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Allow bursts of ``capacity`` requests, refilled at ``capacity`` per ``per_seconds``"""
+    capacity: int
+    per_seconds: float
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+# Default limits per route and key scope; override with the RATE_LIMITS environment
+# variable, e.g. RATE_LIMITS='{"login": {"ip": [50, 60]}}'
+DEFAULT_RATE_LIMITS = {
+    "login": {"ip": RateLimit(30, 60), "account": RateLimit(5, 300)},
+    "register": {"ip": RateLimit(5, 3600)},
+    "forgot_password": {"ip": RateLimit(5, 900), "account": RateLimit(3, 900)},
+    "reset_password": {"ip": RateLimit(10, 900)},
+    "contact": {"ip": RateLimit(5, 900)},
+    "2fa": {"ip": RateLimit(10, 60), "account": RateLimit(5, 300)},
+}
+
+# Routes where only failed attempts (400/401) stay charged: every attempt takes a token
+# up front and successful ones give it back. Legitimate users logging in repeatedly from
+# a shared office IP are never throttled, while credential stuffing is - including a
+# concurrent burst, which can never run more attempts than the bucket holds.
+FAILURES_ONLY_ROUTES = {"login", "2fa"}
+
+# Peers allowed to report the client address in X-Real-IP / X-Forwarded-For; override
+# with the TRUSTED_PROXIES environment variable (comma-separated addresses or networks)
+DEFAULT_TRUSTED_PROXIES = "127.0.0.1,::1"
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# Paths limited per client IP by RateLimitMiddleware (POST only)
+RATE_LIMITED_PATHS = {
+    "/api/auth/login": "login",
+    "/api/auth/register": "register",
+    "/api/auth/forgot-password": "forgot_password",
+    "/api/auth/reset-password": "reset_password",
+    "/api/contact": "contact",
+    "/api/auth/setup-2fa": "2fa",
+    "/api/auth/verify-2fa": "2fa",
+    "/api/auth/disable-2fa": "2fa",
+}
+
+
+def load_rate_limits(overrides: Optional[str] = None) -> Dict[str, Dict[str, RateLimit]]:
+    limits = {route: dict(scopes) for route, scopes in DEFAULT_RATE_LIMITS.items()}
+    if overrides:
+        for route, scopes in json.loads(overrides).items():
+            for scope, (capacity, per_seconds) in scopes.items():
+                limits.setdefault(route, {})[scope] = RateLimit(int(capacity), float(per_seconds))
+    return limits
+
+
+class InMemoryBackend:
+    """Buckets held in this process only - use with a single worker"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def _refilled(self, key: str, limit: RateLimit, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (limit.capacity, now))
+        return min(limit.capacity, tokens + (now - updated) * limit.refill_rate)
+
+    async def consume(self, key: str, limit: RateLimit, cost: int = 1) -> float:
+        """Take ``cost`` tokens; returns 0 when allowed, otherwise seconds until a token is available"""
+        now = time.monotonic()
+        tokens = self._refilled(key, limit, now)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= cost
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            self._buckets.pop(next(iter(self._buckets)), None)
+        self._buckets[key] = (tokens, now)
+        return 0.0 if allowed else (1 - tokens) / limit.refill_rate
+
+    async def refund(self, key: str, limit: RateLimit, amount: int = 1) -> None:
+        """Give back tokens taken by ``consume``, up to the bucket's capacity"""
+        if key in self._buckets:
+            now = time.monotonic()
+            self._buckets[key] = (min(limit.capacity, self._refilled(key, limit, now) + amount), now)
+
+
+class MongoBackend:
+    """Buckets stored in a Mongo collection shared by all workers.
+
+    Each hit is a single atomic findOneAndUpdate using an update pipeline evaluated
+    against the server clock ($$NOW), so workers never disagree about refill time.
+    Idle buckets are removed by a TTL index on ``expires_at``.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def _refill(limit: RateLimit, amount: int = 0) -> dict:
+        """Pipeline stage bringing the bucket up to date, plus ``amount`` tokens"""
+        elapsed_seconds = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        return {"$set": {
+            "tokens": {"$min": [
+                limit.capacity,
+                {"$add": [
+                    {"$ifNull": ["$tokens", limit.capacity]}, {"$multiply": [elapsed_seconds, limit.refill_rate]}, amount
+                ]}
+            ]},
+            "updated_at": "$$NOW",
+            # Keep the bucket until it would have refilled completely
+            "expires_at": {"$add": ["$$NOW", int(limit.per_seconds * 1000)]}
+        }}
+
+    async def consume(self, key: str, limit: RateLimit, cost: int = 1) -> float:
+        pipeline = [
+            self._refill(limit),
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}}
+        ]
+        for attempt in range(2):
+            try:
+                bucket = await self.collection.find_one_and_update(
+                    {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+                )
+                break
+            except DuplicateKeyError:
+                # Two workers upserted the same new bucket; the second attempt updates it
+                if attempt:
+                    raise
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / limit.refill_rate
+
+    async def refund(self, key: str, limit: RateLimit, amount: int = 1) -> None:
+        """Give back tokens taken by ``consume``, up to the bucket's capacity"""
+        await self.collection.update_one({"_id": key}, [self._refill(limit, amount)])
+
+
+class RateLimiter:
+    def __init__(self, backend, limits: Dict[str, Dict[str, RateLimit]], enabled: bool = True):
+        self.backend = backend
+        self.limits = limits
+        self.enabled = enabled
+
+    async def hit(self, route: str, scope: str, identity: str, cost: int = 1) -> None:
+        """Consume ``cost`` tokens for ``identity``; raises RateLimitExceeded when the bucket is empty"""
+        limit = self.limits.get(route, {}).get(scope)
+        if not self.enabled or limit is None or not identity:
+            return
+        try:
+            retry_after = await self.backend.consume(f"{route}:{scope}:{identity}", limit, cost)
+        except PyMongoError as e:
+            # Fail open: an unavailable limiter store must not take logins down with it
+            logger.error(f"Rate limiter backend error: {e}")
+            return
+        if retry_after > 0:
+            raise RateLimitExceeded(retry_after)
+
+    async def refund(self, route: str, scope: str, identity: str) -> None:
+        """Give back the token a successful attempt took on a failures-only route"""
+        limit = self.limits.get(route, {}).get(scope)
+        if not self.enabled or limit is None or not identity:
+            return
+        try:
+            await self.backend.refund(f"{route}:{scope}:{identity}", limit)
+        except PyMongoError as e:
+            logger.error(f"Rate limiter backend error: {e}")
+
+
+def parse_trusted_proxies(value: str) -> List[Network]:
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+def is_trusted(address: str, trusted_proxies: List[Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def get_client_ip(request: Request, trusted_proxies: List[Network]) -> str:
+    """Client address, taken from the proxy headers only when the peer is a trusted proxy.
+
+    In X-Forwarded-For each proxy appends the address it received the request from, so
+    the right-most address that is not a trusted proxy is the client; anything to its
+    left was supplied by the client itself.
+    """
+    peer = request.client.host if request.client else ""
+    if not is_trusted(peer, trusted_proxies):
+        return peer
+    forwarded_for = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(forwarded_for):
+        if not is_trusted(hop, trusted_proxies):
+            return hop
+    real_ip = request.headers.get("x-real-ip", "").strip()
+    return real_ip or (forwarded_for[0] if forwarded_for else peer)
+
+
+def rate_limited_response(retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests. Please try again later."},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """Per-IP limits, checked before the request body is parsed or any password is hashed"""
+
+    def __init__(self, app, limiter: RateLimiter, paths: Dict[str, str] = None, trusted_proxies: str = DEFAULT_TRUSTED_PROXIES):
+        super().__init__(app)
+        self.limiter = limiter
+        self.paths = RATE_LIMITED_PATHS if paths is None else paths
+        self.trusted_proxies = parse_trusted_proxies(trusted_proxies)
+
+    async def dispatch(self, request: Request, call_next):
+        route = self.paths.get(request.url.path.rstrip("/")) if request.method == "POST" else None
+        if not route:
+            return await call_next(request)
+
+        client_ip = get_client_ip(request, self.trusted_proxies)
+        try:
+            await self.limiter.hit(route, "ip", client_ip)
+        except RateLimitExceeded as e:
+            return rate_limited_response(e.retry_after)
+
+        response = await call_next(request)
+        if route in FAILURES_ONLY_ROUTES and response.status_code not in (400, 401):
+            await self.limiter.refund(route, "ip", client_ip)
+        return response
@@ -0,0 +1,430 @@
+"""Admin search across users, tickets, servers, orders and invoices.
+
+Documents are held in an in-process inverted index. Write paths in the API
+update it as they go, and it is rebuilt from Mongo periodically to pick up
+writes made by other workers. Terms are words, plus whole identifiers such as
+emails, IPs, hostnames and invoice numbers, so a query can match either
+"john" or a prefix like "john@exa" or "10.0.3.".
+
+Ranking: a term found in an identifier field beats one found in a name or
+subject, which beats one found in a message body. An exact term beats a
+prefix match, and newer documents win ties.
+"""
+import asyncio
+import logging
+import re
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Field weights, which double as the ranking tiers
+IDENTIFIER = 3
+NAME = 2
+BODY = 1
+
+# Query words shorter than this only match whole terms
+MIN_PREFIX = 2
+MAX_EXPANSIONS = 1000
+# Multi-word queries score at most this many candidates, best matches first
+MAX_CANDIDATES = 20000
+# New terms are buffered and merged into the sorted term list in batches
+PENDING_TERMS = 4096
+# (exact term, field weight) match groups in descending order of score
+_MATCH_ORDER = sorted(((exact, weight) for exact in (True, False) for weight in (IDENTIFIER, NAME, BODY)),
+                      key=lambda group: -group[1] * (2 if group[0] else 1))
+
+_WORD = re.compile(r"[^\s,;()<>\[\]\"']+")
+_PART = re.compile(r"[a-z0-9]+")
+_UUID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+_EDGE = ".:-_!?#/"
+
+
+def short_id(doc_id: str) -> str:
+    """The 8-character id prefix shown in the dashboards, e.g. Ticket #3f2a1b2c"""
+    return doc_id.split("-", 1)[0]
+
+
+def _words(text: str) -> List[str]:
+    words = []
+    for word in _WORD.findall(text.lower()):
+        word = word.strip(_EDGE)
+        if word:
+            words.append(short_id(word) if len(word) == 36 and _UUID.match(word) else word)
+    return words
+
+
+def tokenize(text: str) -> List[str]:
+    """Words and the alphanumeric parts of identifiers: "a.b@c.com" gives a.b@c.com, a, b, c, com"""
+    terms = []
+    for word in _words(text):
+        if word.isalnum() and word.isascii():
+            terms.append(word)
+            continue
+        parts = _PART.findall(word)
+        if parts:
+            terms.append(word)
+            terms.extend(parts)
+    return terms
+
+
+# How each searchable collection is indexed and shown in results
+SOURCES = {
+    "user": {
+        "collection": "users",
+        "permission": None,
+        "query": {"role": "user"},
+        "projection": {"_id": 0, "id": 1, "email": 1, "full_name": 1, "company": 1},
+        "fields": lambda doc: [(doc.get("email"), IDENTIFIER), (doc.get("full_name"), NAME), (doc.get("company"), NAME)],
+        "summary": lambda doc: (doc.get("full_name") or doc["email"], doc["email"]),
+    },
+    "ticket": {
+        "collection": "tickets",
+        "permission": "support",
+        "query": {},
+        "projection": {"_id": 0, "id": 1, "subject": 1, "status": 1, "priority": 1},
+        "fields": lambda doc: [(short_id(doc["id"]), IDENTIFIER), (doc.get("subject"), NAME)],
+        "summary": lambda doc: (doc["subject"], f"#{short_id(doc['id'])} - {doc['status']}"),
+    },
+    "server": {
+        "collection": "servers",
+        "permission": "provisioning",
+        "query": {},
+        "projection": {"_id": 0, "id": 1, "hostname": 1, "ip_address": 1, "plan_name": 1, "status": 1},
+        "fields": lambda doc: [(doc.get("hostname"), IDENTIFIER), (doc.get("ip_address"), IDENTIFIER),
+                               (doc.get("plan_name"), BODY)],
+        "summary": lambda doc: (doc["hostname"], f"{doc.get('ip_address') or 'No IP'} - {doc['status']}"),
+    },
+    "order": {
+        "collection": "orders",
+        "permission": "billing",
+        "query": {},
+        "projection": {"_id": 0, "id": 1, "plan_name": 1, "data_center_name": 1, "order_status": 1, "amount": 1},
+        "fields": lambda doc: [(short_id(doc["id"]), IDENTIFIER), (doc.get("plan_name"), NAME),
+                               (doc.get("data_center_name"), BODY)],
+        "summary": lambda doc: (f"Order #{short_id(doc['id'])}", f"{doc.get('plan_name')} - {doc.get('order_status')}"),
+    },
+    "invoice": {
+        "collection": "invoices",
+        "permission": "billing",
+        "query": {},
+        "projection": {"_id": 0, "id": 1, "invoice_number": 1, "description": 1, "amount": 1, "status": 1},
+        "fields": lambda doc: [(doc.get("invoice_number"), IDENTIFIER), (doc.get("description"), BODY)],
+        "summary": lambda doc: (doc["invoice_number"], f"${doc.get('amount', 0):.2f} - {doc.get('status')}"),
+    },
+}
+
+KINDS = tuple(SOURCES)
+
+
+def document_fields(kind: str, doc: dict) -> List[Tuple[str, int]]:
+    return [(text, weight) for text, weight in SOURCES[kind]["fields"](doc) if text]
+
+
+class SearchIndex:
+    """Inverted index over (kind, id) documents.
+
+    Each document gets a slot; postings map a term to the slots holding it,
+    packed as ``slot << 2 | weight``. Updating a document retires its slot and
+    takes a new one, so postings are only ever appended to. Retired slots are
+    skipped at query time and dropped when the index is rebuilt.
+    """
+
+    def __init__(self, kinds: Sequence[str] = KINDS):
+        self.kinds = tuple(kinds)
+        self._kind_codes = {kind: code for code, kind in enumerate(self.kinds)}
+        self._slots: Dict[Tuple[str, str], int] = {}
+        self._doc_ids: List[Optional[str]] = []
+        self._doc_kinds = bytearray()
+        self._doc_terms: List[Optional[Dict[str, int]]] = []
+        # A term's postings are an int while it has one entry, then an array
+        self._postings: Dict[str, object] = {}
+        self._max_weights: Dict[str, int] = {}
+        self._terms: List[str] = []
+        self._pending: List[str] = []
+        # While loading, new terms are only sorted once at the end
+        self._loading = False
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def retired(self) -> int:
+        return len(self._doc_ids) - len(self._slots)
+
+    def _post(self, term: str, entry: int):
+        postings = self._postings.get(term)
+        if postings is None:
+            self._postings[term] = entry
+            if self._loading:
+                self._pending.append(term)
+            else:
+                insort(self._pending, term)
+                if len(self._pending) >= PENDING_TERMS:
+                    self._merge_pending()
+        elif isinstance(postings, int):
+            self._postings[term] = array("Q", (postings, entry))
+            self._max_weights[term] = max(postings & 3, entry & 3)
+        else:
+            postings.append(entry)
+            if entry & 3 > self._max_weights[term]:
+                self._max_weights[term] = entry & 3
+
+    def _merge_pending(self):
+        # Cheap when pending is a sorted run too: sorted() then just merges the two
+        self._terms = sorted(self._terms + self._pending)
+        self._pending = []
+
+    def start_loading(self):
+        """Defer sorting new terms while an empty index is filled in bulk; call finish_loading before searching"""
+        self._loading = True
+
+    def finish_loading(self):
+        self._loading = False
+        self._merge_pending()
+
+    def _entries(self, term: str) -> Sequence[int]:
+        postings = self._postings.get(term)
+        if postings is None:
+            return ()
+        return (postings,) if isinstance(postings, int) else postings
+
+    def add(self, kind: str, doc_id: str, fields: Iterable[Tuple[str, int]]):
+        """Index a document, replacing any earlier version of it"""
+        self.remove(kind, doc_id)
+        slot = len(self._doc_ids)
+        self._slots[(kind, doc_id)] = slot
+        self._doc_ids.append(doc_id)
+        self._doc_kinds.append(self._kind_codes[kind])
+        self._doc_terms.append({})
+        self.extend(kind, doc_id, fields)
+
+    def extend(self, kind: str, doc_id: str, fields: Iterable[Tuple[str, int]]):
+        """Add more text to an indexed document, e.g. a new reply on a ticket"""
+        slot = self._slots.get((kind, doc_id))
+        if slot is None:
+            return
+        terms = self._doc_terms[slot]
+        for text, weight in fields:
+            if not text:
+                continue
+            for term in tokenize(text):
+                if terms.get(term, 0) < weight:
+                    terms[term] = weight
+                    self._post(term, slot << 2 | weight)
+
+    def remove(self, kind: str, doc_id: str):
+        slot = self._slots.pop((kind, doc_id), None)
+        if slot is not None:
+            self._doc_ids[slot] = None
+            self._doc_terms[slot] = None
+
+    def _expand(self, word: str) -> List[str]:
+        """Indexed terms the query word matches, the exact term first"""
+        if len(word) < MIN_PREFIX:
+            return [word] if word in self._postings else []
+        matches = [word] if word in self._postings else []
+        for terms in (self._terms, self._pending):
+            i = bisect_left(terms, word)
+            while i < len(terms) and len(matches) < MAX_EXPANSIONS and terms[i].startswith(word):
+                if terms[i] != word:
+                    matches.append(terms[i])
+                i += 1
+        return matches
+
+    def _query_words(self, query: str) -> List[Tuple[str, List[str]]]:
+        """Each query word with the terms it matches; identifiers nothing starts with fall back to their parts"""
+        words = []
+        for word in _words(query):
+            parts = _PART.findall(word)
+            if not parts:
+                continue
+            expansions = self._expand(word)
+            if not expansions and parts != [word]:
+                words.extend((part, self._expand(part)) for part in parts)
+            else:
+                words.append((word, expansions))
+        return words
+
+    def _walk(self, word: str, expansions: List[str]):
+        """Slots holding the word, in descending order of match score"""
+        exact = expansions[:1] if expansions[0] == word else []
+        prefixed = expansions[len(exact):]
+        for is_exact, weight in _MATCH_ORDER:
+            score = weight * (2 if is_exact else 1)
+            for term in exact if is_exact else prefixed:
+                if self._max_weight(term) < weight:
+                    continue
+                for entry in reversed(self._entries(term)):
+                    if entry & 3 == weight:
+                        yield entry >> 2, score
+
+    def _max_weight(self, term: str) -> int:
+        postings = self._postings[term]
+        return postings & 3 if isinstance(postings, int) else self._max_weights[term]
+
+    def _best_score(self, word: str, expansions: List[str]) -> int:
+        """The most any document can score for the word"""
+        return max(self._max_weight(term) * (2 if term == word else 1) for term in expansions)
+
+    def _score(self, terms: Dict[str, int], word: str, expansions: List[str]) -> int:
+        """Best match score of the word in one document's terms, 0 if it is absent"""
+        if len(expansions) == 1:
+            return terms.get(word, 0) * 2 if expansions[0] == word else terms.get(expansions[0], 0)
+        if len(expansions) <= len(terms) or len(word) < MIN_PREFIX:
+            candidates = ((term, terms.get(term)) for term in expansions)
+        else:
+            candidates = ((term, weight) for term, weight in terms.items() if term.startswith(word))
+        best = 0
+        for term, weight in candidates:
+            if weight:
+                best = max(best, weight * (2 if term == word else 1))
+        return best
+
+    def search(self, query: str, kinds: Optional[Iterable[str]] = None, offset: int = 0,
+               limit: int = 20) -> Tuple[List[Tuple[str, str, int]], bool]:
+        """Ranked (kind, id, score) hits for a page of results, and whether more follow"""
+        words = self._query_words(query)
+        if not words or any(not expansions for _, expansions in words):
+            return [], False
+        allowed = None if kinds is None else {self._kind_codes[kind] for kind in kinds}
+        wanted = offset + limit + 1
+
+        # Start from the word with the fewest postings and check the others per document
+        seed = 0
+        if len(words) > 1:
+            sizes = [sum(len(self._entries(term)) for term in expansions) for _, expansions in words]
+            seed = sizes.index(min(sizes))
+        others = [w for i, w in enumerate(words) if i != seed]
+        headroom = sum(self._best_score(word, expansions) for word, expansions in others)
+
+        seen = set()
+        matches = []
+        group_score = None
+        for slot, score in self._walk(*words[seed]):
+            if score != group_score:
+                # Documents from here on score at most ``top``; once enough have
+                # reached it the page cannot change
+                group_score = score
+                top = score + headroom
+                settled = sum(1 for match in matches if match[0] >= top)
+                if settled >= wanted:
+                    break
+            if slot in seen:
+                continue
+            seen.add(slot)
+            terms = self._doc_terms[slot]
+            if terms is None or (allowed is not None and self._doc_kinds[slot] not in allowed):
+                continue
+            for word, expansions in others:
+                word_score = self._score(terms, word, expansions)
+                if not word_score:
+                    break
+                score += word_score
+            else:
+                matches.append((score, slot))
+                if score >= top:
+                    settled += 1
+                    if settled >= wanted:
+                        break
+            if len(seen) >= MAX_CANDIDATES:
+                break
+
+        matches.sort(key=lambda match: (-match[0], -match[1]))
+        page = [(self.kinds[self._doc_kinds[slot]], self._doc_ids[slot], score)
+                for score, slot in matches[offset:offset + limit]]
+        return page, len(matches) > offset + limit
+
+
+class SearchService:
+    """The index for the API, with write-path helpers and a periodic rebuild from Mongo"""
+
+    def __init__(self, db, refresh_interval: float = 600, batch_size: int = 1000):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.index = SearchIndex()
+        self.ready = False
+        self._replay: Optional[list] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _apply(self, index: SearchIndex, change: tuple):
+        action, kind, doc_id, fields = change
+        if action == "add":
+            index.add(kind, doc_id, fields)
+        elif action == "extend":
+            index.extend(kind, doc_id, fields)
+        else:
+            index.remove(kind, doc_id)
+
+    def _record(self, change: tuple):
+        self._apply(self.index, change)
+        # Writes made while a rebuild is running are replayed onto the new index
+        if self._replay is not None:
+            self._replay.append(change)
+
+    def add(self, kind: str, doc: dict):
+        self._record(("add", kind, doc["id"], document_fields(kind, doc)))
+
+    def add_many(self, kind: str, docs: Iterable[dict]):
+        for doc in docs:
+            self.add(kind, doc)
+
+    def add_message(self, ticket_id: str, message: str):
+        self._record(("extend", "ticket", ticket_id, [(message, BODY)]))
+
+    def remove(self, kind: str, doc_id: str):
+        self._record(("remove", kind, doc_id, None))
+
+    def search(self, query: str, kinds: Optional[Iterable[str]] = None, offset: int = 0, limit: int = 20):
+        return self.index.search(query, kinds, offset, limit)
+
+    async def rebuild(self):
+        """Build a fresh index from Mongo and swap it in, yielding to other requests between batches"""
+        self._replay = []
+        try:
+            index = SearchIndex()
+            index.start_loading()
+            for kind, source in SOURCES.items():
+                cursor = self.db[source["collection"]].find(source["query"], source["projection"])
+                async for doc in cursor.batch_size(self.batch_size):
+                    index.add(kind, doc["id"], document_fields(kind, doc))
+                    if len(index) % self.batch_size == 0:
+                        await asyncio.sleep(0)
+            messages = self.db.ticket_messages.find({}, {"_id": 0, "ticket_id": 1, "message": 1})
+            count = 0
+            async for message in messages.batch_size(self.batch_size):
+                index.extend("ticket", message["ticket_id"], [(message.get("message"), BODY)])
+                count += 1
+                if count % self.batch_size == 0:
+                    await asyncio.sleep(0)
+            index.finish_loading()
+            for change in self._replay:
+                self._apply(index, change)
+            self.index = index
+            self.ready = True
+        finally:
+            self._replay = None
+        logger.info(f"Search index rebuilt: {len(self.index)} documents")
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.rebuild()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Search index rebuild failed: {e}")
+            if self.refresh_interval <= 0 and self.ready:
+                return
+            await asyncio.sleep(self.refresh_interval if self.ready else 30)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
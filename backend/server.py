@@ -1,25 +1,57 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, Request, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, Request, UploadFile, File, Form, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import RedirectResponse, FileResponse, StreamingResponse
+from fastapi.responses import RedirectResponse, FileResponse, StreamingResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.concurrency import run_in_threadpool
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 import os
+import asyncio
+import gc
 import logging
+import math
+import re
+import time
+import csv
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr, ConfigDict
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, EmailStr, ConfigDict, BeforeValidator, ValidationError
+from typing import List, Optional, Literal, Annotated
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import pyotp
 import qrcode
-from io import BytesIO
+import qrcode.image.svg
+from io import BytesIO, StringIO
 import secrets
+import hashlib
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
+from cache import TTLCache
+from totp_verifier import TOTPVerifier
+from idempotency import IdempotencyStore
+from ipam import IPAM, IPAMError, AddressConflict
+from events import EventBus, format_sse
+from search import SearchService, SOURCES, KINDS
+from sla import SLAPolicy, CLOSED_STATUSES, parse_targets, to_update
+from email_templates import EmailRenderer, branding_from_settings
+from jinja2 import TemplateError
+from email_queue import EmailQueue, SUPPRESSED as QUEUE_SUPPRESSED
+from email_log import EmailLog, SENT as EMAIL_SENT, FAILED as EMAIL_FAILED, SUPPRESSED as EMAIL_SUPPRESSED, NOT_CONFIGURED as EMAIL_NOT_CONFIGURED, STATUSES as EMAIL_STATUSES, SUPPRESSING_EVENTS, UNSUBSCRIBE_EVENTS, ALL as EMAIL_SUPPRESS_ALL, MARKETING as EMAIL_SUPPRESS_MARKETING
+from broadcasts import Broadcaster, Segments, ACTIVE_STATUSES as ACTIVE_BROADCAST_STATUSES
+from provisioning import ProvisioningQueue, ActionInProgress, load_driver, parse_limits
+from inventory import AVAILABLE, ALLOCATED, CREDENTIAL_FIELDS, claim_machine, release_machine, ensure_indexes as ensure_inventory_indexes, availability as inventory_availability
+from migrate_datetimes import is_migration_complete, parse_timestamp
+from pricing import PricingCatalog, PricingError, Quote
+from unit_of_work import UnitOfWork, InsufficientFunds, debit_wallet
+from rate_limit import RateLimiter, RateLimitExceeded, RateLimitMiddleware, InMemoryBackend, MongoBackend, load_rate_limits, DEFAULT_TRUSTED_PROXIES
+from health import HealthMonitor, PoolMonitor, threshold_status, OK as HEALTH_OK, DEGRADED as HEALTH_DEGRADED, FAILING as HEALTH_FAILING
+from metrics import Registry, MetricsMiddleware, MongoCommandTimer, LoopLagMonitor, timed_job, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from slow_queries import SlowQueryLog, SORT_FIELDS as SLOW_QUERY_SORT_FIELDS
+from tracing import Tracer, TracingMiddleware, MongoSpanListener, JsonFileExporter, OTLPHttpExporter, CLIENT as SPAN_CLIENT
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -38,19 +70,189 @@ class HTTPSRedirectMiddleware(BaseHTTPMiddleware):
                     return RedirectResponse(url=new_location, status_code=307)
         return response
 
+# Prometheus metrics, served at /api/metrics
+metrics = Registry()
+http_requests = metrics.counter("kloudnests_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_latency = metrics.histogram("kloudnests_http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+mongo_latency = metrics.histogram("kloudnests_mongo_command_duration_seconds", "MongoDB command latency by collection",
+                                  ("collection", "command"))
+mongo_failures = metrics.counter("kloudnests_mongo_command_failures_total", "Failed MongoDB commands by collection",
+                                 ("collection", "command"))
+job_duration = metrics.histogram("kloudnests_job_duration_seconds", "Background job run time", ("job", "status"),
+                                 buckets=(0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900))
+loop_lag = metrics.histogram("kloudnests_event_loop_lag_seconds", "How late the event loop runs a scheduled wakeup",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+loop_lag_monitor = LoopLagMonitor(loop_lag, metrics.gauge("kloudnests_event_loop_lag_last_seconds", "Most recent event loop lag sample"))
+# Set at scrape time by the collectors registered below the routes
+queue_depth = metrics.gauge("kloudnests_queue_depth", "Jobs waiting or in progress", ("queue", "status"))
+cache_lookups = metrics.counter("kloudnests_cache_lookups_total", "In-process cache lookups", ("cache", "result"))
+cache_hit_ratio = metrics.gauge("kloudnests_cache_hit_ratio", "Share of cache lookups served from the cache", ("cache",))
+cache_entries = metrics.gauge("kloudnests_cache_entries", "Entries held in the cache", ("cache",))
+# Bearer token required to scrape /api/metrics; open when unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+spans_exported = metrics.counter("kloudnests_trace_spans_total", "Trace spans exported or dropped because the buffer was full", ("result",))
+
+# Request tracing: finished spans are appended as OTLP/JSON lines to TRACE_FILE and/or posted to an
+# OTLP/HTTP collector (e.g. http://localhost:4318/v1/traces); tracing is off when neither is set
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', '')
+# Share of requests traced (0-1); an incoming traceparent header decides for the requests that carry one
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+trace_exporters = []
+if TRACE_FILE:
+    trace_exporters.append(JsonFileExporter(TRACE_FILE))
+if TRACE_OTLP_ENDPOINT:
+    trace_exporters.append(OTLPHttpExporter(TRACE_OTLP_ENDPOINT))
+tracer = Tracer(os.environ.get('TRACE_SERVICE_NAME', 'kloudnests-api'), TRACE_SAMPLE_RATE, trace_exporters)
+
+# Deep health checks run in the background this often (seconds); the probes only read the last result
+HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', '5'))
+# Readiness fails above this Mongo ping time (ms) or event loop lag (seconds); a fifth of either is reported as degraded
+HEALTH_MAX_MONGO_LATENCY_MS = float(os.environ.get('HEALTH_MAX_MONGO_LATENCY_MS', '1000'))
+HEALTH_MAX_LOOP_LAG = float(os.environ.get('HEALTH_MAX_LOOP_LAG', '1.0'))
+# Email due this many seconds ago and still unsent marks the queue as degraded
+HEALTH_EMAIL_BACKLOG_AGE = float(os.environ.get('HEALTH_EMAIL_BACKLOG_AGE', '900'))
+# Liveness fails when a queue worker loop has not polled for this many seconds
+HEALTH_WORKER_STALE_AFTER = float(os.environ.get('HEALTH_WORKER_STALE_AFTER', '300'))
+
+# Mongo commands slower than this (ms) are grouped by query shape and explained once per shape
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+SLOW_QUERY_RETENTION_DAYS = int(os.environ.get('SLOW_QUERY_RETENTION_DAYS', '30'))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+mongo_pool = PoolMonitor()
+slow_query_log = SlowQueryLog(threshold_ms=SLOW_QUERY_MS, explain=SLOW_QUERY_EXPLAIN, retention_days=SLOW_QUERY_RETENTION_DAYS)
+# Timestamps are stored as BSON dates and read back as timezone-aware UTC datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[
+    MongoCommandTimer(mongo_latency, mongo_failures), mongo_pool, MongoSpanListener(tracer), slow_query_log
+])
 db = client[os.environ['DB_NAME']]
+slow_query_log.bind(client, os.environ['DB_NAME'])
 
 # JWT Config - Use stable secret
 JWT_SECRET = os.environ.get('JWT_SECRET', 'kloudnests-secure-jwt-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Admin authorization - roles and fine-grained permissions are signed into the JWT
+ADMIN_ROLES = ("admin", "super_admin")
+ADMIN_PERMISSIONS = ("billing", "support", "provisioning")
+TOKEN_VERSION_CACHE_TTL = int(os.environ.get('TOKEN_VERSION_CACHE_TTL', '30'))
+
+# 2FA setup QR codes are memoized briefly while the user completes setup
+QR_CODE_CACHE_TTL = int(os.environ.get('QR_CODE_CACHE_TTL', '300'))
+
+# Multi-document transactions - "auto" uses them when Mongo runs as a replica set
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'auto').lower()
+
+# Plans, add-ons and data centers are priced from an in-memory snapshot refreshed this often
+PRICING_CACHE_TTL = int(os.environ.get('PRICING_CACHE_TTL', '60'))
+
+# Per-subnet free address bitmaps are rebuilt from Mongo this often
+IPAM_CACHE_TTL = int(os.environ.get('IPAM_CACHE_TTL', '300'))
+
+# Server control actions - with a driver ("fake" or "module:Class") reboots and reinstalls
+# run through the job queue, without one they open a support ticket for the team
+PROVISIONING_DRIVER = os.environ.get('PROVISIONING_DRIVER', '')
+PROVISIONING_WORKER = os.environ.get('PROVISIONING_WORKER', 'true').lower() == 'true'
+PROVISIONING_CONCURRENCY = int(os.environ.get('PROVISIONING_CONCURRENCY', '2'))
+PROVISIONING_DC_LIMITS = os.environ.get('PROVISIONING_DC_LIMITS', '')
+
+# Rate limiting - "memory" for a single worker, "mongo" when running several workers
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# Proxies whose X-Real-IP / X-Forwarded-For headers identify the client (nginx on this host)
+TRUSTED_PROXIES = os.environ.get('TRUSTED_PROXIES', DEFAULT_TRUSTED_PROXIES)
+
+# Live events - "memory" for a single worker, "mongo" to share them between workers
+EVENT_BUS_BACKEND = os.environ.get('EVENT_BUS_BACKEND', 'memory')
+EVENT_STREAM_HEARTBEAT = int(os.environ.get('EVENT_STREAM_HEARTBEAT', '15'))
+
+# Admin search index - rebuilt from Mongo this often to pick up writes made by other workers
+SEARCH_REFRESH_INTERVAL = int(os.environ.get('SEARCH_REFRESH_INTERVAL', '600'))
+
+# Ticket SLA targets in hours per priority, e.g. "urgent=0.5/2,low=48/240" (first response/resolution)
+TICKET_SLA_TARGETS = os.environ.get('TICKET_SLA_TARGETS', '')
+
+# Email branding (company name, site URL, contact address) is re-read from site settings this often
+EMAIL_BRANDING_CACHE_TTL = int(os.environ.get('EMAIL_BRANDING_CACHE_TTL', '60'))
+
+# Queued email (broadcasts) is sent at most this many messages per second per worker, within the provider's limit
+EMAIL_RATE_LIMIT = float(os.environ.get('EMAIL_RATE_LIMIT', '10'))
+EMAIL_QUEUE_WORKER = os.environ.get('EMAIL_QUEUE_WORKER', 'true').lower() == 'true'
+
 # SendGrid Config
 SENDGRID_API_KEY = os.environ.get('SENDGRID_API_KEY', '')
 SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'noreply@kloudnests.com')
+# Shared secret the SendGrid event webhook passes as ?token=; the webhook is disabled when unset
+SENDGRID_WEBHOOK_TOKEN = os.environ.get('SENDGRID_WEBHOOK_TOKEN', '')
+# Days of email delivery history kept in email_events
+EMAIL_EVENT_RETENTION_DAYS = int(os.environ.get('EMAIL_EVENT_RETENTION_DAYS', '90'))
+
+rate_limiter = RateLimiter(
+    MongoBackend(db.rate_limits) if RATE_LIMIT_BACKEND == "mongo" else InMemoryBackend(),
+    load_rate_limits(os.environ.get('RATE_LIMITS')),
+    enabled=RATE_LIMIT_ENABLED
+)
+
+pricing_catalog = PricingCatalog(db, ttl=PRICING_CACHE_TTL)
+unit_of_work = UnitOfWork(client, MONGO_TRANSACTIONS)
+
+# Subnets and the addresses assigned to servers and inventory machines
+ipam = IPAM(db, ttl=IPAM_CACHE_TTL)
+
+event_bus = EventBus(db.events if EVENT_BUS_BACKEND == "mongo" else None)
+
+sla_policy = SLAPolicy(parse_targets(TICKET_SLA_TARGETS))
+
+# Compiled email templates, loaded at startup
+email_renderer = EmailRenderer()
+email_branding_cache = TTLCache(ttl=EMAIL_BRANDING_CACHE_TTL, maxsize=1)
+
+# Users, tickets, servers, orders and invoices for /admin/search
+search_service = SearchService(db, refresh_interval=SEARCH_REFRESH_INTERVAL)
+
+async def publish_provisioning_update(job: dict, summary: dict):
+    if job["status"] in ("succeeded", "failed") and job.get("started_at"):
+        # Time of the final attempt
+        job_duration.observe((job["finished_at"] - job["started_at"]).total_seconds(), f"provisioning_{job['action']}", job["status"])
+    await event_bus.publish(
+        "server.action", {"server_id": job["server_id"], **summary}, user_id=job["user_id"], permission="provisioning"
+    )
+
+provisioning_driver = load_driver(PROVISIONING_DRIVER)
+provisioning_queue = ProvisioningQueue(
+    db.provisioning_jobs, db.servers, provisioning_driver,
+    concurrency=PROVISIONING_CONCURRENCY,
+    limits=parse_limits(PROVISIONING_DC_LIMITS),
+    on_update=publish_provisioning_update
+) if provisioning_driver else None
+
+# Every send attempt is logged; suppressed addresses are skipped before reaching SendGrid
+email_log = EmailLog(db.email_events, db.email_suppressions, retention_days=EMAIL_EVENT_RETENTION_DAYS)
+
+# Broadcast emails are rendered per recipient into the email queue, which sends them in the background
+email_queue = EmailQueue(
+    db.email_queue, lambda to_email, subject, html: send_queued_email(to_email, subject, html),
+    rate=EMAIL_RATE_LIMIT
+)
+broadcaster = Broadcaster(
+    db.broadcasts, email_queue, Segments(db, exclude=lambda email: email_log.is_suppressed(email, "broadcast")),
+    render=lambda broadcast, users: render_broadcast_batch(broadcast, users),
+    on_progress=lambda broadcast: event_bus.publish(
+        "broadcast.progress", {key: broadcast.get(key, 0) for key in ("id", "status", "queued", "sent", "failed", "suppressed")},
+        permission="support"
+    )
+)
+email_queue.on_result = broadcaster.record_result
+
+# Responses of side-effecting requests sent with an Idempotency-Key header, replayed on retry
+idempotency_store = IdempotencyStore(db.idempotency_keys)
+
+# TOTP codes are accepted only for a step after the user's last one, shared between workers through Mongo
+totp_verifier = TOTPVerifier(db.totp_last_steps)
 
 # Create the main app
 app = FastAPI(title="KloudNests API", version="1.0.0")
@@ -67,9 +269,38 @@ admin_router = APIRouter(prefix="/admin", tags=["Admin"])
 user_router = APIRouter(prefix="/user", tags=["User"])
 datacenters_router = APIRouter(prefix="/datacenters", tags=["Data Centers"])
 addons_router = APIRouter(prefix="/addons", tags=["Add-ons"])
+events_router = APIRouter(prefix="/events", tags=["Events"])
 
 security = HTTPBearer()
 
+# ============ TIMESTAMPS ============
+
+def to_timestamp(value):
+    """Serialize a stored timestamp for API responses.
+
+    Documents written before the native datetime migration still hold ISO strings,
+    so both forms are accepted and returned in the same ISO 8601 format.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+def format_date(value) -> str:
+    """YYYY-MM-DD for emails and invoices, from a datetime or a legacy ISO string"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    return str(value or "")[:10]
+
+def as_datetime(value) -> Optional[datetime]:
+    """Aware datetime from a stored timestamp, parsing legacy ISO strings; None if neither"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return parse_timestamp(value)
+
+Timestamp = Annotated[str, BeforeValidator(to_timestamp)]
+
 # ============ MODELS ============
 
 class UserCreate(BaseModel):
@@ -93,7 +324,7 @@ class UserResponse(BaseModel):
     wallet_balance: float
     is_verified: bool
     is_2fa_enabled: bool
-    created_at: str
+    created_at: Timestamp
 
 class TokenResponse(BaseModel):
     access_token: str
@@ -125,6 +356,12 @@ class OrderCreate(BaseModel):
     payment_method: Literal["wallet", "bank_transfer", "crypto"]
     notes: Optional[str] = None
 
+class OrderQuoteRequest(BaseModel):
+    plan_id: str
+    billing_cycle: Literal["monthly", "quarterly", "yearly"]
+    data_center_id: Optional[str] = None
+    addons: Optional[List[str]] = []
+
 class OrderResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
@@ -143,8 +380,8 @@ class OrderResponse(BaseModel):
     payment_status: str
     order_status: str
     notes: Optional[str]
-    created_at: str
-    updated_at: str
+    created_at: Timestamp
+    updated_at: Timestamp
 
 class ServerResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -165,10 +402,11 @@ class ServerResponse(BaseModel):
     data_center_name: Optional[str] = None
     status: str
     plan_name: Optional[str] = "Custom Server"
-    renewal_date: str
-    created_at: str
+    renewal_date: Timestamp
+    created_at: Timestamp
     specs: Optional[dict] = None
     additional_notes: Optional[str] = None
+    last_action: Optional[dict] = None  # Latest control action job: job_id, action, status, attempts, error
 
 class InvoiceResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -178,10 +416,10 @@ class InvoiceResponse(BaseModel):
     invoice_number: str
     amount: float
     status: str
-    due_date: str
-    paid_date: Optional[str]
+    due_date: Timestamp
+    paid_date: Optional[Timestamp]
     description: str
-    created_at: str
+    created_at: Timestamp
 
 class TicketCreate(BaseModel):
     subject: str
@@ -197,8 +435,12 @@ class TicketResponse(BaseModel):
     priority: str
     status: str
     order_id: Optional[str]
-    created_at: str
-    updated_at: str
+    user_unread: int = 0
+    message_count: int = 0
+    last_message_at: Optional[Timestamp] = None
+    last_message_by_staff: bool = False
+    created_at: Timestamp
+    updated_at: Timestamp
 
 class TicketMessageCreate(BaseModel):
     message: str
@@ -211,7 +453,7 @@ class TransactionResponse(BaseModel):
     amount: float
     description: str
     reference: Optional[str]
-    created_at: str
+    created_at: Timestamp
 
 # Data Center Models
 class DataCenterCreate(BaseModel):
@@ -228,7 +470,7 @@ class DataCenterResponse(BaseModel):
     country: str
     description: Optional[str]
     is_active: bool
-    created_at: str
+    created_at: Timestamp
 
 # Add-on Models
 class AddOnCreate(BaseModel):
@@ -247,7 +489,7 @@ class AddOnResponse(BaseModel):
     billing_cycle: str
     description: Optional[str]
     is_active: bool
-    created_at: str
+    created_at: Timestamp
 
 class WalletTopupRequest(BaseModel):
     amount: float
@@ -255,7 +497,8 @@ class WalletTopupRequest(BaseModel):
 
 class AdminServerCreate(BaseModel):
     order_id: str
-    ip_address: str
+    ip_address: Optional[str] = None
+    subnet_id: Optional[str] = None  # Allocate the next free address when ip_address is not given
     hostname: str
     username: str
     password: str
@@ -266,6 +509,47 @@ class AdminServerCreate(BaseModel):
     additional_notes: Optional[str] = None
     send_email: bool = True
 
+class InventoryMachineCreate(BaseModel):
+    data_center_id: str
+    plan_id: str
+    hostname: str
+    ip_address: str
+    username: str = "root"
+    password: str
+    ssh_port: int = 22
+    panel_url: Optional[str] = None
+    panel_username: Optional[str] = None
+    panel_password: Optional[str] = None
+    cpu: Optional[str] = None
+    ram: Optional[str] = None
+    storage: Optional[str] = None
+    additional_notes: Optional[str] = None
+
+class InventoryBatchCreate(BaseModel):
+    machines: List[InventoryMachineCreate]
+
+class SubnetCreate(BaseModel):
+    data_center_id: str
+    cidr: str
+    gateway: Optional[str] = None
+    description: Optional[str] = None
+
+class InventoryMachineUpdate(BaseModel):
+    data_center_id: Optional[str] = None
+    plan_id: Optional[str] = None
+    hostname: Optional[str] = None
+    username: Optional[str] = None
+    password: Optional[str] = None
+    ssh_port: Optional[int] = None
+    panel_url: Optional[str] = None
+    panel_username: Optional[str] = None
+    panel_password: Optional[str] = None
+    cpu: Optional[str] = None
+    ram: Optional[str] = None
+    storage: Optional[str] = None
+    additional_notes: Optional[str] = None
+    status: Optional[Literal["available", "maintenance"]] = None
+
 class AdminOrderUpdate(BaseModel):
     order_status: Optional[str] = None
     payment_status: Optional[str] = None
@@ -347,16 +631,34 @@ class PaymentProofUpload(BaseModel):
 
 # ============ UTILITY FUNCTIONS ============
 
+# bcrypt is CPU-bound; request handlers call these through run_in_threadpool
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    with tracer.span("bcrypt.hashpw"):
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
-
-def create_token(user_id: str, role: str) -> str:
+    with tracer.span("bcrypt.checkpw"):
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+
+def get_admin_permissions(user: dict) -> List[str]:
+    """Permissions granted to a user; admins without an explicit list get all of them"""
+    if user.get("role") == "super_admin":
+        return list(ADMIN_PERMISSIONS)
+    if user.get("role") == "admin":
+        permissions = user.get("permissions")
+        if permissions is None:
+            return list(ADMIN_PERMISSIONS)
+        return [p for p in permissions if p in ADMIN_PERMISSIONS]
+    return []
+
+def create_token(user: dict) -> str:
     payload = {
-        "sub": user_id,
-        "role": role,
+        "sub": user["id"],
+        "role": user["role"],
+        "email": user["email"],
+        "name": user.get("full_name"),
+        "ver": user.get("token_version", 0),
+        "perms": get_admin_permissions(user),
         "exp": datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
@@ -369,23 +671,143 @@ def decode_token(token: str) -> dict:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# user_id -> current token_version, so admin requests can be authorized without reading the user
+token_version_cache = TTLCache(ttl=TOKEN_VERSION_CACHE_TTL)
+
+async def get_token_version(user_id: str) -> Optional[int]:
+    version = token_version_cache.get(user_id)
+    if version is None:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "token_version": 1})
+        if user is None:
+            return None
+        version = user.get("token_version", 0)
+        token_version_cache.set(user_id, version)
+    return version
+
+async def revoke_user_tokens(user_id: str):
+    """Invalidate every token issued to a user so far"""
+    await db.users.update_one({"id": user_id}, {"$inc": {"token_version": 1}})
+    token_version_cache.pop(user_id)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     payload = decode_token(credentials.credentials)
     user = await db.users.find_one({"id": payload["sub"]}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    token_version_cache.set(user["id"], user.get("token_version", 0))
+    if payload.get("ver", 0) != user.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
     return user
 
 async def get_admin_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    user = await get_current_user(credentials)
-    if user["role"] not in ["admin", "super_admin"]:
+    """Authorize an admin from the verified token claims plus the cached token-version check"""
+    payload = decode_token(credentials.credentials)
+    if payload.get("role") not in ADMIN_ROLES:
         raise HTTPException(status_code=403, detail="Admin access required")
-    return user
+    
+    # Tokens issued before claims-based authorization carry no email - fall back to the user record
+    if "email" not in payload:
+        user = await get_current_user(credentials)
+        if user["role"] not in ADMIN_ROLES:
+            raise HTTPException(status_code=403, detail="Admin access required")
+        return {**user, "permissions": get_admin_permissions(user)}
+    
+    version = await get_token_version(payload["sub"])
+    if version is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if payload.get("ver", 0) != version:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return {
+        "id": payload["sub"],
+        "email": payload["email"],
+        "full_name": payload.get("name"),
+        "role": payload["role"],
+        "permissions": payload.get("perms", [])
+    }
+
+def require_admin_permission(permission: str):
+    """Dependency factory for admin routes that need a specific permission"""
+    async def dependency(admin: dict = Depends(get_admin_user)):
+        if permission not in admin["permissions"]:
+            raise HTTPException(status_code=403, detail=f"Admin permission '{permission}' required")
+        return admin
+    return dependency
+
+get_billing_admin = require_admin_permission("billing")
+get_support_admin = require_admin_permission("support")
+get_provisioning_admin = require_admin_permission("provisioning")
+
+async def enforce_account_rate_limit(route: str, account: str, cost: int = 1):
+    """Per-account throttling; per-IP limits are applied by RateLimitMiddleware.
+    On failures-only routes give the token back with rate_limiter.refund once the attempt succeeds"""
+    try:
+        await rate_limiter.hit(route, "account", account, cost)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts. Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+
+# ============ AUTH TOKENS ============
+# Single-use tokens (password reset, email verification) are stored hashed in auth_tokens
+# with a native Date expires_at, so lookups are unique-index point queries and a TTL
+# index purges expired records.
+
+PASSWORD_RESET_TOKEN_TTL = timedelta(hours=1)
+EMAIL_VERIFICATION_TOKEN_TTL = timedelta(days=7)
+
+auth_token_counters = {"issued": 0, "redeemed": 0, "rejected": 0}
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def issue_auth_token(user_id: str, purpose: str, ttl: timedelta) -> str:
+    token = secrets.token_urlsafe(32)
+    now = datetime.now(timezone.utc)
+    await db.auth_tokens.insert_one({
+        "token_hash": hash_token(token),
+        "purpose": purpose,
+        "user_id": user_id,
+        "expires_at": now + ttl,
+        "created_at": now
+    })
+    auth_token_counters["issued"] += 1
+    return token
+
+async def redeem_auth_token(token: str, purpose: str) -> Optional[dict]:
+    """Consume a token atomically; returns None if it is unknown, expired or already used"""
+    record = await db.auth_tokens.find_one_and_delete({
+        "token_hash": hash_token(token),
+        "purpose": purpose,
+        # The TTL monitor runs once a minute, so expiry is also enforced here
+        "expires_at": {"$gt": datetime.now(timezone.utc)}
+    })
+    auth_token_counters["redeemed" if record else "rejected"] += 1
+    return record
 
 def generate_invoice_number():
     return f"INV-{datetime.now(timezone.utc).strftime('%Y%m%d')}-{secrets.token_hex(4).upper()}"
 
-async def send_email(to_email: str, subject: str, html_content: str):
+async def publish_server_status(server: dict, status: str):
+    await event_bus.publish(
+        "server.status", {"server_id": server["id"], "hostname": server["hostname"], "status": status},
+        user_id=server["user_id"], permission="provisioning"
+    )
+
+async def publish_invoice_paid(invoice: dict):
+    await event_bus.publish(
+        "invoice.paid",
+        {"invoice_id": invoice["id"], "invoice_number": invoice["invoice_number"], "amount": invoice["amount"], "order_id": invoice.get("order_id")},
+        user_id=invoice["user_id"], permission="billing"
+    )
+
+async def send_email(to_email: str, subject: str, html_content: str, template: Optional[str] = None):
+    """Send through SendGrid and log the attempt; ``template`` names the email in the delivery log"""
+    if email_log.is_suppressed(to_email, template):
+        email_log.record(to_email, EMAIL_SUPPRESSED, template)
+        return False
+
     # First try environment variable, then database settings
     api_key = SENDGRID_API_KEY
     sender = SENDER_EMAIL
@@ -399,8 +821,10 @@ async def send_email(to_email: str, subject: str, html_content: str):
     
     if not api_key:
         logging.warning("SendGrid API key not configured, skipping email")
+        email_log.record(to_email, EMAIL_NOT_CONFIGURED, template)
         return False
     
+    started = time.perf_counter()
     try:
         message = Mail(
             from_email=sender,
@@ -409,11 +833,15 @@ async def send_email(to_email: str, subject: str, html_content: str):
             html_content=html_content
         )
         sg = SendGridAPIClient(api_key)
-        response = sg.send(message)
+        # The SendGrid client blocks; keep it off the event loop
+        with tracer.span("sendgrid.send", {"email.template": template}, kind=SPAN_CLIENT):
+            response = await run_in_threadpool(sg.send, message)
+        email_log.record(to_email, EMAIL_SENT, template, (time.perf_counter() - started) * 1000)
         logging.info(f"Email sent to {to_email}: {subject} (status: {response.status_code})")
         return True
     except Exception as e:
         error_msg = str(e)
+        email_log.record(to_email, EMAIL_FAILED, template, (time.perf_counter() - started) * 1000, error_msg[:500])
         if "401" in error_msg or "Unauthorized" in error_msg:
             logging.error(f"SendGrid authentication failed - invalid API key")
         elif "403" in error_msg or "Forbidden" in error_msg:
@@ -422,6 +850,31 @@ async def send_email(to_email: str, subject: str, html_content: str):
             logging.error(f"Failed to send email: {e}")
         return False
 
+async def send_queued_email(to_email: str, subject: str, html_content: str):
+    """Email queue sender for broadcasts; a suppressed address ends the message instead of retrying it"""
+    if email_log.is_suppressed(to_email, "broadcast"):
+        email_log.record(to_email, EMAIL_SUPPRESSED, "broadcast")
+        return QUEUE_SUPPRESSED
+    return await send_email(to_email, subject, html_content, template="broadcast")
+
+async def get_email_branding() -> dict:
+    brand = email_branding_cache.get("site")
+    if brand is None:
+        brand = branding_from_settings(await db.site_settings.find_one({"_id": "site_settings"}))
+        email_branding_cache.set("site", brand)
+    return brand
+
+async def send_template_email(to_email: str, template: str, /, **context):
+    """Render one of templates/email with the site branding and send it"""
+    email = email_renderer.render(template, await get_email_branding(), **context)
+    return await send_email(to_email, email.subject, email.html, template=template)
+
+async def send_template_emails(template: str, recipients: List[tuple]):
+    """Render ``template`` for each (email, context) pair in one batch, then send them one after another"""
+    emails = email_renderer.render_many(template, await get_email_branding(), (context for _, context in recipients))
+    for (to_email, _), email in zip(recipients, emails):
+        await send_email(to_email, email.subject, email.html, template=template)
+
 async def send_invoice_email(user: dict, invoice: dict, order: dict = None):
     """Send invoice email with PDF attachment"""
     from reportlab.lib.pagesizes import letter
@@ -459,8 +912,8 @@ async def send_invoice_email(user: dict, invoice: dict, order: dict = None):
     
     elements.append(Paragraph(f"<b>INVOICE</b>", ParagraphStyle('Invoice', fontSize=20, spaceAfter=20)))
     elements.append(Paragraph(f"<b>Invoice Number:</b> {invoice['invoice_number']}", header_style))
-    elements.append(Paragraph(f"<b>Date:</b> {invoice['created_at'][:10]}", header_style))
-    elements.append(Paragraph(f"<b>Due Date:</b> {invoice['due_date'][:10]}", header_style))
+    elements.append(Paragraph(f"<b>Date:</b> {format_date(invoice['created_at'])}", header_style))
+    elements.append(Paragraph(f"<b>Due Date:</b> {format_date(invoice['due_date'])}", header_style))
     elements.append(Spacer(1, 20))
     elements.append(Paragraph("<b>Bill To:</b>", header_style))
     elements.append(Paragraph(user.get("full_name", "Customer"), header_style))
@@ -491,33 +944,19 @@ async def send_invoice_email(user: dict, invoice: dict, order: dict = None):
     if company_email:
         elements.append(Paragraph(f"Contact {company_email} for any billing questions.", styles['Normal']))
     
-    doc.build(elements)
+    with tracer.span("pdf.render", {"invoice.number": invoice["invoice_number"]}):
+        doc.build(elements)
     pdf_data = buffer.getvalue()
     buffer.close()
     
-    # Send email with HTML content
-    html_content = f"""
-    <h2>Invoice #{invoice['invoice_number']}</h2>
-    <p>Hi {user.get('full_name', 'Customer')},</p>
-    <p>A new invoice has been generated for your account.</p>
-    <hr>
-    <p><strong>Invoice Number:</strong> {invoice['invoice_number']}</p>
-    <p><strong>Amount:</strong> ${invoice['amount']:.2f}</p>
-    <p><strong>Due Date:</strong> {invoice['due_date'][:10]}</p>
-    <p><strong>Description:</strong> {invoice['description']}</p>
-    <hr>
-    <p>Please complete your payment before the due date to avoid service interruption.</p>
-    <p>You can view and download your invoice from your dashboard.</p>
-    <p>Best regards,<br>{company_name} Team</p>
-    """
-    
-    await send_email(user["email"], f"Invoice #{invoice['invoice_number']} - {company_name}", html_content)
+    await send_template_email(user["email"], "invoice", user=user, invoice=invoice)
 
+@timed_job(job_duration, "renewal_invoices")
 async def check_and_create_renewal_invoices():
     """Background task: Auto-renew from wallet or create renewal invoices for servers nearing renewal date"""
     # Find servers with renewal date within next 7 days
-    seven_days_ahead = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
-    today = datetime.now(timezone.utc).isoformat()
+    seven_days_ahead = datetime.now(timezone.utc) + timedelta(days=7)
+    today = datetime.now(timezone.utc)
     
     servers = await db.servers.find({
         "status": "active",
@@ -546,18 +985,26 @@ async def check_and_create_renewal_invoices():
             continue
         
         renewal_amount = order["amount"]
-        wallet_balance = user.get("wallet_balance", 0)
+        cycle_days = {"monthly": 30, "quarterly": 90, "yearly": 365}
+        new_renewal = datetime.now(timezone.utc) + timedelta(days=cycle_days.get(order["billing_cycle"], 30))
         
-        # Try auto-renewal from wallet if sufficient balance
-        if wallet_balance >= renewal_amount:
-            # Deduct from wallet
-            new_balance = wallet_balance - renewal_amount
-            await db.users.update_one(
-                {"id": user["id"]},
-                {"$set": {"wallet_balance": new_balance}}
-            )
-            
-            # Create transaction record
+        renewal_invoice = {
+            "id": str(uuid.uuid4()),
+            "user_id": server["user_id"],
+            "order_id": server["order_id"],
+            "server_id": server["id"],
+            "invoice_number": generate_invoice_number(),
+            "amount": renewal_amount,
+            "status": "paid",
+            "due_date": server["renewal_date"],
+            "paid_date": datetime.now(timezone.utc),
+            "description": f"Auto-Renewal (Wallet): {server['plan_name']} - {order['billing_cycle']}",
+            "created_at": datetime.now(timezone.utc)
+        }
+        
+        # Debit, transaction, renewal date and paid invoice are written together
+        async def renew_from_wallet(session):
+            await debit_wallet(db, user["id"], renewal_amount, session)
             await db.transactions.insert_one({
                 "id": str(uuid.uuid4()),
                 "user_id": user["id"],
@@ -565,50 +1012,34 @@ async def check_and_create_renewal_invoices():
                 "amount": renewal_amount,
                 "description": f"Auto-renewal: {server['plan_name']} - {server['hostname']}",
                 "reference": f"SERVER-{server['id'][:8]}",
-                "created_at": datetime.now(timezone.utc).isoformat()
-            })
-            
-            # Extend renewal date
-            cycle_days = {"monthly": 30, "quarterly": 90, "yearly": 365}
-            new_renewal = datetime.now(timezone.utc) + timedelta(days=cycle_days.get(order["billing_cycle"], 30))
+                "created_at": datetime.now(timezone.utc)
+            }, session=session)
             await db.servers.update_one(
                 {"id": server["id"]},
-                {"$set": {"renewal_date": new_renewal.isoformat()}}
+                {"$set": {"renewal_date": new_renewal}},
+                session=session
             )
-            
-            # Create paid invoice record
-            invoice_id = str(uuid.uuid4())
-            invoice_number = generate_invoice_number()
-            invoice_doc = {
-                "id": invoice_id,
-                "user_id": server["user_id"],
-                "order_id": server["order_id"],
-                "server_id": server["id"],
-                "invoice_number": invoice_number,
-                "amount": renewal_amount,
-                "status": "paid",
-                "due_date": server["renewal_date"],
-                "paid_date": datetime.now(timezone.utc).isoformat(),
-                "description": f"Auto-Renewal (Wallet): {server['plan_name']} - {order['billing_cycle']}",
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.invoices.insert_one(invoice_doc)
+            await db.invoices.insert_one(renewal_invoice, session=session)
+        
+        # Try auto-renewal from wallet if sufficient balance
+        renewed = False
+        if user.get("wallet_balance", 0) >= renewal_amount:
+            try:
+                await unit_of_work.run(renew_from_wallet)
+                renewed = True
+            except InsufficientFunds:
+                pass
+        
+        if renewed:
+            search_service.add("invoice", renewal_invoice)
+            await publish_invoice_paid(renewal_invoice)
+            updated_user = await db.users.find_one({"id": user["id"]}, {"_id": 0, "wallet_balance": 1})
+            new_balance = updated_user.get("wallet_balance", 0)
             
             # Send confirmation email
-            await send_email(
-                user["email"],
-                f"Service Renewed - {server['hostname']}",
-                f"""
-                <h2>Service Auto-Renewed Successfully!</h2>
-                <p>Hi {user.get('full_name', 'Customer')},</p>
-                <p>Your server <strong>{server['hostname']}</strong> has been automatically renewed using your wallet balance.</p>
-                <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                    <p><strong>Amount Charged:</strong> ${renewal_amount:.2f}</p>
-                    <p><strong>New Renewal Date:</strong> {new_renewal.strftime('%B %d, %Y')}</p>
-                    <p><strong>Remaining Wallet Balance:</strong> ${new_balance:.2f}</p>
-                </div>
-                <p>Thank you for choosing KloudNests!</p>
-                """
+            await send_template_email(
+                user["email"], "renewal_paid",
+                user=user, server=server, amount=renewal_amount, renewal_date=new_renewal, wallet_balance=new_balance
             )
             
             logging.info(f"Auto-renewed server {server['hostname']} from wallet. New balance: ${new_balance:.2f}")
@@ -627,45 +1058,32 @@ async def check_and_create_renewal_invoices():
                 "due_date": server["renewal_date"],
                 "paid_date": None,
                 "description": f"Renewal: {server['plan_name']} - {order['billing_cycle']}",
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
             await db.invoices.insert_one(invoice_doc)
+            search_service.add("invoice", invoice_doc)
             
             # Send renewal invoice email with wallet top-up reminder
-            await send_email(
-                user["email"],
-                f"Renewal Invoice - {server['hostname']}",
-                f"""
-                <h2>Service Renewal Required</h2>
-                <p>Hi {user.get('full_name', 'Customer')},</p>
-                <p>Your server <strong>{server['hostname']}</strong> is due for renewal.</p>
-                <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                    <p><strong>Invoice #:</strong> {invoice_number}</p>
-                    <p><strong>Amount Due:</strong> ${renewal_amount:.2f}</p>
-                    <p><strong>Due Date:</strong> {server['renewal_date'][:10]}</p>
-                    <p><strong>Your Wallet Balance:</strong> ${wallet_balance:.2f}</p>
-                </div>
-                <p><strong>Tip:</strong> Add funds to your wallet for automatic renewals!</p>
-                <p>Please pay before the due date to avoid service suspension.</p>
-                <p>If payment is not received within 7 days after the due date, the service will be automatically cancelled.</p>
-                """
+            await send_template_email(
+                user["email"], "renewal_invoice",
+                user=user, server=server, invoice=invoice_doc, wallet_balance=user.get("wallet_balance", 0)
             )
             
             logging.info(f"Created renewal invoice {invoice_number} for server {server['hostname']}")
 
+@timed_job(job_duration, "suspend_overdue")
 async def check_and_suspend_overdue_services():
     """Background task: Suspend servers with overdue invoices and cancel after grace period"""
     today = datetime.now(timezone.utc)
-    today_str = today.isoformat()
     
     # Grace period: 7 days after due date for suspension, 14 days for cancellation
-    seven_days_ago = (today - timedelta(days=7)).isoformat()
-    fourteen_days_ago = (today - timedelta(days=14)).isoformat()
+    seven_days_ago = today - timedelta(days=7)
+    fourteen_days_ago = today - timedelta(days=14)
     
     # Find unpaid invoices past due date (for suspension)
     overdue_invoices = await db.invoices.find({
         "status": "unpaid",
-        "due_date": {"$lt": today_str, "$gte": seven_days_ago}
+        "due_date": {"$lt": today, "$gte": seven_days_ago}
     }, {"_id": 0}).to_list(500)
     
     for invoice in overdue_invoices:
@@ -675,24 +1093,16 @@ async def check_and_suspend_overdue_services():
             if server:
                 await db.servers.update_one(
                     {"id": server["id"]},
-                    {"$set": {"status": "suspended", "suspended_at": datetime.now(timezone.utc).isoformat()}}
+                    {"$set": {"status": "suspended", "suspended_at": datetime.now(timezone.utc)}}
                 )
+                await publish_server_status(server, "suspended")
                 
                 # Notify user
                 user = await db.users.find_one({"id": server["user_id"]}, {"_id": 0})
                 if user:
-                    await send_email(
-                        user["email"],
-                        f"Service Suspended - {server['hostname']}",
-                        f"""
-                        <h2>Service Suspended</h2>
-                        <p>Hi {user.get('full_name', 'Customer')},</p>
-                        <p>Your server <strong>{server['hostname']}</strong> has been suspended due to non-payment.</p>
-                        <p><strong>Invoice:</strong> {invoice['invoice_number']}</p>
-                        <p><strong>Amount Due:</strong> ${invoice['amount']:.2f}</p>
-                        <p><strong>Warning:</strong> If payment is not received within 7 days, your service will be permanently cancelled and all data will be deleted.</p>
-                        <p>Please pay your outstanding invoice to restore your service.</p>
-                        """
+                    await send_template_email(
+                        user["email"], "service_suspended",
+                        user=user, server=server, invoice=invoice, cancellation_warning=True
                     )
                 
                 logging.info(f"Suspended server {server['hostname']} due to overdue invoice {invoice['invoice_number']}")
@@ -703,22 +1113,15 @@ async def check_and_suspend_overdue_services():
             if server:
                 await db.servers.update_one(
                     {"id": server["id"]},
-                    {"$set": {"status": "suspended", "suspended_at": datetime.now(timezone.utc).isoformat()}}
+                    {"$set": {"status": "suspended", "suspended_at": datetime.now(timezone.utc)}}
                 )
+                await publish_server_status(server, "suspended")
                 
                 user = await db.users.find_one({"id": server["user_id"]}, {"_id": 0})
                 if user:
-                    await send_email(
-                        user["email"],
-                        f"Service Suspended - {server['hostname']}",
-                        f"""
-                        <h2>Service Suspended</h2>
-                        <p>Hi {user.get('full_name', 'Customer')},</p>
-                        <p>Your server <strong>{server['hostname']}</strong> has been suspended due to non-payment.</p>
-                        <p><strong>Invoice:</strong> {invoice['invoice_number']}</p>
-                        <p><strong>Amount Due:</strong> ${invoice['amount']:.2f}</p>
-                        <p>Please pay your outstanding invoice to restore your service.</p>
-                        """
+                    await send_template_email(
+                        user["email"], "service_suspended",
+                        user=user, server=server, invoice=invoice, cancellation_warning=False
                     )
                 
                 logging.info(f"Suspended server {server['hostname']} due to overdue invoice {invoice['invoice_number']}")
@@ -742,46 +1145,115 @@ async def check_and_suspend_overdue_services():
                 {"id": server["id"]},
                 {"$set": {
                     "status": "cancelled",
-                    "cancelled_at": datetime.now(timezone.utc).isoformat(),
+                    "cancelled_at": datetime.now(timezone.utc),
                     "cancellation_reason": "Non-payment - automatic cancellation"
                 }}
             )
+            await publish_server_status(server, "cancelled")
             
             # Update order status
             if server.get("order_id"):
                 await db.orders.update_one(
                     {"id": server["order_id"]},
-                    {"$set": {"order_status": "cancelled", "updated_at": datetime.now(timezone.utc).isoformat()}}
+                    {"$set": {"order_status": "cancelled", "updated_at": datetime.now(timezone.utc)}}
                 )
             
             # Mark invoice as cancelled
             await db.invoices.update_one(
                 {"id": invoice["id"]},
-                {"$set": {"status": "cancelled", "cancelled_at": datetime.now(timezone.utc).isoformat()}}
+                {"$set": {"status": "cancelled", "cancelled_at": datetime.now(timezone.utc)}}
             )
             
             # Notify user
             user = await db.users.find_one({"id": server["user_id"]}, {"_id": 0})
             if user:
-                await send_email(
-                    user["email"],
-                    f"Service Cancelled - {server['hostname']}",
-                    f"""
-                    <h2>Service Cancelled</h2>
-                    <p>Hi {user.get('full_name', 'Customer')},</p>
-                    <p>Your server <strong>{server['hostname']}</strong> has been permanently cancelled due to non-payment.</p>
-                    <div style="background: #ffebee; padding: 20px; border-radius: 8px; margin: 20px 0; border: 1px solid #ffcdd2;">
-                        <p><strong>⚠️ Important:</strong> All data on this server has been scheduled for deletion.</p>
-                    </div>
-                    <p><strong>Invoice #:</strong> {invoice['invoice_number']}</p>
-                    <p><strong>Outstanding Amount:</strong> ${invoice['amount']:.2f}</p>
-                    <p>If you wish to continue using our services, please create a new order.</p>
-                    <p>If you have any questions, please contact our support team.</p>
-                    """
-                )
+                await send_template_email(user["email"], "service_cancelled", user=user, server=server, invoice=invoice)
             
             logging.info(f"Cancelled server {server['hostname']} due to non-payment (14+ days overdue)")
 
+@timed_job(job_duration, "sla_escalation")
+async def check_ticket_sla_breaches():
+    """Background task: Escalate tickets past their SLA deadline one priority level and alert support"""
+    now = datetime.now(timezone.utc)
+    tickets = await db.tickets.find(
+        {"sla_due_at": {"$lt": now}, "sla_escalated": {"$ne": True}}, {"_id": 0}
+    ).sort("sla_due_at", 1).to_list(500)
+    
+    escalated = []
+    for ticket in tickets:
+        priority = sla_policy.escalated_priority(ticket["priority"])
+        breaches = sla_policy.breaches(ticket, now)
+        # Skip tickets answered or closed since they were read
+        result = await db.tickets.update_one(
+            {"id": ticket["id"], "sla_due_at": ticket["sla_due_at"], "sla_escalated": {"$ne": True}},
+            {
+                "$set": {"sla_escalated": True, "priority": priority, "escalated_at": now},
+                "$inc": {"escalation_level": 1},
+                "$push": {"sla_breaches": {"deadlines": breaches, "due_at": ticket["sla_due_at"], "escalated_at": now}}
+            }
+        )
+        if not result.modified_count:
+            continue
+        escalated.append({**ticket, "priority": priority, "breaches": breaches})
+        await event_bus.publish(
+            "ticket.escalated", {"ticket_id": ticket["id"], "priority": priority, "breaches": breaches},
+            permission="support"
+        )
+    
+    if escalated:
+        await send_template_email(SENDER_EMAIL, "sla_breach_digest", tickets=escalated)
+        logging.info(f"Escalated {len(escalated)} tickets past their SLA deadline")
+    return len(escalated)
+
+async def backfill_ticket_sla():
+    """Give tickets opened before SLAs were tracked their deadlines, counted from when they were opened"""
+    now = datetime.now(timezone.utc)
+    async for ticket in db.tickets.find(
+        {"resolution_due_at": {"$exists": False}, "status": {"$nin": list(CLOSED_STATUSES)}}, {"_id": 0}
+    ):
+        # Until migrate_datetimes.py has run, timestamps may still be ISO strings
+        created_at = as_datetime(ticket.get("created_at"))
+        if created_at is None:
+            logger.warning(f"Ticket {ticket['id']} has no valid created_at; SLA deadlines not backfilled")
+            continue
+        fields = sla_policy.open_fields(ticket["priority"], created_at)
+        last = await db.ticket_messages.find_one({"ticket_id": ticket["id"]}, {"_id": 0}, sort=[("created_at", -1)])
+        if last and last["is_staff"]:
+            fields.update({"response_due_at": None, "sla_due_at": fields["resolution_due_at"],
+                           "first_response_at": as_datetime(last.get("created_at")) or created_at})
+        # Deadlines missed before the upgrade show in the queue without a burst of escalations
+        fields["sla_escalated"] = fields["sla_due_at"] < now
+        await db.tickets.update_one({"id": ticket["id"]}, to_update(fields))
+
+async def backfill_ticket_summaries():
+    """Add message counts and latest-message fields to tickets opened before they were kept on the ticket"""
+    while True:
+        ticket_ids = [t["id"] for t in await db.tickets.find(
+            {"message_count": {"$exists": False}}, {"_id": 0, "id": 1}
+        ).to_list(500)]
+        if not ticket_ids:
+            return
+        summaries = {s["_id"]: s async for s in db.ticket_messages.aggregate([
+            {"$match": {"ticket_id": {"$in": ticket_ids}}},
+            {"$sort": {"created_at": 1}},
+            {"$group": {
+                "_id": "$ticket_id",
+                "count": {"$sum": 1},
+                "created_at": {"$last": "$created_at"},
+                "user_id": {"$last": "$user_id"},
+                "is_staff": {"$last": "$is_staff"}
+            }}
+        ])}
+        authors = {u["id"]: u.get("full_name") or u["email"] async for u in db.users.find(
+            {"id": {"$in": list({s["user_id"] for s in summaries.values()})}}, {"_id": 0, "id": 1, "full_name": 1, "email": 1}
+        )}
+        for ticket_id in ticket_ids:
+            summary = summaries.get(ticket_id)
+            fields = {"message_count": summary["count"] if summary else 0}
+            if summary:
+                fields.update(message_summary(summary, authors.get(summary["user_id"], "")))
+            await db.tickets.update_one({"id": ticket_id}, {"$set": fields})
+
 # ============ AUTH ROUTES ============
 
 @auth_router.post("/register", response_model=TokenResponse)
@@ -791,48 +1263,34 @@ async def register(user_data: UserCreate, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     user_id = str(uuid.uuid4())
-    verification_token = secrets.token_urlsafe(32)
     user_doc = {
         "id": user_id,
         "email": user_data.email.lower(),
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await run_in_threadpool(hash_password, user_data.password),
         "full_name": user_data.full_name,
         "company": user_data.company,
         "role": "user",
         "wallet_balance": 0.0,
         "is_verified": False,
-        "verification_token": verification_token,
         "is_2fa_enabled": False,
         "totp_secret": None,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
     await db.users.insert_one(user_doc)
+    search_service.add("user", user_doc)
+    verification_token = await issue_auth_token(user_id, "email_verification", EMAIL_VERIFICATION_TOKEN_TTL)
     
-    # Get settings for site URL
-    settings = await db.site_settings.find_one({"_id": "site_settings"})
-    site_url = settings.get("site_url", "https://kloudnests.com") if settings else "https://kloudnests.com"
-    verify_link = f"{site_url}/verify-email?token={verification_token}"
+    brand = await get_email_branding()
+    verify_link = f"{brand['site_url']}/verify-email?token={verification_token}"
     
     # Send verification email
     background_tasks.add_task(
-        send_email,
-        user_data.email,
-        "Verify Your Email - KloudNests",
-        f"""
-        <h2>Welcome to KloudNests, {user_data.full_name}!</h2>
-        <p>Thank you for registering! Please verify your email address by clicking the button below:</p>
-        <div style="text-align: center; margin: 30px 0;">
-            <a href="{verify_link}" style="background-color: #3B82F6; color: white; padding: 14px 28px; text-decoration: none; border-radius: 8px; font-weight: bold;">Verify Email</a>
-        </div>
-        <p>Or copy and paste this link in your browser:</p>
-        <p style="color: #666; word-break: break-all;">{verify_link}</p>
-        <p>If you didn't create an account, please ignore this email.</p>
-        <p>Best regards,<br>KloudNests Team</p>
-        """
+        send_template_email, user_data.email, "verify_email",
+        user=user_doc, verify_link=verify_link, welcome=True
     )
     
-    token = create_token(user_id, "user")
+    token = create_token(user_doc)
     user_response = UserResponse(
         id=user_id,
         email=user_doc["email"],
@@ -849,7 +1307,12 @@ async def register(user_data: UserCreate, background_tasks: BackgroundTasks):
 @auth_router.get("/verify-email")
 async def verify_email(token: str):
     """Verify user email with token"""
-    user = await db.users.find_one({"verification_token": token}, {"_id": 0})
+    record = await redeem_auth_token(token, "email_verification")
+    if record:
+        user = await db.users.find_one({"id": record["user_id"]}, {"_id": 0})
+    else:
+        # Links sent before tokens moved to auth_tokens (sparse index on users.verification_token)
+        user = await db.users.find_one({"verification_token": token}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=400, detail="Invalid or expired verification token")
     
@@ -858,8 +1321,9 @@ async def verify_email(token: str):
     
     await db.users.update_one(
         {"id": user["id"]},
-        {"$set": {"is_verified": True, "verification_token": None}}
+        {"$set": {"is_verified": True}, "$unset": {"verification_token": ""}}
     )
+    await db.auth_tokens.delete_many({"user_id": user["id"], "purpose": "email_verification"})
     
     return {"message": "Email verified successfully"}
 
@@ -869,48 +1333,37 @@ async def resend_verification(background_tasks: BackgroundTasks, user: dict = De
     if user.get("is_verified"):
         raise HTTPException(status_code=400, detail="Email already verified")
     
-    verification_token = secrets.token_urlsafe(32)
-    await db.users.update_one(
-        {"id": user["id"]},
-        {"$set": {"verification_token": verification_token}}
-    )
+    # Only the most recent link stays valid
+    await db.auth_tokens.delete_many({"user_id": user["id"], "purpose": "email_verification"})
+    verification_token = await issue_auth_token(user["id"], "email_verification", EMAIL_VERIFICATION_TOKEN_TTL)
     
-    settings = await db.site_settings.find_one({"_id": "site_settings"})
-    site_url = settings.get("site_url", "https://kloudnests.com") if settings else "https://kloudnests.com"
-    verify_link = f"{site_url}/verify-email?token={verification_token}"
+    brand = await get_email_branding()
+    verify_link = f"{brand['site_url']}/verify-email?token={verification_token}"
     
     background_tasks.add_task(
-        send_email,
-        user["email"],
-        "Verify Your Email - KloudNests",
-        f"""
-        <h2>Email Verification</h2>
-        <p>Please verify your email address by clicking the button below:</p>
-        <div style="text-align: center; margin: 30px 0;">
-            <a href="{verify_link}" style="background-color: #3B82F6; color: white; padding: 14px 28px; text-decoration: none; border-radius: 8px; font-weight: bold;">Verify Email</a>
-        </div>
-        <p>Or copy and paste this link in your browser:</p>
-        <p style="color: #666; word-break: break-all;">{verify_link}</p>
-        <p>Best regards,<br>KloudNests Team</p>
-        """
+        send_template_email, user["email"], "verify_email",
+        user=user, verify_link=verify_link, welcome=False
     )
     
     return {"message": "Verification email sent"}
 
 @auth_router.post("/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email.lower()}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    email = credentials.email.lower()
+    await enforce_account_rate_limit("login", email)
+    user = await db.users.find_one({"email": email}, {"_id": 0})
+    if not user or not await run_in_threadpool(verify_password, credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if user.get("is_2fa_enabled") and user.get("totp_secret"):
         if not credentials.totp_code:
+            await rate_limiter.refund("login", "account", email)
             raise HTTPException(status_code=400, detail="2FA code required")
-        totp = pyotp.TOTP(user["totp_secret"])
-        if not totp.verify(credentials.totp_code):
+        if not await totp_verifier.verify(user["id"], user["totp_secret"], credentials.totp_code):
             raise HTTPException(status_code=401, detail="Invalid 2FA code")
     
-    token = create_token(user["id"], user["role"])
+    await rate_limiter.refund("login", "account", email)
+    token = create_token(user)
     user_response = UserResponse(
         id=user["id"],
         email=user["email"],
@@ -950,35 +1403,55 @@ async def setup_2fa(user: dict = Depends(get_current_user)):
     )
     return Setup2FAResponse(secret=secret, qr_uri=qr_uri)
 
-@auth_router.get("/2fa-qr/{secret}")
-async def get_2fa_qr(secret: str, user: dict = Depends(get_current_user)):
-    """Generate QR code image for 2FA setup"""
-    totp = pyotp.TOTP(secret)
-    qr_uri = totp.provisioning_uri(name=user["email"], issuer_name="KloudNests")
-    
-    # Generate QR code
+# (user_id, secret, format) -> rendered QR image; the Security settings page re-requests it on every refresh
+qr_code_cache = TTLCache(ttl=QR_CODE_CACHE_TTL, maxsize=1000)
+
+def render_qr_code(data: str, image_format: str) -> bytes:
+    """Render a QR code as PNG (through Pillow) or SVG (pure Python, much cheaper)"""
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(qr_uri)
+    qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
     
-    # Save to bytes
     img_bytes = BytesIO()
-    img.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
-    
-    return StreamingResponse(img_bytes, media_type="image/png")
+    if image_format == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(img_bytes)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
+
+@auth_router.get("/2fa-qr/{secret}")
+async def get_2fa_qr(secret: str, format: Literal["png", "svg"] = "png", user: dict = Depends(get_current_user)):
+    """Generate QR code image for 2FA setup"""
+    # Only the secret issued by /setup-2fa is rendered, so the cache holds at most one per user
+    user_doc = await db.users.find_one({"id": user["id"]}, {"_id": 0, "totp_secret_pending": 1})
+    if not user_doc or not user_doc.get("totp_secret_pending") or not secrets.compare_digest(user_doc["totp_secret_pending"], secret):
+        raise HTTPException(status_code=404, detail="No 2FA setup in progress for this secret")
+    cache_key = (user["id"], secret, format)
+    image = qr_code_cache.get(cache_key)
+    if image is None:
+        totp = pyotp.TOTP(secret)
+        qr_uri = totp.provisioning_uri(name=user["email"], issuer_name="KloudNests")
+        # Image encoding is CPU-bound, keep it off the event loop
+        image = await run_in_threadpool(render_qr_code, qr_uri, format)
+        qr_code_cache.set(cache_key, image)
+    
+    return Response(
+        content=image,
+        media_type="image/svg+xml" if format == "svg" else "image/png",
+        headers={"Cache-Control": f"private, max-age={QR_CODE_CACHE_TTL}"}
+    )
 
 @auth_router.post("/verify-2fa")
 async def verify_2fa(data: Verify2FARequest, user: dict = Depends(get_current_user)):
+    await enforce_account_rate_limit("2fa", user["id"])
     user_doc = await db.users.find_one({"id": user["id"]}, {"_id": 0})
     pending_secret = user_doc.get("totp_secret_pending")
     if not pending_secret:
         raise HTTPException(status_code=400, detail="No 2FA setup in progress")
     
-    totp = pyotp.TOTP(pending_secret)
-    if not totp.verify(data.code):
+    if not await totp_verifier.verify(user["id"], pending_secret, data.code):
         raise HTTPException(status_code=400, detail="Invalid code")
+    await rate_limiter.refund("2fa", "account", user["id"])
     
     await db.users.update_one(
         {"id": user["id"]},
@@ -987,17 +1460,20 @@ async def verify_2fa(data: Verify2FARequest, user: dict = Depends(get_current_us
             "$unset": {"totp_secret_pending": ""}
         }
     )
+    for image_format in ("png", "svg"):
+        qr_code_cache.pop((user["id"], pending_secret, image_format))
     return {"message": "2FA enabled successfully"}
 
 @auth_router.post("/disable-2fa")
 async def disable_2fa(data: Verify2FARequest, user: dict = Depends(get_current_user)):
+    await enforce_account_rate_limit("2fa", user["id"])
     user_doc = await db.users.find_one({"id": user["id"]}, {"_id": 0})
     if not user_doc.get("is_2fa_enabled"):
         raise HTTPException(status_code=400, detail="2FA is not enabled")
     
-    totp = pyotp.TOTP(user_doc["totp_secret"])
-    if not totp.verify(data.code):
+    if not await totp_verifier.verify(user["id"], user_doc["totp_secret"], data.code):
         raise HTTPException(status_code=400, detail="Invalid code")
+    await rate_limiter.refund("2fa", "account", user["id"])
     
     await db.users.update_one(
         {"id": user["id"]},
@@ -1007,55 +1483,29 @@ async def disable_2fa(data: Verify2FARequest, user: dict = Depends(get_current_u
 
 @auth_router.post("/forgot-password")
 async def forgot_password(data: PasswordResetRequest, background_tasks: BackgroundTasks):
+    await enforce_account_rate_limit("forgot_password", data.email.lower())
     user = await db.users.find_one({"email": data.email.lower()}, {"_id": 0})
     if user:
-        reset_token = secrets.token_urlsafe(32)
-        await db.password_resets.insert_one({
-            "user_id": user["id"],
-            "token": reset_token,
-            "expires_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat(),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        reset_token = await issue_auth_token(user["id"], "password_reset", PASSWORD_RESET_TOKEN_TTL)
         
-        # Get site URL from settings
-        settings = await db.site_settings.find_one({"_id": "site_settings"})
-        site_url = settings.get("site_url", "https://kloudnests.com") if settings else "https://kloudnests.com"
-        reset_link = f"{site_url}/reset-password?token={reset_token}"
+        brand = await get_email_branding()
+        reset_link = f"{brand['site_url']}/reset-password?token={reset_token}"
         
-        background_tasks.add_task(
-            send_email,
-            data.email,
-            "Password Reset - KloudNests",
-            f"""
-            <h2>Password Reset Request</h2>
-            <p>Hi {user.get('full_name', 'there')},</p>
-            <p>We received a request to reset your password. Click the button below to set a new password:</p>
-            <div style="text-align: center; margin: 30px 0;">
-                <a href="{reset_link}" style="background-color: #3B82F6; color: white; padding: 14px 28px; text-decoration: none; border-radius: 8px; font-weight: bold;">Reset Password</a>
-            </div>
-            <p>Or copy and paste this link in your browser:</p>
-            <p style="color: #666; word-break: break-all;">{reset_link}</p>
-            <p><strong>This link expires in 1 hour.</strong></p>
-            <p>If you didn't request this password reset, please ignore this email. Your password will remain unchanged.</p>
-            <p>Best regards,<br>KloudNests Team</p>
-            """
-        )
+        background_tasks.add_task(send_template_email, data.email, "password_reset", user=user, reset_link=reset_link)
     return {"message": "If email exists, reset instructions have been sent"}
 
 @auth_router.post("/reset-password")
 async def reset_password(data: PasswordResetConfirm):
-    reset = await db.password_resets.find_one({"token": data.token}, {"_id": 0})
+    reset = await redeem_auth_token(data.token, "password_reset")
     if not reset:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
     
-    if datetime.fromisoformat(reset["expires_at"]) < datetime.now(timezone.utc):
-        raise HTTPException(status_code=400, detail="Token expired")
-    
     await db.users.update_one(
         {"id": reset["user_id"]},
-        {"$set": {"password_hash": hash_password(data.new_password)}}
+        {"$set": {"password_hash": await run_in_threadpool(hash_password, data.new_password)}}
     )
-    await db.password_resets.delete_one({"token": data.token})
+    await revoke_user_tokens(reset["user_id"])
+    await db.auth_tokens.delete_many({"user_id": reset["user_id"], "purpose": "password_reset"})
     return {"message": "Password reset successfully"}
 
 # ============ PLANS ROUTES ============
@@ -1077,47 +1527,27 @@ async def get_plan(plan_id: str):
 
 # ============ ORDERS ROUTES ============
 
+async def get_order_quote(plan_id: str, billing_cycle: str, data_center_id: Optional[str] = None,
+                          addon_ids: Optional[List[str]] = None) -> Quote:
+    try:
+        return await pricing_catalog.quote(plan_id, billing_cycle, data_center_id, addon_ids or [])
+    except PricingError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 @orders_router.post("/", response_model=OrderResponse)
-async def create_order(order_data: OrderCreate, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
-    plan = await db.plans.find_one({"id": order_data.plan_id, "is_active": True}, {"_id": 0})
-    if not plan:
-        raise HTTPException(status_code=404, detail="Plan not found")
-    
-    # Calculate base price
-    price_map = {
-        "monthly": plan["price_monthly"],
-        "quarterly": plan["price_quarterly"],
-        "yearly": plan["price_yearly"]
-    }
-    amount = price_map[order_data.billing_cycle]
-    
-    # Get data center info
-    data_center_name = None
-    if order_data.data_center_id:
-        datacenter = await db.datacenters.find_one({"id": order_data.data_center_id, "is_active": True}, {"_id": 0})
-        if datacenter:
-            data_center_name = datacenter["name"]
-    
-    # Calculate add-on pricing
-    addon_details = []
-    addon_total = 0
-    if order_data.addons:
-        addons = await db.addons.find({"id": {"$in": order_data.addons}, "is_active": True}, {"_id": 0}).to_list(50)
-        for addon in addons:
-            addon_price = addon["price"]
-            # Adjust add-on price based on billing cycle
-            if addon["billing_cycle"] == "monthly" and order_data.billing_cycle == "quarterly":
-                addon_price = addon["price"] * 3
-            elif addon["billing_cycle"] == "monthly" and order_data.billing_cycle == "yearly":
-                addon_price = addon["price"] * 12
-            addon_details.append({
-                "id": addon["id"],
-                "name": addon["name"],
-                "price": addon_price
-            })
-            addon_total += addon_price
-    
-    total_amount = amount + addon_total
+async def create_order(order_data: OrderCreate, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user),
+                       idempotency_key: Optional[str] = Header(None)):
+    return await idempotency_store.run(
+        idempotency_key, user["id"], "create_order", order_data,
+        lambda: place_order(order_data, background_tasks, user)
+    )
+
+async def place_order(order_data: OrderCreate, background_tasks: BackgroundTasks, user: dict):
+    quote = await get_order_quote(order_data.plan_id, order_data.billing_cycle, order_data.data_center_id, order_data.addons)
+    plan = {"id": quote.plan_id, "name": quote.plan_name}
+    data_center_name = quote.data_center_name
+    addon_details = quote.addon_details
+    total_amount = quote.total
     
     # Handle wallet payment
     payment_status = "pending"
@@ -1134,24 +1564,6 @@ async def create_order(order_data: OrderCreate, background_tasks: BackgroundTask
                 detail=f"Insufficient wallet balance. You have ${wallet_balance:.2f}, need ${total_amount:.2f}"
             )
         
-        # Deduct from wallet
-        new_balance = wallet_balance - total_amount
-        await db.users.update_one(
-            {"id": user["id"]},
-            {"$set": {"wallet_balance": new_balance}}
-        )
-        
-        # Create wallet transaction
-        await db.transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": user["id"],
-            "type": "debit",
-            "amount": total_amount,
-            "description": f"Order: {plan['name']} ({order_data.billing_cycle})",
-            "reference": f"ORDER-{str(uuid.uuid4())[:8].upper()}",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        
         payment_status = "paid"
         invoice_status = "paid"
     
@@ -1173,10 +1585,9 @@ async def create_order(order_data: OrderCreate, background_tasks: BackgroundTask
         "payment_status": payment_status,
         "order_status": "pending" if payment_status == "paid" else "awaiting_payment",
         "notes": order_data.notes,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
-    await db.orders.insert_one(order_doc)
     
     # Create invoice
     invoice_id = str(uuid.uuid4())
@@ -1188,12 +1599,53 @@ async def create_order(order_data: OrderCreate, background_tasks: BackgroundTask
         "invoice_number": invoice_number,
         "amount": total_amount,
         "status": invoice_status,
-        "due_date": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
-        "paid_date": datetime.now(timezone.utc).isoformat() if invoice_status == "paid" else None,
+        "due_date": datetime.now(timezone.utc) + timedelta(days=7),
+        "paid_date": datetime.now(timezone.utc) if invoice_status == "paid" else None,
         "description": f"Order: {plan['name']} - {order_data.billing_cycle}" + (f" + {len(addon_details)} add-ons" if addon_details else ""),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
-    await db.invoices.insert_one(invoice_doc)
+    
+    # Debit, order and invoice are written together or not at all
+    async def write_order(session):
+        if order_data.payment_method == "wallet":
+            await debit_wallet(db, user["id"], total_amount, session)
+            await db.transactions.insert_one({
+                "id": str(uuid.uuid4()),
+                "user_id": user["id"],
+                "type": "debit",
+                "amount": total_amount,
+                "description": f"Order: {plan['name']} ({order_data.billing_cycle})",
+                "reference": f"ORDER-{str(uuid.uuid4())[:8].upper()}",
+                "created_at": datetime.now(timezone.utc)
+            }, session=session)
+        # Paid orders take a machine from the inventory pool when one is free
+        allocated.clear()
+        order_doc["order_status"] = "pending" if payment_status == "paid" else "awaiting_payment"
+        if payment_status == "paid":
+            machine = await claim_machine(db.server_inventory, plan["id"], order_data.data_center_id, order_id, user["id"], session)
+            if machine:
+                server_doc = server_doc_for_order(order_doc, machine, "inventory")
+                await db.server_inventory.update_one({"id": machine["id"]}, {"$set": {"server_id": server_doc["id"]}}, session=session)
+                await db.servers.insert_one(server_doc, session=session)
+                order_doc["order_status"] = "active"
+                allocated["server"] = server_doc
+        await db.orders.insert_one(order_doc, session=session)
+        await db.invoices.insert_one(invoice_doc, session=session)
+    
+    allocated = {}
+    try:
+        await unit_of_work.run(write_order)
+    except InsufficientFunds:
+        # The balance dropped between the check above and the debit
+        raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+    
+    search_service.add("order", order_doc)
+    search_service.add("invoice", invoice_doc)
+    if invoice_doc["status"] == "paid":
+        await publish_invoice_paid(invoice_doc)
+    if allocated:
+        search_service.add("server", allocated["server"])
+        await publish_server_status(allocated["server"], "active")
     
     # Send order confirmation email with PDF invoice attached
     background_tasks.add_task(
@@ -1202,9 +1654,21 @@ async def create_order(order_data: OrderCreate, background_tasks: BackgroundTask
         invoice_doc,
         order_doc
     )
+    if allocated:
+        server_doc = allocated["server"]
+        background_tasks.add_task(
+            send_template_email, user["email"], "server_ready",
+            user=user, server=server_doc, heading="Your Server Has Been Provisioned!"
+        )
     
     return OrderResponse(**{k: v for k, v in order_doc.items() if k != "_id"})
 
+@orders_router.post("/quote")
+async def quote_order(data: OrderQuoteRequest, user: dict = Depends(get_current_user)):
+    """Price a plan, billing cycle and add-ons without placing an order"""
+    quote = await get_order_quote(data.plan_id, data.billing_cycle, data.data_center_id, data.addons)
+    return quote.to_dict()
+
 @orders_router.get("/", response_model=List[OrderResponse])
 async def get_orders(user: dict = Depends(get_current_user)):
     orders = await db.orders.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(100)
@@ -1219,8 +1683,16 @@ async def get_order(order_id: str, user: dict = Depends(get_current_user)):
 
 @orders_router.post("/{order_id}/payment-proof")
 async def upload_payment_proof(order_id: str, proof_url: str, payment_reference: Optional[str] = None, 
-                               background_tasks: BackgroundTasks = None, user: dict = Depends(get_current_user)):
+                               background_tasks: BackgroundTasks = None, user: dict = Depends(get_current_user),
+                               idempotency_key: Optional[str] = Header(None)):
     """Upload payment proof for an order"""
+    return await idempotency_store.run(
+        idempotency_key, user["id"], "payment_proof",
+        {"order_id": order_id, "proof_url": proof_url, "payment_reference": payment_reference},
+        lambda: save_payment_proof(order_id, proof_url, payment_reference, user)
+    )
+
+async def save_payment_proof(order_id: str, proof_url: str, payment_reference: Optional[str], user: dict):
     order = await db.orders.find_one({"id": order_id, "user_id": user["id"]}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -1236,7 +1708,7 @@ async def upload_payment_proof(order_id: str, proof_url: str, payment_reference:
         "proof_url": proof_url,
         "payment_reference": payment_reference,
         "status": "pending_review",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     # Update order with payment proof reference
@@ -1246,7 +1718,7 @@ async def upload_payment_proof(order_id: str, proof_url: str, payment_reference:
             "payment_proof_url": proof_url,
             "payment_reference": payment_reference,
             "payment_status": "pending_verification",
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
     
@@ -1268,7 +1740,7 @@ async def get_server(server_id: str, user: dict = Depends(get_current_user)):
 
 @servers_router.post("/{server_id}/control")
 async def server_control_action(server_id: str, action_data: ServerControlAction, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
-    """Request server control action (reboot/reinstall) - Creates a support ticket"""
+    """Request server control action (reboot/reinstall) - Queues a provisioning job, or creates a support ticket without a driver"""
     server = await db.servers.find_one({"id": server_id, "user_id": user["id"]}, {"_id": 0})
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
@@ -1276,9 +1748,18 @@ async def server_control_action(server_id: str, action_data: ServerControlAction
     if not action_data.confirm:
         raise HTTPException(status_code=400, detail="Please confirm the action")
     
+    action_desc = "Server Reboot" if action_data.action == "reboot" else "OS Reinstall"
+    if provisioning_queue:
+        if server["status"] != "active":
+            raise HTTPException(status_code=400, detail=f"Server is {server['status']}")
+        try:
+            job = await provisioning_queue.enqueue(server, action_data.action, {"os": server.get("os")}, requested_by=user["id"])
+        except ActionInProgress:
+            raise HTTPException(status_code=409, detail="Another action is already in progress for this server")
+        return {"message": f"{action_desc} queued", "job_id": job["id"], "status": job["status"]}
+    
     # Create a support ticket for the action request
     ticket_id = str(uuid.uuid4())
-    action_desc = "Server Reboot" if action_data.action == "reboot" else "OS Reinstall"
     ticket_doc = {
         "id": ticket_id,
         "user_id": user["id"],
@@ -1286,10 +1767,12 @@ async def server_control_action(server_id: str, action_data: ServerControlAction
         "priority": "high" if action_data.action == "reinstall" else "medium",
         "status": "open",
         "order_id": server.get("order_id"),
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "staff_unread": 1,
+        "user_unread": 0,
+        **sla_policy.open_fields("high" if action_data.action == "reinstall" else "medium", datetime.now(timezone.utc)),
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
-    await db.tickets.insert_one(ticket_doc)
     
     # Create ticket message
     message = f"""
@@ -1302,32 +1785,34 @@ Server Control Action Requested:
     if action_data.action == "reinstall":
         message += "\nPlease reinstall the operating system. I understand all data will be lost."
     
-    await db.ticket_messages.insert_one({
+    await open_ticket(ticket_doc, {
         "id": str(uuid.uuid4()),
         "ticket_id": ticket_id,
         "user_id": user["id"],
         "message": message,
         "is_staff": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+        "created_at": datetime.now(timezone.utc)
+    }, user.get("full_name") or user["email"])
     
     # Notify admin via email
     background_tasks.add_task(
-        send_email,
-        SENDER_EMAIL,
-        f"Server Control Request - {action_desc}",
-        f"""
-        <h2>Server Control Action Requested</h2>
-        <p><strong>Action:</strong> {action_desc}</p>
-        <p><strong>Server:</strong> {server['hostname']} ({server['ip_address']})</p>
-        <p><strong>User:</strong> {user['email']}</p>
-        <p><strong>Ticket ID:</strong> {ticket_id[:8]}</p>
-        <p>Please process this request.</p>
-        """
+        send_template_email, SENDER_EMAIL, "server_control_request",
+        action=action_desc, server=server, user=user, ticket_id=ticket_id
     )
     
     return {"message": f"{action_desc} request submitted. Ticket #{ticket_id[:8]} created.", "ticket_id": ticket_id}
 
+@servers_router.get("/{server_id}/actions")
+async def get_server_actions(server_id: str, user: dict = Depends(get_current_user)):
+    """Control action jobs for a server, newest first"""
+    server = await db.servers.find_one({"id": server_id, "user_id": user["id"]}, {"_id": 0, "id": 1})
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    return await db.provisioning_jobs.find(
+        {"server_id": server_id},
+        {"_id": 0, "id": 1, "action": 1, "status": 1, "attempts": 1, "last_error": 1, "created_at": 1, "updated_at": 1, "finished_at": 1}
+    ).sort("created_at", -1).to_list(20)
+
 # ============ INVOICES ROUTES ============
 
 @invoices_router.get("/", response_model=List[InvoiceResponse])
@@ -1388,8 +1873,8 @@ async def download_invoice_pdf(invoice_id: str, user: dict = Depends(get_current
     # Invoice details
     elements.append(Paragraph(f"<b>INVOICE</b>", ParagraphStyle('Invoice', fontSize=20, spaceAfter=20)))
     elements.append(Paragraph(f"<b>Invoice Number:</b> {invoice['invoice_number']}", header_style))
-    elements.append(Paragraph(f"<b>Date:</b> {invoice['created_at'][:10]}", header_style))
-    elements.append(Paragraph(f"<b>Due Date:</b> {invoice['due_date'][:10]}", header_style))
+    elements.append(Paragraph(f"<b>Date:</b> {format_date(invoice['created_at'])}", header_style))
+    elements.append(Paragraph(f"<b>Due Date:</b> {format_date(invoice['due_date'])}", header_style))
     elements.append(Paragraph(f"<b>Status:</b> {invoice['status'].upper()}", header_style))
     elements.append(Spacer(1, 20))
     
@@ -1433,7 +1918,8 @@ async def download_invoice_pdf(invoice_id: str, user: dict = Depends(get_current
     if company_email:
         elements.append(Paragraph(f"Contact {company_email} for any billing questions.", styles['Normal']))
     
-    doc.build(elements)
+    with tracer.span("pdf.render", {"invoice.number": invoice["invoice_number"]}):
+        doc.build(elements)
     buffer.seek(0)
     
     return StreamingResponse(
@@ -1444,6 +1930,84 @@ async def download_invoice_pdf(invoice_id: str, user: dict = Depends(get_current
 
 # ============ TICKETS ROUTES ============
 
+TICKET_MESSAGE_PAGE_SIZE = 100
+
+async def fetch_ticket_messages(ticket_id: str, since: Optional[datetime] = None,
+                                before: Optional[datetime] = None, limit: int = TICKET_MESSAGE_PAGE_SIZE,
+                                since_id: Optional[str] = None, before_id: Optional[str] = None) -> dict:
+    """One page of a ticket's messages, oldest first.
+
+    With ``since`` the page holds the messages posted after it, for clients
+    that already have the thread. Otherwise it holds the newest messages
+    older than ``before`` (or the newest overall). ``has_more`` says whether
+    further messages exist past the page in the direction it was read.
+
+    Messages are ordered by (created_at, id). Passing the id of the message a
+    cursor was taken from (``since_id``/``before_id``) makes the cursor exact,
+    so messages posted in the same millisecond are neither skipped nor repeated.
+    """
+    query = {"ticket_id": ticket_id}
+    if since:
+        query.update(cursor_query(since, since_id, "$gt"))
+        messages = await db.ticket_messages.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).to_list(limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before:
+            query.update(cursor_query(before, before_id, "$lt"))
+        messages = await db.ticket_messages.find(query, {"_id": 0}).sort([("created_at", -1), ("id", -1)]).to_list(limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+    return {"messages": messages, "has_more": has_more}
+
+def cursor_query(created_at: datetime, message_id: Optional[str], op: str) -> dict:
+    """Messages past the (created_at, id) cursor in the direction of ``op`` ($gt or $lt)"""
+    if not message_id:
+        return {"created_at": {op: created_at}}
+    return {"$or": [{"created_at": {op: created_at}}, {"created_at": created_at, "id": {op: message_id}}]}
+
+async def mark_ticket_read(ticket: dict, is_staff: bool):
+    """Reset the unread count for the side that just read the ticket"""
+    field = "staff_unread" if is_staff else "user_unread"
+    if ticket.get(field):
+        await db.tickets.update_one({"id": ticket["id"]}, {"$set": {field: 0}})
+        ticket[field] = 0
+
+def message_summary(message_doc: dict, author: str) -> dict:
+    """Ticket fields describing its latest message, so ticket lists never read ticket_messages"""
+    return {
+        "last_message_at": message_doc["created_at"],
+        "last_message_by": author,
+        "last_message_by_staff": message_doc["is_staff"]
+    }
+
+async def open_ticket(ticket_doc: dict, message_doc: dict, author: str):
+    """Store a new ticket together with its first message"""
+    ticket_doc.update(message_count=1, **message_summary(message_doc, author))
+    
+    async def write_ticket(session):
+        await db.tickets.insert_one(ticket_doc, session=session)
+        await db.ticket_messages.insert_one(message_doc, session=session)
+    
+    await unit_of_work.run(write_ticket)
+    search_service.add("ticket", ticket_doc)
+    search_service.add_message(ticket_doc["id"], message_doc["message"])
+
+async def record_ticket_message(ticket: dict, message_doc: dict, author: str):
+    """Store a reply, update the ticket's summary, count it as unread for the other side and move the SLA deadline"""
+    unread_field = "user_unread" if message_doc["is_staff"] else "staff_unread"
+    update = to_update(sla_policy.message_fields(ticket, message_doc["is_staff"], message_doc["created_at"]))
+    update.setdefault("$set", {}).update(updated_at=message_doc["created_at"], **message_summary(message_doc, author))
+    update["$inc"] = {unread_field: 1, "message_count": 1}
+    
+    # The message and the counters on its ticket are written together
+    async def write_message(session):
+        await db.ticket_messages.insert_one(message_doc, session=session)
+        await db.tickets.update_one({"id": ticket["id"]}, update, session=session)
+    
+    await unit_of_work.run(write_message)
+    search_service.add_message(ticket["id"], message_doc["message"])
+
 @tickets_router.post("/", response_model=TicketResponse)
 async def create_ticket(ticket_data: TicketCreate, user: dict = Depends(get_current_user)):
     ticket_id = str(uuid.uuid4())
@@ -1454,20 +2018,24 @@ async def create_ticket(ticket_data: TicketCreate, user: dict = Depends(get_curr
         "priority": ticket_data.priority,
         "status": "open",
         "order_id": ticket_data.order_id,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "staff_unread": 1,
+        "user_unread": 0,
+        **sla_policy.open_fields(ticket_data.priority, datetime.now(timezone.utc)),
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
     }
-    await db.tickets.insert_one(ticket_doc)
-    
-    # Create initial message
-    await db.ticket_messages.insert_one({
+    await open_ticket(ticket_doc, {
         "id": str(uuid.uuid4()),
         "ticket_id": ticket_id,
         "user_id": user["id"],
         "message": ticket_data.message,
         "is_staff": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+        "created_at": datetime.now(timezone.utc)
+    }, user.get("full_name") or user["email"])
+    await event_bus.publish(
+        "ticket.created", {"ticket_id": ticket_id, "subject": ticket_data.subject, "priority": ticket_data.priority},
+        user_id=user["id"], permission="support"
+    )
     
     return TicketResponse(**{k: v for k, v in ticket_doc.items() if k != "_id"})
 
@@ -1481,8 +2049,26 @@ async def get_ticket(ticket_id: str, user: dict = Depends(get_current_user)):
     ticket = await db.tickets.find_one({"id": ticket_id, "user_id": user["id"]}, {"_id": 0})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    messages = await db.ticket_messages.find({"ticket_id": ticket_id}, {"_id": 0}).sort("created_at", 1).to_list(100)
-    return {"ticket": ticket, "messages": messages}
+    page = await fetch_ticket_messages(ticket_id)
+    await mark_ticket_read(ticket, is_staff=False)
+    return {"ticket": ticket, **page}
+
+@tickets_router.get("/{ticket_id}/messages")
+async def get_ticket_messages(
+    ticket_id: str,
+    since: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    since_id: Optional[str] = None,
+    before_id: Optional[str] = None,
+    limit: int = Query(TICKET_MESSAGE_PAGE_SIZE, ge=1, le=TICKET_MESSAGE_PAGE_SIZE),
+    user: dict = Depends(get_current_user)
+):
+    ticket = await db.tickets.find_one({"id": ticket_id, "user_id": user["id"]}, {"_id": 0, "id": 1, "user_unread": 1})
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    page = await fetch_ticket_messages(ticket_id, since, before, limit, since_id, before_id)
+    await mark_ticket_read(ticket, is_staff=False)
+    return page
 
 @tickets_router.post("/{ticket_id}/messages")
 async def add_ticket_message(ticket_id: str, message_data: TicketMessageCreate, user: dict = Depends(get_current_user)):
@@ -1496,13 +2082,12 @@ async def add_ticket_message(ticket_id: str, message_data: TicketMessageCreate,
         "user_id": user["id"],
         "message": message_data.message,
         "is_staff": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
-    await db.ticket_messages.insert_one(message_doc)
-    
-    await db.tickets.update_one(
-        {"id": ticket_id},
-        {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+    await record_ticket_message(ticket, message_doc, user.get("full_name") or user["email"])
+    await event_bus.publish(
+        "ticket.message", {"ticket_id": ticket_id, "message_id": message_doc["id"], "is_staff": False},
+        user_id=user["id"], permission="support"
     )
     
     return {"message": "Message added successfully"}
@@ -1526,9 +2111,20 @@ async def request_topup(
     payment_method: str = Form(...),
     transaction_ref: str = Form(...),
     payment_proof: Optional[UploadFile] = File(None),
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Submit a wallet topup request with payment proof"""
+    request_params = {"amount": amount, "payment_method": payment_method, "transaction_ref": transaction_ref}
+    if payment_proof and idempotency_key:
+        request_params["payment_proof"] = hashlib.sha256(await payment_proof.read()).hexdigest()
+        await payment_proof.seek(0)
+    return await idempotency_store.run(
+        idempotency_key, user["id"], "wallet_topup", request_params,
+        lambda: submit_topup(amount, payment_method, transaction_ref, payment_proof, user)
+    )
+
+async def submit_topup(amount: float, payment_method: str, transaction_ref: str, payment_proof: Optional[UploadFile], user: dict):
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be greater than 0")
     
@@ -1566,26 +2162,22 @@ async def request_topup(
         "transaction_ref": transaction_ref,
         "payment_proof": proof_filename,
         "status": "pending",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
+    await event_bus.publish(
+        "topup.created", {"request_id": topup_id, "amount": amount, "user_email": user["email"]},
+        user_id=user["id"], permission="billing"
+    )
     
     # Notify admin via email (optional)
     try:
         settings = await db.site_settings.find_one({"_id": "site_settings"})
         admin_email = settings.get("contact_email") if settings else None
         if admin_email:
-            await send_email(
-                admin_email,
-                f"New Wallet Topup Request - {user['email']}",
-                f"""
-                <h2>New Wallet Topup Request</h2>
-                <p><strong>User:</strong> {user['email']}</p>
-                <p><strong>Amount:</strong> ${amount:.2f}</p>
-                <p><strong>Payment Method:</strong> {payment_method.replace('_', ' ').title()}</p>
-                <p><strong>Transaction Reference:</strong> {transaction_ref}</p>
-                <p><strong>Payment Proof:</strong> {'Uploaded' if proof_filename else 'Not provided'}</p>
-                <p>Please review and approve/reject this request from the admin panel.</p>
-                """
+            await send_template_email(
+                admin_email, "topup_request",
+                user=user, amount=amount, payment_method=payment_method, transaction_ref=transaction_ref,
+                has_proof=bool(proof_filename)
             )
     except Exception as e:
         logger.error(f"Failed to send admin notification: {e}")
@@ -1594,13 +2186,15 @@ async def request_topup(
 
 @user_router.put("/profile")
 async def update_profile(full_name: Optional[str] = None, company: Optional[str] = None, user: dict = Depends(get_current_user)):
-    updates = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    updates = {"updated_at": datetime.now(timezone.utc)}
     if full_name:
         updates["full_name"] = full_name
     if company is not None:
         updates["company"] = company
     
     await db.users.update_one({"id": user["id"]}, {"$set": updates})
+    if user["role"] == "user":
+        search_service.add("user", {**user, **updates})
     return {"message": "Profile updated"}
 
 class ChangePasswordRequest(BaseModel):
@@ -1616,7 +2210,7 @@ async def change_password(data: ChangePasswordRequest, user: dict = Depends(get_
         raise HTTPException(status_code=404, detail="User not found")
     
     # Verify current password
-    if not verify_password(data.current_password, user_doc["password_hash"]):
+    if not await run_in_threadpool(verify_password, data.current_password, user_doc["password_hash"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Validate new password
@@ -1626,11 +2220,269 @@ async def change_password(data: ChangePasswordRequest, user: dict = Depends(get_
     # Update password
     await db.users.update_one(
         {"id": user["id"]},
-        {"$set": {"password_hash": hash_password(data.new_password), "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"password_hash": await run_in_threadpool(hash_password, data.new_password), "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Password changed successfully"}
 
+# ============ LIVE EVENTS ============
+
+# EventSource can't send an Authorization header, so a stream is opened with a
+# short-lived single-use ticket requested with the normal bearer token
+EVENT_STREAM_TICKET_TTL = timedelta(minutes=1)
+
+@events_router.post("/ticket")
+async def create_event_stream_ticket(user: dict = Depends(get_current_user)):
+    """Single-use ticket for opening /events/stream"""
+    ticket = await issue_auth_token(user["id"], "event_stream", EVENT_STREAM_TICKET_TTL)
+    return {"ticket": ticket, "expires_in": int(EVENT_STREAM_TICKET_TTL.total_seconds())}
+
+@events_router.get("/stream")
+async def event_stream(request: Request, ticket: str, types: Optional[str] = None):
+    """Server-sent events for the user's servers, tickets, invoices and topups (and, for admins, those of their areas).
+    ``types`` is an optional comma-separated filter such as "server.status,server.action"."""
+    record = await redeem_auth_token(ticket, "event_stream")
+    if not record:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+    user = await db.users.find_one({"id": record["user_id"]}, {"_id": 0, "id": 1, "role": 1, "permissions": 1})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    subscription = event_bus.subscribe(
+        user["id"], get_admin_permissions(user), [t.strip() for t in types.split(",")] if types else None
+    )
+    
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=EVENT_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ============ ADMIN SEARCH ============
+
+@admin_router.get("/search")
+async def admin_search(
+    q: str = Query(..., min_length=1, max_length=200),
+    types: Optional[str] = None,
+    offset: int = Query(0, ge=0, le=1000),
+    limit: int = Query(20, ge=1, le=100),
+    admin: dict = Depends(get_admin_user)
+):
+    """Ranked search over users, tickets, servers, orders and invoices in the admin's areas.
+    ``types`` is an optional comma-separated filter such as "user,server"."""
+    if not search_service.ready:
+        raise HTTPException(status_code=503, detail="Search index is being built", headers={"Retry-After": "30"})
+    kinds = [kind for kind in KINDS if SOURCES[kind]["permission"] in (None, *admin["permissions"])]
+    if types:
+        requested = {t.strip() for t in types.split(",")}
+        kinds = [kind for kind in kinds if kind in requested]
+    hits, has_more = search_service.search(q, kinds, offset, limit) if kinds else ([], False)
+    
+    # The index only holds ids; show the current version of each hit
+    docs = {}
+    for kind in {kind for kind, _, _ in hits}:
+        source = SOURCES[kind]
+        ids = [doc_id for hit_kind, doc_id, _ in hits if hit_kind == kind]
+        async for doc in db[source["collection"]].find({**source["query"], "id": {"$in": ids}}, source["projection"]):
+            docs[(kind, doc["id"])] = doc
+    results = []
+    for kind, doc_id, score in hits:
+        doc = docs.get((kind, doc_id))
+        if doc is None:
+            continue
+        title, subtitle = SOURCES[kind]["summary"](doc)
+        results.append({"type": kind, "id": doc_id, "title": title, "subtitle": subtitle, "score": score})
+    return {"query": q, "results": results, "offset": offset, "limit": limit, "has_more": has_more}
+
+# ============ ADMIN BROADCASTS ============
+
+class BroadcastSegment(BaseModel):
+    plan_id: Optional[str] = None
+    data_center_id: Optional[str] = None
+    server_status: Optional[Literal["active", "suspended", "cancelled"]] = None
+    unpaid_invoices: bool = False
+
+class BroadcastCreate(BaseModel):
+    subject: str = Field(..., min_length=1, max_length=200)
+    message: str = Field(..., min_length=1)
+    segment: BroadcastSegment = BroadcastSegment()
+
+async def render_broadcast_batch(broadcast: dict, users: List[dict]) -> List[tuple]:
+    """(subject, html) for each user; rendered in a thread so large batches don't hold up requests"""
+    emails = await run_in_threadpool(
+        email_renderer.render_broadcast, await get_email_branding(), broadcast["subject"], broadcast["message"], users
+    )
+    return [(email.subject, email.html) for email in emails]
+
+async def backfill_server_plan_ids():
+    """Copy plan ids from orders onto servers provisioned before servers kept them, for plan segments"""
+    async for server in db.servers.find(
+        {"plan_id": {"$exists": False}, "order_id": {"$ne": None}}, {"_id": 0, "id": 1, "order_id": 1}
+    ):
+        order = await db.orders.find_one({"id": server["order_id"]}, {"_id": 0, "plan_id": 1})
+        await db.servers.update_one({"id": server["id"]}, {"$set": {"plan_id": order.get("plan_id") if order else None}})
+
+async def check_broadcast(data: BroadcastCreate, user: dict):
+    """Render the broadcast for ``user`` up front, so syntax errors and unsafe expressions are a 400, not a failed send"""
+    try:
+        return (await render_broadcast_batch(data.model_dump(), [user]))[0]
+    except TemplateError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid template: {e}")
+
+async def describe_broadcast_segment(segment: BroadcastSegment) -> str:
+    parts = []
+    if segment.plan_id:
+        plan = await db.plans.find_one({"id": segment.plan_id}, {"_id": 0, "name": 1})
+        parts.append(f"plan {plan['name'] if plan else segment.plan_id}")
+    if segment.data_center_id:
+        data_center = await db.datacenters.find_one({"id": segment.data_center_id}, {"_id": 0, "name": 1})
+        parts.append(f"in {data_center['name'] if data_center else segment.data_center_id}")
+    if segment.server_status:
+        parts.append(f"{segment.server_status} servers")
+    if segment.unpaid_invoices:
+        parts.append("with unpaid invoices")
+    return ", ".join(parts) or "all customers"
+
+@admin_router.post("/broadcasts/preview")
+async def admin_preview_broadcast(data: BroadcastCreate, admin: dict = Depends(get_support_admin)):
+    """Recipient count and the message as the first recipient will see it"""
+    await check_broadcast(data, admin)
+    segment = data.segment.model_dump()
+    recipients = await broadcaster.segments.count(segment)
+    sample = None
+    async for users in broadcaster.segments.user_batches(segment):
+        subject, html = await check_broadcast(data, users[0])
+        sample = {"email": users[0]["email"], "subject": subject, "html": html}
+        break
+    return {"recipients": recipients, "segment_description": await describe_broadcast_segment(data.segment), "sample": sample}
+
+@admin_router.post("/broadcasts")
+async def admin_create_broadcast(data: BroadcastCreate, admin: dict = Depends(get_support_admin)):
+    """Queue an email to every customer in a segment; progress is on the returned broadcast"""
+    await check_broadcast(data, admin)
+    return await broadcaster.create(
+        data.subject, data.message, data.segment.model_dump(), admin["email"],
+        description=await describe_broadcast_segment(data.segment)
+    )
+
+@admin_router.get("/broadcasts")
+async def admin_get_broadcasts(admin: dict = Depends(get_support_admin)):
+    return await db.broadcasts.find({}, {"_id": 0, "message": 0}).sort("created_at", -1).to_list(50)
+
+@admin_router.get("/broadcasts/{broadcast_id}")
+async def admin_get_broadcast(broadcast_id: str, admin: dict = Depends(get_support_admin)):
+    broadcast = await db.broadcasts.find_one({"id": broadcast_id}, {"_id": 0})
+    if not broadcast:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return broadcast
+
+@admin_router.post("/broadcasts/{broadcast_id}/cancel")
+async def admin_cancel_broadcast(broadcast_id: str, admin: dict = Depends(get_support_admin)):
+    """Stop a broadcast; messages already sent stay sent"""
+    broadcast = await broadcaster.cancel(broadcast_id)
+    if broadcast is None:
+        if not await db.broadcasts.find_one({"id": broadcast_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Broadcast not found")
+        raise HTTPException(status_code=400, detail=f"Only {' or '.join(ACTIVE_BROADCAST_STATUSES)} broadcasts can be cancelled")
+    return broadcast
+
+# ============ EMAIL DELIVERY ============
+
+class EmailSuppressionCreate(BaseModel):
+    email: EmailStr
+    reason: str = Field("Added by admin", max_length=200)
+
+@admin_router.get("/email/stats")
+async def admin_email_stats(days: int = Query(7, ge=1, le=90), admin: dict = Depends(get_support_admin)):
+    """Delivery counts and SendGrid latency per template"""
+    return await email_log.stats(datetime.now(timezone.utc) - timedelta(days=days))
+
+@admin_router.get("/email/events")
+async def admin_email_events(to: Optional[str] = None, status: Optional[str] = None, template: Optional[str] = None,
+                             limit: int = Query(100, ge=1, le=500), admin: dict = Depends(get_support_admin)):
+    """Most recent send attempts, newest first"""
+    query = {}
+    if to:
+        query["to"] = to.lower()
+    if status:
+        if status not in EMAIL_STATUSES:
+            raise HTTPException(status_code=400, detail=f"Status must be one of: {', '.join(EMAIL_STATUSES)}")
+        query["status"] = status
+    if template:
+        query["template"] = template
+    return await db.email_events.find(query, {"_id": 0, "expires_at": 0}).sort("created_at", -1).to_list(limit)
+
+@admin_router.get("/email/suppressions")
+async def admin_email_suppressions(email: Optional[str] = None, admin: dict = Depends(get_support_admin)):
+    query = {"email": {"$regex": f"^{re.escape(email.lower())}"}} if email else {}
+    return await db.email_suppressions.find(query, {"_id": 0}).sort("created_at", -1).to_list(200)
+
+@admin_router.post("/email/suppressions")
+async def admin_add_email_suppression(data: EmailSuppressionCreate, admin: dict = Depends(get_support_admin)):
+    """Stop all email to an address"""
+    if not await email_log.suppress(data.email, data.reason, source=admin["email"]):
+        raise HTTPException(status_code=400, detail="Address is already suppressed")
+    return {"message": f"{data.email} suppressed"}
+
+@admin_router.delete("/email/suppressions/{email}")
+async def admin_remove_email_suppression(email: str, admin: dict = Depends(get_support_admin)):
+    if not await email_log.unsuppress(email):
+        raise HTTPException(status_code=404, detail="Address is not suppressed")
+    return {"message": f"{email} can receive email again"}
+
+@api_router.post("/email/webhook")
+async def sendgrid_event_webhook(request: Request, token: str = ""):
+    """SendGrid event webhook: suppress addresses that bounce, are dropped or report spam, and record unsubscribes"""
+    if not SENDGRID_WEBHOOK_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not secrets.compare_digest(token, SENDGRID_WEBHOOK_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    try:
+        events = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of events")
+    suppressed = 0
+    for event in events:
+        if isinstance(event, dict) and event.get("event") in SUPPRESSING_EVENTS and event.get("email"):
+            reason = event.get("reason") or event["event"]
+            # Unsubscribing opts out of broadcasts; invoices, resets and credentials still go out
+            scope = EMAIL_SUPPRESS_MARKETING if event["event"] in UNSUBSCRIBE_EVENTS else EMAIL_SUPPRESS_ALL
+            suppressed += await email_log.suppress(event["email"], str(reason)[:200], source="sendgrid", scope=scope)
+    return {"suppressed": suppressed}
+
+# ============ SLOW QUERIES ============
+
+@admin_router.get("/slow-queries")
+async def admin_slow_queries(limit: int = Query(20, ge=1, le=200), sort: str = "total_ms",
+                             collection: Optional[str] = None, admin: dict = Depends(get_admin_user)):
+    """Slowest Mongo query shapes across workers, with the explain plan for each"""
+    if sort not in SLOW_QUERY_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Sort must be one of: {', '.join(SLOW_QUERY_SORT_FIELDS)}")
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "shapes": await slow_query_log.report(limit, sort, collection)
+    }
+
+@admin_router.delete("/slow-queries")
+async def admin_reset_slow_queries(admin: dict = Depends(get_admin_user)):
+    """Start over, e.g. after adding an index"""
+    if admin["role"] != "super_admin":
+        raise HTTPException(status_code=403, detail="Super admin access required")
+    return {"message": f"Cleared {await slow_query_log.reset()} query shapes"}
+
 # ============ ADMIN ROUTES ============
 
 @admin_router.get("/dashboard")
@@ -1657,7 +2509,7 @@ async def admin_dashboard(admin: dict = Depends(get_admin_user)):
     }
 
 @admin_router.get("/orders")
-async def admin_get_orders(status: Optional[str] = None, admin: dict = Depends(get_admin_user)):
+async def admin_get_orders(status: Optional[str] = None, admin: dict = Depends(get_billing_admin)):
     """Get all orders with user details"""
     query = {}
     if status:
@@ -1681,21 +2533,24 @@ async def admin_get_orders(status: Optional[str] = None, admin: dict = Depends(g
     return enriched_orders
 
 @admin_router.put("/orders/{order_id}")
-async def admin_update_order(order_id: str, data: AdminOrderUpdate, background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
+async def admin_update_order(order_id: str, data: AdminOrderUpdate, background_tasks: BackgroundTasks, admin: dict = Depends(get_billing_admin)):
     order = await db.orders.find_one({"id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    updates = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    updates = {"updated_at": datetime.now(timezone.utc)}
     if data.order_status:
         updates["order_status"] = data.order_status
     if data.payment_status:
         updates["payment_status"] = data.payment_status
         if data.payment_status == "paid":
-            await db.invoices.update_one(
+            invoice = await db.invoices.find_one_and_update(
                 {"order_id": order_id},
-                {"$set": {"status": "paid", "paid_date": datetime.now(timezone.utc).isoformat()}}
+                {"$set": {"status": "paid", "paid_date": datetime.now(timezone.utc)}},
+                projection={"_id": 0}
             )
+            if invoice and invoice["status"] != "paid":
+                await publish_invoice_paid(invoice)
     
     await db.orders.update_one({"id": order_id}, {"$set": updates})
     
@@ -1703,139 +2558,92 @@ async def admin_update_order(order_id: str, data: AdminOrderUpdate, background_t
     user = await db.users.find_one({"id": order["user_id"]}, {"_id": 0})
     if user:
         background_tasks.add_task(
-            send_email,
-            user["email"],
-            f"Order Update - {order_id[:8]}",
-            f"""
-            <h2>Order Status Update</h2>
-            <p>Your order {order_id[:8]} has been updated.</p>
-            <p><strong>Order Status:</strong> {data.order_status or order['order_status']}</p>
-            <p><strong>Payment Status:</strong> {data.payment_status or order['payment_status']}</p>
-            """
+            send_template_email, user["email"], "order_update",
+            order_id=order_id,
+            order_status=data.order_status or order["order_status"],
+            payment_status=data.payment_status or order["payment_status"]
         )
     
     return {"message": "Order updated"}
 
-@admin_router.post("/servers")
-async def admin_create_server(data: AdminServerCreate, background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
-    order = await db.orders.find_one({"id": data.order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    existing_server = await db.servers.find_one({"order_id": data.order_id}, {"_id": 0})
-    if existing_server:
-        raise HTTPException(status_code=400, detail="Server already exists for this order")
-    
-    # Calculate renewal date based on billing cycle
+async def reserve_ip(ip_address: Optional[str], subnet_id: Optional[str], owner_type: str, owner_id: str) -> str:
+    """Assign ``ip_address``, or the next free address in ``subnet_id``, to a server or machine"""
+    try:
+        if ip_address:
+            return await ipam.assign(ip_address, owner_type, owner_id)
+        if subnet_id:
+            return await ipam.allocate(subnet_id, owner_type, owner_id)
+    except AddressConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except IPAMError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    raise HTTPException(status_code=400, detail="Specify an IP address or a subnet to allocate one from")
+
+def server_doc_for_order(order: dict, credentials: dict, provisioned_by: str) -> dict:
+    """Server record for a provisioned order; ``credentials`` holds the machine's access details"""
     cycle_days = {"monthly": 30, "quarterly": 90, "yearly": 365}
-    renewal_date = datetime.now(timezone.utc) + timedelta(days=cycle_days.get(order["billing_cycle"], 30))
-    
-    server_id = str(uuid.uuid4())
-    server_doc = {
-        "id": server_id,
-        "order_id": data.order_id,
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "order_id": order["id"],
         "user_id": order["user_id"],
-        "ip_address": data.ip_address,
-        "hostname": data.hostname,
-        "username": data.username,
-        "password": data.password,
-        "ssh_port": data.ssh_port,
+        "ip_address": credentials["ip_address"],
+        "hostname": credentials["hostname"],
+        "username": credentials["username"],
+        "password": credentials["password"],
+        "ssh_port": str(credentials.get("ssh_port") or 22),
         "os": order["os"],
         "control_panel": order.get("control_panel"),
-        "panel_url": data.panel_url,
-        "panel_username": data.panel_username,
-        "panel_password": data.panel_password,
-        "additional_notes": data.additional_notes,
+        "panel_url": credentials.get("panel_url"),
+        "panel_username": credentials.get("panel_username"),
+        "panel_password": credentials.get("panel_password"),
+        "additional_notes": credentials.get("additional_notes"),
+        "specs": {k: credentials[k] for k in ("cpu", "ram", "storage") if credentials.get(k)} or None,
         "status": "active",
+        "plan_id": order.get("plan_id"),
         "plan_name": order["plan_name"],
         "data_center_id": order.get("data_center_id"),
         "data_center_name": order.get("data_center_name"),
-        "renewal_date": renewal_date.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "provisioned_by": admin["email"]
+        "renewal_date": now + timedelta(days=cycle_days.get(order["billing_cycle"], 30)),
+        "created_at": now,
+        "provisioned_by": provisioned_by
     }
+
+@admin_router.post("/servers")
+async def admin_create_server(data: AdminServerCreate, background_tasks: BackgroundTasks, admin: dict = Depends(get_provisioning_admin)):
+    order = await db.orders.find_one({"id": data.order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    existing_server = await db.servers.find_one({"order_id": data.order_id}, {"_id": 0})
+    if existing_server:
+        raise HTTPException(status_code=400, detail="Server already exists for this order")
+    
+    server_doc = server_doc_for_order(order, data.model_dump(), admin["email"])
+    server_id = server_doc["id"]
+    server_doc["ip_address"] = await reserve_ip(data.ip_address, data.subnet_id, "server", server_id)
     await db.servers.insert_one(server_doc)
+    search_service.add("server", server_doc)
+    await publish_server_status(server_doc, server_doc["status"])
     
     # Update order status
     await db.orders.update_one(
         {"id": data.order_id},
-        {"$set": {"order_status": "active", "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"order_status": "active", "updated_at": datetime.now(timezone.utc)}}
     )
     
     # Send credentials email if requested
     user = await db.users.find_one({"id": order["user_id"]}, {"_id": 0})
     if user and data.send_email:
-        # Build control panel section if provided
-        control_panel_section = ""
-        if data.panel_url:
-            control_panel_section = f"""
-            <div style="background: #f0f9ff; padding: 15px; border-radius: 8px; margin: 15px 0;">
-                <h3 style="margin-top: 0; color: #0369a1;">Control Panel Access</h3>
-                <p><strong>URL:</strong> <a href="{data.panel_url}">{data.panel_url}</a></p>
-                <p><strong>Username:</strong> {data.panel_username or 'Same as SSH'}</p>
-                <p><strong>Password:</strong> {data.panel_password or 'Same as SSH'}</p>
-            </div>
-            """
-        
-        # Build notes section if provided
-        notes_section = ""
-        if data.additional_notes:
-            notes_section = f"""
-            <div style="background: #fef3c7; padding: 15px; border-radius: 8px; margin: 15px 0;">
-                <h3 style="margin-top: 0; color: #92400e;">Additional Information</h3>
-                <p>{data.additional_notes}</p>
-            </div>
-            """
-        
         background_tasks.add_task(
-            send_email,
-            user["email"],
-            f"Your Server is Ready! - {data.hostname}",
-            f"""
-            <h2>🎉 Your Server Has Been Provisioned!</h2>
-            <p>Hi {user['full_name']},</p>
-            <p>Great news! Your server has been set up and is ready to use.</p>
-            
-            <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                <h3 style="margin-top: 0; color: #1e40af;">SSH / Server Access</h3>
-                <table style="width: 100%; border-collapse: collapse;">
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>Plan:</strong></td><td>{order['plan_name']}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>Hostname:</strong></td><td>{data.hostname}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>IP Address:</strong></td><td>{data.ip_address}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>Username:</strong></td><td>{data.username}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>Password:</strong></td><td>{data.password}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>SSH Port:</strong></td><td>{data.ssh_port}</td></tr>
-                    <tr><td style="padding: 8px 0;"><strong>OS:</strong></td><td>{order['os']}</td></tr>
-                </table>
-            </div>
-            
-            <div style="background: #1e293b; color: #e2e8f0; padding: 15px; border-radius: 8px; font-family: monospace; margin: 15px 0;">
-                <strong>Quick Connect Command:</strong><br>
-                ssh {data.username}@{data.ip_address} -p {data.ssh_port}
-            </div>
-            
-            {control_panel_section}
-            {notes_section}
-            
-            <p><strong>🔐 Security Tips:</strong></p>
-            <ul>
-                <li>Change your password after first login</li>
-                <li>Keep your credentials secure</li>
-                <li>Enable firewall rules</li>
-            </ul>
-            
-            <p>You can view your server details anytime in your <a href="https://kloudnests.com/dashboard/services">dashboard</a>.</p>
-            
-            <p>If you have any questions, our support team is here to help!</p>
-            
-            <p>Best regards,<br><strong>KloudNests Team</strong></p>
-            """
+            send_template_email, user["email"], "server_ready",
+            user=user, server=server_doc, heading="Your Server Has Been Provisioned!"
         )
     
     return {"message": "Server created and credentials sent", "server_id": server_id}
 
 @admin_router.get("/servers")
-async def admin_get_servers(admin: dict = Depends(get_admin_user)):
+async def admin_get_servers(admin: dict = Depends(get_provisioning_admin)):
     servers = await db.servers.find({}, {"_id": 0}).to_list(500)
     # Add user email to each server
     for server in servers:
@@ -1846,10 +2654,13 @@ async def admin_get_servers(admin: dict = Depends(get_admin_user)):
 class AllocateServerRequest(BaseModel):
     user_id: str
     plan_id: Optional[str] = None
-    hostname: str
-    ip_address: str
+    from_inventory: bool = False  # Take the oldest available machine for plan_id instead of the details below
+    data_center_id: Optional[str] = None  # Limits the inventory claim to one data center
+    hostname: Optional[str] = None  # Required unless from_inventory
+    ip_address: Optional[str] = None
+    subnet_id: Optional[str] = None  # Allocate the next free address when ip_address is not given
     username: str = "root"
-    password: str
+    password: Optional[str] = None  # Required unless from_inventory
     port: str = "22"
     control_panel_url: Optional[str] = None
     control_panel_username: Optional[str] = None
@@ -1860,8 +2671,15 @@ class AllocateServerRequest(BaseModel):
     amount: Optional[float] = None  # Amount to deduct from wallet (if payment_received is False)
 
 @admin_router.post("/servers/allocate")
-async def admin_allocate_server(data: AllocateServerRequest, background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
+async def admin_allocate_server(data: AllocateServerRequest, background_tasks: BackgroundTasks, admin: dict = Depends(get_provisioning_admin),
+                                idempotency_key: Optional[str] = Header(None)):
     """Allocate a server to any user with credentials"""
+    return await idempotency_store.run(
+        idempotency_key, admin["id"], "allocate_server", data,
+        lambda: allocate_server(data, background_tasks, admin)
+    )
+
+async def allocate_server(data: AllocateServerRequest, background_tasks: BackgroundTasks, admin: dict):
     # Verify user exists
     user = await db.users.find_one({"id": data.user_id}, {"_id": 0})
     if not user:
@@ -1883,33 +2701,25 @@ async def admin_allocate_server(data: AllocateServerRequest, background_tasks: B
             )
         
         amount_charged = data.amount
-        
-        # Deduct from wallet
-        new_balance = wallet_balance - data.amount
-        await db.users.update_one(
-            {"id": user["id"]},
-            {"$set": {"wallet_balance": new_balance}}
-        )
-        
-        # Create transaction record
-        await db.transactions.insert_one({
-            "id": str(uuid.uuid4()),
-            "user_id": user["id"],
-            "type": "debit",
-            "amount": data.amount,
-            "description": f"Server allocation: {data.hostname}",
-            "reference": f"ALLOC-{data.hostname}",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
     
     # Get plan info if provided
     plan_name = "Custom Server"
+    plan = None
     if data.plan_id and data.plan_id != "custom":
         plan = await db.plans.find_one({"id": data.plan_id}, {"_id": 0})
         if plan:
             plan_name = plan["name"]
+    if data.from_inventory:
+        if not plan:
+            raise HTTPException(status_code=400, detail="Select a plan to allocate a machine from inventory")
+    elif not data.hostname or not data.password:
+        raise HTTPException(status_code=400, detail="Hostname and password are required")
     
     server_id = str(uuid.uuid4())
+    # Inventory machines already hold their address in IPAM
+    ip_address = None if data.from_inventory else await reserve_ip(data.ip_address, data.subnet_id, "server", server_id)
+    
+    now = datetime.now(timezone.utc)
     server_doc = {
         "id": server_id,
         "user_id": data.user_id,
@@ -1917,7 +2727,7 @@ async def admin_allocate_server(data: AllocateServerRequest, background_tasks: B
         "plan_id": data.plan_id if data.plan_id != "custom" else None,
         "plan_name": plan_name,
         "hostname": data.hostname,
-        "ip_address": data.ip_address,
+        "ip_address": ip_address,
         "username": data.username,
         "password": data.password,
         "ssh_port": data.port,
@@ -1926,105 +2736,418 @@ async def admin_allocate_server(data: AllocateServerRequest, background_tasks: B
         "panel_password": data.control_panel_password,
         "additional_notes": data.additional_notes,
         "status": "active",
-        "renewal_date": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "renewal_date": now + timedelta(days=30),
+        "created_at": now,
         "allocated_by": admin["email"],
         "payment_received_externally": data.payment_received,
         "amount_charged": amount_charged
     }
-    await db.servers.insert_one(server_doc)
     
     # Create invoice for the allocation (whether paid from wallet or externally)
-    if amount_charged > 0 or data.payment_received:
+    invoice_doc = None
+    invoice_amount = amount_charged if amount_charged > 0 else (data.amount or 0)
+    if invoice_amount > 0:
+        invoice_doc = {
+            "id": str(uuid.uuid4()),
+            "user_id": data.user_id,
+            "server_id": server_id,
+            "order_id": None,  # Manual allocation
+            "invoice_number": generate_invoice_number(),
+            "amount": invoice_amount,
+            "status": "paid",
+            "due_date": now,
+            "paid_date": now,
+            "description": f"Server Allocation: {plan_name} - {data.hostname}",
+            "payment_method": "wallet" if not data.payment_received else "external",
+            "created_at": now
+        }
+    
+    # Claim, debit, transaction, server and invoice are written together
+    async def write_allocation(session):
+        if data.from_inventory:
+            machine = await claim_machine(db.server_inventory, plan["id"], data.data_center_id, None, user["id"], session)
+            if not machine:
+                raise HTTPException(status_code=409, detail="No machine available for this plan and data center")
+            claimed["machine"] = machine
+            server_doc.update({field: machine.get(field) for field in CREDENTIAL_FIELDS})
+            server_doc["ssh_port"] = str(machine.get("ssh_port") or 22)
+            server_doc["specs"] = {k: machine[k] for k in ("cpu", "ram", "storage") if machine.get(k)} or None
+            server_doc["data_center_id"] = machine.get("data_center_id")
+            if invoice_doc:
+                invoice_doc["description"] = f"Server Allocation: {plan_name} - {machine['hostname']}"
+            await db.server_inventory.update_one({"id": machine["id"]}, {"$set": {"server_id": server_id}}, session=session)
+        if amount_charged:
+            await debit_wallet(db, user["id"], amount_charged, session)
+            await db.transactions.insert_one({
+                "id": str(uuid.uuid4()),
+                "user_id": user["id"],
+                "type": "debit",
+                "amount": amount_charged,
+                "description": f"Server allocation: {server_doc['hostname']}",
+                "reference": f"ALLOC-{server_doc['hostname']}",
+                "created_at": now
+            }, session=session)
+        await db.servers.insert_one(server_doc, session=session)
+        if invoice_doc:
+            await db.invoices.insert_one(invoice_doc, session=session)
+    
+    claimed = {}
+    try:
+        await unit_of_work.run(write_allocation)
+    except Exception as e:
+        # Without a server record the address or machine would stay assigned to nothing
+        if not await db.servers.find_one({"id": server_id}, {"_id": 1}):
+            if ip_address:
+                await ipam.release(ip_address, server_id)
+            if claimed and not unit_of_work.enabled:
+                # A transaction already rolled the claim back
+                await release_machine(db.server_inventory, claimed["machine"]["id"])
+        if isinstance(e, InsufficientFunds):
+            # The balance dropped between the check above and the debit
+            raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+        raise
+    
+    search_service.add("server", server_doc)
+    await publish_server_status(server_doc, server_doc["status"])
+    if invoice_doc:
+        search_service.add("invoice", invoice_doc)
+    
+    # Send credentials email if requested
+    if data.send_email:
+        background_tasks.add_task(
+            send_template_email, user["email"], "server_ready",
+            user=user, server=server_doc, heading="Your Server Has Been Allocated!"
+        )
+    
+    return {"message": "Server allocated successfully", "server_id": server_id}
+
+# ============ BULK PROVISIONING ============
+
+MAX_BULK_ROWS = 500
+
+class BulkServerCreate(BaseModel):
+    servers: List[AdminServerCreate]
+
+class BulkAllocateRequest(BaseModel):
+    allocations: List[AllocateServerRequest]
+
+def bulk_row_error(row: int, error: str) -> dict:
+    return {"row": row, "status": "error", "error": error}
+
+def bulk_report(results: List[dict]) -> dict:
+    results.sort(key=lambda result: result["row"])
+    created = sum(1 for result in results if result["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+async def parse_bulk_csv(file: UploadFile, model):
+    """Rows of an uploaded CSV as ``model`` instances; returns (rows, errors) keyed by data row number"""
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV file must be UTF-8 encoded")
+    rows, errors = [], []
+    for number, record in enumerate(csv.DictReader(StringIO(text)), start=1):
+        if number > MAX_BULK_ROWS:
+            # Refuse oversized uploads before validating the rest of them
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ROWS} rows per request")
+        # Empty cells fall back to the field defaults
+        values = {key.strip(): value.strip() for key, value in record.items() if key and value and value.strip()}
+        try:
+            rows.append((number, model.model_validate(values)))
+        except ValidationError as e:
+            message = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+            errors.append(bulk_row_error(number, message))
+    return rows, errors
+
+async def insert_bulk_servers(server_docs: List[dict], results: List[dict]) -> set:
+    """Insert servers created by a bulk request and return the ids written.
+
+    Rows whose insert failed give their reserved address back and are reported as errors.
+    """
+    server_ids = [server_doc["id"] for server_doc in server_docs]
+    try:
+        await db.servers.insert_many(server_docs, ordered=False)
+        return set(server_ids)
+    except Exception:
+        logging.exception(f"Bulk insert of {len(server_docs)} servers failed")
+    written = {doc["id"] async for doc in db.servers.find({"id": {"$in": server_ids}}, {"_id": 0, "id": 1})}
+    for server_doc in server_docs:
+        if server_doc["id"] not in written:
+            await ipam.release(server_doc["ip_address"], server_doc["id"])
+    for i, result in enumerate(results):
+        if result.get("server_id") in server_ids and result["server_id"] not in written:
+            results[i] = bulk_row_error(result["row"], "Server could not be saved, please retry")
+    return written
+
+async def provision_servers_bulk(rows: List[tuple], background_tasks: BackgroundTasks, admin: dict) -> List[dict]:
+    """Create servers for paid orders; ``rows`` are (row number, AdminServerCreate)"""
+    results = []
+    order_ids = list({data.order_id for _, data in rows})
+    orders = {order["id"]: order for order in await db.orders.find({"id": {"$in": order_ids}}, {"_id": 0}).to_list(len(order_ids))}
+    provisioned = {server["order_id"] for server in await db.servers.find(
+        {"order_id": {"$in": order_ids}}, {"_id": 0, "order_id": 1}
+    ).to_list(len(order_ids))}
+    
+    seen_orders, seen_ips = set(), set()
+    server_docs, emails = [], []
+    for row, data in rows:
+        order = orders.get(data.order_id)
+        if not order:
+            results.append(bulk_row_error(row, "Order not found"))
+            continue
+        if data.order_id in provisioned or data.order_id in seen_orders:
+            results.append(bulk_row_error(row, "Server already exists for this order"))
+            continue
+        if data.ip_address and data.ip_address in seen_ips:
+            results.append(bulk_row_error(row, f"Duplicate IP address {data.ip_address} in this batch"))
+            continue
+        
+        server_doc = server_doc_for_order(order, data.model_dump(), admin["email"])
+        try:
+            server_doc["ip_address"] = await reserve_ip(data.ip_address, data.subnet_id, "server", server_doc["id"])
+        except HTTPException as e:
+            results.append(bulk_row_error(row, e.detail))
+            continue
+        seen_orders.add(data.order_id)
+        seen_ips.add(data.ip_address)
+        server_docs.append((data, server_doc))
+        results.append({"row": row, "status": "created", "server_id": server_doc["id"], "order_id": data.order_id})
+    
+    if not server_docs:
+        return results
+    
+    written = await insert_bulk_servers([server_doc for _, server_doc in server_docs], results)
+    server_docs = [(data, server_doc) for data, server_doc in server_docs if server_doc["id"] in written]
+    if not server_docs:
+        return results
+    search_service.add_many("server", (server_doc for _, server_doc in server_docs))
+    for _, server_doc in server_docs:
+        await publish_server_status(server_doc, server_doc["status"])
+    await db.orders.update_many(
+        {"id": {"$in": [server_doc["order_id"] for _, server_doc in server_docs]}},
+        {"$set": {"order_status": "active", "updated_at": datetime.now(timezone.utc)}}
+    )
+    
+    user_ids = list({server_doc["user_id"] for data, server_doc in server_docs if data.send_email})
+    users = {user["id"]: user for user in await db.users.find({"id": {"$in": user_ids}}, {"_id": 0}).to_list(len(user_ids))}
+    for data, server_doc in server_docs:
+        user = users.get(server_doc["user_id"])
+        if user and data.send_email:
+            emails.append((user["email"], {"user": user, "server": server_doc, "heading": "Your Server Has Been Provisioned!"}))
+    if emails:
+        background_tasks.add_task(send_template_emails, "server_ready", emails)
+    return results
+
+async def allocate_servers_bulk(rows: List[tuple], background_tasks: BackgroundTasks, admin: dict) -> List[dict]:
+    """Allocate servers to users, charging wallets per user in one update; ``rows`` are (row number, AllocateServerRequest)"""
+    results = []
+    user_ids = list({data.user_id for _, data in rows})
+    users = {user["id"]: user for user in await db.users.find({"id": {"$in": user_ids}}, {"_id": 0}).to_list(len(user_ids))}
+    plan_ids = list({data.plan_id for _, data in rows if data.plan_id and data.plan_id != "custom"})
+    plans = {plan["id"]: plan for plan in await db.plans.find({"id": {"$in": plan_ids}}, {"_id": 0}).to_list(len(plan_ids))}
+    
+    # Validate rows and reserve wallet funds in input order
+    accepted = []
+    charges = {}
+    seen_ips = set()
+    for row, data in rows:
+        user = users.get(data.user_id)
+        if not user:
+            results.append(bulk_row_error(row, "User not found"))
+            continue
+        if data.from_inventory:
+            results.append(bulk_row_error(row, "Inventory allocation is not supported in bulk; allocate this server on its own"))
+            continue
+        if not data.hostname or not data.password:
+            results.append(bulk_row_error(row, "Hostname and password are required"))
+            continue
+        if data.ip_address and data.ip_address in seen_ips:
+            results.append(bulk_row_error(row, f"Duplicate IP address {data.ip_address} in this batch"))
+            continue
+        amount_charged = 0
+        if not data.payment_received:
+            if data.amount is None or data.amount <= 0:
+                results.append(bulk_row_error(row, "Please specify the amount to deduct from wallet"))
+                continue
+            available = user.get("wallet_balance", 0) - charges.get(user["id"], 0)
+            if available < data.amount:
+                results.append(bulk_row_error(row, f"Insufficient wallet balance. User has ${available:.2f}, required ${data.amount:.2f}"))
+                continue
+            amount_charged = data.amount
+        server_id = str(uuid.uuid4())
+        try:
+            ip_address = await reserve_ip(data.ip_address, data.subnet_id, "server", server_id)
+        except HTTPException as e:
+            results.append(bulk_row_error(row, e.detail))
+            continue
+        if amount_charged:
+            charges[user["id"]] = charges.get(user["id"], 0) + amount_charged
+        seen_ips.add(data.ip_address)
+        accepted.append((row, data, amount_charged, server_id, ip_address))
+    
+    if not accepted:
+        return results
+    
+    # Per row: (row, server, wallet transaction, invoice, email), the last three optional
+    created = {}
+    for row, data, amount_charged, server_id, ip_address in accepted:
+        now = datetime.now(timezone.utc)
+        plan = plans.get(data.plan_id)
+        plan_name = plan["name"] if plan else "Custom Server"
+        server_doc = {
+            "id": server_id,
+            "user_id": data.user_id,
+            "order_id": None,  # Manual allocation, no order
+            "plan_id": data.plan_id if data.plan_id != "custom" else None,
+            "plan_name": plan_name,
+            "hostname": data.hostname,
+            "ip_address": ip_address,
+            "username": data.username,
+            "password": data.password,
+            "ssh_port": data.port,
+            "panel_url": data.control_panel_url,
+            "panel_username": data.control_panel_username,
+            "panel_password": data.control_panel_password,
+            "additional_notes": data.additional_notes,
+            "status": "active",
+            "renewal_date": now + timedelta(days=30),
+            "created_at": now,
+            "allocated_by": admin["email"],
+            "payment_received_externally": data.payment_received,
+            "amount_charged": amount_charged
+        }
+        transaction = invoice = email = None
+        if amount_charged:
+            transaction = {
+                "id": str(uuid.uuid4()),
+                "user_id": data.user_id,
+                "type": "debit",
+                "amount": amount_charged,
+                "description": f"Server allocation: {data.hostname}",
+                "reference": f"ALLOC-{data.hostname}",
+                "created_at": now
+            }
         invoice_amount = amount_charged if amount_charged > 0 else (data.amount or 0)
         if invoice_amount > 0:
-            invoice_id = str(uuid.uuid4())
-            invoice_number = generate_invoice_number()
-            invoice_doc = {
-                "id": invoice_id,
+            invoice = {
+                "id": str(uuid.uuid4()),
                 "user_id": data.user_id,
-                "server_id": server_id,
+                "server_id": server_doc["id"],
                 "order_id": None,  # Manual allocation
-                "invoice_number": invoice_number,
+                "invoice_number": generate_invoice_number(),
                 "amount": invoice_amount,
                 "status": "paid",
-                "due_date": datetime.now(timezone.utc).isoformat(),
-                "paid_date": datetime.now(timezone.utc).isoformat(),
+                "due_date": now,
+                "paid_date": now,
                 "description": f"Server Allocation: {plan_name} - {data.hostname}",
                 "payment_method": "wallet" if not data.payment_received else "external",
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": now
             }
-            await db.invoices.insert_one(invoice_doc)
-    
-    # Send credentials email if requested
-    if data.send_email:
-        control_panel_section = ""
-        if data.control_panel_url:
-            control_panel_section = f"""
-            <div style="background: #f0f9ff; padding: 15px; border-radius: 8px; margin: 15px 0;">
-                <h3 style="margin-top: 0; color: #0369a1;">Control Panel Access</h3>
-                <p><strong>URL:</strong> <a href="{data.control_panel_url}">{data.control_panel_url}</a></p>
-                <p><strong>Username:</strong> {data.control_panel_username or 'N/A'}</p>
-                <p><strong>Password:</strong> {data.control_panel_password or 'N/A'}</p>
-            </div>
-            """
-        
-        notes_section = ""
-        if data.additional_notes:
-            notes_section = f"""
-            <div style="background: #fef3c7; padding: 15px; border-radius: 8px; margin: 15px 0;">
-                <h3 style="margin-top: 0; color: #92400e;">Additional Information</h3>
-                <p>{data.additional_notes}</p>
-            </div>
-            """
-        
-        background_tasks.add_task(
-            send_email,
-            user["email"],
-            f"Your Server is Ready! - {data.hostname}",
-            f"""
-            <h2>🎉 Your Server Has Been Allocated!</h2>
-            <p>Hi {user['full_name']},</p>
-            <p>Great news! Your server has been set up and is ready to use.</p>
-            
-            <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                <h3 style="margin-top: 0; color: #1e40af;">SSH / Server Access</h3>
-                <table style="width: 100%; border-collapse: collapse;">
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>Hostname:</strong></td><td>{data.hostname}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>IP Address:</strong></td><td>{data.ip_address}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>Username:</strong></td><td>{data.username}</td></tr>
-                    <tr><td style="padding: 8px 0; border-bottom: 1px solid #ddd;"><strong>Password:</strong></td><td>{data.password}</td></tr>
-                    <tr><td style="padding: 8px 0;"><strong>SSH Port:</strong></td><td>{data.port}</td></tr>
-                </table>
-            </div>
-            
-            <div style="background: #1e293b; color: #e2e8f0; padding: 15px; border-radius: 8px; font-family: monospace; margin: 15px 0;">
-                <strong>Quick Connect Command:</strong><br>
-                ssh {data.username}@{data.ip_address} -p {data.port}
-            </div>
-            
-            {control_panel_section}
-            {notes_section}
-            
-            <p><strong>🔐 Security Tips:</strong></p>
-            <ul>
-                <li>Change your password after first login</li>
-                <li>Keep your credentials secure</li>
-                <li>Enable firewall rules</li>
-            </ul>
-            
-            <p>You can view your server details anytime in your <a href="https://kloudnests.com/dashboard/services">dashboard</a>.</p>
-            
-            <p>If you have any questions, our support team is here to help!</p>
-            
-            <p>Best regards,<br><strong>KloudNests Team</strong></p>
-            """
-        )
+        if data.send_email:
+            email = (
+                users[data.user_id]["email"],
+                {"user": users[data.user_id], "server": server_doc, "heading": "Your Server Has Been Allocated!"}
+            )
+        created.setdefault(data.user_id, []).append((row, server_doc, transaction, invoice, email))
+    
+    # Each user's debit, servers, transactions and invoices are written together
+    allocated = []
+    for user_id, items in created.items():
+        written = await write_bulk_allocations(user_id, items, results)
+        allocated.extend(item for item in items if item[1]["id"] in written)
+    
+    server_docs = [server_doc for _, server_doc, _, _, _ in allocated]
+    invoices = [invoice for _, _, _, invoice, _ in allocated if invoice]
+    emails = [email for _, _, _, _, email in allocated if email]
+    search_service.add_many("server", server_docs)
+    for server_doc in server_docs:
+        await publish_server_status(server_doc, server_doc["status"])
+    if invoices:
+        search_service.add_many("invoice", invoices)
+    if emails:
+        background_tasks.add_task(send_template_emails, "server_ready", emails)
+    return results
+
+async def write_bulk_allocations(user_id: str, items: List[tuple], results: List[dict]) -> set:
+    """Write one user's bulk allocations in a unit of work and return the server ids written.
+
+    ``items`` are (row, server, transaction, invoice, email). Rows that were not written
+    give their reserved address back, are refunded and are reported as errors.
+    """
+    server_docs = [server_doc for _, server_doc, _, _, _ in items]
+    transactions = [transaction for _, _, transaction, _, _ in items if transaction]
+    invoices = [invoice for _, _, _, invoice, _ in items if invoice]
+    total = sum(transaction["amount"] for transaction in transactions)
+    debited = {}
+    
+    async def write_user(session):
+        if total:
+            await debit_wallet(db, user_id, total, session)
+            debited["amount"] = total
+        await db.servers.insert_many(server_docs, session=session)
+        if transactions:
+            await db.transactions.insert_many(transactions, session=session)
+        if invoices:
+            await db.invoices.insert_many(invoices, session=session)
     
-    return {"message": "Server allocated successfully", "server_id": server_id}
+    try:
+        await unit_of_work.run(write_user)
+        for row, server_doc, _, _, _ in items:
+            results.append({"row": row, "status": "created", "server_id": server_doc["id"], "user_id": user_id})
+        return {server_doc["id"] for server_doc in server_docs}
+    except InsufficientFunds:
+        # The balance dropped between validation and the debit
+        error = "Wallet balance changed during allocation, please retry"
+    except Exception:
+        logging.exception(f"Bulk allocation for user {user_id} failed")
+        error = "Server could not be saved, please retry"
+    
+    # A transaction rolled everything back; without one some servers may have been saved
+    server_ids = [server_doc["id"] for server_doc in server_docs]
+    written = {doc["id"] async for doc in db.servers.find({"id": {"$in": server_ids}}, {"_id": 0, "id": 1})}
+    refund = 0
+    for row, server_doc, transaction, _, _ in items:
+        if server_doc["id"] in written:
+            results.append({"row": row, "status": "created", "server_id": server_doc["id"], "user_id": user_id})
+            continue
+        results.append(bulk_row_error(row, error))
+        await ipam.release(server_doc["ip_address"], server_doc["id"])
+        if transaction:
+            refund += transaction["amount"]
+    if debited and refund and not unit_of_work.enabled:
+        await db.users.update_one({"id": user_id}, {"$inc": {"wallet_balance": refund}})
+    return written
+
+@admin_router.post("/servers/bulk")
+async def admin_create_servers_bulk(data: BulkServerCreate, background_tasks: BackgroundTasks, admin: dict = Depends(get_provisioning_admin)):
+    """Provision servers for many orders at once; returns a result per row"""
+    if len(data.servers) > MAX_BULK_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ROWS} rows per request")
+    rows = list(enumerate(data.servers, start=1))
+    return bulk_report(await provision_servers_bulk(rows, background_tasks, admin))
+
+@admin_router.post("/servers/bulk/csv")
+async def admin_create_servers_bulk_csv(background_tasks: BackgroundTasks, file: UploadFile = File(...), admin: dict = Depends(get_provisioning_admin)):
+    """Provision servers from a CSV with AdminServerCreate columns (order_id, ip_address, hostname, ...)"""
+    rows, errors = await parse_bulk_csv(file, AdminServerCreate)
+    return bulk_report(errors + await provision_servers_bulk(rows, background_tasks, admin))
+
+@admin_router.post("/servers/allocate/bulk")
+async def admin_allocate_servers_bulk(data: BulkAllocateRequest, background_tasks: BackgroundTasks, admin: dict = Depends(get_provisioning_admin)):
+    """Allocate many servers at once; returns a result per row"""
+    if len(data.allocations) > MAX_BULK_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ROWS} rows per request")
+    rows = list(enumerate(data.allocations, start=1))
+    return bulk_report(await allocate_servers_bulk(rows, background_tasks, admin))
+
+@admin_router.post("/servers/allocate/bulk/csv")
+async def admin_allocate_servers_bulk_csv(background_tasks: BackgroundTasks, file: UploadFile = File(...), admin: dict = Depends(get_provisioning_admin)):
+    """Allocate servers from a CSV with AllocateServerRequest columns (user_id, hostname, ip_address, password, ...)"""
+    rows, errors = await parse_bulk_csv(file, AllocateServerRequest)
+    return bulk_report(errors + await allocate_servers_bulk(rows, background_tasks, admin))
 
 @admin_router.post("/servers/{server_id}/send-credentials")
-async def admin_send_credentials(server_id: str, background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
+async def admin_send_credentials(server_id: str, background_tasks: BackgroundTasks, admin: dict = Depends(get_provisioning_admin)):
     """Resend server credentials email to user"""
     server = await db.servers.find_one({"id": server_id}, {"_id": 0})
     if not server:
@@ -2034,32 +3157,7 @@ async def admin_send_credentials(server_id: str, background_tasks: BackgroundTas
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    background_tasks.add_task(
-        send_email,
-        user["email"],
-        "Your Server Credentials - KloudNests",
-        f"""
-        <h2>Your Server Credentials</h2>
-        <p>Hi {user['full_name']},</p>
-        <p>Here are the credentials for your server as requested.</p>
-        <hr>
-        <p><strong>Server Details:</strong></p>
-        <ul>
-            <li><strong>Hostname:</strong> {server['hostname']}</li>
-            <li><strong>IP Address:</strong> {server['ip_address']}</li>
-            <li><strong>Username:</strong> {server['username']}</li>
-            <li><strong>Password:</strong> {server['password']}</li>
-            <li><strong>SSH Port:</strong> {server['ssh_port']}</li>
-            {f"<li><strong>Panel URL:</strong> {server['panel_url']}</li>" if server.get('panel_url') else ''}
-        </ul>
-        <hr>
-        <p><strong>SSH Command:</strong></p>
-        <code>ssh {server['username']}@{server['ip_address']} -p {server['ssh_port']}</code>
-        <hr>
-        <p>You can also view your server details anytime in your dashboard.</p>
-        <p><strong>Important:</strong> Keep these credentials secure and change your password regularly.</p>
-        """
-    )
+    background_tasks.add_task(send_template_email, user["email"], "server_credentials", user=user, server=server)
     
     return {"message": f"Credentials email sent to {user['email']}"}
 
@@ -2067,15 +3165,15 @@ async def admin_send_credentials(server_id: str, background_tasks: BackgroundTas
 async def admin_update_server(server_id: str, background_tasks: BackgroundTasks, ip_address: Optional[str] = None, hostname: Optional[str] = None, 
                                username: Optional[str] = None, password: Optional[str] = None,
                                status: Optional[str] = None, panel_url: Optional[str] = None,
-                               admin: dict = Depends(get_admin_user)):
+                               admin: dict = Depends(get_provisioning_admin)):
     server = await db.servers.find_one({"id": server_id}, {"_id": 0})
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
     
     updates = {}
     credentials_changed = False
-    if ip_address:
-        updates["ip_address"] = ip_address
+    if ip_address and ip_address != server.get("ip_address"):
+        updates["ip_address"] = await reserve_ip(ip_address, None, "server", server_id)
         credentials_changed = True
     if hostname:
         updates["hostname"] = hostname
@@ -2093,6 +3191,11 @@ async def admin_update_server(server_id: str, background_tasks: BackgroundTasks,
     
     if updates:
         await db.servers.update_one({"id": server_id}, {"$set": updates})
+        search_service.add("server", {**server, **updates})
+        await publish_server_status({**server, **updates}, updates.get("status", server["status"]))
+        if server.get("ip_address") and updates.get("ip_address", server["ip_address"]) != server["ip_address"]:
+            # The old address goes back to its subnet unless a machine still holds it
+            await ipam.release(server["ip_address"], server_id)
         
         # Send notification email if credentials were updated
         if credentials_changed:
@@ -2101,27 +3204,7 @@ async def admin_update_server(server_id: str, background_tasks: BackgroundTasks,
                 # Get updated server info
                 updated_server = await db.servers.find_one({"id": server_id}, {"_id": 0})
                 background_tasks.add_task(
-                    send_email,
-                    user["email"],
-                    "Server Credentials Updated - KloudNests",
-                    f"""
-                    <h2>Your Server Credentials Have Been Updated</h2>
-                    <p>Hi {user['full_name']},</p>
-                    <p>The credentials for your server have been updated by our team.</p>
-                    <hr>
-                    <p><strong>Updated Server Details:</strong></p>
-                    <ul>
-                        <li><strong>Hostname:</strong> {updated_server['hostname']}</li>
-                        <li><strong>IP Address:</strong> {updated_server['ip_address']}</li>
-                        <li><strong>Username:</strong> {updated_server['username']}</li>
-                        <li><strong>Password:</strong> {updated_server['password']}</li>
-                        <li><strong>SSH Port:</strong> {updated_server['ssh_port']}</li>
-                        {f"<li><strong>Panel URL:</strong> {updated_server['panel_url']}</li>" if updated_server.get('panel_url') else ''}
-                    </ul>
-                    <hr>
-                    <p>You can view your updated server details anytime in your dashboard.</p>
-                    <p><strong>Important:</strong> Please change your password after first login if this is a new credential.</p>
-                    """
+                    send_template_email, user["email"], "credentials_updated", user=user, server=updated_server
                 )
     
     return {"message": "Server updated"}
@@ -2178,27 +3261,186 @@ async def admin_get_user_details(user_id: str, admin: dict = Depends(get_admin_u
     }
 
 @admin_router.post("/users/{user_id}/notify")
-async def admin_notify_user(user_id: str, subject: str, message: str, background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
+async def admin_notify_user(user_id: str, subject: str, message: str, background_tasks: BackgroundTasks, admin: dict = Depends(get_support_admin)):
     """Send notification email to user"""
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     background_tasks.add_task(
-        send_email,
-        user["email"],
-        subject,
-        f"""
-        <h2>{subject}</h2>
-        <p>Hi {user['full_name']},</p>
-        <div>{message}</div>
-        <hr>
-        <p>Best regards,<br>KloudNests Team</p>
-        """
+        send_template_email, user["email"], "user_notification", user=user, subject=subject, message=message
     )
     
     return {"message": f"Notification sent to {user['email']}"}
 
+# ============ SERVER INVENTORY ============
+
+@admin_router.get("/inventory")
+async def admin_get_inventory(status: Optional[str] = None, plan_id: Optional[str] = None, data_center_id: Optional[str] = None,
+                              admin: dict = Depends(get_provisioning_admin)):
+    """Admin: List machines in the inventory pool"""
+    query = {}
+    if status:
+        query["status"] = status
+    if plan_id:
+        query["plan_id"] = plan_id
+    if data_center_id:
+        query["data_center_id"] = data_center_id
+    return await db.server_inventory.find(query, {"_id": 0}).sort("created_at", 1).to_list(1000)
+
+@admin_router.get("/inventory/availability")
+async def admin_get_inventory_availability(admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Available machines per plan and data center"""
+    return await inventory_availability(db.server_inventory)
+
+@admin_router.post("/inventory")
+async def admin_add_inventory(data: InventoryBatchCreate, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Add machines to the inventory pool; returns a result per row"""
+    if len(data.machines) > MAX_BULK_ROWS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ROWS} rows per request")
+    plan_ids = {plan["id"] for plan in await db.plans.find({}, {"_id": 0, "id": 1}).to_list(1000)}
+    datacenter_ids = {dc["id"] for dc in await db.datacenters.find({}, {"_id": 0, "id": 1}).to_list(1000)}
+    
+    results, machine_docs = [], []
+    for row, machine in enumerate(data.machines, start=1):
+        if machine.plan_id not in plan_ids:
+            results.append(bulk_row_error(row, "Plan not found"))
+        elif machine.data_center_id not in datacenter_ids:
+            results.append(bulk_row_error(row, "Data center not found"))
+        else:
+            machine_id = str(uuid.uuid4())
+            try:
+                ip_address = await reserve_ip(machine.ip_address, None, "machine", machine_id)
+            except HTTPException as e:
+                results.append(bulk_row_error(row, e.detail))
+                continue
+            machine_doc = {
+                "id": machine_id,
+                **machine.model_dump(),
+                "ip_address": ip_address,
+                "status": AVAILABLE,
+                "created_at": datetime.now(timezone.utc),
+                "added_by": admin["email"]
+            }
+            machine_docs.append(machine_doc)
+            results.append({"row": row, "status": "created", "machine_id": machine_doc["id"]})
+    if machine_docs:
+        await db.server_inventory.insert_many(machine_docs)
+    return bulk_report(results)
+
+@admin_router.put("/inventory/{machine_id}")
+async def admin_update_inventory(machine_id: str, data: InventoryMachineUpdate, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Edit an unallocated machine or move it in and out of maintenance"""
+    updates = {k: v for k, v in data.model_dump().items() if v is not None}
+    if not updates:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    updates["updated_at"] = datetime.now(timezone.utc)
+    result = await db.server_inventory.update_one({"id": machine_id, "status": {"$ne": ALLOCATED}}, {"$set": updates})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Machine not found or currently allocated")
+    return {"message": "Machine updated"}
+
+@admin_router.post("/inventory/{machine_id}/release")
+async def admin_release_inventory(machine_id: str, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Return an allocated machine to the pool once its server has been wiped"""
+    if not await release_machine(db.server_inventory, machine_id):
+        raise HTTPException(status_code=404, detail="Machine not found or not allocated")
+    return {"message": "Machine returned to the pool"}
+
+@admin_router.delete("/inventory/{machine_id}")
+async def admin_delete_inventory(machine_id: str, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Remove an unallocated machine from the inventory"""
+    machine = await db.server_inventory.find_one_and_delete({"id": machine_id, "status": {"$ne": ALLOCATED}}, projection={"_id": 0})
+    if not machine:
+        raise HTTPException(status_code=404, detail="Machine not found or currently allocated")
+    await ipam.release(machine["ip_address"], machine_id)
+    return {"message": "Machine removed"}
+
+# ============ IP ADDRESS MANAGEMENT ============
+
+@admin_router.get("/subnets")
+async def admin_get_subnets(data_center_id: Optional[str] = None, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: List subnets with their used and free address counts"""
+    subnets = [subnet for _, subnet in await ipam.networks()
+               if not data_center_id or subnet["data_center_id"] == data_center_id]
+    return [await ipam.usage(subnet, ranges=5) for subnet in subnets]
+
+@admin_router.post("/subnets")
+async def admin_create_subnet(data: SubnetCreate, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Add a subnet to a data center"""
+    datacenter = await db.datacenters.find_one({"id": data.data_center_id}, {"_id": 0, "id": 1})
+    if not datacenter:
+        raise HTTPException(status_code=404, detail="Data center not found")
+    try:
+        subnet = await ipam.add_subnet(str(uuid.uuid4()), data.data_center_id, data.cidr, data.gateway,
+                                       data.description, admin["email"])
+    except IPAMError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Subnet created", "id": subnet["id"], "cidr": subnet["cidr"]}
+
+@admin_router.get("/subnets/{subnet_id}")
+async def admin_get_subnet(subnet_id: str, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Subnet usage with its free address ranges"""
+    try:
+        subnet = await ipam.get_subnet(subnet_id)
+    except IPAMError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return await ipam.usage(subnet)
+
+@admin_router.get("/subnets/{subnet_id}/next-free")
+async def admin_get_next_free_ip(subnet_id: str, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: The address the next allocation from this subnet would get"""
+    try:
+        allocator = await ipam.allocator(await ipam.get_subnet(subnet_id))
+    except IPAMError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    offset = allocator.next_free()
+    return {"ip_address": allocator.address(offset) if offset is not None else None, "free": allocator.free_count}
+
+@admin_router.delete("/subnets/{subnet_id}")
+async def admin_delete_subnet(subnet_id: str, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Remove a subnet that has no assigned addresses"""
+    try:
+        await ipam.remove_subnet(subnet_id)
+    except IPAMError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Subnet deleted"}
+
+@admin_router.get("/ip-addresses/{ip_address}")
+async def admin_check_ip_address(ip_address: str, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Whether an address is free, and who holds it if not"""
+    try:
+        owner = await ipam.owner(ip_address)
+    except IPAMError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ip_address": ip_address, "available": owner is None, "assignment": owner}
+
+# ============ PROVISIONING JOBS ============
+
+@admin_router.get("/provisioning/jobs")
+async def admin_get_provisioning_jobs(status: Optional[str] = None, server_id: Optional[str] = None,
+                                      admin: dict = Depends(get_provisioning_admin)):
+    """Admin: List server control action jobs, newest first"""
+    query = {}
+    if status:
+        query["status"] = status
+    if server_id:
+        query["server_id"] = server_id
+    return await db.provisioning_jobs.find(query, {"_id": 0}).sort("created_at", -1).to_list(200)
+
+@admin_router.post("/provisioning/jobs/{job_id}/retry")
+async def admin_retry_provisioning_job(job_id: str, admin: dict = Depends(get_provisioning_admin)):
+    """Admin: Queue a failed job again"""
+    if not provisioning_queue:
+        raise HTTPException(status_code=400, detail="No provisioning driver is configured")
+    try:
+        job = await provisioning_queue.retry(job_id)
+    except ActionInProgress:
+        raise HTTPException(status_code=409, detail="Another action is already in progress for this server")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or not failed")
+    return {"message": "Job queued", "job_id": job_id}
+
 # ============ DATA CENTERS ROUTES ============
 
 @datacenters_router.get("/", response_model=List[DataCenterResponse])
@@ -2208,13 +3450,13 @@ async def get_datacenters():
     return datacenters
 
 @admin_router.get("/datacenters")
-async def admin_get_datacenters(admin: dict = Depends(get_admin_user)):
+async def admin_get_datacenters(admin: dict = Depends(get_provisioning_admin)):
     """Admin: Get all data centers including inactive"""
     datacenters = await db.datacenters.find({}, {"_id": 0}).to_list(100)
     return datacenters
 
 @admin_router.post("/datacenters")
-async def admin_create_datacenter(data: DataCenterCreate, admin: dict = Depends(get_admin_user)):
+async def admin_create_datacenter(data: DataCenterCreate, admin: dict = Depends(get_provisioning_admin)):
     """Admin: Create a new data center"""
     datacenter_id = str(uuid.uuid4())
     datacenter_doc = {
@@ -2224,15 +3466,16 @@ async def admin_create_datacenter(data: DataCenterCreate, admin: dict = Depends(
         "country": data.country,
         "description": data.description,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.datacenters.insert_one(datacenter_doc)
+    pricing_catalog.invalidate()
     return {"message": "Data center created", "id": datacenter_id}
 
 @admin_router.put("/datacenters/{datacenter_id}")
 async def admin_update_datacenter(datacenter_id: str, name: Optional[str] = None, location: Optional[str] = None,
                                   country: Optional[str] = None, description: Optional[str] = None,
-                                  is_active: Optional[bool] = None, admin: dict = Depends(get_admin_user)):
+                                  is_active: Optional[bool] = None, admin: dict = Depends(get_provisioning_admin)):
     """Admin: Update a data center"""
     datacenter = await db.datacenters.find_one({"id": datacenter_id}, {"_id": 0})
     if not datacenter:
@@ -2252,13 +3495,15 @@ async def admin_update_datacenter(datacenter_id: str, name: Optional[str] = None
     
     if updates:
         await db.datacenters.update_one({"id": datacenter_id}, {"$set": updates})
+        pricing_catalog.invalidate()
     
     return {"message": "Data center updated"}
 
 @admin_router.delete("/datacenters/{datacenter_id}")
-async def admin_delete_datacenter(datacenter_id: str, admin: dict = Depends(get_admin_user)):
+async def admin_delete_datacenter(datacenter_id: str, admin: dict = Depends(get_provisioning_admin)):
     """Admin: Delete a data center (soft delete)"""
     result = await db.datacenters.update_one({"id": datacenter_id}, {"$set": {"is_active": False}})
+    pricing_catalog.invalidate()
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Data center not found")
     return {"message": "Data center deleted"}
@@ -2272,13 +3517,13 @@ async def get_addons():
     return addons
 
 @admin_router.get("/addons")
-async def admin_get_addons(admin: dict = Depends(get_admin_user)):
+async def admin_get_addons(admin: dict = Depends(get_billing_admin)):
     """Admin: Get all add-ons including inactive"""
     addons = await db.addons.find({}, {"_id": 0}).to_list(100)
     return addons
 
 @admin_router.post("/addons")
-async def admin_create_addon(data: AddOnCreate, admin: dict = Depends(get_admin_user)):
+async def admin_create_addon(data: AddOnCreate, admin: dict = Depends(get_billing_admin)):
     """Admin: Create a new add-on"""
     addon_id = str(uuid.uuid4())
     addon_doc = {
@@ -2289,15 +3534,16 @@ async def admin_create_addon(data: AddOnCreate, admin: dict = Depends(get_admin_
         "billing_cycle": data.billing_cycle,
         "description": data.description,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.addons.insert_one(addon_doc)
+    pricing_catalog.invalidate()
     return {"message": "Add-on created", "id": addon_id}
 
 @admin_router.put("/addons/{addon_id}")
 async def admin_update_addon(addon_id: str, name: Optional[str] = None, price: Optional[float] = None,
                              description: Optional[str] = None, is_active: Optional[bool] = None,
-                             admin: dict = Depends(get_admin_user)):
+                             admin: dict = Depends(get_billing_admin)):
     """Admin: Update an add-on"""
     addon = await db.addons.find_one({"id": addon_id}, {"_id": 0})
     if not addon:
@@ -2315,13 +3561,15 @@ async def admin_update_addon(addon_id: str, name: Optional[str] = None, price: O
     
     if updates:
         await db.addons.update_one({"id": addon_id}, {"$set": updates})
+        pricing_catalog.invalidate()
     
     return {"message": "Add-on updated"}
 
 @admin_router.delete("/addons/{addon_id}")
-async def admin_delete_addon(addon_id: str, admin: dict = Depends(get_admin_user)):
+async def admin_delete_addon(addon_id: str, admin: dict = Depends(get_billing_admin)):
     """Admin: Delete an add-on (soft delete)"""
     result = await db.addons.update_one({"id": addon_id}, {"$set": {"is_active": False}})
+    pricing_catalog.invalidate()
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Add-on not found")
     return {"message": "Add-on deleted"}
@@ -2329,19 +3577,25 @@ async def admin_delete_addon(addon_id: str, admin: dict = Depends(get_admin_user
 # ============ ADMIN AUTOMATION ROUTES ============
 
 @admin_router.post("/run-renewal-check")
-async def admin_run_renewal_check(background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
+async def admin_run_renewal_check(background_tasks: BackgroundTasks, admin: dict = Depends(get_billing_admin)):
     """Admin: Manually trigger renewal invoice generation"""
     background_tasks.add_task(check_and_create_renewal_invoices)
     return {"message": "Renewal check started in background"}
 
 @admin_router.post("/run-suspend-check")
-async def admin_run_suspend_check(background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
+async def admin_run_suspend_check(background_tasks: BackgroundTasks, admin: dict = Depends(get_billing_admin)):
     """Admin: Manually trigger overdue service suspension"""
     background_tasks.add_task(check_and_suspend_overdue_services)
     return {"message": "Suspension check started in background"}
 
+@admin_router.post("/run-sla-check")
+async def admin_run_sla_check(background_tasks: BackgroundTasks, admin: dict = Depends(get_support_admin)):
+    """Admin: Manually trigger escalation of tickets past their SLA deadline"""
+    background_tasks.add_task(check_ticket_sla_breaches)
+    return {"message": "SLA check started in background"}
+
 @admin_router.post("/servers/{server_id}/unsuspend")
-async def admin_unsuspend_server(server_id: str, background_tasks: BackgroundTasks, admin: dict = Depends(get_admin_user)):
+async def admin_unsuspend_server(server_id: str, background_tasks: BackgroundTasks, admin: dict = Depends(get_provisioning_admin)):
     """Admin: Unsuspend a server (after payment received)"""
     server = await db.servers.find_one({"id": server_id}, {"_id": 0})
     if not server:
@@ -2354,39 +3608,32 @@ async def admin_unsuspend_server(server_id: str, background_tasks: BackgroundTas
     order = await db.orders.find_one({"id": server["order_id"]}, {"_id": 0})
     cycle_days = {"monthly": 30, "quarterly": 90, "yearly": 365}
     days = cycle_days.get(order["billing_cycle"], 30)
-    new_renewal_date = (datetime.now(timezone.utc) + timedelta(days=days)).isoformat()
+    new_renewal_date = datetime.now(timezone.utc) + timedelta(days=days)
     
     await db.servers.update_one(
         {"id": server_id},
         {"$set": {"status": "active", "renewal_date": new_renewal_date}, "$unset": {"suspended_at": ""}}
     )
+    await publish_server_status(server, "active")
     
     # Notify user
     user = await db.users.find_one({"id": server["user_id"]}, {"_id": 0})
     if user:
         background_tasks.add_task(
-            send_email,
-            user["email"],
-            f"Service Restored - {server['hostname']}",
-            f"""
-            <h2>Service Restored!</h2>
-            <p>Hi {user.get('full_name', 'Customer')},</p>
-            <p>Great news! Your server <strong>{server['hostname']}</strong> has been restored.</p>
-            <p><strong>New Renewal Date:</strong> {new_renewal_date[:10]}</p>
-            <p>Thank you for your payment. Your service is now active again.</p>
-            """
+            send_template_email, user["email"], "service_restored",
+            user=user, server=server, renewal_date=new_renewal_date
         )
     
     return {"message": f"Server {server['hostname']} has been unsuspended"}
 
 @admin_router.put("/users/{user_id}")
 async def admin_update_user(user_id: str, is_verified: Optional[bool] = None, wallet_balance: Optional[float] = None,
-                            admin: dict = Depends(get_admin_user)):
+                            admin: dict = Depends(get_billing_admin)):
     user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    updates = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    updates = {"updated_at": datetime.now(timezone.utc)}
     if is_verified is not None:
         updates["is_verified"] = is_verified
     if wallet_balance is not None:
@@ -2400,12 +3647,43 @@ async def admin_update_user(user_id: str, is_verified: Optional[bool] = None, wa
             "amount": abs(wallet_balance - old_balance),
             "description": "Admin adjustment",
             "reference": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         })
     
     await db.users.update_one({"id": user_id}, {"$set": updates})
     return {"message": "User updated"}
 
+class AdminPermissionsUpdate(BaseModel):
+    role: Optional[Literal["user", "admin"]] = None
+    permissions: Optional[List[Literal["billing", "support", "provisioning"]]] = None
+
+@admin_router.put("/users/{user_id}/permissions")
+async def admin_update_user_permissions(user_id: str, data: AdminPermissionsUpdate, admin: dict = Depends(get_admin_user)):
+    """Super admin: Change a user's role and admin permissions"""
+    if admin["role"] != "super_admin":
+        raise HTTPException(status_code=403, detail="Super admin access required")
+    
+    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if user["role"] == "super_admin":
+        raise HTTPException(status_code=400, detail="Cannot change permissions of a super admin")
+    
+    updates = {"updated_at": datetime.now(timezone.utc)}
+    if data.role is not None:
+        updates["role"] = data.role
+    if data.permissions is not None:
+        updates["permissions"] = data.permissions
+    
+    # Role and permissions live in the token, so existing tokens must be re-issued
+    await db.users.update_one({"id": user_id}, {"$set": updates, "$inc": {"token_version": 1}})
+    token_version_cache.pop(user_id)
+    if data.role == "user":
+        search_service.add("user", user)
+    elif data.role is not None:
+        search_service.remove("user", user_id)
+    return {"message": "Permissions updated"}
+
 @admin_router.post("/test-email")
 async def admin_test_email(admin: dict = Depends(get_admin_user)):
     """Send a test email to verify SendGrid configuration"""
@@ -2420,49 +3698,82 @@ async def admin_test_email(admin: dict = Depends(get_admin_user)):
     if not sender_email:
         raise HTTPException(status_code=400, detail="Sender email not configured. Please add a verified sender email in Settings → Email.")
     
-    result = await send_email(
-        admin["email"],
-        "Test Email - KloudNests",
-        f"""
-        <h2>Test Email</h2>
-        <p>Hi {admin.get('full_name', 'Admin')},</p>
-        <p>This is a test email to verify your SendGrid configuration is working correctly.</p>
-        <p>If you received this email, your email settings are properly configured!</p>
-        <hr>
-        <p><strong>Configuration Details:</strong></p>
-        <ul>
-            <li>Sender: {sender_email}</li>
-            <li>Recipient: {admin['email']}</li>
-        </ul>
-        <hr>
-        <p>Best regards,<br>KloudNests System</p>
-        """
-    )
+    result = await send_template_email(admin["email"], "test_email", admin=admin, sender_email=sender_email)
     
     if result:
         return {"message": f"Test email sent to {admin['email']}! Check your inbox."}
     else:
         raise HTTPException(status_code=500, detail="Failed to send email. Please verify: 1) Your SendGrid API key is valid (starts with 'SG.'), 2) Your sender email is verified in SendGrid.")
 
+@admin_router.get("/auth-tokens/stats")
+async def admin_auth_token_stats(admin: dict = Depends(get_admin_user)):
+    """Live single-use tokens per purpose, and expired ones still waiting for the TTL purge"""
+    now = datetime.now(timezone.utc)
+    pipeline = [
+        {"$group": {
+            "_id": "$purpose",
+            "total": {"$sum": 1},
+            "awaiting_purge": {"$sum": {"$cond": [{"$lte": ["$expires_at", now]}, 1, 0]}}
+        }}
+    ]
+    by_purpose = await db.auth_tokens.aggregate(pipeline).to_list(10)
+    return {
+        "purposes": {
+            row["_id"]: {"active": row["total"] - row["awaiting_purge"], "awaiting_purge": row["awaiting_purge"]}
+            for row in by_purpose
+        },
+        # Counted by this worker since startup
+        "counters": auth_token_counters
+    }
+
 @admin_router.get("/tickets")
-async def admin_get_tickets(status: Optional[str] = None, admin: dict = Depends(get_admin_user)):
+async def admin_get_tickets(status: Optional[str] = None, admin: dict = Depends(get_support_admin)):
     query = {}
     if status:
         query["status"] = status
     tickets = await db.tickets.find(query, {"_id": 0}).sort("created_at", -1).to_list(500)
     return tickets
 
+@admin_router.get("/tickets/queue")
+async def admin_ticket_queue(limit: int = Query(50, ge=1, le=500), admin: dict = Depends(get_support_admin)):
+    """Open tickets in SLA deadline order, most pressing first"""
+    tickets = await db.tickets.find(
+        {"sla_due_at": {"$exists": True}}, {"_id": 0}
+    ).sort("sla_due_at", 1).limit(limit).to_list(limit)
+    now = datetime.now(timezone.utc)
+    for ticket in tickets:
+        ticket["sla_breached"] = ticket["sla_due_at"] <= now
+    return tickets
+
 @admin_router.get("/tickets/{ticket_id}")
-async def admin_get_ticket(ticket_id: str, admin: dict = Depends(get_admin_user)):
+async def admin_get_ticket(ticket_id: str, admin: dict = Depends(get_support_admin)):
     ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    messages = await db.ticket_messages.find({"ticket_id": ticket_id}, {"_id": 0}).sort("created_at", 1).to_list(100)
+    page = await fetch_ticket_messages(ticket_id)
+    await mark_ticket_read(ticket, is_staff=True)
     user = await db.users.find_one({"id": ticket["user_id"]}, {"_id": 0, "password_hash": 0})
-    return {"ticket": ticket, "messages": messages, "user": user}
+    return {"ticket": ticket, **page, "user": user}
+
+@admin_router.get("/tickets/{ticket_id}/messages")
+async def admin_get_ticket_messages(
+    ticket_id: str,
+    since: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    since_id: Optional[str] = None,
+    before_id: Optional[str] = None,
+    limit: int = Query(TICKET_MESSAGE_PAGE_SIZE, ge=1, le=TICKET_MESSAGE_PAGE_SIZE),
+    admin: dict = Depends(get_support_admin)
+):
+    ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0, "id": 1, "staff_unread": 1})
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    page = await fetch_ticket_messages(ticket_id, since, before, limit, since_id, before_id)
+    await mark_ticket_read(ticket, is_staff=True)
+    return page
 
 @admin_router.post("/tickets/{ticket_id}/messages")
-async def admin_add_ticket_message(ticket_id: str, message_data: TicketMessageCreate, admin: dict = Depends(get_admin_user)):
+async def admin_add_ticket_message(ticket_id: str, message_data: TicketMessageCreate, admin: dict = Depends(get_support_admin)):
     ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
@@ -2473,27 +3784,30 @@ async def admin_add_ticket_message(ticket_id: str, message_data: TicketMessageCr
         "user_id": admin["id"],
         "message": message_data.message,
         "is_staff": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
-    await db.ticket_messages.insert_one(message_doc)
-    
-    await db.tickets.update_one(
-        {"id": ticket_id},
-        {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+    await record_ticket_message(ticket, message_doc, admin.get("full_name") or admin["email"])
+    await event_bus.publish(
+        "ticket.message", {"ticket_id": ticket_id, "message_id": message_doc["id"], "is_staff": True},
+        user_id=ticket["user_id"], permission="support"
     )
     
     return {"message": "Message added successfully"}
 
 @admin_router.put("/tickets/{ticket_id}/status")
-async def admin_update_ticket_status(ticket_id: str, status: str, admin: dict = Depends(get_admin_user)):
-    await db.tickets.update_one(
-        {"id": ticket_id},
-        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+async def admin_update_ticket_status(ticket_id: str, status: str, admin: dict = Depends(get_support_admin)):
+    ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
+    if ticket:
+        now = datetime.now(timezone.utc)
+        update = to_update(sla_policy.status_fields(ticket, status, now))
+        update.setdefault("$set", {}).update({"status": status, "updated_at": now})
+        await db.tickets.update_one({"id": ticket_id}, update)
+        await event_bus.publish("ticket.status", {"ticket_id": ticket_id, "status": status},
+                                user_id=ticket["user_id"], permission="support")
     return {"message": "Ticket status updated"}
 
 @admin_router.get("/invoices")
-async def admin_get_invoices(status: Optional[str] = None, admin: dict = Depends(get_admin_user)):
+async def admin_get_invoices(status: Optional[str] = None, admin: dict = Depends(get_billing_admin)):
     query = {}
     if status:
         query["status"] = status
@@ -2501,22 +3815,24 @@ async def admin_get_invoices(status: Optional[str] = None, admin: dict = Depends
     return invoices
 
 @admin_router.put("/invoices/{invoice_id}")
-async def admin_update_invoice(invoice_id: str, status: str, admin: dict = Depends(get_admin_user)):
+async def admin_update_invoice(invoice_id: str, status: str, admin: dict = Depends(get_billing_admin)):
     invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
     updates = {"status": status}
     if status == "paid":
-        updates["paid_date"] = datetime.now(timezone.utc).isoformat()
+        updates["paid_date"] = datetime.now(timezone.utc)
     
     await db.invoices.update_one({"id": invoice_id}, {"$set": updates})
+    if status == "paid" and invoice["status"] != "paid":
+        await publish_invoice_paid(invoice)
     return {"message": "Invoice updated"}
 
 # ============ TOPUP REQUESTS MANAGEMENT ============
 
 @admin_router.get("/topup-requests")
-async def admin_get_topup_requests(status: Optional[str] = None, admin: dict = Depends(get_admin_user)):
+async def admin_get_topup_requests(status: Optional[str] = None, admin: dict = Depends(get_billing_admin)):
     """Get all topup requests"""
     query = {}
     if status:
@@ -2525,7 +3841,7 @@ async def admin_get_topup_requests(status: Optional[str] = None, admin: dict = D
     return requests
 
 @admin_router.get("/topup-requests/{request_id}")
-async def admin_get_topup_request(request_id: str, admin: dict = Depends(get_admin_user)):
+async def admin_get_topup_request(request_id: str, admin: dict = Depends(get_billing_admin)):
     """Get a specific topup request"""
     request = await db.topup_requests.find_one({"id": request_id}, {"_id": 0})
     if not request:
@@ -2537,7 +3853,7 @@ async def admin_update_topup_request(
     request_id: str, 
     status: str,
     admin_notes: Optional[str] = None,
-    admin: dict = Depends(get_admin_user)
+    admin: dict = Depends(get_billing_admin)
 ):
     """Approve or reject a topup request"""
     if status not in ["approved", "rejected"]:
@@ -2552,25 +3868,32 @@ async def admin_update_topup_request(
     
     updates = {
         "status": status,
-        "processed_at": datetime.now(timezone.utc).isoformat(),
+        "processed_at": datetime.now(timezone.utc),
         "processed_by": admin["email"]
     }
     if admin_notes:
         updates["admin_notes"] = admin_notes
     
-    await db.topup_requests.update_one({"id": request_id}, {"$set": updates})
-    
-    # If approved, add funds to user wallet
-    if status == "approved":
-        user = await db.users.find_one({"id": request["user_id"]}, {"_id": 0})
+    # The status change and, on approval, the wallet credit are written together;
+    # the pending-status guard stops two admins from crediting the same request twice
+    async def process_topup(session):
+        result = await db.topup_requests.update_one(
+            {"id": request_id, "status": "pending"},
+            {"$set": updates},
+            session=session
+        )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=400, detail="This request has already been processed")
+        if status != "approved":
+            return None
+        user = await db.users.find_one_and_update(
+            {"id": request["user_id"]},
+            {"$inc": {"wallet_balance": request["amount"]}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
         if user:
-            new_balance = user.get("wallet_balance", 0) + request["amount"]
-            await db.users.update_one(
-                {"id": request["user_id"]},
-                {"$set": {"wallet_balance": new_balance}}
-            )
-            
-            # Create transaction record
             await db.transactions.insert_one({
                 "id": str(uuid.uuid4()),
                 "user_id": request["user_id"],
@@ -2578,25 +3901,27 @@ async def admin_update_topup_request(
                 "amount": request["amount"],
                 "description": f"Wallet topup via {request['payment_method'].replace('_', ' ').title()}",
                 "reference": request.get("transaction_ref", ""),
-                "created_at": datetime.now(timezone.utc).isoformat()
-            })
+                "created_at": datetime.now(timezone.utc)
+            }, session=session)
+        return user
+    
+    credited_user = await unit_of_work.run(process_topup)
+    await event_bus.publish(
+        "topup.updated",
+        {"request_id": request_id, "status": status, "amount": request["amount"],
+         "wallet_balance": credited_user.get("wallet_balance") if credited_user else None},
+        user_id=request["user_id"], permission="billing"
+    )
+    
+    # If approved, notify the user of their new balance
+    if status == "approved":
+        user = credited_user
+        if user:
+            new_balance = user.get("wallet_balance", 0)
             
             # Send confirmation email to user
             try:
-                await send_email(
-                    user["email"],
-                    "Wallet Topup Approved - KloudNests",
-                    f"""
-                    <h2>Wallet Topup Approved!</h2>
-                    <p>Great news! Your wallet topup request has been approved.</p>
-                    <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                        <p><strong>Amount Added:</strong> ${request['amount']:.2f}</p>
-                        <p><strong>New Balance:</strong> ${new_balance:.2f}</p>
-                        <p><strong>Payment Method:</strong> {request['payment_method'].replace('_', ' ').title()}</p>
-                    </div>
-                    <p>Thank you for choosing KloudNests!</p>
-                    """
-                )
+                await send_template_email(user["email"], "topup_approved", request=request, wallet_balance=new_balance)
             except Exception as e:
                 logger.error(f"Failed to send topup confirmation email: {e}")
     else:
@@ -2604,20 +3929,7 @@ async def admin_update_topup_request(
         user = await db.users.find_one({"id": request["user_id"]}, {"_id": 0})
         if user:
             try:
-                await send_email(
-                    user["email"],
-                    "Wallet Topup Request Update - KloudNests",
-                    f"""
-                    <h2>Wallet Topup Request Update</h2>
-                    <p>Unfortunately, your wallet topup request could not be approved.</p>
-                    <div style="background: #f5f5f5; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                        <p><strong>Amount:</strong> ${request['amount']:.2f}</p>
-                        <p><strong>Payment Method:</strong> {request['payment_method'].replace('_', ' ').title()}</p>
-                        {f"<p><strong>Reason:</strong> {admin_notes}</p>" if admin_notes else ""}
-                    </div>
-                    <p>If you believe this is an error, please contact our support team.</p>
-                    """
-                )
+                await send_template_email(user["email"], "topup_rejected", request=request, admin_notes=admin_notes)
             except Exception as e:
                 logger.error(f"Failed to send topup rejection email: {e}")
     
@@ -2632,19 +3944,19 @@ async def get_payment_proof(filename: str):
     return FileResponse(file_path)
 
 @admin_router.get("/plans")
-async def admin_get_plans(admin: dict = Depends(get_admin_user)):
+async def admin_get_plans(admin: dict = Depends(get_billing_admin)):
     plans = await db.plans.find({}, {"_id": 0}).to_list(100)
     return plans
 
 @admin_router.get("/plans/{plan_id}")
-async def admin_get_plan(plan_id: str, admin: dict = Depends(get_admin_user)):
+async def admin_get_plan(plan_id: str, admin: dict = Depends(get_billing_admin)):
     plan = await db.plans.find_one({"id": plan_id}, {"_id": 0})
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
     return plan
 
 @admin_router.post("/plans")
-async def admin_create_plan(data: AdminPlanCreate, admin: dict = Depends(get_admin_user)):
+async def admin_create_plan(data: AdminPlanCreate, admin: dict = Depends(get_billing_admin)):
     plan_id = str(uuid.uuid4())
     plan_doc = {
         "id": plan_id,
@@ -2659,15 +3971,16 @@ async def admin_create_plan(data: AdminPlanCreate, admin: dict = Depends(get_adm
         "price_yearly": data.price_yearly,
         "features": data.features,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.plans.insert_one(plan_doc)
+    pricing_catalog.invalidate()
     # Fetch the plan without _id to return clean response
     created_plan = await db.plans.find_one({"id": plan_id}, {"_id": 0})
     return {"message": "Plan created", "plan_id": plan_id, "plan": created_plan}
 
 @admin_router.put("/plans/{plan_id}")
-async def admin_update_plan(plan_id: str, data: AdminPlanUpdate, admin: dict = Depends(get_admin_user)):
+async def admin_update_plan(plan_id: str, data: AdminPlanUpdate, admin: dict = Depends(get_billing_admin)):
     plan = await db.plans.find_one({"id": plan_id}, {"_id": 0})
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
@@ -2695,14 +4008,15 @@ async def admin_update_plan(plan_id: str, data: AdminPlanUpdate, admin: dict = D
         updates["is_active"] = data.is_active
     
     if updates:
-        updates["updated_at"] = datetime.now(timezone.utc).isoformat()
+        updates["updated_at"] = datetime.now(timezone.utc)
         await db.plans.update_one({"id": plan_id}, {"$set": updates})
+        pricing_catalog.invalidate()
     
     updated_plan = await db.plans.find_one({"id": plan_id}, {"_id": 0})
     return {"message": "Plan updated", "plan": updated_plan}
 
 @admin_router.delete("/plans/{plan_id}")
-async def admin_delete_plan(plan_id: str, admin: dict = Depends(get_admin_user)):
+async def admin_delete_plan(plan_id: str, admin: dict = Depends(get_billing_admin)):
     plan = await db.plans.find_one({"id": plan_id}, {"_id": 0})
     if not plan:
         raise HTTPException(status_code=404, detail="Plan not found")
@@ -2712,9 +4026,11 @@ async def admin_delete_plan(plan_id: str, admin: dict = Depends(get_admin_user))
     if orders_count > 0:
         # Don't delete, just deactivate
         await db.plans.update_one({"id": plan_id}, {"$set": {"is_active": False}})
+        pricing_catalog.invalidate()
         return {"message": "Plan deactivated (has existing orders)", "deactivated": True}
     
     await db.plans.delete_one({"id": plan_id})
+    pricing_catalog.invalidate()
     return {"message": "Plan deleted", "deleted": True}
 
 # ============ SITE SETTINGS ROUTES ============
@@ -2729,13 +4045,14 @@ async def admin_get_settings(admin: dict = Depends(get_admin_user)):
 @admin_router.put("/settings")
 async def admin_update_settings(data: SiteSettingsUpdate, admin: dict = Depends(get_admin_user)):
     updates = {k: v for k, v in data.model_dump().items() if v is not None}
-    updates["updated_at"] = datetime.now(timezone.utc).isoformat()
+    updates["updated_at"] = datetime.now(timezone.utc)
     
     await db.site_settings.update_one(
         {"_id": "site_settings"},
         {"$set": updates},
         upsert=True
     )
+    email_branding_cache.clear()
     return {"message": "Settings updated"}
 
 @api_router.get("/settings/public")
@@ -2776,22 +4093,11 @@ async def contact_form(data: ContactRequest, background_tasks: BackgroundTasks):
         "email": data.email,
         "subject": data.subject,
         "message": data.message,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     # Send confirmation email
-    background_tasks.add_task(
-        send_email,
-        data.email,
-        "We received your message - KloudNests",
-        f"""
-        <h2>Thank you for contacting us!</h2>
-        <p>Hi {data.name},</p>
-        <p>We have received your message and will get back to you soon.</p>
-        <p><strong>Subject:</strong> {data.subject}</p>
-        <p>Best regards,<br>KloudNests Team</p>
-        """
-    )
+    background_tasks.add_task(send_template_email, data.email, "contact_received", name=data.name, subject=data.subject)
     
     return {"message": "Message sent successfully"}
 
@@ -2803,6 +4109,96 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+# ============ HEALTH CHECKS ============
+
+health_monitor = HealthMonitor(interval=HEALTH_CHECK_INTERVAL)
+
+@health_monitor.check("mongo")
+async def check_mongo():
+    started = time.perf_counter()
+    await db.command("ping")
+    latency_ms = (time.perf_counter() - started) * 1000
+    return {
+        "status": threshold_status(latency_ms, HEALTH_MAX_MONGO_LATENCY_MS / 5, HEALTH_MAX_MONGO_LATENCY_MS),
+        "latency_ms": round(latency_ms, 1)
+    }
+
+@health_monitor.check("connection_pool")
+async def check_connection_pool():
+    max_size = client.options.pool_options.max_pool_size
+    saturation = mongo_pool.in_use / max_size if max_size else 0
+    status = HEALTH_DEGRADED if saturation >= 0.8 else HEALTH_OK
+    if mongo_pool.waiting > max_size:
+        # More requests queued for a connection than the pool holds
+        status = HEALTH_FAILING
+    return {"status": status, "in_use": mongo_pool.in_use, "waiting": mongo_pool.waiting,
+            "max_size": max_size, "saturation": round(saturation, 3)}
+
+@health_monitor.check("event_loop")
+async def check_event_loop():
+    lag = loop_lag_monitor.last
+    return {"status": threshold_status(lag, HEALTH_MAX_LOOP_LAG / 5, HEALTH_MAX_LOOP_LAG), "lag_ms": round(lag * 1000, 1)}
+
+@health_monitor.check("email_queue", critical=False)
+async def check_email_queue():
+    """A backlog is shared by every worker, so it is reported but never takes a worker out of rotation"""
+    now = datetime.now(timezone.utc)
+    due = {"status": "queued", "run_after": {"$lte": now}}
+    oldest = await db.email_queue.find_one(due, {"_id": 0, "run_after": 1}, sort=[("run_after", 1)])
+    oldest_age = (now - oldest["run_after"]).total_seconds() if oldest else 0
+    return {
+        "status": HEALTH_DEGRADED if oldest_age > HEALTH_EMAIL_BACKLOG_AGE else HEALTH_OK,
+        "due": await db.email_queue.count_documents(due, limit=10000),
+        "oldest_due_s": round(oldest_age, 1)
+    }
+
+@api_router.get("/health/live")
+async def liveness(response: Response):
+    """Liveness probe: fails only when this process should be restarted"""
+    alive, report = health_monitor.liveness()
+    if not alive:
+        response.status_code = 503
+    return report
+
+@api_router.get("/health/ready")
+async def readiness(response: Response):
+    """Readiness probe: the last background check round; 503 takes the worker out of the load balancer"""
+    ready, report = health_monitor.readiness()
+    if not ready:
+        response.status_code = 503
+    return report
+
+# ============ METRICS ============
+
+@metrics.collector
+async def collect_queue_depth():
+    for status in ("queued", "sending"):
+        queue_depth.set(await db.email_queue.count_documents({"status": status}), "email", status)
+    if provisioning_queue:
+        for status in ("queued", "running"):
+            queue_depth.set(await db.provisioning_jobs.count_documents({"status": status}), "provisioning", status)
+
+@metrics.collector
+def collect_cache_stats():
+    for name, cache in (("token_version", token_version_cache), ("qr_code", qr_code_cache), ("email_branding", email_branding_cache)):
+        cache_lookups.set_total(cache.hits, name, "hit")
+        cache_lookups.set_total(cache.misses, name, "miss")
+        lookups = cache.hits + cache.misses
+        cache_hit_ratio.set(cache.hits / lookups if lookups else 0, name)
+        cache_entries.set(len(cache), name)
+
+@metrics.collector
+def collect_trace_stats():
+    spans_exported.set_total(tracer.exported, "exported")
+    spans_exported.set_total(tracer.dropped, "dropped")
+
+@api_router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus scrape endpoint; counts are per worker process"""
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=await metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 # Include routers
 api_router.include_router(auth_router)
 api_router.include_router(plans_router)
@@ -2814,9 +4210,13 @@ api_router.include_router(user_router)
 api_router.include_router(admin_router)
 api_router.include_router(datacenters_router)
 api_router.include_router(addons_router)
+api_router.include_router(events_router)
 
 app.include_router(api_router)
 
+# Throttle login/registration/2FA per client IP before any handler work
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, trusted_proxies=TRUSTED_PROXIES)
+
 # Add HTTPS redirect middleware first
 app.add_middleware(HTTPSRedirectMiddleware)
 
@@ -2828,6 +4228,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Root span per sampled request; streams, probes and the scrape are never traced
+app.add_middleware(TracingMiddleware, tracer=tracer,
+                   exclude=("/api/events/stream", "/api/metrics", "/api/health/live", "/api/health/ready"))
+
+# Outermost, so latency includes the other middleware; event streams stay open and the scrape would count itself
+app.add_middleware(MetricsMiddleware, requests=http_requests, latency=http_latency,
+                   exclude=("/api/events/stream", "/api/metrics"))
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -2835,6 +4243,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    logger.info(f"Compiled {email_renderer.load()} email templates")
+    await unit_of_work.detect()
+    await totp_verifier.ensure_indexes()
+    await db.auth_tokens.create_index("token_hash", unique=True)
+    await db.auth_tokens.create_index("expires_at", expireAfterSeconds=0)
+    await db.auth_tokens.create_index([("user_id", 1), ("purpose", 1)])
+    await db.users.create_index("verification_token", sparse=True)
+    await idempotency_store.ensure_indexes()
+    await ensure_inventory_indexes(db.server_inventory)
+    await ipam.ensure_indexes()
+    await event_bus.start()
+    search_service.start()
+    loop_lag_monitor.start()
+    health_monitor.start()
+    tracer.start()
+    await slow_query_log.ensure_indexes()
+    slow_query_log.start()
+    await email_log.ensure_indexes()
+    logger.info(f"Loaded {await email_log.load()} suppressed email addresses")
+    email_log.start()
+    await email_queue.ensure_indexes()
+    await broadcaster.ensure_indexes()
+    if EMAIL_QUEUE_WORKER:
+        email_queue.start()
+        health_monitor.watch("email_queue", lambda: email_queue.heartbeat, HEALTH_WORKER_STALE_AFTER)
+    await broadcaster.resume()
+    if provisioning_queue:
+        await provisioning_queue.ensure_indexes()
+        if PROVISIONING_WORKER:
+            provisioning_queue.start()
+            health_monitor.watch("provisioning_queue", lambda: provisioning_queue.heartbeat, HEALTH_WORKER_STALE_AFTER)
+    if not await db.ip_assignments.estimated_document_count():
+        # First start with IPAM: register the addresses already handed out
+        await ipam.backfill(db.server_inventory, "machine")
+        await ipam.backfill(db.servers, "server")
+    # Range scans of the renewal and overdue billing jobs
+    await db.servers.create_index([("status", 1), ("renewal_date", 1)])
+    await db.invoices.create_index([("status", 1), ("due_date", 1)])
+    # Message pages are read in (created_at, id) order
+    await db.ticket_messages.create_index([("ticket_id", 1), ("created_at", 1), ("id", 1)])
+    # Support work queue and SLA escalation scans; closed tickets have no sla_due_at
+    await db.tickets.create_index("sla_due_at", sparse=True)
+    await backfill_ticket_sla()
+    await backfill_ticket_summaries()
+    await backfill_server_plan_ids()
+    if isinstance(rate_limiter.backend, MongoBackend):
+        await rate_limiter.backend.ensure_indexes()
+    if not await is_migration_complete(db):
+        logger.warning("Timestamps may still be stored as ISO strings; run backend/migrate_datetimes.py")
+
 # Seed initial data
 @app.on_event("startup")
 async def seed_data():
@@ -2856,7 +4316,7 @@ async def seed_data():
                 "price_yearly": 59.99,
                 "features": ["99.9% Uptime", "DDoS Protection", "24/7 Support", "Root Access"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -2871,7 +4331,7 @@ async def seed_data():
                 "price_yearly": 199.99,
                 "features": ["99.9% Uptime", "DDoS Protection", "24/7 Support", "Root Access", "Weekly Backups"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -2886,7 +4346,7 @@ async def seed_data():
                 "price_yearly": 399.99,
                 "features": ["99.99% Uptime", "Advanced DDoS", "Priority Support", "Root Access", "Daily Backups", "Free SSL"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
         ]
         
@@ -2905,7 +4365,7 @@ async def seed_data():
                 "price_yearly": 29.99,
                 "features": ["1 Website", "Free SSL", "cPanel Access", "Email Accounts"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -2920,7 +4380,7 @@ async def seed_data():
                 "price_yearly": 79.99,
                 "features": ["10 Websites", "Free SSL", "cPanel Access", "Unlimited Email", "Free Domain"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
         ]
         
@@ -2939,7 +4399,7 @@ async def seed_data():
                 "price_yearly": 999.99,
                 "features": ["Full Root Access", "DDoS Protection", "IPMI Access", "24/7 Support", "Free Setup"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -2954,7 +4414,7 @@ async def seed_data():
                 "price_yearly": 1999.99,
                 "features": ["Full Root Access", "Advanced DDoS", "IPMI Access", "Priority Support", "Free Setup", "Hardware RAID"],
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
         ]
         
@@ -2975,8 +4435,8 @@ async def seed_data():
             "is_verified": True,
             "is_2fa_enabled": False,
             "totp_secret": None,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.users.insert_one(admin_doc)
         logger.info("Created admin user: brijesh.kr.dube@gmail.com / Cloud@9874")
@@ -2992,7 +4452,7 @@ async def seed_data():
                 "country": "United States",
                 "description": "Low latency to East Coast US and Europe",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3001,7 +4461,7 @@ async def seed_data():
                 "country": "United States",
                 "description": "Optimal for West Coast US and Asia-Pacific",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3010,7 +4470,7 @@ async def seed_data():
                 "country": "Germany",
                 "description": "Central European hub with excellent connectivity",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3019,7 +4479,7 @@ async def seed_data():
                 "country": "Singapore",
                 "description": "Asia-Pacific region with low latency",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
         ]
         await db.datacenters.insert_many(datacenters)
@@ -3037,7 +4497,7 @@ async def seed_data():
                 "billing_cycle": "monthly",
                 "description": "Full-featured web hosting control panel",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3047,7 +4507,7 @@ async def seed_data():
                 "billing_cycle": "monthly",
                 "description": "Web hosting platform for WordPress",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3057,7 +4517,7 @@ async def seed_data():
                 "billing_cycle": "yearly",
                 "description": "Domain validated SSL certificate",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3067,7 +4527,7 @@ async def seed_data():
                 "billing_cycle": "yearly",
                 "description": "Wildcard SSL for unlimited subdomains",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3077,7 +4537,7 @@ async def seed_data():
                 "billing_cycle": "monthly",
                 "description": "Automated daily backups with 7-day retention",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3087,7 +4547,7 @@ async def seed_data():
                 "billing_cycle": "monthly",
                 "description": "Additional dedicated IPv4 address",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             },
             {
                 "id": str(uuid.uuid4()),
@@ -3097,12 +4557,31 @@ async def seed_data():
                 "billing_cycle": "monthly",
                 "description": "24/7 priority support with 1-hour response time",
                 "is_active": True,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
         ]
         await db.addons.insert_many(addons)
         logger.info("Seeded initial add-ons")
 
+@app.on_event("startup")
+async def freeze_startup_objects():
+    # Modules, models, compiled templates and caches loaded so far live as long as the
+    # process; moving them out of the collector once keeps full collections from
+    # rescanning them. Later objects, the search index included, are collected as usual.
+    gc.collect()
+    gc.freeze()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if provisioning_queue:
+        await provisioning_queue.stop()
+    await broadcaster.stop()
+    await email_queue.stop()
+    await email_log.stop()
+    await event_bus.stop()
+    await search_service.stop()
+    await loop_lag_monitor.stop()
+    await health_monitor.stop()
+    await tracer.stop()
+    await slow_query_log.stop()
     client.close()
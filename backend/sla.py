@@ -0,0 +1,124 @@
+"""Support ticket SLAs.
+
+Each priority has a first-response target and a resolution target. A ticket's
+``sla_due_at`` is the next deadline the support team has to meet:
+
+- while a customer message waits for a staff reply, the earlier of the reply
+  deadline and the resolution deadline;
+- once staff have replied, the resolution deadline;
+- none once the ticket is resolved or closed (the field is removed).
+
+``sla_due_at`` has a sparse index, so the support work queue is an index scan
+in deadline order and the escalation job finds breached tickets with a range
+query. Priority is built into the deadlines, so urgent tickets sort first.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+PRIORITIES = ("low", "medium", "high", "urgent")
+CLOSED_STATUSES = ("resolved", "closed")
+
+
+@dataclass(frozen=True)
+class SLATarget:
+    first_response: timedelta
+    resolution: timedelta
+
+
+DEFAULT_TARGETS = {
+    "urgent": SLATarget(timedelta(hours=1), timedelta(hours=4)),
+    "high": SLATarget(timedelta(hours=4), timedelta(hours=24)),
+    "medium": SLATarget(timedelta(hours=8), timedelta(hours=72)),
+    "low": SLATarget(timedelta(hours=24), timedelta(hours=120)),
+}
+
+
+def parse_targets(spec: Optional[str]) -> Dict[str, SLATarget]:
+    """Targets in hours, first response then resolution, such as "urgent=0.5/2,low=48/240" """
+    targets = dict(DEFAULT_TARGETS)
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        priority, _, hours = item.partition("=")
+        first_response, _, resolution = hours.partition("/")
+        priority = priority.strip()
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown ticket priority in SLA targets: {priority}")
+        targets[priority] = SLATarget(timedelta(hours=float(first_response)), timedelta(hours=float(resolution)))
+    return targets
+
+
+def to_update(fields: dict) -> dict:
+    """Mongo update operators for SLA fields, where None removes the field"""
+    update = {}
+    for name, value in fields.items():
+        if value is None:
+            update.setdefault("$unset", {})[name] = ""
+        else:
+            update.setdefault("$set", {})[name] = value
+    return update
+
+
+class SLAPolicy:
+    """Computes a ticket's SLA fields as it is opened, answered and closed"""
+
+    def __init__(self, targets: Optional[Dict[str, SLATarget]] = None):
+        self.targets = targets or dict(DEFAULT_TARGETS)
+
+    def target(self, priority: str) -> SLATarget:
+        return self.targets.get(priority, self.targets["medium"])
+
+    def open_fields(self, priority: str, now: datetime) -> dict:
+        """Fields for a ticket opened with a customer message at ``now``"""
+        target = self.target(priority)
+        response_due = now + target.first_response
+        resolution_due = now + target.resolution
+        return {
+            "response_due_at": response_due,
+            "resolution_due_at": resolution_due,
+            "sla_due_at": min(response_due, resolution_due),
+            "sla_escalated": False
+        }
+
+    def message_fields(self, ticket: dict, is_staff: bool, now: datetime) -> dict:
+        """Changes to the SLA fields when a message is added; none while the ticket is closed"""
+        if ticket.get("status") in CLOSED_STATUSES or "resolution_due_at" not in ticket:
+            return {}
+        if is_staff:
+            fields = {"response_due_at": None, "sla_due_at": ticket["resolution_due_at"]}
+            if not ticket.get("first_response_at"):
+                fields["first_response_at"] = now
+        else:
+            # A customer following up on their own unanswered message keeps the original deadline
+            response_due = ticket.get("response_due_at") or now + self.target(ticket["priority"]).first_response
+            fields = {"response_due_at": response_due, "sla_due_at": min(response_due, ticket["resolution_due_at"])}
+        if fields["sla_due_at"] != ticket.get("sla_due_at"):
+            fields["sla_escalated"] = False
+        return fields
+
+    def status_fields(self, ticket: dict, status: str, now: datetime) -> dict:
+        """Changes to the SLA fields when staff set the ticket status"""
+        was_closed = ticket.get("status") in CLOSED_STATUSES
+        if status in CLOSED_STATUSES:
+            return {} if was_closed else {"sla_due_at": None, "response_due_at": None, "resolved_at": now}
+        if not was_closed:
+            return {}
+        # Reopened by staff: the resolution clock starts again
+        resolution_due = now + self.target(ticket["priority"]).resolution
+        return {"resolution_due_at": resolution_due, "sla_due_at": resolution_due, "resolved_at": None,
+                "sla_escalated": False}
+
+    def breaches(self, ticket: dict, now: datetime) -> List[str]:
+        """The deadlines a ticket has missed"""
+        missed = []
+        response_due = ticket.get("response_due_at")
+        if response_due and response_due <= now:
+            missed.append("response" if ticket.get("first_response_at") else "first_response")
+        if ticket.get("resolution_due_at") and ticket["resolution_due_at"] <= now:
+            missed.append("resolution")
+        return missed
+
+    @staticmethod
+    def escalated_priority(priority: str) -> str:
+        """One priority level up, staying at urgent"""
+        index = PRIORITIES.index(priority) if priority in PRIORITIES else 1
+        return PRIORITIES[min(index + 1, len(PRIORITIES) - 1)]
@@ -0,0 +1,303 @@
+"""Slow Mongo query log with explain plans.
+
+``SlowQueryLog`` is a pymongo command listener. Commands that filter
+documents (find, aggregate, count, distinct, findAndModify, update, delete)
+and run longer than ``threshold_ms`` are grouped by query shape: the command,
+collection, filter with every literal replaced by ``"?"``, and sort. Operators,
+field names and ``$field`` references are kept, so ``{"description":
+{"$regex": "?"}}`` is one shape however many servers it was run for, and no
+customer data is stored.
+
+Counts and timings are added up in memory (pymongo calls the listener from
+motor's worker threads, so under a lock) and merged into ``slow_queries``
+every ``flush_interval`` seconds, which sums them across workers. The first
+time a shape is stored, the worker that saw it runs ``explain`` in
+executionStats mode on the command it saw and stores a summary of the plan
+(stages, indexes used, keys and documents examined), so a collection scan
+shows up without profiling by hand. Literal values in the plan are not kept.
+Shapes not seen for ``retention_days`` expire.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne, monitoring
+
+logger = logging.getLogger(__name__)
+
+# Command name -> fields holding the filter and sort
+SHAPED_COMMANDS = {
+    "find": ("filter", "sort"),
+    "aggregate": ("pipeline", None),
+    "count": ("query", None),
+    "distinct": ("query", None),
+    "findAndModify": ("query", "sort"),
+    "update": ("updates", None),
+    "delete": ("deletes", None),
+}
+
+# Session and transport fields explain does not accept
+_EXPLAIN_DROP = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern",
+                 "$clusterTime", "$db", "$readPreference", "ordered", "bypassDocumentValidation"}
+
+SORT_FIELDS = ("total_ms", "max_ms", "count")
+
+
+def shape_of(value):
+    """``value`` with literals replaced by "?"; operators, field names and $field references kept"""
+    if isinstance(value, dict):
+        return {key: shape_of(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $and/$or clauses and pipeline stages keep their structure; lists of values ($in) collapse
+        if value and all(isinstance(item, dict) for item in value):
+            return [shape_of(item) for item in value]
+        return ["?"]
+    if isinstance(value, str) and value.startswith("$"):
+        return value
+    return "?"
+
+
+def command_shape(command_name: str, command: dict) -> dict:
+    filter_field, sort_field = SHAPED_COMMANDS[command_name]
+    target = command.get(filter_field)
+    if command_name in ("update", "delete"):
+        # One statement per command is how the app writes; shape the first
+        target = (target or [{}])[0].get("q")
+    shape = {"pipeline" if command_name == "aggregate" else "filter": shape_of(target or {})}
+    if sort_field and command.get(sort_field):
+        shape["sort"] = dict(command[sort_field])
+    return shape
+
+
+def _plan_stages(plan: dict, stages: List[str], indexes: List[str]):
+    if "queryPlan" in plan:
+        # Slot-based engine (6.0+) nests the classic plan under queryPlan
+        plan = plan["queryPlan"]
+    stage = plan.get("stage")
+    if stage:
+        stages.append(stage)
+    if plan.get("indexName"):
+        indexes.append(plan["indexName"])
+    for child in [plan.get("inputStage")] + list(plan.get("inputStages") or []):
+        if child:
+            _plan_stages(child, stages, indexes)
+
+
+def _find(document, key: str):
+    """First value under ``key`` anywhere in an explain document"""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        children = document.values()
+    elif isinstance(document, list):
+        children = document
+    else:
+        return None
+    for child in children:
+        found = _find(child, key)
+        if found is not None:
+            return found
+    return None
+
+
+def summarize_explain(explain: dict) -> dict:
+    """Winning plan stages and execution counts from explain output, without the parsed query"""
+    stages, indexes = [], []
+    winning = _find(explain, "winningPlan")
+    if winning:
+        _plan_stages(winning, stages, indexes)
+    stats = _find(explain, "executionStats") or {}
+    return {
+        "stages": stages,
+        "indexes": indexes,
+        "collection_scan": "COLLSCAN" in stages,
+        "returned": stats.get("nReturned"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    }
+
+
+def explain_command(command_name: str, command: dict) -> dict:
+    """The command as explain expects it: command name first, without session fields"""
+    cleaned = {command_name: command[command_name]}
+    cleaned.update((key, value) for key, value in command.items() if key != command_name and key not in _EXPLAIN_DROP)
+    return cleaned
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    """Groups slow commands by query shape and explains each new shape once"""
+
+    def __init__(self, collection_name: str = "slow_queries", threshold_ms: float = 100.0, explain: bool = True,
+                 retention_days: int = 30, flush_interval: float = 10.0, max_explains: int = 5, exclude: Iterable[str] = ()):
+        self.client = None
+        self.database: Optional[str] = None
+        self.collection_name = collection_name
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.retention = timedelta(days=retention_days)
+        self.flush_interval = flush_interval
+        # Explains run per flush, so a burst of new shapes cannot load the database
+        self.max_explains = max_explains
+        # Our own collection is never logged, so flushing cannot feed itself
+        self.exclude = frozenset(exclude) | {collection_name}
+        self._pending: Dict[tuple, tuple] = {}
+        # shape id -> totals since the last flush
+        self._slow: Dict[str, dict] = {}
+        # shape id -> (database, command name, command) awaiting explain
+        self._samples: Dict[str, tuple] = {}
+        self._explained: set = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def bind(self, client, database: str):
+        """Attach the client this listener was registered with; it is created after the listener"""
+        self.client = client
+        self.database = database
+
+    @property
+    def collection(self):
+        return self.client[self.database][self.collection_name]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index([("total_ms", -1)])
+
+    # pymongo listener callbacks, run on motor's worker threads
+
+    def started(self, event):
+        if event.command_name in SHAPED_COMMANDS:
+            self._pending[(event.connection_id, event.request_id)] = (
+                event.database_name, event.command_name, event.command
+            )
+
+    def succeeded(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is not None and event.duration_micros >= self.threshold_ms * 1000:
+            self._record(*pending, event.duration_micros / 1000)
+
+    def failed(self, event):
+        self._pending.pop((event.connection_id, event.request_id), None)
+
+    def _record(self, database: str, command_name: str, command: dict, duration_ms: float):
+        collection = command.get(command_name)
+        if not isinstance(collection, str) or collection in self.exclude:
+            return
+        try:
+            shape = command_shape(command_name, command)
+        except Exception:
+            logger.exception(f"Could not shape slow {command_name} on {collection}")
+            return
+        shape_text = json.dumps(shape, default=str, separators=(",", ":"))
+        shape_id = hashlib.sha1(f"{database}.{collection}:{command_name}:{shape_text}".encode()).hexdigest()[:16]
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._slow.get(shape_id)
+            if entry is None:
+                entry = self._slow[shape_id] = {
+                    "database": database, "collection": collection, "command": command_name, "shape": shape_text,
+                    "count": 0, "total_ms": 0.0, "max_ms": 0.0, "first_seen": now
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen"] = now
+            if self.explain and shape_id not in self._explained:
+                self._samples[shape_id] = (database, command_name, command)
+
+    # Flushing and explaining, on the event loop
+
+    async def flush(self) -> int:
+        with self._lock:
+            slow, self._slow = self._slow, {}
+        if not slow:
+            return 0
+        updates = [UpdateOne({"_id": shape_id}, {
+            "$inc": {"count": entry["count"], "total_ms": round(entry["total_ms"], 1)},
+            "$max": {"max_ms": round(entry["max_ms"], 1), "last_seen": entry["last_seen"],
+                     "expires_at": entry["last_seen"] + self.retention},
+            "$min": {"first_seen": entry["first_seen"]},
+            "$set": {key: entry[key] for key in ("database", "collection", "command", "shape")}
+        }, upsert=True) for shape_id, entry in slow.items()]
+        try:
+            await self.collection.bulk_write(updates, ordered=False)
+        except Exception:
+            # Diagnostics only; a failed write loses these counts, never a request
+            logger.exception(f"Failed to write {len(updates)} slow query shapes")
+            return 0
+        if self.explain:
+            await self._explain_new()
+        return len(updates)
+
+    async def _explain_new(self):
+        with self._lock:
+            candidates = list(self._samples.items())
+        if not candidates:
+            return
+        # Another worker may have explained the shape already
+        done = {doc["_id"] async for doc in self.collection.find(
+            {"_id": {"$in": [shape_id for shape_id, _ in candidates]}, "explained_at": {"$exists": True}}, {"_id": 1}
+        )}
+        explained = 0
+        for shape_id, (database, command_name, command) in candidates:
+            if shape_id not in done:
+                if explained >= self.max_explains:
+                    continue
+                explained += 1
+                await self._explain_one(shape_id, database, command_name, command)
+            with self._lock:
+                self._explained.add(shape_id)
+                self._samples.pop(shape_id, None)
+
+    async def _explain_one(self, shape_id: str, database: str, command_name: str, command: dict):
+        try:
+            result = await self.client[database].command(
+                {"explain": explain_command(command_name, command), "verbosity": "executionStats"}
+            )
+            plan = summarize_explain(result)
+        except Exception as e:
+            plan = {"error": f"{type(e).__name__}: {e}"[:500]}
+        await self.collection.update_one(
+            {"_id": shape_id}, {"$set": {"plan": plan, "explained_at": datetime.now(timezone.utc)}}
+        )
+
+    async def report(self, limit: int = 20, sort: str = "total_ms", collection: Optional[str] = None) -> List[dict]:
+        """The ``limit`` slowest shapes by ``sort``, with average time per run"""
+        await self.flush()
+        query = {"collection": collection} if collection else {}
+        shapes = await self.collection.find(query, {"expires_at": 0}).sort(sort, -1).to_list(limit)
+        for shape in shapes:
+            shape["id"] = shape.pop("_id")
+            shape["avg_ms"] = round(shape["total_ms"] / shape["count"], 1) if shape.get("count") else None
+        return shapes
+
+    async def reset(self) -> int:
+        with self._lock:
+            self._slow.clear()
+            self._samples.clear()
+            self._explained.clear()
+        result = await self.collection.delete_many({})
+        return result.deleted_count
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Slow query flush failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -0,0 +1,90 @@
+"""TOTP code verification with replay protection.
+
+Per RFC 6238 section 5.2 a verifier must not accept a second login for a
+time-step it already accepted. Since the window spans a step either side of
+now, this keeps the last accepted step per user and rejects any code for that
+step or an earlier one, so a code observed in flight cannot be replayed even
+after a newer code was used. The last step lives in memory and, when a
+collection is given, in a Mongo document per user (unique on user_id) that
+every worker advances with a conditional update. Records expire through a TTL
+index once their step can no longer fall inside the verification window.
+"""
+import functools
+import hmac
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import pyotp
+from pymongo.errors import DuplicateKeyError
+
+
+@functools.lru_cache(maxsize=4096)
+def get_totp(secret: str) -> pyotp.TOTP:
+    """TOTP objects are immutable per secret, so build each one only once"""
+    return pyotp.TOTP(secret)
+
+
+class TOTPVerifier:
+    def __init__(self, collection=None, valid_window: int = 1, max_memory_entries: int = 100000):
+        self.collection = collection
+        self.valid_window = valid_window
+        self.max_memory_entries = max_memory_entries
+        # user_id -> (last accepted step, unix time it leaves the window); the whole store when no collection is set
+        self._last = {}
+
+    async def ensure_indexes(self):
+        if self.collection is not None:
+            await self.collection.create_index("user_id", unique=True)
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def match_step(self, secret: str, code: str, for_time: Optional[float] = None) -> Optional[int]:
+        """Return the time-step ``code`` is valid for, or None if it matches no step in the window"""
+        totp = get_totp(secret)
+        if not code or len(code) != totp.digits or not code.isdigit():
+            return None
+        counter = int(time.time() if for_time is None else for_time) // totp.interval
+        for step in range(counter - self.valid_window, counter + self.valid_window + 1):
+            if hmac.compare_digest(totp.generate_otp(step), code):
+                return step
+        return None
+
+    def expires_at(self, step: int, interval: int) -> float:
+        """Unix time after which ``step`` is outside the window, so its record is no longer needed"""
+        return (step + self.valid_window + 1) * interval
+
+    async def verify(self, user_id: str, secret: str, code: str, for_time: Optional[float] = None) -> bool:
+        """Check ``code`` and consume it; a code for a step at or before the last accepted one is rejected"""
+        step = self.match_step(secret, code, for_time)
+        if step is None:
+            return False
+        return await self._advance(user_id, step, get_totp(secret).interval)
+
+    async def _advance(self, user_id: str, step: int, interval: int) -> bool:
+        last = self._last.get(user_id)
+        if last is not None and last[0] >= step:
+            return False
+
+        expires = self.expires_at(step, interval)
+        if self.collection is not None:
+            try:
+                # Matches only if this step is newer; otherwise the upsert collides with the user's record
+                await self.collection.update_one(
+                    {"user_id": user_id, "step": {"$lt": step}},
+                    {"$set": {"step": step, "expires_at": datetime.fromtimestamp(expires, timezone.utc)}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # This step or a later one was used on another worker
+                return False
+
+        if len(self._last) >= self.max_memory_entries:
+            self._prune(time.time())
+        self._last[user_id] = (step, expires)
+        return True
+
+    def _prune(self, now: float):
+        for key in [k for k, (_, expires) in self._last.items() if expires <= now]:
+            del self._last[key]
+        while len(self._last) >= self.max_memory_entries:
+            self._last.pop(next(iter(self._last)))
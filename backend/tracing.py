@@ -0,0 +1,362 @@
+"""Request tracing in the OpenTelemetry data model.
+
+Each sampled request gets a root span named after its route template, with
+child spans for the work that usually explains a slow page: every Mongo
+command (recorded by ``MongoSpanListener`` through pymongo command
+monitoring), bcrypt, PDF rendering and SendGrid calls. Spans carry W3C trace
+context, so a sampled ``traceparent`` from a proxy or the frontend joins its
+trace, and the response carries the request's own ``traceparent`` back so a
+slow page can be looked up by trace id.
+
+The current span lives in a context variable. Starlette's ``run_in_threadpool``
+and motor's executor both copy the context into their worker threads, so
+bcrypt and Mongo spans find their parent without being passed one.
+
+Finished spans are buffered and exported in batches every ``flush_interval``
+seconds as OTLP/JSON: appended to a file (one export request per line, the
+format the collector's ``otlpjsonfile`` receiver reads) and/or posted to an
+OTLP/HTTP collector such as ``http://localhost:4318/v1/traces``. Tracing is
+off when no exporter is configured, and outside a sampled request ``span()``
+does nothing beyond a context variable lookup.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import re
+import secrets
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    """(trace id, parent span id, sampled) from a W3C traceparent header, or None if invalid"""
+    match = _TRACEPARENT.match((value or "").strip().lower())
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # int64 is a string in proto3 JSON
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "kind", "attributes",
+                 "start_ns", "end_ns", "status", "message")
+
+    def __init__(self, tracer: "Tracer", trace_id: str, parent_id: Optional[str], name: str,
+                 kind: int = INTERNAL, attributes: Optional[dict] = None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = 0
+        self.message = ""
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_error(self, message: str):
+        self.status = STATUS_ERROR
+        self.message = message[:500]
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer.finish(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status:
+            span["status"] = {"code": self.status, "message": self.message} if self.message else {"code": self.status}
+        return span
+
+
+class _SpanScope:
+    """Context manager making a span current for a block; yields None when not tracing"""
+    __slots__ = ("tracer", "name", "kind", "attributes", "span", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, kind: int, attributes: Optional[dict]):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.span: Optional[Span] = None
+        self._token = None
+
+    def __enter__(self) -> Optional[Span]:
+        parent = self.tracer.current()
+        if parent is not None:
+            self.span = Span(self.tracer, parent.trace_id, parent.span_id, self.name, self.kind, self.attributes)
+            self._token = self.tracer._current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            if exc is not None:
+                self.span.set_error(f"{exc_type.__name__}: {exc}")
+            self.tracer._current.reset(self._token)
+            self.span.end()
+        return False
+
+
+class JsonFileExporter:
+    """Appends each batch as one OTLP/JSON export request per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, line: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def export(self, payload: dict):
+        await asyncio.to_thread(self._write, json.dumps(payload, separators=(",", ":")))
+
+    async def close(self):
+        pass
+
+
+class OTLPHttpExporter:
+    """Posts batches to an OTLP/HTTP collector endpoint as JSON"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def export(self, payload: dict):
+        response = await self._client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class Tracer:
+    """Samples requests, holds the current span and exports finished spans in batches"""
+
+    def __init__(self, service_name: str, sample_rate: float = 0.0, exporters: Iterable = (),
+                 flush_interval: float = 5.0, batch_size: int = 2000, max_queued: int = 20000):
+        self.service_name = service_name
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.exporters = list(exporters)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_queued = max_queued
+        # Counted by this worker
+        self.exported = 0
+        self.dropped = 0
+        self._current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+        self._finished: List[Span] = []
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def current(self) -> Optional[Span]:
+        return self._current.get()
+
+    def sampled(self, trace_id: str) -> bool:
+        # Same rule as OpenTelemetry's TraceIdRatioBased sampler, so every service sampling a trace id agrees
+        return int(trace_id[16:], 16) < self.sample_rate * (1 << 64)
+
+    def start_request(self, name: str, traceparent: Optional[str] = None,
+                      attributes: Optional[dict] = None) -> Optional[Span]:
+        """Root span for an incoming request, or None if it is not sampled; a valid traceparent decides for us"""
+        if not self.exporters:
+            return None
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+            sampled = self.sampled(trace_id)
+        if not sampled:
+            return None
+        return Span(self, trace_id, parent_id, name, SERVER, attributes)
+
+    def span(self, name: str, attributes: Optional[dict] = None, kind: int = INTERNAL) -> _SpanScope:
+        """``with tracer.span("pdf.render"):`` records a child of the current span, if there is one"""
+        return _SpanScope(self, name, kind, attributes)
+
+    def finish(self, span: Span):
+        # Called from worker threads too (Mongo listener, threadpool spans)
+        with self._lock:
+            if len(self._finished) >= self.max_queued:
+                self.dropped += 1
+                return
+            self._finished.append(span)
+
+    def _payload(self, spans: List[Span]) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "kloudnests.tracing"}, "spans": [span.to_otlp() for span in spans]}]
+        }]}
+
+    async def flush(self) -> int:
+        sent = 0
+        while True:
+            with self._lock:
+                batch, self._finished = self._finished[:self.batch_size], self._finished[self.batch_size:]
+            if not batch:
+                return sent
+            payload = self._payload(batch)
+            for exporter in self.exporters:
+                try:
+                    await exporter.export(payload)
+                except Exception as e:
+                    # Traces are diagnostics; a collector being down must not affect requests
+                    logger.warning(f"Trace export to {type(exporter).__name__} failed: {e}")
+            sent += len(batch)
+            self.exported += len(batch)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Trace flush failed")
+
+    def start(self):
+        if self._task is None and self.exporters:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        for exporter in self.exporters:
+            await exporter.close()
+
+
+class TracingMiddleware:
+    """Root span per sampled request, named by method and route template"""
+
+    def __init__(self, app, tracer: Tracer, exclude: Iterable[str] = ()):
+        self.app = app
+        self.tracer = tracer
+        # Raw paths never traced, such as long-lived streams, probes and the metrics scrape
+        self.exclude = frozenset(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        method = scope["method"]
+        span = self.tracer.start_request(method, traceparent, {"http.method": method, "http.target": scope["path"]})
+        if span is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_context(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                if message["status"] >= 500:
+                    span.status = STATUS_ERROR
+                message = {**message, "headers": [*message.get("headers", []), (b"traceparent", span.traceparent.encode())]}
+            await send(message)
+
+        token = self.tracer._current.set(span)
+        try:
+            await self.app(scope, receive, send_with_context)
+        except Exception as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self.tracer._current.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                span.name = f"{method} {route.path}"
+                span.attributes["http.route"] = route.path
+            span.end()
+
+
+class MongoSpanListener(monitoring.CommandListener):
+    """Child span for every Mongo command run inside a traced request"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._pending: Dict[tuple, Span] = {}
+
+    def started(self, event):
+        parent = self.tracer.current()
+        if parent is None:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        host, port = event.connection_id
+        span = Span(self.tracer, parent.trace_id, parent.span_id,
+                    f"{event.command_name} {collection}" if collection else event.command_name, CLIENT, {
+                        "db.system": "mongodb",
+                        "db.name": event.database_name,
+                        "db.operation": event.command_name,
+                        "db.mongodb.collection": collection or None,
+                        "net.peer.name": host,
+                        "net.peer.port": port,
+                    })
+        self._pending[(event.connection_id, event.request_id)] = span
+
+    def succeeded(self, event):
+        span = self._pending.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end()
+
+    def failed(self, event):
+        span = self._pending.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            failure = event.failure
+            span.set_error(str(failure.get("errmsg", failure)) if isinstance(failure, dict) else str(failure))
+            span.end()
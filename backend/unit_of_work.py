@@ -0,0 +1,71 @@
+"""Multi-document writes that must succeed or fail together.
+
+Wallet debits and the orders, invoices and transactions recorded with them run
+inside a Mongo transaction, so a crash or error halfway through leaves nothing
+behind. Transactions need a replica set (a single-node one is enough); against a
+standalone mongod the writes run one after another, as they did before.
+"""
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from pymongo.errors import OperationFailure
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class InsufficientFunds(Exception):
+    """The conditional wallet debit matched no user with enough balance"""
+
+
+async def debit_wallet(db, user_id: str, amount: float, session=None) -> None:
+    """Take ``amount`` from the wallet only if the balance covers it, in one atomic update"""
+    result = await db.users.update_one(
+        {"id": user_id, "wallet_balance": {"$gte": amount}},
+        {"$inc": {"wallet_balance": -amount}},
+        session=session
+    )
+    if result.modified_count == 0:
+        raise InsufficientFunds(user_id)
+
+
+class UnitOfWork:
+    """Runs a coroutine ``callback(session)`` in a transaction when the deployment supports it.
+
+    ``mode`` is "auto" (use transactions on a replica set or sharded cluster),
+    "true" (always) or "false" (never). Without a transaction ``session`` is None,
+    which Motor accepts everywhere a session is.
+    """
+
+    def __init__(self, client, mode: str = "auto"):
+        self.client = client
+        self.mode = mode
+        self.enabled = mode == "true"
+
+    async def detect(self) -> bool:
+        if self.mode == "auto":
+            try:
+                hello = await self.client.admin.command("hello")
+            except OperationFailure as e:
+                logger.warning(f"Could not detect Mongo topology, transactions disabled: {e}")
+                hello = {}
+            self.enabled = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        if not self.enabled:
+            reason = "disabled by MONGO_TRANSACTIONS" if self.mode == "false" else "unavailable on a standalone server"
+            logger.warning(f"Mongo transactions {reason}; multi-document writes are not atomic")
+        return self.enabled
+
+    async def run(self, callback: Callable[[Optional[object]], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await callback(None)
+        async with await self.client.start_session() as session:
+            # with_transaction retries the whole callback on TransientTransactionError
+            # and the commit on UnknownTransactionCommitResult
+            return await session.with_transaction(
+                callback,
+                read_concern=ReadConcern("snapshot"),
+                write_concern=WriteConcern("majority")
+            )
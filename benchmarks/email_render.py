@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Email rendering benchmark
+Compiles the email templates, then renders a notification run of server-ready
+and renewal-invoice emails for synthetic users with render_many, as the bulk
+provisioning and billing jobs do. Reports compile time and emails per second.
+
+Usage: python benchmarks/email_render.py [--emails 20000] [--seed 1]
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from email_templates import EmailRenderer, branding_from_settings  # noqa: E402
+
+# Names with characters the templates have to escape
+COMPANIES = ["Acme", "Globex", "O'Neil & Sons", "<Initech>"]
+
+
+def make_contexts(count: int, rng: random.Random):
+    now = datetime.now(timezone.utc)
+    servers, invoices = [], []
+    for i in range(count):
+        user = {"full_name": f"Customer {i} ({rng.choice(COMPANIES)})", "email": f"user{i}@example.com"}
+        server = {
+            "hostname": f"srv-{i}.fra.cloud", "ip_address": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+            "username": "root", "password": f"{rng.getrandbits(64):x}", "ssh_port": "22",
+            "plan_name": "VPS Pro", "os": "Ubuntu 24.04",
+            "panel_url": f"https://panel.example.com/{i}" if i % 3 == 0 else None
+        }
+        servers.append({"user": user, "server": server, "heading": "Your Server Has Been Provisioned!"})
+        invoices.append({
+            "user": user, "server": server, "wallet_balance": rng.uniform(0, 50),
+            "invoice": {"invoice_number": f"INV-{i:08X}", "amount": rng.uniform(5, 500), "due_date": now + timedelta(days=7)}
+        })
+    return {"server_ready": servers, "renewal_invoice": invoices}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    renderer = EmailRenderer()
+    start = time.perf_counter()
+    count = renderer.load()
+    print(f"Compiled {count} templates in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    brand = branding_from_settings({"company_name": "KloudNests"})
+    for name, contexts in make_contexts(args.emails, random.Random(args.seed)).items():
+        start = time.perf_counter()
+        emails = renderer.render_many(name, brand, contexts)
+        elapsed = time.perf_counter() - start
+        size = sum(len(email.html) for email in emails) / len(emails)
+        print(f"{name}: {len(emails):,} emails in {elapsed:.2f}s ({len(emails) / elapsed:,.0f}/s, {size:,.0f} bytes each)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Login flood load test
+Fires a credential-stuffing style flood at /api/auth/login (default 1000 rps) while
+probing /api/health, and reports how the API holds up:
+- share of flood requests rejected with 429 by the rate limiter
+- health probe latency percentiles during the flood (should stay low)
+
+Logins for unknown addresses return before bcrypt runs, so the flood targets
+real accounts: with MONGO_URL and DB_NAME set to the backend's database,
+--accounts throwaway users are created for the run and removed afterwards;
+--email points the whole flood at one existing account instead.
+
+Usage: MONGO_URL=... DB_NAME=... python benchmarks/login_flood.py [--rps 1000] [--duration 30] [--accounts 500]
+       python benchmarks/login_flood.py --email someone@example.com
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import bcrypt
+import httpx
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://127.0.0.1:8001')
+SEED_DOMAIN = "loadtest.invalid"
+
+
+async def seed_accounts(db, count: int) -> list:
+    """Create ``count`` verified users with a password the flood never guesses"""
+    # One hash at the backend's cost factor is enough; every login still runs a full bcrypt check
+    password_hash = bcrypt.hashpw(uuid.uuid4().hex.encode(), bcrypt.gensalt()).decode()
+    run_id = uuid.uuid4().hex[:8]
+    now = datetime.now(timezone.utc)
+    users = [{
+        "id": str(uuid.uuid4()),
+        "email": f"flood-{run_id}-{n}@{SEED_DOMAIN}",
+        "password_hash": password_hash,
+        "full_name": f"Login Flood {n}",
+        "company": None,
+        "role": "user",
+        "wallet_balance": 0.0,
+        "is_verified": True,
+        "is_2fa_enabled": False,
+        "totp_secret": None,
+        "created_at": now,
+        "updated_at": now
+    } for n in range(count)]
+    await db.users.insert_many(users)
+    return [user["email"] for user in users]
+
+
+async def flood(client: httpx.AsyncClient, rps: int, duration: float, statuses: Counter, emails: list):
+    """Send login attempts at a fixed rate, spread over the target accounts and many source IPs"""
+    interval = 1.0 / rps
+    tasks = []
+    start = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - start < duration:
+        payload = {"email": emails[sent % len(emails)], "password": f"guess-{sent}"}
+        # The API trusts X-Real-IP from TRUSTED_PROXIES (loopback by default, so run this on
+        # the API host or add its address); simulate a small botnet
+        headers = {"X-Real-IP": f"203.0.113.{sent % 50}"}
+        tasks.append(asyncio.create_task(attempt(client, payload, headers, statuses)))
+        sent += 1
+        next_send = start + sent * interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.gather(*tasks)
+    return sent
+
+
+async def attempt(client: httpx.AsyncClient, payload: dict, headers: dict, statuses: Counter):
+    try:
+        response = await client.post(f"{BASE_URL}/api/auth/login", json=payload, headers=headers)
+        statuses[response.status_code] += 1
+    except httpx.HTTPError as e:
+        statuses[type(e).__name__] += 1
+
+
+async def probe(client: httpx.AsyncClient, duration: float, latencies: list):
+    """Measure health endpoint latency as seen by a legitimate client during the flood"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        t0 = time.perf_counter()
+        try:
+            await client.get(f"{BASE_URL}/api/health")
+            latencies.append((time.perf_counter() - t0) * 1000)
+        except httpx.HTTPError:
+            latencies.append(float("inf"))
+        await asyncio.sleep(0.1)
+
+
+async def run(rps: int, duration: float, accounts: int, email: str) -> int:
+    mongo, db = None, None
+    if email:
+        emails = [email.lower()]
+    elif os.environ.get("MONGO_URL") and os.environ.get("DB_NAME"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db = mongo[os.environ["DB_NAME"]]
+        emails = await seed_accounts(db, accounts)
+    else:
+        print("Set MONGO_URL and DB_NAME to seed accounts, or pass --email for an existing account")
+        return 2
+
+    statuses = Counter()
+    latencies = []
+    limits = httpx.Limits(max_connections=500, max_keepalive_connections=500)
+    try:
+        async with httpx.AsyncClient(timeout=10, limits=limits) as flood_client, \
+                httpx.AsyncClient(timeout=10) as probe_client:
+            sent, _ = await asyncio.gather(
+                flood(flood_client, rps, duration, statuses, emails),
+                probe(probe_client, duration, latencies)
+            )
+    finally:
+        if db is not None:
+            await db.users.delete_many({"email": {"$in": emails}})
+            mongo.close()
+
+    print(f"Target: {BASE_URL} ({len(emails)} account{'s' if len(emails) != 1 else ''})")
+    print(f"Login attempts sent: {sent} ({sent / duration:.0f} rps)")
+    for status, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+        print(f"  {status}: {count}")
+
+    finite = sorted(l for l in latencies if l != float("inf"))
+    failed_probes = len(latencies) - len(finite)
+    if not finite:
+        print("Health probes: all failed")
+        return 1
+    p50 = statistics.median(finite)
+    p99 = finite[min(len(finite) - 1, int(len(finite) * 0.99))]
+    print(f"Health probes: {len(latencies)} (failed: {failed_probes}) p50={p50:.1f}ms p99={p99:.1f}ms")
+
+    # The API is considered responsive when health stays under 250ms at p99
+    return 0 if failed_probes == 0 and p99 < 250 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--accounts", type=int, default=500, help="accounts to seed when MONGO_URL and DB_NAME are set")
+    parser.add_argument("--email", default="", help="flood one existing account instead of seeding")
+    args = parser.parse_args()
+    return asyncio.run(run(args.rps, args.duration, args.accounts, args.email))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Metrics middleware overhead benchmark
+Times MetricsMiddleware around a no-op ASGI app, which isolates its own cost
+per request, then calls a FastAPI app directly through ASGI with and without
+it for the end-to-end difference (within run-to-run noise). Routes are spread
+over a few templates and statuses so the label lookups match a real mix. Also
+times a Mongo command listener callback pair and a scrape of the registry.
+
+Usage: python benchmarks/metrics_overhead.py [--requests 20000] [--budget-us 50]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from fastapi import FastAPI, HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from metrics import Registry, MetricsMiddleware, MongoCommandTimer  # noqa: E402
+
+PATHS = ["/api/plans/", "/api/servers/abc", "/api/servers/def", "/api/tickets/missing", "/api/unknown"]
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/plans/")
+    async def plans():
+        return {"plans": []}
+
+    @app.get("/api/servers/{server_id}")
+    async def get_server(server_id: str):
+        return {"id": server_id}
+
+    @app.get("/api/tickets/{ticket_id}")
+    async def get_ticket(ticket_id: str):
+        raise HTTPException(status_code=404, detail="Ticket not found")
+
+    return app
+
+
+async def call(app, path: str):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+def noop_app(routes):
+    """Stands in for the router: sets the matched route and sends a status, nothing else"""
+    async def app(scope, receive, send):
+        scope["route"] = routes[scope["path"]]
+        await send({"type": "http.response.start", "status": 404 if scope["path"].endswith("missing") else 200})
+    return app
+
+
+async def per_request_us(app, requests: int) -> float:
+    for path in PATHS * 50:  # warm up
+        await call(app, path)
+    start = time.perf_counter()
+    for i in range(requests):
+        await call(app, PATHS[i % len(PATHS)])
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def run(requests: int, rounds: int, budget_us: float) -> bool:
+    plain = make_app()
+    registry = Registry()
+    instrumented = MetricsMiddleware(
+        make_app(),
+        requests=registry.counter("http_requests_total", "Requests", ("method", "route", "status")),
+        latency=registry.histogram("http_request_duration_seconds", "Latency", ("method", "route"))
+    )
+
+    routes = {path: SimpleNamespace(path=path.rsplit("/", 1)[0] + "/{id}") for path in PATHS}
+    bare, timed = noop_app(routes), MetricsMiddleware(noop_app(routes), instrumented.requests, instrumented.latency)
+    isolated = statistics.median(
+        [await per_request_us(timed, requests) - await per_request_us(bare, requests) for _ in range(rounds)]
+    )
+
+    # Interleave rounds so drift in machine load hits both sides alike
+    deltas, base = [], []
+    for _ in range(rounds):
+        without = await per_request_us(plain, requests)
+        with_metrics = await per_request_us(instrumented, requests)
+        base.append(without)
+        deltas.append(with_metrics - without)
+    overhead = statistics.median(deltas)
+    print(f"Requests per round: {requests}, rounds: {rounds}")
+    print(f"Middleware alone:   {isolated:.2f} us/request")
+    print(f"FastAPI app:        {statistics.median(base):.1f} us/request without metrics")
+    print(f"End to end:         {overhead:+.2f} us/request (median; rounds {', '.join(f'{d:+.1f}' for d in deltas)})")
+
+    timer = MongoCommandTimer(
+        registry.histogram("mongo_command_duration_seconds", "Mongo", ("collection", "command")),
+        registry.counter("mongo_command_failures_total", "Mongo failures", ("collection", "command"))
+    )
+    started = SimpleNamespace(command={"find": "servers"}, command_name="find", connection_id=("db", 27017), request_id=1)
+    succeeded = SimpleNamespace(connection_id=("db", 27017), request_id=1, duration_micros=850)
+    start = time.perf_counter()
+    for _ in range(requests):
+        timer.started(started)
+        timer.succeeded(succeeded)
+    print(f"Mongo listener:     {(time.perf_counter() - start) / requests * 1e6:.2f} us/command")
+
+    start = time.perf_counter()
+    body = await registry.render()
+    print(f"Scrape:             {(time.perf_counter() - start) * 1e3:.2f} ms for {len(body.splitlines())} lines")
+
+    ok = isolated < budget_us
+    print(f"{'PASS' if ok else 'FAIL'}: overhead {'under' if ok else 'over'} {budget_us:g} us/request")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--budget-us", type=float, default=50.0)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.requests, args.rounds, args.budget_us)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Order pricing benchmark
+Measures quotes per second from the in-memory pricing snapshot, with a random
+plan, billing cycle, data center and add-on selection per quote.
+Set MONGO_URL (and optionally DB_NAME) to also time the previous per-order path
+of sequential plan, data center and add-on reads.
+
+Usage: python benchmarks/pricing_quote.py [--quotes 100000] [--plans 50] [--addons 20]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from pricing import CYCLE_MONTHS, CatalogSnapshot, PricingCatalog  # noqa: E402
+
+
+def build_catalog(plan_count: int, addon_count: int, datacenter_count: int = 5):
+    plans = [{
+        "id": str(uuid.uuid4()),
+        "name": f"Plan {i}",
+        "price_monthly": 5.0 + i,
+        "price_quarterly": (5.0 + i) * 2.85,
+        "price_yearly": (5.0 + i) * 10.5,
+        "is_active": True
+    } for i in range(plan_count)]
+    addons = [{
+        "id": str(uuid.uuid4()),
+        "name": f"Add-on {i}",
+        "price": 1.0 + i,
+        "billing_cycle": random.choice(["monthly", "yearly", "one_time"]),
+        "is_active": True
+    } for i in range(addon_count)]
+    datacenters = [{"id": str(uuid.uuid4()), "name": f"DC {i}", "is_active": True} for i in range(datacenter_count)]
+    return plans, addons, datacenters
+
+
+def build_requests(count: int, plans, addons, datacenters):
+    return [(
+        random.choice(plans)["id"],
+        random.choice(list(CYCLE_MONTHS)),
+        random.choice(datacenters)["id"],
+        [addon["id"] for addon in random.sample(addons, k=random.randint(0, min(4, len(addons))))]
+    ) for _ in range(count)]
+
+
+def bench_snapshot(snapshot: CatalogSnapshot, requests) -> float:
+    start = time.perf_counter()
+    for plan_id, cycle, datacenter_id, addon_ids in requests:
+        snapshot.quote(plan_id, cycle, datacenter_id, addon_ids)
+    return len(requests) / (time.perf_counter() - start)
+
+
+async def bench_catalog(catalog: PricingCatalog, requests) -> float:
+    start = time.perf_counter()
+    for plan_id, cycle, datacenter_id, addon_ids in requests:
+        await catalog.quote(plan_id, cycle, datacenter_id, addon_ids)
+    return len(requests) / (time.perf_counter() - start)
+
+
+async def bench_sequential_reads(db, requests) -> float:
+    """The lookups create_order made for every order before the pricing snapshot"""
+    start = time.perf_counter()
+    for plan_id, cycle, datacenter_id, addon_ids in requests:
+        await db.plans.find_one({"id": plan_id, "is_active": True}, {"_id": 0})
+        await db.datacenters.find_one({"id": datacenter_id, "is_active": True}, {"_id": 0})
+        if addon_ids:
+            await db.addons.find({"id": {"$in": addon_ids}, "is_active": True}, {"_id": 0}).to_list(50)
+    return len(requests) / (time.perf_counter() - start)
+
+
+async def run(quote_count: int, plan_count: int, addon_count: int):
+    plans, addons, datacenters = build_catalog(plan_count, addon_count)
+    requests = build_requests(quote_count, plans, addons, datacenters)
+    snapshot = CatalogSnapshot(
+        plans={plan["id"]: plan for plan in plans},
+        addons={addon["id"]: addon for addon in addons},
+        datacenters={datacenter["id"]: datacenter for datacenter in datacenters},
+        loaded_at=time.monotonic()
+    )
+
+    print(f"Plans: {plan_count}, add-ons: {addon_count}, quotes: {quote_count}")
+    print(f"Snapshot quote:         {bench_snapshot(snapshot, requests):,.0f} quotes/s")
+
+    mongo_url = os.environ.get("MONGO_URL")
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+        db = client[os.environ.get("DB_NAME", "pricing_benchmark") + "_pricing_benchmark"]
+        await client.drop_database(db.name)
+        await db.plans.insert_many([dict(plan) for plan in plans])
+        await db.addons.insert_many([dict(addon) for addon in addons])
+        await db.datacenters.insert_many([dict(datacenter) for datacenter in datacenters])
+
+        catalog = PricingCatalog(db)
+        print(f"PricingCatalog.quote:   {await bench_catalog(catalog, requests):,.0f} quotes/s (one snapshot load)")
+        sample = requests[:min(len(requests), 2000)]
+        print(f"Sequential Mongo reads: {await bench_sequential_reads(db, sample):,.0f} quotes/s")
+        await client.drop_database(db.name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quotes", type=int, default=100000)
+    parser.add_argument("--plans", type=int, default=50)
+    parser.add_argument("--addons", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.quotes, args.plans, args.addons))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Admin search benchmark
+Builds the search index over synthetic users, servers, orders, invoices and
+tickets (with replies), then times a mix of admin queries: exact and partial
+emails, names, hostnames, IPs, invoice numbers, ticket words and two-word
+queries. Reports build time, peak memory and per-query latency percentiles.
+
+Usage: python benchmarks/search_index.py [--docs 1000000] [--queries 2000] [--seed 1]
+"""
+
+import argparse
+import random
+import resource
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from search import SearchIndex, document_fields, BODY  # noqa: E402
+
+FIRST = ["john", "jane", "alex", "maria", "li", "omar", "sara", "ivan", "emma", "raj", "yuki", "noah", "olga", "pedro"]
+LAST = ["smith", "garcia", "chen", "patel", "kowalski", "nguyen", "müller", "okafor", "silva", "tanaka", "brown"]
+DOMAINS = ["gmail.com", "example.com", "acme.io", "hostmail.net", "corp.co.uk"]
+COMPANIES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Vandelay Industries", ""]
+PLANS = ["VPS Starter", "VPS Pro", "Dedicated Xeon", "Dedicated EPYC", "Shared Basic"]
+WORDS = ["server", "down", "reboot", "network", "slow", "disk", "upgrade", "billing", "refund", "dns",
+         "ssl", "backup", "restore", "kernel", "panel", "login", "password", "firewall", "port", "email"]
+
+
+def make_docs(count: int, rng: random.Random):
+    """(kind, doc) pairs and ticket replies, in the proportions of a hosting customer base"""
+    docs, messages = [], []
+    for i in range(count):
+        roll = i % 20
+        doc_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        if roll < 5:
+            first, last = rng.choice(FIRST), rng.choice(LAST)
+            docs.append(("user", {"id": doc_id, "email": f"{first}.{last}{i}@{rng.choice(DOMAINS)}",
+                                  "full_name": f"{first.title()} {last.title()}", "company": rng.choice(COMPANIES)}))
+        elif roll < 10:
+            docs.append(("server", {"id": doc_id, "hostname": f"srv-{i}.{rng.choice(['fra', 'nyc', 'sgp'])}.cloud",
+                                    "ip_address": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                                    "plan_name": rng.choice(PLANS)}))
+        elif roll < 15:
+            docs.append(("invoice", {"id": doc_id, "invoice_number": f"INV-2026{i % 12 + 1:02d}{i % 28 + 1:02d}-{i:08X}",
+                                     "description": f"Renewal: {rng.choice(PLANS)} - monthly"}))
+        elif roll < 17:
+            docs.append(("order", {"id": doc_id, "plan_name": rng.choice(PLANS), "data_center_name": "Frankfurt"}))
+        else:
+            docs.append(("ticket", {"id": doc_id, "subject": " ".join(rng.sample(WORDS, 4))}))
+            for _ in range(rng.randint(1, 4)):
+                messages.append((doc_id, " ".join(rng.choices(WORDS, k=12))))
+    return docs, messages
+
+
+def make_queries(docs, count: int, rng: random.Random):
+    users = [doc for kind, doc in docs if kind == "user"]
+    servers = [doc for kind, doc in docs if kind == "server"]
+    invoices = [doc for kind, doc in docs if kind == "invoice"]
+    tickets = [doc for kind, doc in docs if kind == "ticket"]
+    makers = [
+        lambda: rng.choice(users)["email"],
+        lambda: rng.choice(users)["email"][:8],
+        lambda: rng.choice(users)["full_name"],
+        lambda: rng.choice(LAST),
+        lambda: rng.choice(servers)["hostname"],
+        lambda: rng.choice(servers)["ip_address"],
+        lambda: rng.choice(servers)["ip_address"].rsplit(".", 1)[0] + ".",
+        lambda: rng.choice(invoices)["invoice_number"],
+        lambda: rng.choice(invoices)["invoice_number"][:12],
+        lambda: "#" + rng.choice(tickets)["id"][:8],
+        lambda: " ".join(rng.sample(WORDS, 2)),
+        lambda: rng.choice(WORDS),
+    ]
+    return [rng.choice(makers)() for _ in range(count)]
+
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    docs, messages = make_docs(args.docs, rng)
+    queries = make_queries(docs, args.queries, rng)
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.start_loading()
+    for kind, doc in docs:
+        index.add(kind, doc["id"], document_fields(kind, doc))
+    for ticket_id, message in messages:
+        index.extend("ticket", ticket_id, [(message, BODY)])
+    index.finish_loading()
+    build = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Indexed {len(index):,} documents and {len(messages):,} replies in {build:.1f}s (peak RSS {peak_mb:,.0f} MB)")
+
+    latencies = []
+    empty = 0
+    for query in queries:
+        start = time.perf_counter()
+        hits, _ = index.search(query, limit=20)
+        latencies.append((time.perf_counter() - start) * 1000)
+        empty += not hits
+    print(f"{len(queries)} queries ({empty} without results): "
+          f"p50 {percentile(latencies, 50):.2f} ms, p95 {percentile(latencies, 95):.2f} ms, "
+          f"p99 {percentile(latencies, 99):.2f} ms, max {max(latencies):.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+TOTP verification benchmark
+Measures verifications per second through TOTPVerifier under concurrent logins,
+comparing a fresh pyotp.TOTP per call (the old code path) with the cached verifier.
+Set MONGO_URL (and optionally DB_NAME) to include the Mongo-backed replay store.
+
+Usage: python benchmarks/totp_verify.py [--users 1000] [--concurrency 100]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import pyotp
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from totp_verifier import TOTPVerifier  # noqa: E402
+
+
+def bench_uncached(secrets, codes) -> float:
+    start = time.perf_counter()
+    for secret, code in zip(secrets, codes):
+        pyotp.TOTP(secret).verify(code, valid_window=1)
+    return len(secrets) / (time.perf_counter() - start)
+
+
+def bench_match_step(verifier: TOTPVerifier, secrets, codes) -> float:
+    start = time.perf_counter()
+    for secret, code in zip(secrets, codes):
+        verifier.match_step(secret, code)
+    return len(secrets) / (time.perf_counter() - start)
+
+
+async def bench_verifier(verifier: TOTPVerifier, secrets, codes, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login(i):
+        async with semaphore:
+            assert await verifier.verify(f"user-{i}", secrets[i], codes[i])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(len(secrets))))
+    elapsed = time.perf_counter() - start
+
+    # Every code was consumed above, so replaying them must fail
+    replayed = [await verifier.verify(f"user-{i}", secrets[i], codes[i]) for i in range(min(100, len(secrets)))]
+    assert not any(replayed), "replayed code accepted"
+    return len(secrets) / elapsed
+
+
+async def run(users: int, concurrency: int):
+    secrets = [pyotp.random_base32() for _ in range(users)]
+    codes = [pyotp.TOTP(secret).now() for secret in secrets]
+
+    print(f"Users: {users}, concurrency: {concurrency}")
+    print(f"pyotp.TOTP per call:       {bench_uncached(secrets, codes):,.0f} verifications/s")
+
+    verifier = TOTPVerifier()
+    bench_match_step(verifier, secrets, codes)  # warm the TOTP object cache
+    print(f"Cached TOTP (match only):  {bench_match_step(verifier, secrets, codes):,.0f} verifications/s")
+    rate = await bench_verifier(verifier, secrets, codes, concurrency)
+    print(f"TOTPVerifier (in-memory):  {rate:,.0f} verifications/s (concurrent, with replay check)")
+
+    mongo_url = os.environ.get("MONGO_URL")
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+        collection = client[os.environ.get("DB_NAME", "totp_benchmark")]["totp_last_steps_benchmark"]
+        await collection.drop()
+        verifier = TOTPVerifier(collection)
+        await verifier.ensure_indexes()
+        rate = await bench_verifier(verifier, secrets, codes, concurrency)
+        print(f"TOTPVerifier (mongo):      {rate:,.0f} verifications/s (concurrent, with replay check)")
+        await collection.drop()
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.concurrency))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
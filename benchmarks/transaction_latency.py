@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Order write latency: transactional vs sequential
+Replays the create_order write sequence (wallet debit, transaction, order and
+invoice inserts) through UnitOfWork with and without a Mongo transaction and
+reports latency percentiles for each.
+
+Transactions need a replica set. A local single-node one is enough:
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+
+Usage: MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0 python benchmarks/transaction_latency.py [--orders 500] [--concurrency 10]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from unit_of_work import UnitOfWork, debit_wallet  # noqa: E402
+
+
+async def place_orders(db, unit_of_work: UnitOfWork, orders: int, concurrency: int, users) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def place(i):
+        user_id = users[i % len(users)]
+
+        async def write_order(session):
+            now = datetime.now(timezone.utc)
+            await debit_wallet(db, user_id, 5.0, session)
+            await db.transactions.insert_one({"id": str(uuid.uuid4()), "user_id": user_id, "type": "debit", "amount": 5.0, "created_at": now}, session=session)
+            order_id = str(uuid.uuid4())
+            await db.orders.insert_one({"id": order_id, "user_id": user_id, "amount": 5.0, "created_at": now}, session=session)
+            await db.invoices.insert_one({"id": str(uuid.uuid4()), "order_id": order_id, "user_id": user_id, "amount": 5.0, "created_at": now}, session=session)
+
+        async with semaphore:
+            start = time.perf_counter()
+            await unit_of_work.run(write_order)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(place(i) for i in range(orders)))
+    return latencies
+
+
+def summarize(label: str, latencies: list, elapsed: float):
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<14} p50={statistics.median(ordered):6.2f}ms  p99={p99:6.2f}ms  {len(ordered) / elapsed:,.0f} orders/s")
+
+
+async def run(orders: int, concurrency: int) -> int:
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], tz_aware=True)
+    db = client[os.environ.get("DB_NAME", "kloudnests") + "_transaction_benchmark"]
+    await client.drop_database(db.name)
+    # Collections must exist before the first transactional insert on older servers
+    for name in ("users", "transactions", "orders", "invoices"):
+        await db.create_collection(name)
+    await db.users.create_index("id", unique=True)
+
+    users = [str(uuid.uuid4()) for _ in range(50)]
+    await db.users.insert_many([{"id": user_id, "wallet_balance": 1e9} for user_id in users])
+
+    transactional = UnitOfWork(client, "auto")
+    if not await transactional.detect():
+        print("MONGO_URL does not point at a replica set; transactions are unavailable")
+        client.close()
+        return 1
+
+    print(f"Orders: {orders}, concurrency: {concurrency}")
+    for label, unit_of_work in (("sequential", UnitOfWork(client, "false")), ("transactional", transactional)):
+        start = time.perf_counter()
+        latencies = await place_orders(db, unit_of_work, orders, concurrency, users)
+        summarize(label, latencies, time.perf_counter() - start)
+
+    await client.drop_database(db.name)
+    client.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    return asyncio.run(run(args.orders, args.concurrency))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -48,6 +48,10 @@ import AdminDataCenters from "./pages/admin/DataCenters";
 import AdminAddOns from "./pages/admin/AddOns";
 import AdminAutomation from "./pages/admin/Automation";
 import AdminTopupRequests from "./pages/admin/TopupRequests";
+import AdminSearch from "./pages/admin/Search";
+import AdminBroadcasts from "./pages/admin/Broadcasts";
+import AdminEmailDelivery from "./pages/admin/EmailDelivery";
+import AdminSlowQueries from "./pages/admin/SlowQueries";
 
 // Context
 import { AuthProvider, useAuth } from "./context/AuthContext";
@@ -125,6 +129,10 @@ function App() {
           
           {/* Admin Dashboard Routes */}
           <Route path="/admin" element={<ProtectedRoute adminOnly><AdminDashboard /></ProtectedRoute>} />
+          <Route path="/admin/search" element={<ProtectedRoute adminOnly><AdminSearch /></ProtectedRoute>} />
+          <Route path="/admin/broadcasts" element={<ProtectedRoute adminOnly><AdminBroadcasts /></ProtectedRoute>} />
+          <Route path="/admin/email" element={<ProtectedRoute adminOnly><AdminEmailDelivery /></ProtectedRoute>} />
+          <Route path="/admin/slow-queries" element={<ProtectedRoute adminOnly><AdminSlowQueries /></ProtectedRoute>} />
           <Route path="/admin/orders" element={<ProtectedRoute adminOnly><AdminOrders /></ProtectedRoute>} />
           <Route path="/admin/servers" element={<ProtectedRoute adminOnly><AdminServers /></ProtectedRoute>} />
           <Route path="/admin/users" element={<ProtectedRoute adminOnly><AdminUsers /></ProtectedRoute>} />
@@ -3,7 +3,7 @@ import { Link, useLocation, useNavigate } from 'react-router-dom';
 import { 
   Server, LayoutDashboard, ShoppingCart, CreditCard, Wallet, 
   MessageSquare, User, Settings, LogOut, Menu, X, ChevronRight,
-  Users, Package, FileText, Bell, Tags, MapPin, Puzzle, Zap, WalletCards
+  Users, Package, FileText, Bell, Tags, MapPin, Puzzle, Zap, WalletCards, Search, Megaphone, Mail, Gauge
 } from 'lucide-react';
 import { Button } from '../ui/button';
 import { useAuth } from '../../context/AuthContext';
@@ -32,6 +32,7 @@ const DashboardLayout = ({ children, isAdmin = false }) => {
 
   const adminNavItems = [
     { name: 'Dashboard', href: '/admin', icon: LayoutDashboard },
+    { name: 'Search', href: '/admin/search', icon: Search },
     { name: 'Orders', href: '/admin/orders', icon: Package },
     { name: 'Servers', href: '/admin/servers', icon: Server },
     { name: 'Users', href: '/admin/users', icon: Users },
@@ -41,6 +42,9 @@ const DashboardLayout = ({ children, isAdmin = false }) => {
     { name: 'Data Centers', href: '/admin/datacenters', icon: MapPin },
     { name: 'Add-ons', href: '/admin/addons', icon: Puzzle },
     { name: 'Tickets', href: '/admin/tickets', icon: MessageSquare },
+    { name: 'Broadcasts', href: '/admin/broadcasts', icon: Megaphone },
+    { name: 'Email Delivery', href: '/admin/email', icon: Mail },
+    { name: 'Slow Queries', href: '/admin/slow-queries', icon: Gauge },
     { name: 'Automation', href: '/admin/automation', icon: Zap },
     { name: 'Settings', href: '/admin/settings', icon: Settings },
   ];
@@ -0,0 +1,53 @@
+import { useEffect, useRef } from 'react';
+import { useAuth } from '../context/AuthContext';
+
+const API_URL = process.env.REACT_APP_BACKEND_URL + '/api';
+const RECONNECT_DELAY = 5000;
+
+// Calls onEvent(type, data) for each live event of the given types.
+// EventSource cannot send an Authorization header, so the stream is opened
+// with a single-use ticket and every reconnect fetches a fresh one.
+export function useEventStream(types, onEvent) {
+  const { api, token } = useAuth();
+  const apiRef = useRef(api);
+  const handlerRef = useRef(onEvent);
+  apiRef.current = api;
+  handlerRef.current = onEvent;
+  const typeKey = types.join(',');
+
+  useEffect(() => {
+    if (!token) return;
+    let source = null;
+    let timer = null;
+    let closed = false;
+
+    const reconnect = () => {
+      if (!closed) timer = setTimeout(connect, RECONNECT_DELAY);
+    };
+
+    const connect = async () => {
+      try {
+        const response = await apiRef.current.post('/events/ticket');
+        if (closed) return;
+        const params = new URLSearchParams({ ticket: response.data.ticket, types: typeKey });
+        source = new EventSource(`${API_URL}/events/stream?${params}`);
+        typeKey.split(',').forEach((type) => {
+          source.addEventListener(type, (e) => handlerRef.current(type, JSON.parse(e.data).data));
+        });
+        source.onerror = () => {
+          source.close();
+          reconnect();
+        };
+      } catch (error) {
+        reconnect();
+      }
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(timer);
+      if (source) source.close();
+    };
+  }, [token, typeKey]);
+}
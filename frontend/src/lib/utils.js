@@ -42,6 +42,10 @@ export function getStatusColor(status) {
     open: 'text-primary bg-primary/10',
     closed: 'text-text-muted bg-text-muted/10',
     resolved: 'text-accent-success bg-accent-success/10',
+    queued: 'text-accent-warning bg-accent-warning/10',
+    running: 'text-primary bg-primary/10',
+    succeeded: 'text-accent-success bg-accent-success/10',
+    failed: 'text-accent-error bg-accent-error/10',
   };
   return colors[status?.toLowerCase()] || 'text-text-secondary bg-text-secondary/10';
 }
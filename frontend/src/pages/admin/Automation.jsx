@@ -1,5 +1,5 @@
 import { useState } from 'react';
-import { Play, RefreshCw, AlertTriangle, Clock, CheckCircle, Loader2, Zap, Ban } from 'lucide-react';
+import { Play, RefreshCw, AlertTriangle, Clock, CheckCircle, Loader2, Zap, Ban, Timer } from 'lucide-react';
 import DashboardLayout from '../../components/layout/DashboardLayout';
 import { Button } from '../../components/ui/button';
 import { useAuth } from '../../context/AuthContext';
@@ -28,6 +28,15 @@ const AdminAutomation = () => {
       endpoint: '/admin/run-suspend-check',
       color: 'text-accent-warning',
       bgColor: 'bg-accent-warning/20',
+    },
+    {
+      id: 'sla',
+      name: 'Escalate SLA Breaches',
+      description: 'Raises the priority of open tickets past their response or resolution deadline and emails the support team a summary.',
+      icon: Timer,
+      endpoint: '/admin/run-sla-check',
+      color: 'text-accent-error',
+      bgColor: 'bg-accent-error/20',
     }
   ];
 
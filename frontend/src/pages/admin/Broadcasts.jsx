@@ -0,0 +1,287 @@
+import { useState, useEffect } from 'react';
+import { Megaphone, Send, Eye, XCircle, Loader2, Users } from 'lucide-react';
+import DashboardLayout from '../../components/layout/DashboardLayout';
+import { Button } from '../../components/ui/button';
+import { Input } from '../../components/ui/input';
+import { Label } from '../../components/ui/label';
+import { Textarea } from '../../components/ui/textarea';
+import { Checkbox } from '../../components/ui/checkbox';
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../../components/ui/select';
+import { useAuth } from '../../context/AuthContext';
+import { useEventStream } from '../../hooks/use-event-stream';
+import { toast } from 'sonner';
+
+const ANY = 'any';
+
+const STATUS_STYLES = {
+  preparing: 'bg-blue-500/20 text-blue-400',
+  sending: 'bg-yellow-500/20 text-yellow-400',
+  completed: 'bg-green-500/20 text-green-400',
+  cancelled: 'bg-gray-500/20 text-gray-400',
+  failed: 'bg-red-500/20 text-red-400',
+};
+
+const emptyForm = { subject: '', message: '', plan_id: ANY, data_center_id: ANY, server_status: ANY, unpaid_invoices: false };
+
+const AdminBroadcasts = () => {
+  const { api } = useAuth();
+  const [broadcasts, setBroadcasts] = useState([]);
+  const [plans, setPlans] = useState([]);
+  const [datacenters, setDatacenters] = useState([]);
+  const [form, setForm] = useState(emptyForm);
+  const [preview, setPreview] = useState(null);
+  const [previewing, setPreviewing] = useState(false);
+  const [sending, setSending] = useState(false);
+
+  useEffect(() => {
+    fetchBroadcasts();
+    api.get('/plans/').then((r) => setPlans(r.data)).catch(() => {});
+    api.get('/datacenters/').then((r) => setDatacenters(r.data)).catch(() => {});
+  }, []);
+
+  // Counts arrive as the queue sends; merge them into the list
+  useEventStream(['broadcast.progress'], (type, data) => {
+    setBroadcasts((current) => current.map((b) => (b.id === data.id ? { ...b, ...data } : b)));
+  });
+
+  const fetchBroadcasts = async () => {
+    try {
+      const response = await api.get('/admin/broadcasts');
+      setBroadcasts(response.data);
+    } catch (error) {
+      console.error('Failed to fetch broadcasts:', error);
+    }
+  };
+
+  const payload = () => ({
+    subject: form.subject,
+    message: form.message,
+    segment: {
+      plan_id: form.plan_id === ANY ? null : form.plan_id,
+      data_center_id: form.data_center_id === ANY ? null : form.data_center_id,
+      server_status: form.server_status === ANY ? null : form.server_status,
+      unpaid_invoices: form.unpaid_invoices,
+    },
+  });
+
+  const update = (field, value) => {
+    setForm({ ...form, [field]: value });
+    setPreview(null);
+  };
+
+  const handlePreview = async () => {
+    setPreviewing(true);
+    try {
+      const response = await api.post('/admin/broadcasts/preview', payload());
+      setPreview(response.data);
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Failed to preview broadcast');
+    } finally {
+      setPreviewing(false);
+    }
+  };
+
+  const handleSend = async () => {
+    if (!window.confirm(`Send this email to ${preview.recipients} customers?`)) return;
+    setSending(true);
+    try {
+      const response = await api.post('/admin/broadcasts', payload());
+      setBroadcasts([response.data, ...broadcasts]);
+      setForm(emptyForm);
+      setPreview(null);
+      toast.success('Broadcast queued');
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Failed to send broadcast');
+    } finally {
+      setSending(false);
+    }
+  };
+
+  const handleCancel = async (broadcast) => {
+    if (!window.confirm('Cancel this broadcast? Emails already sent cannot be recalled.')) return;
+    try {
+      const response = await api.post(`/admin/broadcasts/${broadcast.id}/cancel`);
+      setBroadcasts(broadcasts.map((b) => (b.id === broadcast.id ? { ...b, ...response.data } : b)));
+      toast.success('Broadcast cancelled');
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Failed to cancel broadcast');
+    }
+  };
+
+  return (
+    <DashboardLayout isAdmin>
+      <div className="space-y-6">
+        <div>
+          <h1 className="font-heading text-3xl font-bold text-text-primary" data-testid="admin-broadcasts-title">
+            Broadcasts
+          </h1>
+          <p className="text-text-secondary mt-1">Email a group of customers by plan, data center, server status or unpaid invoices</p>
+        </div>
+
+        <div className="glass-card p-6 space-y-4">
+          <div>
+            <Label>Subject</Label>
+            <Input
+              value={form.subject}
+              onChange={(e) => update('subject', e.target.value)}
+              placeholder="Scheduled maintenance in {{ brand.company_name }}"
+              className="input-field mt-1"
+              data-testid="broadcast-subject"
+            />
+          </div>
+          <div>
+            <Label>Message (HTML)</Label>
+            <Textarea
+              value={form.message}
+              onChange={(e) => update('message', e.target.value)}
+              placeholder="<p>We will be upgrading...</p>"
+              rows={8}
+              className="input-field mt-1 font-mono text-sm"
+              data-testid="broadcast-message"
+            />
+            <p className="text-text-muted text-xs mt-1">
+              {'Use {{ user.full_name }}, {{ user.email }} and {{ brand.company_name }} to personalise.'}
+            </p>
+          </div>
+
+          <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
+            <div>
+              <Label>Plan</Label>
+              <Select value={form.plan_id} onValueChange={(v) => update('plan_id', v)}>
+                <SelectTrigger className="input-field mt-1" data-testid="broadcast-plan">
+                  <SelectValue />
+                </SelectTrigger>
+                <SelectContent>
+                  <SelectItem value={ANY}>Any plan</SelectItem>
+                  {plans.map((plan) => (
+                    <SelectItem key={plan.id} value={plan.id}>{plan.name}</SelectItem>
+                  ))}
+                </SelectContent>
+              </Select>
+            </div>
+            <div>
+              <Label>Data Center</Label>
+              <Select value={form.data_center_id} onValueChange={(v) => update('data_center_id', v)}>
+                <SelectTrigger className="input-field mt-1" data-testid="broadcast-datacenter">
+                  <SelectValue />
+                </SelectTrigger>
+                <SelectContent>
+                  <SelectItem value={ANY}>Any data center</SelectItem>
+                  {datacenters.map((dc) => (
+                    <SelectItem key={dc.id} value={dc.id}>{dc.name}</SelectItem>
+                  ))}
+                </SelectContent>
+              </Select>
+            </div>
+            <div>
+              <Label>Server Status</Label>
+              <Select value={form.server_status} onValueChange={(v) => update('server_status', v)}>
+                <SelectTrigger className="input-field mt-1" data-testid="broadcast-server-status">
+                  <SelectValue />
+                </SelectTrigger>
+                <SelectContent>
+                  <SelectItem value={ANY}>Any status</SelectItem>
+                  <SelectItem value="active">Active</SelectItem>
+                  <SelectItem value="suspended">Suspended</SelectItem>
+                  <SelectItem value="cancelled">Cancelled</SelectItem>
+                </SelectContent>
+              </Select>
+            </div>
+          </div>
+
+          <label className="flex items-center gap-2 text-text-secondary">
+            <Checkbox
+              checked={form.unpaid_invoices}
+              onCheckedChange={(checked) => update('unpaid_invoices', checked === true)}
+              data-testid="broadcast-unpaid"
+            />
+            Only customers with unpaid invoices
+          </label>
+
+          {preview && (
+            <div className="border border-white/10 rounded-lg p-4 space-y-2" data-testid="broadcast-preview">
+              <div className="flex items-center gap-2 text-text-primary">
+                <Users className="w-4 h-4" />
+                <span>{preview.recipients} recipients — {preview.segment_description}</span>
+              </div>
+              {preview.sample && (
+                <>
+                  <p className="text-text-secondary text-sm">
+                    To {preview.sample.email}: <span className="text-text-primary">{preview.sample.subject}</span>
+                  </p>
+                  <iframe
+                    title="Broadcast preview"
+                    srcDoc={preview.sample.html}
+                    sandbox=""
+                    className="w-full h-80 rounded bg-white"
+                  />
+                </>
+              )}
+            </div>
+          )}
+
+          <div className="flex gap-3">
+            <Button variant="outline" onClick={handlePreview} disabled={!form.subject || !form.message || previewing} data-testid="broadcast-preview-btn">
+              {previewing ? <Loader2 className="w-4 h-4 mr-2 animate-spin" /> : <Eye className="w-4 h-4 mr-2" />}
+              Preview
+            </Button>
+            <Button
+              className="btn-primary"
+              onClick={handleSend}
+              disabled={!preview || !preview.recipients || sending}
+              data-testid="broadcast-send-btn"
+            >
+              {sending ? <Loader2 className="w-4 h-4 mr-2 animate-spin" /> : <Send className="w-4 h-4 mr-2" />}
+              Send
+            </Button>
+          </div>
+        </div>
+
+        {broadcasts.length === 0 ? (
+          <div className="glass-card p-12 text-center">
+            <Megaphone className="w-12 h-12 text-text-muted mx-auto mb-4" />
+            <p className="text-text-secondary">No broadcasts sent yet</p>
+          </div>
+        ) : (
+          <div className="space-y-3">
+            {broadcasts.map((broadcast) => {
+              const done = broadcast.sent + broadcast.failed + (broadcast.suppressed || 0);
+              const percent = broadcast.queued ? Math.round((done / broadcast.queued) * 100) : 0;
+              const active = broadcast.status === 'preparing' || broadcast.status === 'sending';
+              return (
+                <div key={broadcast.id} className="glass-card p-4" data-testid={`broadcast-${broadcast.id}`}>
+                  <div className="flex items-start justify-between gap-4">
+                    <div className="min-w-0">
+                      <p className="text-text-primary font-medium truncate">{broadcast.subject}</p>
+                      <p className="text-text-muted text-sm">
+                        {broadcast.segment_description} · {new Date(broadcast.created_at).toLocaleString()} · {broadcast.created_by}
+                      </p>
+                    </div>
+                    <div className="flex items-center gap-2 shrink-0">
+                      <span className={`px-2 py-1 rounded text-xs font-medium ${STATUS_STYLES[broadcast.status]}`}>
+                        {broadcast.status}
+                      </span>
+                      {active && (
+                        <Button variant="ghost" size="sm" onClick={() => handleCancel(broadcast)} data-testid={`cancel-broadcast-${broadcast.id}`}>
+                          <XCircle className="w-4 h-4" />
+                        </Button>
+                      )}
+                    </div>
+                  </div>
+                  <div className="mt-3 h-2 rounded bg-white/5 overflow-hidden">
+                    <div className="h-full bg-primary transition-all" style={{ width: `${percent}%` }} />
+                  </div>
+                  <p className="text-text-muted text-xs mt-1">
+                    {broadcast.sent} sent · {broadcast.failed} failed · {broadcast.suppressed || 0} suppressed · {broadcast.queued} queued
+                  </p>
+                </div>
+              );
+            })}
+          </div>
+        )}
+      </div>
+    </DashboardLayout>
+  );
+};
+
+export default AdminBroadcasts;
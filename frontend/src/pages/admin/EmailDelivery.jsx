@@ -0,0 +1,220 @@
+import { useState, useEffect } from 'react';
+import { Mail, MailX, Plus, Trash2, CheckCircle, XCircle, Ban } from 'lucide-react';
+import DashboardLayout from '../../components/layout/DashboardLayout';
+import { Button } from '../../components/ui/button';
+import { Input } from '../../components/ui/input';
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../../components/ui/select';
+import { useAuth } from '../../context/AuthContext';
+import { toast } from 'sonner';
+
+const STATUS_STYLES = {
+  sent: 'bg-accent-success/20 text-accent-success',
+  failed: 'bg-accent-error/20 text-accent-error',
+  suppressed: 'bg-accent-warning/20 text-accent-warning',
+  not_configured: 'bg-gray-500/20 text-gray-400',
+};
+
+const AdminEmailDelivery = () => {
+  const { api } = useAuth();
+  const [days, setDays] = useState('7');
+  const [stats, setStats] = useState(null);
+  const [events, setEvents] = useState([]);
+  const [suppressions, setSuppressions] = useState([]);
+  const [newAddress, setNewAddress] = useState('');
+
+  useEffect(() => {
+    fetchStats();
+  }, [days]);
+
+  useEffect(() => {
+    fetchEvents();
+    fetchSuppressions();
+  }, []);
+
+  const fetchStats = async () => {
+    try {
+      const response = await api.get('/admin/email/stats', { params: { days } });
+      setStats(response.data);
+    } catch (error) {
+      console.error('Failed to fetch email stats:', error);
+    }
+  };
+
+  const fetchEvents = async () => {
+    try {
+      const response = await api.get('/admin/email/events', { params: { limit: 50 } });
+      setEvents(response.data);
+    } catch (error) {
+      console.error('Failed to fetch email events:', error);
+    }
+  };
+
+  const fetchSuppressions = async () => {
+    try {
+      const response = await api.get('/admin/email/suppressions');
+      setSuppressions(response.data);
+    } catch (error) {
+      console.error('Failed to fetch suppressions:', error);
+    }
+  };
+
+  const handleSuppress = async () => {
+    try {
+      await api.post('/admin/email/suppressions', { email: newAddress });
+      setNewAddress('');
+      toast.success('Address suppressed');
+      fetchSuppressions();
+    } catch (error) {
+      toast.error(error.response?.data?.detail?.[0]?.msg || error.response?.data?.detail || 'Failed to suppress address');
+    }
+  };
+
+  const handleUnsuppress = async (email) => {
+    if (!window.confirm(`Allow email to ${email} again?`)) return;
+    try {
+      await api.delete(`/admin/email/suppressions/${encodeURIComponent(email)}`);
+      setSuppressions(suppressions.filter((s) => s.email !== email));
+      toast.success('Address removed from the suppression list');
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Failed to remove address');
+    }
+  };
+
+  const summary = stats ? [
+    { label: 'Sent', value: stats.totals.sent, icon: CheckCircle, color: 'text-accent-success' },
+    { label: 'Failed', value: stats.totals.failed, icon: XCircle, color: 'text-accent-error' },
+    { label: 'Suppressed', value: stats.totals.suppressed, icon: Ban, color: 'text-accent-warning' },
+    { label: 'Failure Rate', value: `${(stats.failure_rate * 100).toFixed(1)}%`, icon: MailX, color: 'text-text-primary' },
+  ] : [];
+
+  return (
+    <DashboardLayout isAdmin>
+      <div className="space-y-6">
+        <div className="flex items-center justify-between">
+          <div>
+            <h1 className="font-heading text-3xl font-bold text-text-primary" data-testid="admin-email-title">
+              Email Delivery
+            </h1>
+            <p className="text-text-secondary mt-1">Delivery history and addresses that no longer receive email</p>
+          </div>
+          <Select value={days} onValueChange={setDays}>
+            <SelectTrigger className="w-36 input-field" data-testid="email-stats-days">
+              <SelectValue />
+            </SelectTrigger>
+            <SelectContent>
+              <SelectItem value="1">Last 24 hours</SelectItem>
+              <SelectItem value="7">Last 7 days</SelectItem>
+              <SelectItem value="30">Last 30 days</SelectItem>
+            </SelectContent>
+          </Select>
+        </div>
+
+        <div className="grid grid-cols-2 md:grid-cols-4 gap-4">
+          {summary.map((item) => (
+            <div key={item.label} className="glass-card p-4">
+              <div className="flex items-center gap-2 text-text-muted text-sm">
+                <item.icon className={`w-4 h-4 ${item.color}`} />
+                {item.label}
+              </div>
+              <p className="font-heading text-2xl font-bold text-text-primary mt-1">{item.value}</p>
+            </div>
+          ))}
+        </div>
+
+        {stats && stats.templates.length > 0 && (
+          <div className="glass-card overflow-hidden">
+            <table className="w-full">
+              <thead>
+                <tr className="border-b border-white/5">
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Template</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Sent</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Failed</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Suppressed</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Avg Latency</th>
+                </tr>
+              </thead>
+              <tbody className="divide-y divide-white/5">
+                {stats.templates.map((row) => (
+                  <tr key={row.template} className="hover:bg-white/5">
+                    <td className="px-6 py-4 font-mono text-text-primary">{row.template}</td>
+                    <td className="px-6 py-4 text-text-secondary">{row.sent}</td>
+                    <td className="px-6 py-4 text-text-secondary">{row.failed}</td>
+                    <td className="px-6 py-4 text-text-secondary">{row.suppressed}</td>
+                    <td className="px-6 py-4 text-text-secondary">
+                      {row.avg_latency_ms != null ? `${row.avg_latency_ms} ms` : '-'}
+                    </td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          </div>
+        )}
+
+        <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
+          <div className="glass-card p-6">
+            <h2 className="font-heading text-lg font-semibold text-text-primary mb-4">Recent Sends</h2>
+            {events.length === 0 ? (
+              <p className="text-text-muted text-sm">No emails sent yet</p>
+            ) : (
+              <div className="space-y-2 max-h-96 overflow-y-auto">
+                {events.map((event, i) => (
+                  <div key={i} className="flex items-center justify-between gap-3 text-sm">
+                    <div className="min-w-0">
+                      <p className="text-text-primary truncate">{event.to}</p>
+                      <p className="text-text-muted text-xs truncate" title={event.error || ''}>
+                        {event.template || 'other'} · {new Date(event.created_at).toLocaleString()}
+                        {event.error && ` · ${event.error}`}
+                      </p>
+                    </div>
+                    <span className={`px-2 py-1 rounded text-xs shrink-0 ${STATUS_STYLES[event.status]}`}>
+                      {event.status.replace('_', ' ')}
+                    </span>
+                  </div>
+                ))}
+              </div>
+            )}
+          </div>
+
+          <div className="glass-card p-6">
+            <h2 className="font-heading text-lg font-semibold text-text-primary mb-4">Suppressed Addresses</h2>
+            <div className="flex gap-2 mb-4">
+              <Input
+                value={newAddress}
+                onChange={(e) => setNewAddress(e.target.value)}
+                placeholder="customer@example.com"
+                className="input-field"
+                data-testid="suppress-email-input"
+              />
+              <Button onClick={handleSuppress} disabled={!newAddress} className="btn-primary" data-testid="suppress-email-btn">
+                <Plus className="w-4 h-4 mr-2" />
+                Suppress
+              </Button>
+            </div>
+            {suppressions.length === 0 ? (
+              <div className="text-center py-6">
+                <Mail className="w-10 h-10 text-text-muted mx-auto mb-2" />
+                <p className="text-text-muted text-sm">Every address can receive email</p>
+              </div>
+            ) : (
+              <div className="space-y-2 max-h-96 overflow-y-auto">
+                {suppressions.map((s) => (
+                  <div key={s.email} className="flex items-center justify-between gap-3 text-sm" data-testid={`suppression-${s.email}`}>
+                    <div className="min-w-0">
+                      <p className="text-text-primary truncate">{s.email}</p>
+                      <p className="text-text-muted text-xs truncate">{s.reason} · {s.source}{s.scope === 'marketing' ? ' · broadcasts only' : ''}</p>
+                    </div>
+                    <Button size="sm" variant="ghost" onClick={() => handleUnsuppress(s.email)} className="text-accent-error">
+                      <Trash2 className="w-4 h-4" />
+                    </Button>
+                  </div>
+                ))}
+              </div>
+            )}
+          </div>
+        </div>
+      </div>
+    </DashboardLayout>
+  );
+};
+
+export default AdminEmailDelivery;
@@ -0,0 +1,124 @@
+import { useState, useEffect } from 'react';
+import { Link } from 'react-router-dom';
+import { Search, User, MessageSquare, Server, Package, FileText, ChevronRight, Loader2 } from 'lucide-react';
+import DashboardLayout from '../../components/layout/DashboardLayout';
+import { Button } from '../../components/ui/button';
+import { Input } from '../../components/ui/input';
+import { useAuth } from '../../context/AuthContext';
+
+const PAGE_SIZE = 20;
+
+const RESULT_TYPES = {
+  user: { label: 'User', icon: User, href: (id) => `/admin/users/${id}` },
+  ticket: { label: 'Ticket', icon: MessageSquare, href: (id) => `/admin/tickets/${id}` },
+  server: { label: 'Server', icon: Server, href: () => '/admin/servers' },
+  order: { label: 'Order', icon: Package, href: () => '/admin/orders' },
+  invoice: { label: 'Invoice', icon: FileText, href: () => '/admin/billing' },
+};
+
+const AdminSearch = () => {
+  const { api } = useAuth();
+  const [query, setQuery] = useState('');
+  const [results, setResults] = useState([]);
+  const [hasMore, setHasMore] = useState(false);
+  const [loading, setLoading] = useState(false);
+
+  const runSearch = async (q, offset = 0) => {
+    setLoading(true);
+    try {
+      const response = await api.get('/admin/search', { params: { q, offset, limit: PAGE_SIZE } });
+      setResults(offset ? [...results, ...response.data.results] : response.data.results);
+      setHasMore(response.data.has_more);
+    } catch (error) {
+      console.error('Search failed:', error);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  // Search as the admin types, once they pause
+  useEffect(() => {
+    if (!query.trim()) {
+      setResults([]);
+      setHasMore(false);
+      return;
+    }
+    const timer = setTimeout(() => runSearch(query.trim()), 250);
+    return () => clearTimeout(timer);
+  }, [query]);
+
+  return (
+    <DashboardLayout isAdmin>
+      <div className="space-y-6">
+        <div>
+          <h1 className="font-heading text-3xl font-bold text-text-primary" data-testid="admin-search-title">
+            Search
+          </h1>
+          <p className="text-text-secondary mt-1">Find users, tickets, servers, orders and invoices</p>
+        </div>
+
+        <div className="relative">
+          <Search className="absolute left-3 top-1/2 -translate-y-1/2 w-5 h-5 text-text-muted" />
+          <Input
+            autoFocus
+            value={query}
+            onChange={(e) => setQuery(e.target.value)}
+            placeholder="Email, name, hostname, IP, invoice number, ticket #..."
+            className="input-field pl-10"
+            data-testid="admin-search-input"
+          />
+        </div>
+
+        {query.trim() && !loading && results.length === 0 ? (
+          <div className="glass-card p-12 text-center">
+            <Search className="w-12 h-12 text-text-muted mx-auto mb-4" />
+            <p className="text-text-secondary">No results for "{query}"</p>
+          </div>
+        ) : (
+          <div className="space-y-3">
+            {results.map((result) => {
+              const type = RESULT_TYPES[result.type];
+              return (
+                <Link
+                  key={`${result.type}-${result.id}`}
+                  to={type.href(result.id)}
+                  className="glass-card p-4 flex items-center gap-4 hover:border-primary/30 transition-colors group"
+                  data-testid={`search-result-${result.id}`}
+                >
+                  <div className="w-10 h-10 rounded-lg bg-white/5 flex items-center justify-center">
+                    <type.icon className="w-5 h-5 text-text-muted" />
+                  </div>
+                  <div className="flex-1 min-w-0">
+                    <p className="font-medium text-text-primary truncate group-hover:text-primary transition-colors">
+                      {result.title}
+                    </p>
+                    <p className="text-text-muted text-sm truncate">{result.subtitle}</p>
+                  </div>
+                  <span className="px-2 py-0.5 rounded text-xs font-medium bg-white/5 text-text-secondary">
+                    {type.label}
+                  </span>
+                  <ChevronRight className="w-5 h-5 text-text-muted group-hover:text-primary transition-colors" />
+                </Link>
+              );
+            })}
+          </div>
+        )}
+
+        {loading && (
+          <div className="flex justify-center">
+            <Loader2 className="w-6 h-6 animate-spin text-primary" />
+          </div>
+        )}
+        {hasMore && !loading && (
+          <div className="text-center">
+            <Button variant="outline" onClick={() => runSearch(query.trim(), results.length)} data-testid="search-load-more">
+              Load more
+            </Button>
+          </div>
+        )}
+      </div>
+    </DashboardLayout>
+  );
+};
+
+export default AdminSearch;
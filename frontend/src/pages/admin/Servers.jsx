@@ -25,6 +25,7 @@ const AdminServers = () => {
   const [allocateData, setAllocateData] = useState({
     user_id: '',
     plan_id: '',
+    from_inventory: false,
     hostname: '',
     ip_address: '',
     username: 'root',
@@ -96,7 +97,12 @@ const AdminServers = () => {
   };
 
   const handleAllocateServer = async () => {
-    if (!allocateData.user_id || !allocateData.hostname || !allocateData.ip_address) {
+    if (allocateData.from_inventory) {
+      if (!allocateData.user_id || !allocateData.plan_id || allocateData.plan_id === 'custom') {
+        toast.error('Select a user and a plan to allocate from inventory');
+        return;
+      }
+    } else if (!allocateData.user_id || !allocateData.hostname || !allocateData.ip_address) {
       toast.error('Please fill in all required fields');
       return;
     }
@@ -141,6 +147,7 @@ const AdminServers = () => {
     setAllocateData({
       user_id: '',
       plan_id: '',
+      from_inventory: false,
       hostname: '',
       ip_address: '',
       username: 'root',
@@ -250,6 +257,16 @@ const AdminServers = () => {
                     <Server className="w-4 h-4" />
                     Server Details
                   </h3>
+                  <label className="flex items-center gap-2 text-sm text-text-secondary cursor-pointer">
+                    <input
+                      type="checkbox"
+                      checked={allocateData.from_inventory}
+                      onChange={(e) => setAllocateData({ ...allocateData, from_inventory: e.target.checked })}
+                      data-testid="allocate-from-inventory"
+                    />
+                    Take the oldest available machine for the selected plan from inventory
+                  </label>
+                  {!allocateData.from_inventory && (
                   <div className="grid grid-cols-2 gap-4">
                     <div className="space-y-2">
                       <Label>Hostname *</Label>
@@ -272,9 +289,11 @@ const AdminServers = () => {
                       />
                     </div>
                   </div>
+                  )}
                 </div>
 
                 {/* SSH Credentials */}
+                {!allocateData.from_inventory && (
                 <div className="p-4 bg-white/5 rounded-lg space-y-4">
                   <h3 className="font-semibold text-text-primary">SSH / Root Credentials</h3>
                   <div className="grid grid-cols-3 gap-4">
@@ -313,8 +332,10 @@ const AdminServers = () => {
                     </div>
                   </div>
                 </div>
+                )}
 
                 {/* Control Panel Credentials (Optional) */}
+                {!allocateData.from_inventory && (
                 <div className="p-4 bg-white/5 rounded-lg space-y-4">
                   <h3 className="font-semibold text-text-primary">Control Panel (Optional)</h3>
                   <p className="text-text-muted text-sm">cPanel, WHM, Plesk, or any other control panel</p>
@@ -348,6 +369,7 @@ const AdminServers = () => {
                     </div>
                   </div>
                 </div>
+                )}
 
                 {/* Additional Notes */}
                 <div className="space-y-2">
@@ -0,0 +1,125 @@
+import { useState, useEffect } from 'react';
+import { Gauge, RotateCcw, AlertTriangle } from 'lucide-react';
+import DashboardLayout from '../../components/layout/DashboardLayout';
+import { Button } from '../../components/ui/button';
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../../components/ui/select';
+import { useAuth } from '../../context/AuthContext';
+import { toast } from 'sonner';
+
+const AdminSlowQueries = () => {
+  const { api, user } = useAuth();
+  const [sort, setSort] = useState('total_ms');
+  const [report, setReport] = useState(null);
+
+  useEffect(() => {
+    fetchReport();
+  }, [sort]);
+
+  const fetchReport = async () => {
+    try {
+      const response = await api.get('/admin/slow-queries', { params: { sort, limit: 50 } });
+      setReport(response.data);
+    } catch (error) {
+      console.error('Failed to fetch slow queries:', error);
+    }
+  };
+
+  const handleReset = async () => {
+    if (!window.confirm('Clear all recorded slow queries?')) return;
+    try {
+      const response = await api.delete('/admin/slow-queries');
+      toast.success(response.data.message);
+      fetchReport();
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Failed to clear slow queries');
+    }
+  };
+
+  const describePlan = (plan) => {
+    if (!plan) return 'Not explained yet';
+    if (plan.error) return plan.error;
+    const indexes = plan.indexes.length ? ` (${plan.indexes.join(', ')})` : '';
+    return `${plan.stages.join(' > ')}${indexes} · examined ${plan.docs_examined ?? '-'} docs for ${plan.returned ?? '-'} returned`;
+  };
+
+  return (
+    <DashboardLayout isAdmin>
+      <div className="space-y-6">
+        <div className="flex items-center justify-between">
+          <div>
+            <h1 className="font-heading text-3xl font-bold text-text-primary" data-testid="admin-slow-queries-title">
+              Slow Queries
+            </h1>
+            <p className="text-text-secondary mt-1">
+              Database queries slower than {report ? `${report.threshold_ms} ms` : 'the threshold'}, grouped by shape
+            </p>
+          </div>
+          <div className="flex gap-2">
+            <Select value={sort} onValueChange={setSort}>
+              <SelectTrigger className="w-40 input-field" data-testid="slow-queries-sort">
+                <SelectValue />
+              </SelectTrigger>
+              <SelectContent>
+                <SelectItem value="total_ms">Total time</SelectItem>
+                <SelectItem value="max_ms">Slowest run</SelectItem>
+                <SelectItem value="count">Most frequent</SelectItem>
+              </SelectContent>
+            </Select>
+            {user?.role === 'super_admin' && (
+              <Button variant="outline" onClick={handleReset} data-testid="reset-slow-queries-btn">
+                <RotateCcw className="w-4 h-4 mr-2" />
+                Reset
+              </Button>
+            )}
+          </div>
+        </div>
+
+        <div className="glass-card overflow-hidden">
+          {!report || report.shapes.length === 0 ? (
+            <div className="text-center py-12">
+              <Gauge className="w-12 h-12 text-text-muted mx-auto mb-3" />
+              <p className="text-text-muted">No slow queries recorded</p>
+            </div>
+          ) : (
+            <table className="w-full">
+              <thead>
+                <tr className="border-b border-white/5">
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Query</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Runs</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Avg</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Max</th>
+                  <th className="px-6 py-4 text-left text-xs font-medium text-text-muted uppercase">Total</th>
+                </tr>
+              </thead>
+              <tbody className="divide-y divide-white/5">
+                {report.shapes.map((shape) => (
+                  <tr key={shape.id} className="hover:bg-white/5 align-top" data-testid={`slow-query-${shape.id}`}>
+                    <td className="px-6 py-4 max-w-xl">
+                      <p className="text-text-primary font-medium">
+                        {shape.collection}.{shape.command}
+                        {shape.plan?.collection_scan && (
+                          <span className="ml-2 inline-flex items-center gap-1 px-2 py-0.5 rounded text-xs bg-accent-warning/20 text-accent-warning">
+                            <AlertTriangle className="w-3 h-3" />
+                            collection scan
+                          </span>
+                        )}
+                      </p>
+                      <p className="font-mono text-xs text-text-secondary break-all mt-1">{shape.shape}</p>
+                      <p className="text-xs text-text-muted mt-1">{describePlan(shape.plan)}</p>
+                    </td>
+                    <td className="px-6 py-4 text-text-secondary">{shape.count}</td>
+                    <td className="px-6 py-4 text-text-secondary">{shape.avg_ms} ms</td>
+                    <td className="px-6 py-4 text-text-secondary">{shape.max_ms} ms</td>
+                    <td className="px-6 py-4 text-text-secondary">{(shape.total_ms / 1000).toFixed(1)} s</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          )}
+        </div>
+      </div>
+    </DashboardLayout>
+  );
+};
+
+export default AdminSlowQueries;
@@ -6,6 +6,7 @@ import { Button } from '../../components/ui/button';
 import { Textarea } from '../../components/ui/textarea';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../../components/ui/select';
 import { useAuth } from '../../context/AuthContext';
+import { useEventStream } from '../../hooks/use-event-stream';
 import { formatDateTime, getStatusColor, getPriorityColor } from '../../lib/utils';
 import { toast } from 'sonner';
 
@@ -18,16 +19,54 @@ const AdminTicketDetails = () => {
   const [loading, setLoading] = useState(true);
   const [newMessage, setNewMessage] = useState('');
   const [sending, setSending] = useState(false);
+  const [hasMore, setHasMore] = useState(false);
 
   useEffect(() => {
     fetchTicket();
   }, [ticketId]);
 
+  // Pick up customer replies and status changes made by other staff
+  useEventStream(['ticket.message', 'ticket.status'], (type, data) => {
+    if (data.ticket_id !== ticketId) return;
+    if (type === 'ticket.status') {
+      setTicket((current) => ({ ...current, status: data.status }));
+    } else {
+      fetchNewMessages();
+    }
+  });
+
+  const appendMessages = (incoming) => {
+    setMessages((current) => [...current, ...incoming.filter((m) => !current.some((c) => c.id === m.id))]);
+  };
+
+  // Only pull the messages posted after the newest one already shown
+  const fetchNewMessages = async () => {
+    const last = messages[messages.length - 1];
+    if (!last) return fetchTicket();
+    try {
+      const response = await api.get(`/admin/tickets/${ticketId}/messages`, { params: { since: last.created_at, since_id: last.id } });
+      appendMessages(response.data.messages);
+    } catch (error) {
+      console.error('Failed to fetch messages:', error);
+    }
+  };
+
+  const fetchOlderMessages = async () => {
+    try {
+      const response = await api.get(`/admin/tickets/${ticketId}/messages`, { params: { before: messages[0].created_at, before_id: messages[0].id } });
+      setMessages((current) => [...response.data.messages, ...current]);
+      setHasMore(response.data.has_more);
+    } catch (error) {
+      toast.error('Failed to load earlier messages');
+    }
+  };
+
   const fetchTicket = async () => {
     try {
       const response = await api.get(`/admin/tickets/${ticketId}`);
       setTicket(response.data.ticket);
       setMessages(response.data.messages);
+      setHasMore(response.data.has_more);
       setTicketUser(response.data.user);
     } catch (error) {
       console.error('Failed to fetch ticket:', error);
@@ -45,12 +84,7 @@ const AdminTicketDetails = () => {
       await api.post(`/admin/tickets/${ticketId}/messages`, {
         message: newMessage,
       });
-      setMessages([...messages, {
-        id: Date.now().toString(),
-        message: newMessage,
-        is_staff: true,
-        created_at: new Date().toISOString(),
-      }]);
+      await fetchNewMessages();
       setNewMessage('');
       toast.success('Reply sent');
     } catch (error) {
@@ -128,6 +162,13 @@ const AdminTicketDetails = () => {
           {/* Messages */}
           <div className="lg:col-span-2 glass-card p-6">
             <div className="space-y-6 mb-6 max-h-[500px] overflow-y-auto">
+              {hasMore && (
+                <div className="text-center">
+                  <Button variant="ghost" size="sm" onClick={fetchOlderMessages} data-testid="load-earlier-messages">
+                    Load earlier messages
+                  </Button>
+                </div>
+              )}
               {messages.map((msg) => (
                 <div
                   key={msg.id}
@@ -1,9 +1,10 @@
 import { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
-import { MessageSquare, ChevronRight, User } from 'lucide-react';
+import { MessageSquare, ChevronRight, User, Clock } from 'lucide-react';
 import DashboardLayout from '../../components/layout/DashboardLayout';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../../components/ui/select';
 import { useAuth } from '../../context/AuthContext';
+import { useEventStream } from '../../hooks/use-event-stream';
 import { formatDate, getStatusColor, getPriorityColor } from '../../lib/utils';
 
 const AdminTickets = () => {
@@ -16,10 +17,14 @@ const AdminTickets = () => {
     fetchTickets();
   }, [statusFilter]);
 
+  useEventStream(['ticket.created', 'ticket.message', 'ticket.status', 'ticket.escalated'], () => fetchTickets());
+
   const fetchTickets = async () => {
     try {
-      const params = statusFilter !== 'all' ? { status: statusFilter } : {};
-      const response = await api.get('/admin/tickets', { params });
+      // The queue lists open tickets by SLA deadline rather than by age
+      const response = statusFilter === 'queue'
+        ? await api.get('/admin/tickets/queue')
+        : await api.get('/admin/tickets', { params: statusFilter !== 'all' ? { status: statusFilter } : {} });
       setTickets(response.data);
     } catch (error) {
       console.error('Failed to fetch tickets:', error);
@@ -54,6 +59,7 @@ const AdminTickets = () => {
               <SelectValue placeholder="Filter by status" />
             </SelectTrigger>
             <SelectContent>
+              <SelectItem value="queue">SLA Queue</SelectItem>
               <SelectItem value="all">All Tickets</SelectItem>
               <SelectItem value="open">Open</SelectItem>
               <SelectItem value="resolved">Resolved</SelectItem>
@@ -89,9 +95,28 @@ const AdminTickets = () => {
                     <span className={`px-2 py-0.5 rounded text-xs font-medium ${getPriorityColor(ticket.priority)}`}>
                       {ticket.priority}
                     </span>
+                    {ticket.sla_due_at && (
+                      <span
+                        className={`px-2 py-0.5 rounded text-xs font-medium flex items-center gap-1 ${
+                          new Date(ticket.sla_due_at) <= new Date() ? 'bg-accent-error/20 text-accent-error' : 'bg-white/5 text-text-secondary'
+                        }`}
+                        data-testid="ticket-sla"
+                      >
+                        <Clock className="w-3 h-3" />
+                        {new Date(ticket.sla_due_at) <= new Date() ? 'SLA breached' : `Due ${formatDate(ticket.sla_due_at)}`}
+                      </span>
+                    )}
+                    {ticket.staff_unread > 0 && (
+                      <span className="px-2 py-0.5 rounded-full text-xs font-medium bg-primary text-white" data-testid="ticket-unread">
+                        {ticket.staff_unread} new
+                      </span>
+                    )}
                   </div>
                   <p className="text-text-muted text-sm">
-                    Created {formatDate(ticket.created_at)} • Last updated {formatDate(ticket.updated_at)}
+                    Created {formatDate(ticket.created_at)} • {ticket.message_count} message{ticket.message_count === 1 ? '' : 's'}
+                    {ticket.last_message_at && (
+                      <> • Last reply by {ticket.last_message_by}{ticket.last_message_by_staff ? ' (staff)' : ''} {formatDate(ticket.last_message_at)}</>
+                    )}
                   </p>
                 </div>
                 <span className={`px-3 py-1 rounded text-sm font-medium ${getStatusColor(ticket.status)}`}>
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Server, Check, ChevronRight, Loader2, MapPin, Package, Plus, Minus, Wallet, Building2, Bitcoin, Copy } from 'lucide-react';
 import DashboardLayout from '../../components/layout/DashboardLayout';
@@ -26,6 +26,9 @@ const UserOrderServer = () => {
   const [submitting, setSubmitting] = useState(false);
   const [step, setStep] = useState(1);
   const [copied, setCopied] = useState(null);
+  const [quote, setQuote] = useState(null);
+  // Reused when a submission is retried after a network error, so the order is only placed once
+  const idempotencyKey = useRef(null);
 
   const [orderData, setOrderData] = useState({
     planId: '',
@@ -86,6 +89,24 @@ const UserOrderServer = () => {
     fetchData();
   }, [api]);
 
+  // Server-side price for the current selection; the local estimate is shown until it arrives
+  useEffect(() => {
+    if (!orderData.planId) {
+      setQuote(null);
+      return;
+    }
+    let cancelled = false;
+    api.post('/orders/quote', {
+      plan_id: orderData.planId,
+      billing_cycle: orderData.billingCycle,
+      data_center_id: orderData.dataCenterId || null,
+      addons: orderData.selectedAddons,
+    })
+      .then(response => { if (!cancelled) setQuote(response.data); })
+      .catch(() => { if (!cancelled) setQuote(null); });
+    return () => { cancelled = true; };
+  }, [api, orderData.planId, orderData.billingCycle, orderData.dataCenterId, orderData.selectedAddons]);
+
   const handleCopy = (text, type) => {
     navigator.clipboard.writeText(text);
     setCopied(type);
@@ -125,7 +146,7 @@ const UserOrderServer = () => {
     return total;
   };
 
-  const getTotalPrice = () => getBasePrice() + getAddonsPrice();
+  const getTotalPrice = () => quote ? quote.total : getBasePrice() + getAddonsPrice();
 
   const toggleAddon = (addonId) => {
     setOrderData(prev => ({
@@ -152,6 +173,9 @@ const UserOrderServer = () => {
     }
 
     setSubmitting(true);
+    if (!idempotencyKey.current) {
+      idempotencyKey.current = crypto.randomUUID();
+    }
     try {
       const response = await api.post('/orders/', {
         plan_id: orderData.planId,
@@ -162,7 +186,10 @@ const UserOrderServer = () => {
         addons: orderData.selectedAddons,
         payment_method: orderData.paymentMethod,
         notes: orderData.notes || null,
+      }, {
+        headers: { 'Idempotency-Key': idempotencyKey.current }
       });
+      idempotencyKey.current = null;
       
       if (orderData.paymentMethod === 'wallet') {
         toast.success('Order placed and paid successfully! Your server will be provisioned soon.');
@@ -172,6 +199,10 @@ const UserOrderServer = () => {
       }
       navigate(`/dashboard/orders/${response.data.id}`);
     } catch (error) {
+      if (error.response) {
+        // The server answered, so nothing is pending under this key
+        idempotencyKey.current = null;
+      }
       toast.error(error.response?.data?.detail || 'Failed to place order');
     } finally {
       setSubmitting(false);
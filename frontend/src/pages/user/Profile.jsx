@@ -77,7 +77,12 @@ const UserProfile = () => {
   const handleSetup2FA = async () => {
     try {
       const response = await api.post('/auth/setup-2fa');
-      setQrData(response.data);
+      // Render the QR code on our own API so the secret never leaves the platform
+      const qrImage = await api.get(`/auth/2fa-qr/${response.data.secret}`, {
+        params: { format: 'svg' },
+        responseType: 'blob',
+      });
+      setQrData({ ...response.data, qr_image_url: URL.createObjectURL(qrImage.data) });
       setShow2FASetup(true);
     } catch (error) {
       toast.error('Failed to setup 2FA');
@@ -312,7 +317,7 @@ const UserProfile = () => {
                 <div className="flex flex-col items-center gap-4">
                   <div className="p-4 bg-white rounded-lg">
                     <img
-                      src={`https://api.qrserver.com/v1/create-qr-code/?size=200x200&data=${encodeURIComponent(qrData.qr_uri)}`}
+                      src={qrData.qr_image_url}
                       alt="2FA QR Code"
                       className="w-48 h-48"
                     />
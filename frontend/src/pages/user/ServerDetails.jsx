@@ -5,6 +5,7 @@ import DashboardLayout from '../../components/layout/DashboardLayout';
 import { Button } from '../../components/ui/button';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogFooter, DialogDescription } from '../../components/ui/dialog';
 import { useAuth } from '../../context/AuthContext';
+import { useEventStream } from '../../hooks/use-event-stream';
 import { formatDate, getStatusColor } from '../../lib/utils';
 import { toast } from 'sonner';
 
@@ -24,6 +25,11 @@ const UserServerDetails = () => {
     fetchServer();
   }, [serverId]);
 
+  // Refresh when this server's status or control action changes
+  useEventStream(['server.status', 'server.action'], (type, data) => {
+    if (data.server_id === serverId) fetchServer();
+  });
+
   const fetchServer = async () => {
     try {
       const response = await api.get(`/servers/${serverId}`);
@@ -53,6 +59,7 @@ const UserServerDetails = () => {
       toast.success(response.data.message);
       setControlOpen(false);
       setControlAction(null);
+      fetchServer();
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Failed to submit request');
     } finally {
@@ -155,9 +162,17 @@ const UserServerDetails = () => {
               Request OS Reinstall
             </Button>
           </div>
-          <p className="text-text-muted text-sm mt-3">
-            Control actions will create a support ticket and our team will process your request.
-          </p>
+          {server.last_action ? (
+            <p className="text-text-muted text-sm mt-3" data-testid="last-action-status">
+              Last request: <span className="capitalize">{server.last_action.action}</span> &middot;{' '}
+              <span className={getStatusColor(server.last_action.status)}>{server.last_action.status}</span>
+              {server.last_action.error && ` (${server.last_action.error})`}
+            </p>
+          ) : (
+            <p className="text-text-muted text-sm mt-3">
+              The progress of your latest control request will be shown here.
+            </p>
+          )}
         </div>
 
         {/* Server Credentials */}
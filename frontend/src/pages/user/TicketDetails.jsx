@@ -5,33 +5,73 @@ import DashboardLayout from '../../components/layout/DashboardLayout';
 import { Button } from '../../components/ui/button';
 import { Textarea } from '../../components/ui/textarea';
 import { useAuth } from '../../context/AuthContext';
+import { useEventStream } from '../../hooks/use-event-stream';
 import { formatDateTime, getStatusColor, getPriorityColor } from '../../lib/utils';
 import { toast } from 'sonner';
 
 const UserTicketDetails = () => {
   const { ticketId } = useParams();
-  const { api, user } = useAuth();
+  const { api } = useAuth();
   const [ticket, setTicket] = useState(null);
   const [messages, setMessages] = useState([]);
   const [loading, setLoading] = useState(true);
   const [newMessage, setNewMessage] = useState('');
   const [sending, setSending] = useState(false);
+  const [hasMore, setHasMore] = useState(false);
+
+  const fetchTicket = async () => {
+    try {
+      const response = await api.get(`/tickets/${ticketId}`);
+      setTicket(response.data.ticket);
+      setMessages(response.data.messages);
+      setHasMore(response.data.has_more);
+    } catch (error) {
+      console.error('Failed to fetch ticket:', error);
+      toast.error('Failed to load ticket');
+    } finally {
+      setLoading(false);
+    }
+  };
 
   useEffect(() => {
-    const fetchTicket = async () => {
-      try {
-        const response = await api.get(`/tickets/${ticketId}`);
-        setTicket(response.data.ticket);
-        setMessages(response.data.messages);
-      } catch (error) {
-        console.error('Failed to fetch ticket:', error);
-        toast.error('Failed to load ticket');
-      } finally {
-        setLoading(false);
-      }
-    };
     fetchTicket();
-  }, [api, ticketId]);
+  }, [ticketId]);
+
+  // Pick up staff replies and status changes as they happen
+  useEventStream(['ticket.message', 'ticket.status'], (type, data) => {
+    if (data.ticket_id !== ticketId) return;
+    if (type === 'ticket.status') {
+      setTicket((current) => ({ ...current, status: data.status }));
+    } else {
+      fetchNewMessages();
+    }
+  });
+
+  const appendMessages = (incoming) => {
+    setMessages((current) => [...current, ...incoming.filter((m) => !current.some((c) => c.id === m.id))]);
+  };
+
+  // Only pull the messages posted after the newest one already shown
+  const fetchNewMessages = async () => {
+    const last = messages[messages.length - 1];
+    if (!last) return fetchTicket();
+    try {
+      const response = await api.get(`/tickets/${ticketId}/messages`, { params: { since: last.created_at, since_id: last.id } });
+      appendMessages(response.data.messages);
+    } catch (error) {
+      console.error('Failed to fetch messages:', error);
+    }
+  };
+
+  const fetchOlderMessages = async () => {
+    try {
+      const response = await api.get(`/tickets/${ticketId}/messages`, { params: { before: messages[0].created_at, before_id: messages[0].id } });
+      setMessages((current) => [...response.data.messages, ...current]);
+      setHasMore(response.data.has_more);
+    } catch (error) {
+      toast.error('Failed to load earlier messages');
+    }
+  };
 
   const handleSendMessage = async () => {
     if (!newMessage.trim()) return;
@@ -41,13 +81,7 @@ const UserTicketDetails = () => {
       await api.post(`/tickets/${ticketId}/messages`, {
         message: newMessage,
       });
-      setMessages([...messages, {
-        id: Date.now().toString(),
-        message: newMessage,
-        is_staff: false,
-        user_id: user.id,
-        created_at: new Date().toISOString(),
-      }]);
+      await fetchNewMessages();
       setNewMessage('');
       toast.success('Message sent');
     } catch (error) {
@@ -107,6 +141,13 @@ const UserTicketDetails = () => {
         {/* Messages */}
         <div className="glass-card p-6">
           <div className="space-y-6 mb-6 max-h-[500px] overflow-y-auto">
+            {hasMore && (
+              <div className="text-center">
+                <Button variant="ghost" size="sm" onClick={fetchOlderMessages} data-testid="load-earlier-messages">
+                  Load earlier messages
+                </Button>
+              </div>
+            )}
             {messages.map((msg) => (
               <div
                 key={msg.id}
@@ -210,9 +210,17 @@ const UserTickets = () => {
                     <span className={`px-2 py-0.5 rounded text-xs font-medium ${getPriorityColor(ticket.priority)}`}>
                       {ticket.priority}
                     </span>
+                    {ticket.user_unread > 0 && (
+                      <span className="px-2 py-0.5 rounded-full text-xs font-medium bg-primary text-white" data-testid="ticket-unread">
+                        {ticket.user_unread} new
+                      </span>
+                    )}
                   </div>
                   <p className="text-text-muted text-sm">
-                    Created {formatDate(ticket.created_at)} • Last updated {formatDate(ticket.updated_at)}
+                    Created {formatDate(ticket.created_at)} • {ticket.message_count} message{ticket.message_count === 1 ? '' : 's'}
+                    {ticket.last_message_at && (
+                      <> • Last reply from {ticket.last_message_by_staff ? 'Support' : 'you'} {formatDate(ticket.last_message_at)}</>
+                    )}
                   </p>
                 </div>
                 <span className={`px-3 py-1 rounded text-sm font-medium ${getStatusColor(ticket.status)}`}>
@@ -0,0 +1,1694 @@
+"""
+CloudNest API Tests - Iteration 6
+Testing performance and platform features:
+1. Claims-based admin authorization with per-area permissions
+2. Login throttling (token-bucket rate limiter)
+3. Cached 2FA QR code rendering with SVG output
+4. Hashed, TTL-expiring password reset and verification tokens
+5. Native datetime timestamps serialized as ISO 8601
+6. Idempotency-Key support for side-effecting endpoints
+7. In-memory pricing engine and order quotes
+8. Bulk server provisioning and allocation with per-row reports
+9. Server inventory pool with automatic allocation
+10. IP address management with subnet allocation
+11. Provisioning job queue for server control actions
+12. Live event stream for server, ticket, invoice and topup updates
+13. Ticket message cursors and unread counts
+14. Admin search across users, tickets, servers, orders and invoices
+15. Ticket SLA deadlines, work queue and escalation
+16. Message counts and latest-reply summaries on tickets
+17. Template-rendered emails
+18. Segment broadcasts through the email queue
+19. Email delivery log and suppression list
+20. Prometheus metrics endpoint
+21. Liveness and readiness probes
+22. Request tracing with W3C trace context
+23. Slow query report with explain plans
+24. Renewal invoices when the wallet cannot cover a renewal
+25. Transactional order writes and conditional wallet debits
+26. Admin allocation from the server inventory
+27. TOTP replay protection across steps and workers
+28. Search index rebuilds without freezing objects out of the collector
+29. SLA backfill over tickets with legacy ISO string timestamps
+30. Unsubscribes limited to broadcasts; suppressed queue messages are final
+31. Idempotency keys after handler and completion failures
+32. Email queue heartbeat while a rate-limited batch is sending
+33. Exact (created_at, id) cursors for ticket message pages
+34. Per-user bulk allocation writes in one unit of work
+35. Email queue leases that outlast slow batches
+36. Provisioning drivers missing an action fail without retries
+37. Bulk CSV row limits and address release for unsaved servers
+
+Tests using the local_* fixtures run in-process against a scratch database on
+TEST_MONGO_URL (a single-node replica set, for transactions) and are skipped
+when it is unset:
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval 'rs.initiate()'
+    TEST_MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0 pytest tests/test_cloudnest_iteration6.py
+"""
+import pytest
+import requests
+import os
+import sys
+import asyncio
+import uuid
+import jwt
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://cloudserver-1.preview.emergentagent.com')
+
+ADMIN_CREDENTIALS = {"email": "brijesh.kr.dube@gmail.com", "password": "Cloud@9874"}
+USER_CREDENTIALS = {"email": "test@test.com", "password": "Test123!"}
+
+TEST_MONGO_URL = os.environ.get('TEST_MONGO_URL', '')
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+@pytest.fixture
+def admin_token():
+    """Get admin token"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json=ADMIN_CREDENTIALS)
+    if response.status_code == 200:
+        return response.json()["access_token"]
+    pytest.skip("Admin login failed")
+
+
+@pytest.fixture
+def user_token():
+    """Get user token"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json=USER_CREDENTIALS)
+    if response.status_code == 200:
+        return response.json()["access_token"]
+    pytest.skip("User login failed")
+
+
+@pytest.fixture(scope="module")
+def local_loop():
+    """One event loop for all local tests; Motor clients stay bound to the loop they first ran on"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def local_server(local_loop):
+    """The backend imported in-process against a scratch database on TEST_MONGO_URL"""
+    if not TEST_MONGO_URL:
+        pytest.skip("TEST_MONGO_URL not set")
+    os.environ["MONGO_URL"] = TEST_MONGO_URL
+    os.environ["DB_NAME"] = f"test_iteration6_{uuid.uuid4().hex[:8]}"
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    yield server
+    local_loop.run_until_complete(server.client.drop_database(server.db.name))
+
+
+@pytest.fixture(scope="module")
+def local_client(local_loop):
+    """A Motor client on TEST_MONGO_URL, for testing backend modules without importing the app"""
+    if not TEST_MONGO_URL:
+        pytest.skip("TEST_MONGO_URL not set")
+    sys.path.insert(0, str(BACKEND_DIR))
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(TEST_MONGO_URL, tz_aware=True)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def local_db(local_client, local_loop):
+    """A scratch database dropped after the test"""
+    db = local_client[f"test_iteration6_{uuid.uuid4().hex[:8]}"]
+    yield db
+    local_loop.run_until_complete(local_client.drop_database(db.name))
+
+
+class TestAdminAuthorization:
+    """Test admin routes are authorized from token claims"""
+
+    def test_admin_token_carries_permissions(self, admin_token):
+        """Test admin token includes role, version and permissions claims"""
+        claims = jwt.decode(admin_token, options={"verify_signature": False})
+        assert claims["role"] in ["admin", "super_admin"]
+        assert "ver" in claims
+        assert set(claims["perms"]) == {"billing", "support", "provisioning"}
+        print(f"PASS: Admin token claims - perms: {claims['perms']}")
+
+    def test_user_token_has_no_permissions(self, user_token):
+        """Test regular user token has no admin permissions"""
+        claims = jwt.decode(user_token, options={"verify_signature": False})
+        assert claims["role"] == "user"
+        assert claims["perms"] == []
+        print("PASS: User token has no admin permissions")
+
+    def test_admin_routes_by_permission(self, admin_token):
+        """Test billing, support and provisioning routes accept a full admin"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        for path in ["/api/admin/invoices", "/api/admin/tickets", "/api/admin/servers"]:
+            response = requests.get(f"{BASE_URL}{path}", headers=headers)
+            assert response.status_code == 200, f"{path} returned {response.status_code}"
+        print("PASS: Admin permission routes accessible")
+
+    def test_user_cannot_access_admin_routes(self, user_token):
+        """Test regular user is rejected from admin routes"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/invoices", headers=headers)
+        assert response.status_code == 403
+        print("PASS: User rejected from admin routes")
+
+    def test_permissions_update_requires_super_admin(self, user_token):
+        """Test non-admins cannot change permissions"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.put(
+            f"{BASE_URL}/api/admin/users/some-user/permissions",
+            headers=headers,
+            json={"permissions": ["billing"]}
+        )
+        assert response.status_code == 403
+        print("PASS: Permission updates restricted")
+
+
+class TestLoginRateLimiting:
+    """Test failed logins are throttled per account"""
+
+    def test_repeated_failed_logins_are_throttled(self):
+        """Test an account is locked out with 429 after repeated bad passwords"""
+        email = f"TEST_ratelimit_{uuid.uuid4().hex[:8]}@example.com"
+        statuses = []
+        for _ in range(8):
+            response = requests.post(f"{BASE_URL}/api/auth/login", json={
+                "email": email,
+                "password": "wrong-password"
+            })
+            statuses.append(response.status_code)
+            if response.status_code == 429:
+                assert "Retry-After" in response.headers
+                break
+        assert statuses[0] == 401
+        assert statuses[-1] == 429, f"Expected throttling, got {statuses}"
+        print(f"PASS: Failed logins throttled after {len(statuses) - 1} attempts")
+
+    def test_successful_logins_not_throttled(self):
+        """Test repeated successful logins are never charged"""
+        for _ in range(8):
+            response = requests.post(f"{BASE_URL}/api/auth/login", json=USER_CREDENTIALS)
+            assert response.status_code == 200
+        print("PASS: Successful logins not throttled")
+
+    def test_concurrent_failures_limited_to_bucket(self, local_loop):
+        """Test a concurrent burst of bad logins runs no more attempts than the bucket holds"""
+        import httpx
+        from fastapi import FastAPI, HTTPException
+        sys.path.insert(0, str(BACKEND_DIR))
+        from rate_limit import RateLimiter, RateLimit, RateLimitMiddleware, InMemoryBackend
+        app, attempts = FastAPI(), []
+
+        @app.post("/api/auth/login")
+        async def login():
+            attempts.append(1)
+            await asyncio.sleep(0.05)  # password hashing
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+
+        @app.post("/api/auth/verify-2fa")
+        async def verify():
+            return {}
+
+        limiter = RateLimiter(InMemoryBackend(), {"login": {"ip": RateLimit(5, 60)}, "2fa": {"ip": RateLimit(5, 60)}})
+        app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                burst = await asyncio.gather(*(client.post("/api/auth/login") for _ in range(20)))
+                successes = [await client.post("/api/auth/verify-2fa") for _ in range(20)]
+            return [r.status_code for r in burst], [r.status_code for r in successes]
+
+        burst, successes = local_loop.run_until_complete(run())
+        assert len(attempts) == 5
+        assert sorted(burst) == [401] * 5 + [429] * 15
+        assert successes == [200] * 20
+        print(f"PASS: {len(attempts)} of 20 concurrent bad logins ran; successes refunded")
+
+    def test_client_ip_from_trusted_proxies_only(self):
+        """Test proxy headers are ignored from untrusted peers and spoofed hops are skipped"""
+        from starlette.requests import Request
+        sys.path.insert(0, str(BACKEND_DIR))
+        from rate_limit import get_client_ip, parse_trusted_proxies
+        trusted = parse_trusted_proxies("127.0.0.1,10.0.0.0/8")
+
+        def client_ip(peer, **headers):
+            scope = {"type": "http", "client": (peer, 50000),
+                     "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]}
+            return get_client_ip(Request(scope), trusted)
+
+        assert client_ip("198.51.100.7", x_real_ip="1.2.3.4", x_forwarded_for="1.2.3.4") == "198.51.100.7"
+        assert client_ip("127.0.0.1", x_forwarded_for="1.2.3.4, 198.51.100.7") == "198.51.100.7"
+        assert client_ip("127.0.0.1", x_forwarded_for="1.2.3.4, 198.51.100.7, 10.1.2.3") == "198.51.100.7"
+        assert client_ip("127.0.0.1", x_real_ip="198.51.100.7") == "198.51.100.7"
+        assert client_ip("127.0.0.1") == "127.0.0.1"
+        print("PASS: Client IP taken from trusted proxies only")
+
+
+class TestTwoFactorQRCode:
+    """Test 2FA setup QR code rendering"""
+
+    def test_qr_code_png_and_svg(self, user_token):
+        """Test QR code is served as PNG by default and as SVG on request"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        setup = requests.post(f"{BASE_URL}/api/auth/setup-2fa", headers=headers)
+        assert setup.status_code == 200
+        secret = setup.json()["secret"]
+
+        png = requests.get(f"{BASE_URL}/api/auth/2fa-qr/{secret}", headers=headers)
+        assert png.status_code == 200
+        assert png.headers["content-type"] == "image/png"
+        assert png.content.startswith(b"\x89PNG")
+
+        svg = requests.get(f"{BASE_URL}/api/auth/2fa-qr/{secret}", headers=headers, params={"format": "svg"})
+        assert svg.status_code == 200
+        assert svg.headers["content-type"].startswith("image/svg+xml")
+        assert b"<svg" in svg.content
+        print(f"PASS: QR code PNG ({len(png.content)} bytes) and SVG ({len(svg.content)} bytes)")
+
+    def test_qr_code_only_for_pending_secret(self, user_token):
+        """Test a secret other than the one issued by setup-2fa is not rendered"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/auth/2fa-qr/JBSWY3DPEHPK3PXP", headers=headers)
+        assert response.status_code == 404
+        print("PASS: QR code refused for a secret that is not pending")
+
+
+class TestAuthTokens:
+    """Test single-use auth token handling"""
+
+    def test_unknown_reset_token_rejected(self):
+        """Test reset-password rejects a token that was never issued"""
+        response = requests.post(f"{BASE_URL}/api/auth/reset-password", json={
+            "token": "not-a-real-token",
+            "new_password": "Whatever123!"
+        })
+        assert response.status_code == 400
+        print("PASS: Unknown reset token rejected")
+
+    def test_unknown_verification_token_rejected(self):
+        """Test verify-email rejects a token that was never issued"""
+        response = requests.get(f"{BASE_URL}/api/auth/verify-email", params={"token": "not-a-real-token"})
+        assert response.status_code == 400
+        print("PASS: Unknown verification token rejected")
+
+    def test_admin_token_stats(self, admin_token):
+        """Test admin can see token store statistics"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/auth-tokens/stats", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert "purposes" in data
+        assert set(data["counters"]) == {"issued", "redeemed", "rejected"}
+        print(f"PASS: Token stats - {data['purposes']}")
+
+
+class TestTimestamps:
+    """Test timestamps keep their ISO 8601 format in API responses"""
+
+    def test_profile_created_at_is_iso(self, user_token):
+        """Test created_at parses as a timezone-aware ISO timestamp"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/auth/me", headers=headers)
+        assert response.status_code == 200
+        created_at = datetime.fromisoformat(response.json()["created_at"])
+        assert created_at.tzinfo is not None
+        print(f"PASS: created_at = {created_at.isoformat()}")
+
+    def test_invoice_dates_are_iso(self, user_token):
+        """Test invoice due and creation dates parse as ISO timestamps"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/invoices", headers=headers)
+        assert response.status_code == 200
+        for invoice in response.json():
+            datetime.fromisoformat(invoice["created_at"])
+            datetime.fromisoformat(invoice["due_date"])
+        print(f"PASS: {len(response.json())} invoices with ISO dates")
+
+
+class TestIdempotencyKeys:
+    """Test retried requests with an Idempotency-Key are replayed, not re-executed"""
+
+    def test_order_retry_is_replayed(self, user_token):
+        """Test the same key returns the same order, and a different body is rejected"""
+        headers = {"Authorization": f"Bearer {user_token}", "Idempotency-Key": f"TEST_{uuid.uuid4().hex}"}
+        plans = requests.get(f"{BASE_URL}/api/plans").json()
+        order = {
+            "plan_id": plans[0]["id"],
+            "billing_cycle": "monthly",
+            "os": "Ubuntu 22.04",
+            "payment_method": "bank_transfer"
+        }
+        first = requests.post(f"{BASE_URL}/api/orders/", json=order, headers=headers)
+        assert first.status_code == 200
+        retry = requests.post(f"{BASE_URL}/api/orders/", json=order, headers=headers)
+        assert retry.status_code == 200
+        assert retry.json()["id"] == first.json()["id"]
+        assert retry.headers.get("Idempotent-Replayed") == "true"
+
+        changed = requests.post(f"{BASE_URL}/api/orders/", json=dict(order, billing_cycle="yearly"), headers=headers)
+        assert changed.status_code == 422
+        print(f"PASS: Order {first.json()['id']} replayed for retried key")
+
+
+class TestOrderQuote:
+    """Test order quotes from the pricing engine"""
+
+    def test_quote_converts_monthly_addons(self, user_token):
+        """Test a monthly add-on on a yearly order is charged for 12 months"""
+        plans = requests.get(f"{BASE_URL}/api/plans").json()
+        addons = requests.get(f"{BASE_URL}/api/addons/").json()
+        monthly_addon = next((a for a in addons if a["billing_cycle"] == "monthly"), None)
+        if monthly_addon is None:
+            pytest.skip("No monthly add-on available")
+        plan = plans[0]
+
+        response = requests.post(f"{BASE_URL}/api/orders/quote", json={
+            "plan_id": plan["id"],
+            "billing_cycle": "yearly",
+            "addons": [monthly_addon["id"]]
+        }, headers={"Authorization": f"Bearer {user_token}"})
+        assert response.status_code == 200
+        quote = response.json()
+        assert quote["base_price"] == plan["price_yearly"]
+        assert quote["addon_details"][0]["price"] == pytest.approx(monthly_addon["price"] * 12)
+        assert quote["total"] == pytest.approx(plan["price_yearly"] + monthly_addon["price"] * 12)
+        print(f"PASS: Quote total {quote['total']}")
+
+    def test_quote_unknown_plan(self, user_token):
+        """Test quoting an unknown plan returns 404"""
+        response = requests.post(f"{BASE_URL}/api/orders/quote", json={
+            "plan_id": "non-existent-plan",
+            "billing_cycle": "monthly"
+        }, headers={"Authorization": f"Bearer {user_token}"})
+        assert response.status_code == 404
+        print("PASS: Unknown plan not quoted")
+
+    def test_quote_requires_login(self):
+        """Test quotes are not served to anonymous clients"""
+        response = requests.post(f"{BASE_URL}/api/orders/quote", json={
+            "plan_id": "non-existent-plan",
+            "billing_cycle": "monthly"
+        })
+        assert response.status_code in (401, 403)
+        print("PASS: Anonymous quote rejected")
+
+
+class TestBulkProvisioning:
+    """Test bulk server endpoints validate rows and report per row"""
+
+    def test_bulk_allocate_reports_invalid_rows(self, admin_token):
+        """Test rows for unknown users are reported without creating servers"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.post(f"{BASE_URL}/api/admin/servers/allocate/bulk", headers=headers, json={
+            "allocations": [
+                {"user_id": "non-existent-user", "hostname": "TEST-bulk-1", "ip_address": "192.0.2.1", "password": "x", "payment_received": True},
+                {"user_id": "non-existent-user", "hostname": "TEST-bulk-2", "ip_address": "192.0.2.2", "password": "x"}
+            ]
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert data["created"] == 0
+        assert data["failed"] == 2
+        assert [r["row"] for r in data["results"]] == [1, 2]
+        assert all(r["status"] == "error" for r in data["results"])
+        print("PASS: Bulk allocation reports invalid rows")
+
+    def test_bulk_csv_reports_parse_errors(self, admin_token):
+        """Test CSV rows failing validation are reported by row number"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        csv_data = "order_id,ip_address,hostname,username,password,ssh_port\nnon-existent-order,192.0.2.10,TEST-h1,root,x,not-a-port\n"
+        response = requests.post(
+            f"{BASE_URL}/api/admin/servers/bulk/csv",
+            headers=headers,
+            files={"file": ("servers.csv", csv_data, "text/csv")}
+        )
+        assert response.status_code == 200
+        result = response.json()["results"][0]
+        assert result["row"] == 1
+        assert "ssh_port" in result["error"]
+        print(f"PASS: CSV row error - {result['error']}")
+
+    def test_bulk_requires_provisioning_admin(self, user_token):
+        """Test regular users cannot call bulk endpoints"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.post(f"{BASE_URL}/api/admin/servers/bulk", headers=headers, json={"servers": []})
+        assert response.status_code == 403
+        print("PASS: Bulk provisioning restricted")
+
+
+class TestServerInventory:
+    """Test the server inventory pool endpoints"""
+
+    def test_availability(self, admin_token):
+        """Test availability is reported per plan and data center"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/inventory/availability", headers=headers)
+        assert response.status_code == 200
+        for entry in response.json():
+            assert {"plan_id", "data_center_id", "available"} <= set(entry)
+        print(f"PASS: Availability for {len(response.json())} plan/data center pairs")
+
+    def test_add_machine_with_unknown_plan(self, admin_token):
+        """Test machines for unknown plans are rejected per row"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.post(f"{BASE_URL}/api/admin/inventory", headers=headers, json={
+            "machines": [{
+                "data_center_id": "non-existent-dc",
+                "plan_id": "non-existent-plan",
+                "hostname": "TEST-inventory",
+                "ip_address": "192.0.2.50",
+                "password": "x"
+            }]
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert data["created"] == 0
+        assert data["results"][0]["error"] == "Plan not found"
+        print("PASS: Unknown plan rejected")
+
+    def test_inventory_requires_admin(self, user_token):
+        """Test regular users cannot see the inventory"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/inventory", headers=headers)
+        assert response.status_code == 403
+        print("PASS: Inventory restricted to admins")
+
+
+class TestIPAddressManagement:
+    """Test subnets, next free address lookups and IP conflict checks"""
+
+    def test_subnet_lifecycle(self, admin_token):
+        """Test a subnet can be added, queried for its next free address and removed"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        datacenter = requests.get(f"{BASE_URL}/api/datacenters/").json()[0]
+        cidr = f"198.18.{uuid.uuid4().int % 256}.0/24"
+        response = requests.post(f"{BASE_URL}/api/admin/subnets", headers=headers, json={
+            "data_center_id": datacenter["id"], "cidr": cidr, "gateway": cidr.replace("0/24", "1")
+        })
+        if response.status_code == 400 and "overlaps" in response.json()["detail"]:
+            pytest.skip(f"{cidr} is left over from an earlier run")
+        assert response.status_code == 200
+        subnet_id = response.json()["id"]
+
+        response = requests.get(f"{BASE_URL}/api/admin/subnets/{subnet_id}/next-free", headers=headers)
+        assert response.status_code == 200
+        # .0 is the network address and .1 the gateway
+        assert response.json()["ip_address"] == cidr.replace("0/24", "2")
+        assert response.json()["free"] == 253
+
+        response = requests.delete(f"{BASE_URL}/api/admin/subnets/{subnet_id}", headers=headers)
+        assert response.status_code == 200
+        print(f"PASS: Subnet {cidr} created, queried and deleted")
+
+    def test_invalid_subnet_rejected(self, admin_token):
+        """Test malformed and oversized subnets are rejected"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        datacenter = requests.get(f"{BASE_URL}/api/datacenters/").json()[0]
+        for cidr in ("not-a-subnet", "10.0.0.0/8"):
+            response = requests.post(f"{BASE_URL}/api/admin/subnets", headers=headers, json={
+                "data_center_id": datacenter["id"], "cidr": cidr
+            })
+            assert response.status_code == 400
+        print("PASS: Invalid subnets rejected")
+
+    def test_ip_address_check(self, admin_token):
+        """Test an unused address is reported available and a malformed one rejected"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/ip-addresses/192.0.2.254", headers=headers)
+        assert response.status_code == 200
+        assert "available" in response.json()
+        response = requests.get(f"{BASE_URL}/api/admin/ip-addresses/999.1.1.1", headers=headers)
+        assert response.status_code == 400
+        print("PASS: IP address check")
+
+    def test_subnets_require_admin(self, user_token):
+        """Test regular users cannot see subnets"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/subnets", headers=headers)
+        assert response.status_code == 403
+        print("PASS: Subnets restricted to admins")
+
+
+class TestProvisioningJobs:
+    """Test server control actions and the provisioning job endpoints"""
+
+    def test_actions_for_unknown_server(self, user_token):
+        """Test action history is only served for the user's own servers"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/servers/non-existent-server/actions", headers=headers)
+        assert response.status_code == 404
+        print("PASS: Unknown server has no actions")
+
+    def test_control_action_status(self, user_token):
+        """Test a queued control action is visible on the server while it runs"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        servers = requests.get(f"{BASE_URL}/api/servers/", headers=headers).json()
+        if not servers:
+            pytest.skip("Test user has no servers")
+        server = servers[0]
+        response = requests.post(f"{BASE_URL}/api/servers/{server['id']}/control", headers=headers,
+                                 json={"action": "reboot", "confirm": True})
+        assert response.status_code in [200, 400, 409]
+        if response.status_code == 200 and "job_id" in response.json():
+            detail = requests.get(f"{BASE_URL}/api/servers/{server['id']}", headers=headers).json()
+            assert detail["last_action"]["job_id"] == response.json()["job_id"]
+            actions = requests.get(f"{BASE_URL}/api/servers/{server['id']}/actions", headers=headers).json()
+            assert actions[0]["id"] == response.json()["job_id"]
+        print(f"PASS: Control action request - {response.json()}")
+
+    def test_admin_job_list(self, admin_token):
+        """Test admins can list jobs by status"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/provisioning/jobs", headers=headers, params={"status": "failed"})
+        assert response.status_code == 200
+        assert all(job["status"] == "failed" for job in response.json())
+        print(f"PASS: {len(response.json())} failed jobs")
+
+    def test_retry_unknown_job(self, admin_token):
+        """Test retrying a job that does not exist fails"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.post(f"{BASE_URL}/api/admin/provisioning/jobs/non-existent-job/retry", headers=headers)
+        assert response.status_code in [400, 404]
+        print("PASS: Unknown job not retried")
+
+    def test_jobs_require_admin(self, user_token):
+        """Test regular users cannot list provisioning jobs"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/provisioning/jobs", headers=headers)
+        assert response.status_code == 403
+        print("PASS: Provisioning jobs restricted to admins")
+
+
+class TestLiveEvents:
+    """Test the server-sent event stream"""
+
+    def test_stream_ticket(self, user_token):
+        """Test a logged in user can get a stream ticket"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.post(f"{BASE_URL}/api/events/ticket", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["ticket"]
+        print("PASS: Stream ticket issued")
+
+    def test_stream_rejects_bad_ticket(self):
+        """Test the stream cannot be opened without a valid ticket"""
+        response = requests.get(f"{BASE_URL}/api/events/stream", params={"ticket": "not-a-ticket"}, timeout=10)
+        assert response.status_code == 401
+        print("PASS: Invalid stream ticket rejected")
+
+    def test_stream_opens_once_per_ticket(self, user_token):
+        """Test a ticket opens one event stream and cannot be reused"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        ticket = requests.post(f"{BASE_URL}/api/events/ticket", headers=headers).json()["ticket"]
+        params = {"ticket": ticket, "types": "server.status,ticket.message"}
+        with requests.get(f"{BASE_URL}/api/events/stream", params=params, stream=True, timeout=10) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+        response = requests.get(f"{BASE_URL}/api/events/stream", params=params, timeout=10)
+        assert response.status_code == 401
+        print("PASS: Event stream opened and ticket used up")
+
+
+class TestTicketMessagePages:
+    """Test paging ticket messages and unread counts"""
+
+    def test_new_messages_since_cursor(self, user_token, admin_token):
+        """Test only messages after the cursor are returned and replies count as unread"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        ticket = requests.post(f"{BASE_URL}/api/tickets/", headers=headers, json={
+            "subject": f"TEST_paging_{uuid.uuid4().hex[:6]}", "message": "First message", "priority": "low"
+        }).json()
+        detail = requests.get(f"{BASE_URL}/api/tickets/{ticket['id']}", headers=headers).json()
+        assert detail["has_more"] is False
+        last = detail["messages"][-1]["created_at"]
+
+        response = requests.post(f"{BASE_URL}/api/admin/tickets/{ticket['id']}/messages", headers=admin_headers,
+                                 json={"message": "Staff reply"})
+        assert response.status_code == 200
+        tickets = requests.get(f"{BASE_URL}/api/tickets/", headers=headers).json()
+        assert next(t for t in tickets if t["id"] == ticket["id"])["user_unread"] == 1
+
+        page = requests.get(f"{BASE_URL}/api/tickets/{ticket['id']}/messages", headers=headers,
+                            params={"since": last}).json()
+        assert [m["message"] for m in page["messages"]] == ["Staff reply"]
+        tickets = requests.get(f"{BASE_URL}/api/tickets/", headers=headers).json()
+        assert next(t for t in tickets if t["id"] == ticket["id"])["user_unread"] == 0
+        print("PASS: Incremental fetch returned only the new reply")
+
+    def test_page_size_limit(self, user_token):
+        """Test oversized pages are rejected"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        tickets = requests.get(f"{BASE_URL}/api/tickets/", headers=headers).json()
+        if not tickets:
+            pytest.skip("Test user has no tickets")
+        response = requests.get(f"{BASE_URL}/api/tickets/{tickets[0]['id']}/messages", headers=headers,
+                                params={"limit": 1000})
+        assert response.status_code == 422
+        print("PASS: Page size limited")
+
+
+class TestAdminSearch:
+    """Test the admin search endpoint"""
+
+    def test_find_new_ticket(self, user_token, admin_token):
+        """Test a ticket is searchable by subject and short id as soon as it is created"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        word = f"zq{uuid.uuid4().hex[:10]}"
+        ticket = requests.post(f"{BASE_URL}/api/tickets/", headers=headers, json={
+            "subject": f"TEST search {word}", "message": "Searchable ticket", "priority": "low"
+        }).json()
+        response = requests.get(f"{BASE_URL}/api/admin/search", headers=admin_headers, params={"q": word})
+        if response.status_code == 503:
+            pytest.skip("Search index is still being built")
+        assert response.status_code == 200
+        assert [r["id"] for r in response.json()["results"]] == [ticket["id"]]
+
+        response = requests.get(f"{BASE_URL}/api/admin/search", headers=admin_headers,
+                                params={"q": f"#{ticket['id'][:8]}", "types": "ticket"})
+        assert response.json()["results"][0]["id"] == ticket["id"]
+        print("PASS: New ticket found by subject and short id")
+
+    def test_find_user_by_email_prefix(self, admin_token):
+        """Test users are found from the start of their email"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/search", headers=headers, params={"q": "test@te", "types": "user"})
+        if response.status_code == 503:
+            pytest.skip("Search index is still being built")
+        assert response.status_code == 200
+        assert any(r["subtitle"] == USER_CREDENTIALS["email"] for r in response.json()["results"])
+        print("PASS: User found by email prefix")
+
+    def test_search_pagination(self, admin_token):
+        """Test search pages respect the limit"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/search", headers=headers, params={"q": "test", "limit": 2})
+        if response.status_code == 503:
+            pytest.skip("Search index is still being built")
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["results"]) <= 2
+        assert isinstance(data["has_more"], bool)
+        print(f"PASS: {len(data['results'])} results, has_more={data['has_more']}")
+
+    def test_search_requires_admin(self, user_token):
+        """Test regular users cannot search"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/search", headers=headers, params={"q": "test"})
+        assert response.status_code == 403
+        print("PASS: Search restricted to admins")
+
+
+class TestTicketSLA:
+    """Test ticket SLA deadlines and the support work queue"""
+
+    def test_deadlines_follow_replies(self, user_token, admin_token):
+        """Test a staff reply moves the ticket onto its resolution deadline and closing clears it"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        ticket = requests.post(f"{BASE_URL}/api/tickets/", headers=headers, json={
+            "subject": "TEST SLA ticket", "message": "Waiting for a reply", "priority": "high"
+        }).json()
+        detail = requests.get(f"{BASE_URL}/api/admin/tickets/{ticket['id']}", headers=admin_headers).json()["ticket"]
+        assert detail["sla_due_at"] == detail["response_due_at"]
+        assert detail["resolution_due_at"] > detail["response_due_at"]
+
+        requests.post(f"{BASE_URL}/api/admin/tickets/{ticket['id']}/messages", headers=admin_headers,
+                      json={"message": "Looking into it"})
+        detail = requests.get(f"{BASE_URL}/api/admin/tickets/{ticket['id']}", headers=admin_headers).json()["ticket"]
+        assert "response_due_at" not in detail
+        assert detail["sla_due_at"] == detail["resolution_due_at"]
+        assert detail["first_response_at"]
+
+        requests.put(f"{BASE_URL}/api/admin/tickets/{ticket['id']}/status", headers=admin_headers,
+                     params={"status": "resolved"})
+        detail = requests.get(f"{BASE_URL}/api/admin/tickets/{ticket['id']}", headers=admin_headers).json()["ticket"]
+        assert "sla_due_at" not in detail
+        print("PASS: SLA deadline follows replies and status")
+
+    def test_queue_in_deadline_order(self, admin_token):
+        """Test the work queue lists open tickets by SLA deadline"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/tickets/queue", headers=headers, params={"limit": 20})
+        assert response.status_code == 200
+        tickets = response.json()
+        deadlines = [t["sla_due_at"] for t in tickets]
+        assert deadlines == sorted(deadlines)
+        assert all(isinstance(t["sla_breached"], bool) for t in tickets)
+        assert all(t["status"] not in ("resolved", "closed") for t in tickets)
+        print(f"PASS: {len(tickets)} tickets in deadline order")
+
+    def test_run_sla_check(self, admin_token):
+        """Test the escalation job can be triggered"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.post(f"{BASE_URL}/api/admin/run-sla-check", headers=headers)
+        assert response.status_code == 200
+        assert "started" in response.json()["message"]
+        print("PASS: SLA check started")
+
+    def test_queue_requires_admin(self, user_token):
+        """Test regular users cannot see the work queue"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/admin/tickets/queue", headers=headers)
+        assert response.status_code == 403
+        print("PASS: Work queue restricted to admins")
+
+
+class TestTicketSummaries:
+    """Test message summaries kept on the ticket document"""
+
+    def test_summary_follows_messages(self, user_token, admin_token):
+        """Test the message count and latest reply update with each message"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        admin_headers = {"Authorization": f"Bearer {admin_token}"}
+        ticket = requests.post(f"{BASE_URL}/api/tickets/", headers=headers, json={
+            "subject": "TEST summary ticket", "message": "First message", "priority": "low"
+        }).json()
+        assert ticket["message_count"] == 1
+        assert ticket["last_message_by_staff"] is False
+
+        requests.post(f"{BASE_URL}/api/admin/tickets/{ticket['id']}/messages", headers=admin_headers,
+                      json={"message": "Staff reply"})
+        tickets = requests.get(f"{BASE_URL}/api/admin/tickets", headers=admin_headers).json()
+        summary = next(t for t in tickets if t["id"] == ticket["id"])
+        assert summary["message_count"] == 2
+        assert summary["last_message_by_staff"] is True
+        assert summary["last_message_by"]
+        assert summary["last_message_at"] >= ticket["last_message_at"]
+        print("PASS: Ticket summary follows messages")
+
+    def test_user_list_hides_staff_names(self, user_token):
+        """Test customers see who replied last without staff names"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        tickets = requests.get(f"{BASE_URL}/api/tickets/", headers=headers).json()
+        if not tickets:
+            pytest.skip("Test user has no tickets")
+        assert all("last_message_by" not in t and "message_count" in t for t in tickets)
+        print("PASS: User ticket list carries summaries")
+
+
+class TestEmailTemplates:
+    """Test endpoints that send template-rendered emails"""
+
+    def test_contact_form_with_markup(self):
+        """Test the contact confirmation accepts names that need escaping"""
+        response = requests.post(f"{BASE_URL}/api/contact", json={
+            "name": "TEST <b>O'Neil & Sons</b>", "email": "test.contact@example.com",
+            "subject": "TEST template email", "message": "Checking email rendering"
+        })
+        assert response.status_code == 200
+        print("PASS: Contact confirmation queued")
+
+    def test_forgot_password(self):
+        """Test the password reset email is queued for a known address"""
+        response = requests.post(f"{BASE_URL}/api/auth/forgot-password", json={"email": USER_CREDENTIALS["email"]})
+        assert response.status_code in (200, 429)
+        print("PASS: Password reset email queued")
+
+    def test_notify_user(self, admin_token, user_token):
+        """Test admins can send a notification email to a user"""
+        user = requests.get(f"{BASE_URL}/api/auth/me", headers={"Authorization": f"Bearer {user_token}"}).json()
+        response = requests.post(f"{BASE_URL}/api/admin/users/{user['id']}/notify",
+                                 headers={"Authorization": f"Bearer {admin_token}"},
+                                 params={"subject": "TEST notice", "message": "<p>Template test</p>"})
+        assert response.status_code == 200
+        assert USER_CREDENTIALS["email"] in response.json()["message"]
+        print("PASS: Notification email queued")
+
+
+class TestBroadcasts:
+    """Test admin broadcasts to customer segments"""
+
+    def test_preview_rejects_invalid_template(self, admin_token):
+        """Test broken or unsafe templates are refused before anything is queued"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        for subject in ("TEST {{ user.full_name", "{{ ''.__class__.__mro__ }}"):
+            response = requests.post(f"{BASE_URL}/api/admin/broadcasts/preview", headers=headers,
+                                     json={"subject": subject, "message": "<p>Hi</p>"})
+            assert response.status_code == 400
+        print("PASS: Invalid broadcast templates rejected")
+
+    def test_empty_segment_completes(self, admin_token):
+        """Test a broadcast to a segment with no customers completes without sending"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        body = {"subject": "TEST broadcast {{ user.full_name }}", "message": "<p>Hello</p>",
+                "segment": {"plan_id": f"TEST-{uuid.uuid4()}"}}
+        preview = requests.post(f"{BASE_URL}/api/admin/broadcasts/preview", headers=headers, json=body).json()
+        assert preview["recipients"] == 0
+        assert preview["sample"] is None
+
+        broadcast = requests.post(f"{BASE_URL}/api/admin/broadcasts", headers=headers, json=body).json()
+        assert broadcast["status"] == "preparing"
+        response = requests.get(f"{BASE_URL}/api/admin/broadcasts/{broadcast['id']}", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["queued"] == 0
+        assert any(b["id"] == broadcast["id"] for b in requests.get(f"{BASE_URL}/api/admin/broadcasts", headers=headers).json())
+        print("PASS: Empty segment broadcast created")
+
+    def test_cancel_unknown_broadcast(self, admin_token):
+        """Test cancelling a broadcast that does not exist"""
+        response = requests.post(f"{BASE_URL}/api/admin/broadcasts/{uuid.uuid4()}/cancel",
+                                 headers={"Authorization": f"Bearer {admin_token}"})
+        assert response.status_code == 404
+        print("PASS: Unknown broadcast returns 404")
+
+    def test_requires_admin(self, user_token):
+        """Test customers cannot list broadcasts"""
+        response = requests.get(f"{BASE_URL}/api/admin/broadcasts", headers={"Authorization": f"Bearer {user_token}"})
+        assert response.status_code == 403
+        print("PASS: Broadcasts require admin")
+
+
+class TestEmailDelivery:
+    """Test the email delivery log and suppression list"""
+
+    def test_stats(self, admin_token):
+        """Test delivery stats are grouped by template"""
+        response = requests.get(f"{BASE_URL}/api/admin/email/stats", params={"days": 7},
+                                headers={"Authorization": f"Bearer {admin_token}"})
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data["totals"]) >= {"sent", "failed", "suppressed"}
+        assert 0 <= data["failure_rate"] <= 1
+        assert isinstance(data["templates"], list)
+        print(f"PASS: Email stats - {data['totals']}")
+
+    def test_suppressed_address_is_logged(self, admin_token):
+        """Test email to a suppressed address is skipped and recorded"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        email = f"test.suppressed.{uuid.uuid4().hex[:8]}@example.com"
+        response = requests.post(f"{BASE_URL}/api/admin/email/suppressions", headers=headers,
+                                 json={"email": email, "reason": "TEST bounce"})
+        assert response.status_code == 200
+        duplicate = requests.post(f"{BASE_URL}/api/admin/email/suppressions", headers=headers, json={"email": email.upper()})
+        assert duplicate.status_code == 400
+
+        requests.post(f"{BASE_URL}/api/contact", json={
+            "name": "TEST", "email": email, "subject": "TEST suppression", "message": "Should not be sent"
+        })
+        listed = requests.get(f"{BASE_URL}/api/admin/email/suppressions", headers=headers, params={"email": email}).json()
+        assert [s["email"] for s in listed] == [email]
+
+        response = requests.delete(f"{BASE_URL}/api/admin/email/suppressions/{email}", headers=headers)
+        assert response.status_code == 200
+        response = requests.delete(f"{BASE_URL}/api/admin/email/suppressions/{email}", headers=headers)
+        assert response.status_code == 404
+        print("PASS: Suppression list add, list and remove")
+
+    def test_events_filter_validation(self, admin_token):
+        """Test unknown statuses are rejected"""
+        response = requests.get(f"{BASE_URL}/api/admin/email/events", params={"status": "bogus"},
+                                headers={"Authorization": f"Bearer {admin_token}"})
+        assert response.status_code == 400
+        print("PASS: Email event status filter validated")
+
+    def test_webhook_requires_token(self):
+        """Test the SendGrid webhook refuses requests without the shared token"""
+        response = requests.post(f"{BASE_URL}/api/email/webhook", json=[{"email": "x@example.com", "event": "bounce"}])
+        assert response.status_code in (401, 404)
+        print("PASS: Email webhook requires token")
+
+
+class TestMetrics:
+    """Test the Prometheus metrics endpoint"""
+
+    def test_metrics_exposition(self):
+        """Test requests show up under their route template"""
+        requests.get(f"{BASE_URL}/api/plans/")
+        response = requests.get(f"{BASE_URL}/api/metrics")
+        if response.status_code == 401:
+            pytest.skip("METRICS_TOKEN is set on this deployment")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert "# TYPE kloudnests_http_request_duration_seconds histogram" in body
+        assert 'route="/api/plans/"' in body
+        assert "kloudnests_event_loop_lag_seconds_count" in body
+        assert 'kloudnests_queue_depth{queue="email",status="queued"}' in body
+        print("PASS: Metrics endpoint exposes route histograms")
+
+    def test_route_labels_use_templates(self, user_token):
+        """Test path parameters are not used as label values"""
+        server_id = f"TEST-{uuid.uuid4()}"
+        requests.get(f"{BASE_URL}/api/servers/{server_id}", headers={"Authorization": f"Bearer {user_token}"})
+        response = requests.get(f"{BASE_URL}/api/metrics")
+        if response.status_code == 401:
+            pytest.skip("METRICS_TOKEN is set on this deployment")
+        assert server_id not in response.text
+        assert 'route="/api/servers/{server_id}"' in response.text
+        print("PASS: Metrics label routes by template")
+
+    def test_health_unchanged(self):
+        """Test the health check still returns its fixed response"""
+        response = requests.get(f"{BASE_URL}/api/health")
+        assert response.status_code == 200
+        assert response.json() == {"status": "healthy"}
+        print("PASS: Health check unchanged")
+
+
+class TestHealthProbes:
+    """Test the liveness and readiness probes"""
+
+    def test_readiness_report(self):
+        """Test readiness reports each dependency check"""
+        response = requests.get(f"{BASE_URL}/api/health/ready")
+        assert response.status_code in (200, 503)
+        data = response.json()
+        assert data["status"] in ("ok", "degraded", "failing")
+        assert (response.status_code == 200) == (data["status"] != "failing")
+        for check in ("mongo", "connection_pool", "event_loop", "email_queue"):
+            assert data["checks"][check]["status"] in ("ok", "degraded", "failing")
+        assert "latency_ms" in data["checks"]["mongo"]
+        print(f"PASS: Readiness {data['status']}")
+
+    def test_liveness(self):
+        """Test a serving worker reports itself alive"""
+        response = requests.get(f"{BASE_URL}/api/health/live")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ok"
+        print("PASS: Liveness ok")
+
+
+class TestTracing:
+    """Test request tracing and trace context propagation"""
+
+    def test_sampled_parent_is_followed(self):
+        """Test a sampled traceparent joins its trace when tracing is enabled"""
+        trace_id = uuid.uuid4().hex
+        response = requests.get(f"{BASE_URL}/api/plans/", headers={"traceparent": f"00-{trace_id}-b7ad6b7169203331-01"})
+        assert response.status_code == 200
+        traceparent = response.headers.get("traceparent")
+        if traceparent is None:
+            pytest.skip("No trace exporter configured on this deployment")
+        version, returned_trace, span_id, flags = traceparent.split("-")
+        assert (version, returned_trace, flags) == ("00", trace_id, "01")
+        assert len(span_id) == 16 and span_id != "b7ad6b7169203331"
+        print("PASS: Sampled traceparent followed")
+
+    def test_unsampled_parent_is_not_traced(self):
+        """Test a traceparent with the sampled flag off is not traced"""
+        response = requests.get(f"{BASE_URL}/api/plans/",
+                                headers={"traceparent": f"00-{uuid.uuid4().hex}-b7ad6b7169203331-00"})
+        assert response.status_code == 200
+        assert "traceparent" not in response.headers
+        print("PASS: Unsampled traceparent not traced")
+
+    def test_probes_not_traced(self):
+        """Test health probes never carry a trace"""
+        response = requests.get(f"{BASE_URL}/api/health/live",
+                                headers={"traceparent": f"00-{uuid.uuid4().hex}-b7ad6b7169203331-01"})
+        assert response.status_code == 200
+        assert "traceparent" not in response.headers
+        print("PASS: Probes not traced")
+
+
+class TestSlowQueries:
+    """Test the slow query report"""
+
+    def test_slow_query_report(self, admin_token):
+        """Test the report lists query shapes without literal values"""
+        response = requests.get(f"{BASE_URL}/api/admin/slow-queries", params={"limit": 10},
+                                headers={"Authorization": f"Bearer {admin_token}"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["threshold_ms"] > 0
+        assert len(data["shapes"]) <= 10
+        totals = [shape["total_ms"] for shape in data["shapes"]]
+        assert totals == sorted(totals, reverse=True)
+        for shape in data["shapes"]:
+            assert shape["count"] >= 1 and shape["max_ms"] >= data["threshold_ms"]
+            assert shape["command"] in ("find", "aggregate", "count", "distinct", "findAndModify", "update", "delete")
+        print(f"PASS: Slow query report lists {len(data['shapes'])} shapes")
+
+    def test_invalid_sort_rejected(self, admin_token):
+        """Test sorting by an unknown field is rejected"""
+        response = requests.get(f"{BASE_URL}/api/admin/slow-queries", params={"sort": "shape"},
+                                headers={"Authorization": f"Bearer {admin_token}"})
+        assert response.status_code == 400
+        print("PASS: Invalid sort rejected")
+
+    def test_requires_admin(self, user_token):
+        """Test customers cannot read the report"""
+        response = requests.get(f"{BASE_URL}/api/admin/slow-queries", headers={"Authorization": f"Bearer {user_token}"})
+        assert response.status_code == 403
+        print("PASS: Slow query report requires admin")
+
+
+class TestRenewalInvoices:
+    """Test the renewal job when the wallet cannot cover a renewal (local Mongo)"""
+
+    def test_insufficient_balance_creates_unpaid_invoice(self, local_server, local_loop, monkeypatch):
+        """Test each short server gets an unpaid invoice and an email, and the run reaches every server"""
+        server, db = local_server, local_server.db
+        sent = []
+
+        async def record_email(to_email, template, /, **context):
+            sent.append((to_email, template, context))
+        monkeypatch.setattr(server, "send_template_email", record_email)
+
+        user_id, order_id = f"TEST-{uuid.uuid4()}", f"TEST-{uuid.uuid4()}"
+        due = datetime.now(timezone.utc) + timedelta(days=3)
+        server_ids = [f"TEST-{uuid.uuid4()}" for _ in range(2)]
+
+        async def run():
+            await db.users.insert_one({"id": user_id, "email": "renewal@example.com", "name": "Renewal", "wallet_balance": 1.5})
+            await db.orders.insert_one({"id": order_id, "user_id": user_id, "amount": 10.0, "billing_cycle": "monthly"})
+            await db.servers.insert_many([{
+                "id": server_id, "user_id": user_id, "order_id": order_id, "status": "active", "renewal_date": due,
+                "plan_name": "TEST plan", "hostname": f"TEST-renewal-{n}"
+            } for n, server_id in enumerate(server_ids)])
+            await server.check_and_create_renewal_invoices()
+            return await db.invoices.find({"server_id": {"$in": server_ids}}, {"_id": 0}).to_list(10)
+
+        invoices = local_loop.run_until_complete(run())
+        assert sorted(invoice["server_id"] for invoice in invoices) == sorted(server_ids)
+        assert all(invoice["status"] == "unpaid" and invoice["amount"] == 10.0 for invoice in invoices)
+        assert [template for _, template, _ in sent] == ["renewal_invoice", "renewal_invoice"]
+        assert all(context["wallet_balance"] == 1.5 for _, _, context in sent)
+        user = local_loop.run_until_complete(db.users.find_one({"id": user_id}))
+        assert user["wallet_balance"] == 1.5
+        print("PASS: Short wallet gets unpaid renewal invoices and emails")
+
+
+class TestUnitOfWork:
+    """Test order writes roll back together and wallet debits never go below zero (local Mongo)"""
+
+    def test_failure_mid_callback_writes_nothing(self, local_client, local_db, local_loop):
+        """Test a failure after the debit leaves no debit, order or invoice behind"""
+        from unit_of_work import UnitOfWork, debit_wallet
+        db = local_db
+        unit_of_work = UnitOfWork(local_client, "auto")
+
+        async def run():
+            if not await unit_of_work.detect():
+                pytest.skip("TEST_MONGO_URL is not a replica set")
+            # Collections must exist before the first transactional insert on older servers
+            for name in ("users", "transactions", "orders", "invoices"):
+                await db.create_collection(name)
+            await db.users.insert_one({"id": "TEST-user", "wallet_balance": 50.0})
+
+            async def write_order(session):
+                await debit_wallet(db, "TEST-user", 20.0, session)
+                await db.transactions.insert_one({"id": "TEST-txn", "user_id": "TEST-user", "amount": 20.0}, session=session)
+                await db.orders.insert_one({"id": "TEST-order", "user_id": "TEST-user", "amount": 20.0}, session=session)
+                raise RuntimeError("crash before the invoice")
+
+            with pytest.raises(RuntimeError):
+                await unit_of_work.run(write_order)
+            return (
+                await db.users.find_one({"id": "TEST-user"}),
+                await db.transactions.count_documents({}),
+                await db.orders.count_documents({}),
+                await db.invoices.count_documents({})
+            )
+
+        user, transactions, orders, invoices = local_loop.run_until_complete(run())
+        assert user["wallet_balance"] == 50.0
+        assert (transactions, orders, invoices) == (0, 0, 0)
+        print("PASS: Failed unit of work rolled back the debit, transaction and order")
+
+    def test_concurrent_debits_never_overdraw(self, local_db, local_loop):
+        """Test concurrent debits lose no update and stop at the balance"""
+        from unit_of_work import InsufficientFunds, debit_wallet
+        db = local_db
+
+        async def run():
+            await db.users.insert_one({"id": "TEST-user", "wallet_balance": 100.0})
+            results = await asyncio.gather(*(debit_wallet(db, "TEST-user", 10.0) for _ in range(25)), return_exceptions=True)
+            return results, await db.users.find_one({"id": "TEST-user"})
+
+        results, user = local_loop.run_until_complete(run())
+        assert sum(1 for r in results if r is None) == 10
+        assert all(isinstance(r, InsufficientFunds) for r in results if r is not None)
+        assert user["wallet_balance"] == 0
+        print("PASS: 10 of 25 concurrent debits applied, balance 0")
+
+
+class TestAdminInventoryAllocation:
+    """Test admin allocation claiming a machine from the inventory pool (local Mongo)"""
+
+    def test_allocate_from_inventory(self, local_server, local_loop, monkeypatch):
+        """Test the server gets the machine's credentials and an empty pool answers 409"""
+        from fastapi import BackgroundTasks, HTTPException
+        server, db = local_server, local_server.db
+        monkeypatch.setattr(server.search_service, "add", lambda *args: None)
+        admin = {"id": "TEST-admin", "email": "admin@example.com"}
+        user_id, plan_id, machine_id = f"TEST-{uuid.uuid4()}", f"TEST-{uuid.uuid4()}", f"TEST-{uuid.uuid4()}"
+        data = server.AllocateServerRequest(user_id=user_id, plan_id=plan_id, from_inventory=True,
+                                            data_center_id="TEST-dc", payment_received=True, send_email=False)
+
+        async def run():
+            await db.users.insert_one({"id": user_id, "email": "inventory@example.com", "name": "Inventory", "wallet_balance": 0})
+            await db.plans.insert_one({"id": plan_id, "name": "TEST plan"})
+            await db.server_inventory.insert_one({
+                "id": machine_id, "plan_id": plan_id, "data_center_id": "TEST-dc", "status": "available",
+                "hostname": "TEST-inventory-1", "ip_address": "192.0.2.61", "username": "root", "password": "secret",
+                "ssh_port": 2222, "created_at": datetime.now(timezone.utc)
+            })
+            result = await server.allocate_server(data, BackgroundTasks(), admin)
+            with pytest.raises(HTTPException) as empty:
+                await server.allocate_server(data, BackgroundTasks(), admin)
+            return (
+                result, empty.value,
+                await db.servers.find_one({"id": result["server_id"]}, {"_id": 0}),
+                await db.server_inventory.find_one({"id": machine_id}, {"_id": 0}),
+                await db.servers.count_documents({"user_id": user_id})
+            )
+
+        result, empty, server_doc, machine, servers = local_loop.run_until_complete(run())
+        assert (server_doc["hostname"], server_doc["ip_address"], server_doc["ssh_port"]) == ("TEST-inventory-1", "192.0.2.61", "2222")
+        assert (machine["status"], machine["user_id"], machine["server_id"]) == ("allocated", user_id, result["server_id"])
+        assert empty.status_code == 409
+        assert servers == 1
+        print("PASS: Allocation claimed the machine; empty pool returned 409")
+
+
+class TestTOTPVerifier:
+    """Test TOTP codes are accepted once, never for an earlier step, on any worker"""
+
+    def setup_method(self):
+        # The current step boundary, so for_time + n * 30 is step n after it. Taken per test:
+        # records from a step in the past would already be expired by the TTL index
+        self.NOW = int(datetime.now(timezone.utc).timestamp()) // 30 * 30
+
+    @staticmethod
+    def codes(secret, now):
+        import pyotp
+        totp = pyotp.TOTP(secret)
+        return {offset: totp.at(now + offset * 30) for offset in (-1, 0, 1)}
+
+    def test_replay_and_earlier_steps_rejected(self):
+        """Test a used code and any code for an earlier step are rejected (in memory)"""
+        import pyotp
+        sys.path.insert(0, str(BACKEND_DIR))
+        from totp_verifier import TOTPVerifier
+        verifier = TOTPVerifier()
+        secret = pyotp.random_base32()
+        codes = self.codes(secret, self.NOW)
+
+        async def run():
+            return [
+                await verifier.verify("TEST-user", secret, codes[0], self.NOW),
+                await verifier.verify("TEST-user", secret, codes[0], self.NOW),
+                await verifier.verify("TEST-user", secret, codes[1], self.NOW),
+                # Still inside the window, but before the step just used
+                await verifier.verify("TEST-user", secret, codes[-1], self.NOW),
+                await verifier.verify("TEST-user", secret, codes[0], self.NOW),
+                await verifier.verify("TEST-other", secret, codes[0], self.NOW),
+            ]
+
+        assert asyncio.run(run()) == [True, False, True, False, False, True]
+        print("PASS: Replayed and earlier-step codes rejected")
+
+    def test_other_worker_rejects_used_step(self, local_db, local_loop):
+        """Test a worker without the step in memory is stopped by the shared record"""
+        import pyotp
+        from totp_verifier import TOTPVerifier
+        secret = pyotp.random_base32()
+        codes = self.codes(secret, self.NOW)
+
+        async def run():
+            first = TOTPVerifier(local_db.totp_last_steps)
+            await first.ensure_indexes()
+            accepted = await first.verify("TEST-user", secret, codes[0], self.NOW)
+            other = TOTPVerifier(local_db.totp_last_steps)
+            replayed = await other.verify("TEST-user", secret, codes[0], self.NOW)
+            earlier = await other.verify("TEST-user", secret, codes[-1], self.NOW)
+            # Fresh workers racing on one code: the conditional upsert lets exactly one through
+            racing = [TOTPVerifier(local_db.totp_last_steps) for _ in range(5)]
+            raced = await asyncio.gather(*(worker.verify("TEST-user", secret, codes[1], self.NOW) for worker in racing))
+            return accepted, replayed, earlier, raced, await local_db.totp_last_steps.count_documents({})
+
+        accepted, replayed, earlier, raced, records = local_loop.run_until_complete(run())
+        assert (accepted, replayed, earlier) == (True, False, False)
+        assert sorted(raced) == [False] * 4 + [True]
+        assert records == 1
+        print("PASS: Used step rejected on other workers; one of five racing workers accepted")
+
+    def test_records_expire_when_step_leaves_window(self, local_db, local_loop):
+        """Test records carry a TTL at the time their step can no longer verify"""
+        import pyotp
+        from totp_verifier import TOTPVerifier
+        secret = pyotp.random_base32()
+        codes = self.codes(secret, self.NOW)
+        verifier = TOTPVerifier(local_db.totp_last_steps)
+
+        async def run():
+            await verifier.ensure_indexes()
+            await verifier.verify("TEST-user", secret, codes[1], self.NOW)
+            indexes = await local_db.totp_last_steps.index_information()
+            return indexes, await local_db.totp_last_steps.find_one({"user_id": "TEST-user"})
+
+        indexes, record = local_loop.run_until_complete(run())
+        assert any(index.get("expireAfterSeconds") == 0 for index in indexes.values())
+        step = self.NOW // 30 + 1
+        expires = record["expires_at"].timestamp()
+        assert (record["step"], expires) == (step, (step + 2) * 30)
+        # Once the record is gone the step cannot be matched anymore
+        assert verifier.match_step(secret, codes[1], expires - 1) == step
+        assert verifier.match_step(secret, codes[1], expires) is None
+
+        # The in-memory store drops entries at the same time
+        verifier._prune(expires)
+        assert "TEST-user" not in verifier._last
+        print("PASS: Step records expire when the step leaves the window")
+
+
+class TestSearchRebuild:
+    """Test periodic search index rebuilds leave garbage collection to the process (local Mongo)"""
+
+    def test_rebuild_does_not_freeze_or_keep_old_index(self, local_db, local_loop):
+        """Test rebuilds freeze nothing and a replaced index is collectable"""
+        import gc
+        import weakref
+        from search import SearchService
+        service = SearchService(local_db, refresh_interval=0)
+
+        async def run():
+            await local_db.users.insert_many([{
+                "id": f"TEST-{n}", "role": "user", "email": f"rebuild{n}@example.com", "full_name": f"Rebuild User {n}"
+            } for n in range(200)])
+            await service.rebuild()
+            old = weakref.ref(service.index)
+            frozen = gc.get_freeze_count()
+            await service.rebuild()
+            return old, frozen, gc.get_freeze_count()
+
+        old, before, after = local_loop.run_until_complete(run())
+        assert after == before
+        gc.collect()
+        assert old() is None
+        print(f"PASS: Rebuilds leave {after} frozen objects and release the old index")
+
+
+class TestSLABackfill:
+    """Test the startup SLA backfill before the datetime migration has run (local Mongo)"""
+
+    def test_backfill_parses_string_timestamps(self, local_server, local_loop):
+        """Test ISO string created_at values are parsed and unparseable ones skipped"""
+        server, db = local_server, local_server.db
+        opened = datetime.now(timezone.utc) - timedelta(hours=1)
+        legacy_id, broken_id = f"TEST-{uuid.uuid4()}", f"TEST-{uuid.uuid4()}"
+
+        async def run():
+            await db.tickets.insert_many([
+                {"id": legacy_id, "priority": "high", "status": "open", "created_at": opened.isoformat()},
+                {"id": broken_id, "priority": "high", "status": "open", "created_at": "not a date"},
+            ])
+            await db.ticket_messages.insert_one({
+                "id": f"TEST-{uuid.uuid4()}", "ticket_id": legacy_id, "is_staff": True,
+                "created_at": opened.isoformat(), "message": "On it"
+            })
+            await server.backfill_ticket_sla()
+            return (await db.tickets.find_one({"id": legacy_id}, {"_id": 0}),
+                    await db.tickets.find_one({"id": broken_id}, {"_id": 0}))
+
+        legacy, broken = local_loop.run_until_complete(run())
+        assert legacy["resolution_due_at"] > opened
+        assert legacy["sla_due_at"] == legacy["resolution_due_at"]
+        assert abs((legacy["first_response_at"] - opened).total_seconds()) < 1
+        assert "resolution_due_at" not in broken
+        print("PASS: Legacy string timestamps backfilled, invalid one skipped")
+
+
+class TestEmailSuppressionScope:
+    """Test unsubscribes only stop broadcasts and suppressed queue messages end at once (local Mongo)"""
+
+    def test_unsubscribe_only_stops_marketing(self, local_db, local_loop):
+        """Test an unsubscribed address still gets transactional email until it bounces"""
+        from email_log import EmailLog, ALL, MARKETING
+        email_log = EmailLog(local_db.email_events, local_db.email_suppressions)
+
+        async def run():
+            await email_log.ensure_indexes()
+            await email_log.suppress("Unsub@Example.com", "unsubscribe", source="sendgrid", scope=MARKETING)
+            unsubscribed = (email_log.is_suppressed("unsub@example.com", "broadcast"),
+                            email_log.is_suppressed("unsub@example.com", "password_reset"))
+            repeated = await email_log.suppress("unsub@example.com", "group_unsubscribe", source="sendgrid", scope=MARKETING)
+            widened = await email_log.suppress("unsub@example.com", "bounce", source="sendgrid", scope=ALL)
+            # Recorded before scopes were stored
+            await local_db.email_suppressions.insert_one({"email": "legacy@example.com", "reason": "unsubscribe", "source": "sendgrid"})
+            other_worker = EmailLog(local_db.email_events, local_db.email_suppressions)
+            await other_worker.load()
+            return unsubscribed, repeated, widened, other_worker
+
+        unsubscribed, repeated, widened, other_worker = local_loop.run_until_complete(run())
+        assert unsubscribed == (True, False)
+        assert (repeated, widened) == (False, True)
+        assert email_log.is_suppressed("unsub@example.com", "invoice")
+        assert other_worker.is_suppressed("unsub@example.com", "invoice")
+        assert other_worker.is_suppressed("legacy@example.com", "broadcast")
+        assert not other_worker.is_suppressed("legacy@example.com", "server_ready")
+        print("PASS: Unsubscribes scoped to broadcasts; a bounce widens them to all email")
+
+    def test_suppressed_queue_message_is_final(self, local_db, local_loop):
+        """Test a suppressed message is not retried or counted as failed"""
+        from email_queue import EmailQueue, SUPPRESSED, queued_message
+        results, calls = [], []
+
+        async def send(to_email, subject, html):
+            calls.append(to_email)
+            return SUPPRESSED
+
+        async def on_result(message, status):
+            results.append(status)
+
+        queue = EmailQueue(local_db.email_queue, send, rate=1000, retry_delay=0, on_result=on_result)
+
+        async def run():
+            await queue.enqueue_many([queued_message("gone@example.com", "TEST", "<p>TEST</p>")])
+            await queue.run_pending()
+            await queue.run_pending()
+            return await local_db.email_queue.find_one({}, {"_id": 0})
+
+        message = local_loop.run_until_complete(run())
+        assert (message["status"], message["attempts"], len(calls)) == ("suppressed", 1, 1)
+        assert results == ["suppressed"]
+        assert queue.counters["failed"] == 0 and queue.counters["retried"] == 0
+        print("PASS: Suppressed queue message finished after one attempt")
+
+
+class TestIdempotencyFailures:
+    """Test which failures release an Idempotency-Key and which keep it from running twice (local Mongo)"""
+
+    @staticmethod
+    def store(collection):
+        from idempotency import IdempotencyStore
+        # No lock timeout, so any key left in progress could be taken over at once
+        return IdempotencyStore(collection, lock_timeout=timedelta(0))
+
+    def test_rejection_releases_key(self, local_db, local_loop):
+        """Test an HTTPException from the handler lets the same key run again"""
+        from fastapi import HTTPException
+        store, calls = self.store(local_db.idempotency_keys), []
+
+        async def handler():
+            calls.append(1)
+            if len(calls) == 1:
+                raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+            return {"ok": True}
+
+        async def run():
+            with pytest.raises(HTTPException):
+                await store.run("TEST-key", "TEST-user", "test", {"a": 1}, handler)
+            return await store.run("TEST-key", "TEST-user", "test", {"a": 1}, handler)
+
+        assert local_loop.run_until_complete(run()) == {"ok": True}
+        assert len(calls) == 2
+        print("PASS: Rejected request released its key")
+
+    def test_failure_after_side_effects_is_not_rerun(self, local_db, local_loop):
+        """Test an unexpected error keeps the key failed and retries get a replayed 500"""
+        store, calls = self.store(local_db.idempotency_keys), []
+
+        async def handler():
+            calls.append(1)
+            await local_db.side_effects.insert_one({"n": len(calls)})
+            raise RuntimeError("connection reset after the write")
+
+        async def run():
+            with pytest.raises(RuntimeError):
+                await store.run("TEST-key", "TEST-user", "test", {"a": 1}, handler)
+            return await store.run("TEST-key", "TEST-user", "test", {"a": 1}, handler)
+
+        retry = local_loop.run_until_complete(run())
+        assert retry.status_code == 500
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert len(calls) == 1
+        assert local_loop.run_until_complete(local_db.side_effects.count_documents({})) == 1
+        print("PASS: Failed request kept its key; retry replayed 500 without rerunning")
+
+    def test_unstored_response_blocks_takeover(self, local_db, local_loop):
+        """Test a handler whose response could not be stored is not run again after the lock times out"""
+        from idempotency import COMPLETED
+        collection, calls = local_db.idempotency_keys, []
+
+        class FailingCompletion:
+            """Collection whose write of the completed response fails"""
+
+            def __getattr__(self, name):
+                return getattr(collection, name)
+
+            async def update_one(self, query, update, **kwargs):
+                if update.get("$set", {}).get("status") == COMPLETED:
+                    raise RuntimeError("primary stepped down")
+                return await collection.update_one(query, update, **kwargs)
+
+        store = self.store(FailingCompletion())
+
+        async def handler():
+            calls.append(1)
+            return {"server_id": "TEST-server"}
+
+        async def run():
+            first = await store.run("TEST-key", "TEST-user", "test", {"a": 1}, handler)
+            retry = await store.run("TEST-key", "TEST-user", "test", {"a": 1}, handler)
+            return first, retry, await collection.find_one({})
+
+        first, retry, record = local_loop.run_until_complete(run())
+        assert first == {"server_id": "TEST-server"}
+        assert (retry.status_code, record["status"]) == (500, "failed")
+        assert len(calls) == 1
+        print("PASS: Unstored response left the key failed, not open to takeover")
+
+
+class TestEmailQueueHeartbeat:
+    """Test the email queue heartbeat seen by the liveness probe (local Mongo)"""
+
+    def test_heartbeat_moves_during_a_batch(self, local_db, local_loop):
+        """Test the liveness heartbeat advances with each send, not only between batches"""
+        from email_queue import EmailQueue, queued_message
+        beats = []
+
+        async def send(to_email, subject, html):
+            beats.append(queue.heartbeat)
+            return True
+
+        queue = EmailQueue(local_db.email_queue, send, rate=50, batch_size=10, concurrency=1)
+
+        async def run():
+            await queue.enqueue_many([queued_message(f"beat{n}@example.com", "TEST", "<p>TEST</p>") for n in range(10)])
+            await queue.run_pending()
+
+        local_loop.run_until_complete(run())
+        assert len(beats) == 10
+        assert beats == sorted(beats) and len(set(beats)) == 10
+        print("PASS: Heartbeat advanced with every send in the batch")
+
+
+class TestEmailQueueLeases:
+    """Test slow email queues never let a lease run out mid-batch (local Mongo)"""
+
+    def test_slow_rate_never_sends_twice(self, local_db, local_loop):
+        """Test batches fit in half the lease and a message whose lease was lost is not sent"""
+        from email_queue import EmailQueue, queued_message
+        sent = []
+
+        async def send(to_email, subject, html):
+            sent.append(to_email)
+            return True
+
+        # 0.2 messages/s with a 300s lease: a full batch of 100 would take 500s
+        slow = EmailQueue(local_db.email_queue, send, rate=0.2, batch_size=100, lease_seconds=300)
+        other = EmailQueue(local_db.email_queue, send, rate=0.2, batch_size=100, lease_seconds=300)
+
+        async def run():
+            await slow.enqueue_many([queued_message(f"lease{n}@example.com", "TEST", "<p>TEST</p>") for n in range(40)])
+            batch = await slow.lease()
+            # The worker stalls; its lease runs out and another worker takes the first message over
+            await local_db.email_queue.update_many({}, {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+            await other.requeue_expired()
+            taken = await other.lease()
+            await slow._deliver(batch[0])
+            await other._deliver(taken[0])
+            return batch, taken
+
+        batch, taken = local_loop.run_until_complete(run())
+        assert slow.batch_size == 30 and len(batch) == 30
+        assert taken[0]["id"] == batch[0]["id"]
+        assert sent == [batch[0]["to"]]
+        print(f"PASS: Batch of {len(batch)} at 0.2/s; the message was sent once after its lease moved")
+
+
+class TestProvisioningDrivers:
+    """Test drivers that lack an action (local Mongo)"""
+
+    def test_missing_action_fails_without_retries(self, local_db, local_loop):
+        """Test a job for an action the driver does not implement fails on its first attempt"""
+        from provisioning import ProvisioningDriver, ProvisioningQueue, FAILED
+
+        class RebootOnlyDriver(ProvisioningDriver):
+            name = "reboot-only"
+
+            async def reboot(self, server, params):
+                return {}
+
+        queue = ProvisioningQueue(local_db.provisioning_jobs, local_db.servers, RebootOnlyDriver(), retry_delay=0)
+
+        async def run():
+            server = {"id": f"TEST-{uuid.uuid4()}", "user_id": "TEST-user"}
+            await local_db.servers.insert_one(dict(server))
+            await queue.enqueue(server, "reinstall")
+            await queue.run_job(await queue.lease())
+            return await local_db.provisioning_jobs.find_one({"server_id": server["id"]}, {"_id": 0})
+
+        job = local_loop.run_until_complete(run())
+        assert (job["status"], job["attempts"]) == (FAILED, 1)
+        assert job["last_error"] == "reboot-only driver does not support reinstall"
+        print("PASS: Unsupported action failed after one attempt")
+
+
+class TestBulkProvisioningLimits:
+    """Test bulk CSV size limits and address cleanup for servers that were not saved (local Mongo)"""
+
+    def test_oversized_csv_stops_at_limit(self, local_server, local_loop):
+        """Test an upload over MAX_BULK_ROWS is refused without validating every row"""
+        from fastapi import HTTPException, UploadFile
+        from io import BytesIO
+        server = local_server
+        validated = []
+
+        class CountingRow(server.AdminServerCreate):
+            @classmethod
+            def model_validate(cls, values, **kwargs):
+                validated.append(1)
+                return super().model_validate(values, **kwargs)
+
+        lines = ["order_id,ip_address,hostname,username,password"]
+        lines += [f"TEST-{n},192.0.2.1,TEST-h{n},root,x" for n in range(server.MAX_BULK_ROWS * 4)]
+        upload = UploadFile(BytesIO("\n".join(lines).encode()), filename="servers.csv")
+
+        with pytest.raises(HTTPException) as error:
+            local_loop.run_until_complete(server.parse_bulk_csv(upload, CountingRow))
+        assert error.value.status_code == 400
+        assert len(validated) == server.MAX_BULK_ROWS
+        print(f"PASS: Oversized CSV refused after {len(validated)} rows")
+
+    def test_unsaved_server_releases_address(self, local_server, local_loop, monkeypatch):
+        """Test a row dropped by the bulk insert gives its reserved IP back"""
+        from fastapi import BackgroundTasks
+        server, db = local_server, local_server.db
+        monkeypatch.setattr(server.search_service, "add_many", lambda *args: None)
+        admin = {"id": "TEST-admin", "email": "admin@example.com"}
+        taken = f"TEST-taken-{uuid.uuid4().hex[:8]}"
+        orders = [{"id": f"TEST-{uuid.uuid4()}", "user_id": "TEST-user", "os": "Ubuntu 22.04", "plan_name": "TEST plan",
+                   "billing_cycle": "monthly"} for _ in range(2)]
+        rows = list(enumerate([
+            server.AdminServerCreate(order_id=orders[0]["id"], ip_address="192.0.2.81", hostname=f"TEST-{uuid.uuid4().hex[:8]}",
+                                     username="root", password="x", send_email=False),
+            server.AdminServerCreate(order_id=orders[1]["id"], ip_address="192.0.2.82", hostname=taken,
+                                     username="root", password="x", send_email=False)
+        ], start=1))
+
+        async def run():
+            # A hostname that is already used makes the second insert fail
+            await db.servers.create_index("hostname", unique=True, partialFilterExpression={"hostname": {"$regex": "^TEST-taken-"}})
+            await db.servers.insert_one({"id": f"TEST-{uuid.uuid4()}", "hostname": taken})
+            await db.orders.insert_many([dict(order) for order in orders])
+            results = await server.provision_servers_bulk(rows, BackgroundTasks(), admin)
+            await db.servers.drop_index("hostname_1")
+            return results, {a["ip_address"] async for a in db.ip_assignments.find({"ip_address": {"$in": ["192.0.2.81", "192.0.2.82"]}})}
+
+        results, assigned = local_loop.run_until_complete(run())
+        assert [result["status"] for result in sorted(results, key=lambda r: r["row"])] == ["created", "error"]
+        assert assigned == {"192.0.2.81"}
+        print("PASS: Unsaved bulk server released its address")
+
+
+class TestTicketMessageCursors:
+    """Test message pages never skip or repeat messages posted in the same millisecond (local Mongo)"""
+
+    def test_pages_walk_same_timestamp_messages(self, local_server, local_loop):
+        """Test before and since cursors with ids visit every message exactly once"""
+        server, db = local_server, local_server.db
+        ticket_id = f"TEST-{uuid.uuid4()}"
+        base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        # Three messages share each timestamp
+        messages = [{
+            "id": f"{n:02d}-{uuid.uuid4()}", "ticket_id": ticket_id, "is_staff": False, "message": f"TEST {n}",
+            "created_at": base + timedelta(seconds=n // 3)
+        } for n in range(9)]
+
+        async def run():
+            await db.ticket_messages.insert_many([dict(message) for message in messages])
+            backwards, page = [], await server.fetch_ticket_messages(ticket_id, limit=2)
+            while True:
+                backwards = page["messages"] + backwards
+                if not page["has_more"]:
+                    break
+                first = page["messages"][0]
+                page = await server.fetch_ticket_messages(ticket_id, before=first["created_at"], before_id=first["id"], limit=2)
+            forwards, last = [], backwards[0]
+            forwards.append(last)
+            while True:
+                page = await server.fetch_ticket_messages(ticket_id, since=last["created_at"], since_id=last["id"], limit=2)
+                forwards += page["messages"]
+                if not page["messages"]:
+                    break
+                last = page["messages"][-1]
+            return backwards, forwards
+
+        backwards, forwards = local_loop.run_until_complete(run())
+        expected = [message["id"] for message in messages]
+        assert [message["id"] for message in backwards] == expected
+        assert [message["id"] for message in forwards] == expected
+        print("PASS: 9 messages over 3 timestamps paged exactly once in both directions")
+
+
+class TestBulkAllocationWrites:
+    """Test each user's bulk allocation debit and records are written as one unit (local Mongo)"""
+
+    def test_failed_user_is_not_charged(self, local_server, local_loop, monkeypatch):
+        """Test a failed server write leaves that user uncharged and frees its addresses"""
+        from fastapi import BackgroundTasks
+        server, db = local_server, local_server.db
+        monkeypatch.setattr(server.search_service, "add_many", lambda *args: None)
+        admin = {"id": "TEST-admin", "email": "admin@example.com"}
+        ok_user, failing_user = f"TEST-{uuid.uuid4()}", f"TEST-{uuid.uuid4()}"
+        taken = f"TEST-taken-{uuid.uuid4().hex[:8]}"
+        rows = list(enumerate([
+            server.AllocateServerRequest(user_id=ok_user, hostname=f"TEST-{uuid.uuid4().hex[:8]}", ip_address="192.0.2.71",
+                                         password="x", amount=10.0, send_email=False),
+            server.AllocateServerRequest(user_id=failing_user, hostname=f"TEST-{uuid.uuid4().hex[:8]}", ip_address="192.0.2.72",
+                                         password="x", amount=10.0, send_email=False),
+            server.AllocateServerRequest(user_id=failing_user, hostname=taken, ip_address="192.0.2.73",
+                                         password="x", amount=5.0, send_email=False)
+        ], start=1))
+
+        async def run():
+            await server.unit_of_work.detect()
+            # A hostname that is already used makes the second user's server insert fail
+            await db.servers.create_index("hostname", unique=True, partialFilterExpression={"hostname": {"$regex": "^TEST-taken-"}})
+            await db.servers.insert_one({"id": f"TEST-{uuid.uuid4()}", "hostname": taken})
+            await db.users.insert_many([
+                {"id": ok_user, "email": "bulk-ok@example.com", "wallet_balance": 50.0},
+                {"id": failing_user, "email": "bulk-failing@example.com", "wallet_balance": 50.0}
+            ])
+            results = await server.allocate_servers_bulk(rows, BackgroundTasks(), admin)
+            await db.servers.drop_index("hostname_1")
+            return (
+                results,
+                {user["id"]: user["wallet_balance"] async for user in db.users.find({"id": {"$in": [ok_user, failing_user]}})},
+                await db.transactions.count_documents({"user_id": failing_user}),
+                await db.invoices.count_documents({"user_id": failing_user}),
+                await db.ip_assignments.find_one({"ip_address": "192.0.2.73"})
+            )
+
+        results, balances, transactions, invoices, assignment = local_loop.run_until_complete(run())
+        by_row = {result["row"]: result for result in results}
+        assert by_row[1]["status"] == "created"
+        assert balances[ok_user] == 40.0
+        assert by_row[3]["status"] == "error"
+        assert assignment is None
+        # Whatever was not saved is not charged
+        charged = 10.0 if by_row[2]["status"] == "created" else 0
+        assert balances[failing_user] == 50.0 - charged
+        if server.unit_of_work.enabled:
+            assert by_row[2]["status"] == "error"
+            assert (transactions, invoices) == (0, 0)
+        print(f"PASS: Failed user's rows {[r['status'] for r in results]}, balances {balances}")